@@ -0,0 +1,380 @@
+import json
+import os
+import random
+import socket
+import threading
+import time
+import uuid
+
+# A batch is a directory on a filesystem shared by the workers (one or many hosts) :
+#
+#   <batch_dir>/manifest.json           {"created_at": ..., "tasks": [job, ...]}, every task is a worker job
+#                                       (see worker.py) with a unique "id"
+#   <batch_dir>/claims/<id>.claim       the task is being run : {"worker", "host", "pid", "token", "attempt",
+#                                       "claimed_at"}, its mtime is the last heartbeat of the worker
+#   <batch_dir>/results/<id>.json       the task is finished : {"id", "status", "worker", "host", "attempt",
+#                                       "claimed_at", "finished_at", "elapsed", "report"}
+#
+# A claim is created with a hard link of a file private to the worker, which is atomic on NFS too : when
+# several workers claim the same task only one link succeeds. A worker touches the claims of its
+# running tasks every heartbeat; a claim whose heartbeat is older than the stale delay (its worker died
+# or lost the filesystem) is renamed away by the one worker that reclaims it, and the task runs again.
+# Every attempt converts in its own staging dir, and only publishes and registers its products while
+# its claim is still the current one : a worker whose claim was taken over drops its outputs.
+
+MANIFEST_FILE = "manifest.json"
+
+# seconds between two heartbeats of a worker on the claims of its running tasks
+HEARTBEAT_INTERVAL = 10.0
+
+# seconds without heartbeat after which a claim is abandoned and its task claimed again
+# (several heartbeats, so that a slow filesystem or a clock skew between hosts does not steal live tasks)
+STALE_AFTER = 60.0
+
+def write_json(path, data):
+    """
+    Write a JSON file atomically (written to a temporary file, then renamed over the file).
+    """
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "w") as file:
+        json.dump(data, file, indent=4)
+    os.replace(tmp_path, path)
+
+def create_batch(batch_dir, jobs):
+    """
+    Create a batch : write its manifest of tasks, to be run by any number of 'run_batch' workers.
+
+    Parameters:
+    -----------
+    batch_dir : str
+        Directory of the batch, on a filesystem shared by the workers.
+    jobs : list
+        Worker jobs (see worker.py), the ones without an 'id' are numbered 'task-00000', ...
+
+    Returns:
+    --------
+    List of the tasks of the manifest
+    """
+    tasks = []
+    for i, job in enumerate(jobs):
+        task = dict(job)
+        task.setdefault("id", f"task-{i:05d}")
+        tasks.append(task)
+    ids = [task["id"] for task in tasks]
+    if len(set(ids)) != len(ids):
+        raise ValueError("The ids of the tasks of a batch must be unique.")
+    if os.path.exists(os.path.join(batch_dir, MANIFEST_FILE)):
+        raise FileExistsError(f"'{batch_dir}' already contains a batch.")
+
+    os.makedirs(os.path.join(batch_dir, "claims"), exist_ok=True)
+    os.makedirs(os.path.join(batch_dir, "results"), exist_ok=True)
+    write_json(os.path.join(batch_dir, MANIFEST_FILE), {"created_at": time.time(), "tasks": tasks})
+    return tasks
+
+class Batch:
+    """
+    Claims and results of the tasks of a batch directory, seen by one worker (see the top of this module).
+    """
+
+    def __init__(self, batch_dir, worker_id=None, stale_after=STALE_AFTER):
+        """
+        Parameters:
+        -----------
+        batch_dir : str
+            Directory of the batch (see create_batch).
+        worker_id : str, optional, default = None
+            Name of the worker in the claims and results (default : '<host>-<pid>-<random>').
+        stale_after : float, optional, default = STALE_AFTER
+            Seconds without heartbeat after which a claim is abandoned.
+        """
+        with open(os.path.join(batch_dir, MANIFEST_FILE), "r") as file:
+            self.tasks = json.load(file)["tasks"]
+        self.batch_dir = batch_dir
+        self.claims_dir = os.path.join(batch_dir, "claims")
+        self.results_dir = os.path.join(batch_dir, "results")
+        self.host = socket.gethostname()
+        self.worker_id = worker_id or f"{self.host}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.stale_after = stale_after
+        # task id -> claim of this worker
+        self.claims = {}
+        # task ids whose claim was taken over by another worker
+        self.lost = set()
+        self.lock = threading.Lock()
+
+    def claim_path(self, task_id):
+        return os.path.join(self.claims_dir, f"{task_id}.claim")
+
+    def result_path(self, task_id):
+        return os.path.join(self.results_dir, f"{task_id}.json")
+
+    def is_finished(self, task_id):
+        return os.path.exists(self.result_path(task_id))
+
+    def claim(self, task_id):
+        """
+        Try to claim a task, reclaiming it if its claim is stale.
+
+        Returns:
+        --------
+        The claim (dict) if the task is now run by this worker, None otherwise
+        """
+        if self.is_finished(task_id):
+            return None
+        attempt = 1
+        if os.path.exists(self.claim_path(task_id)):
+            previous = self._reclaim(task_id)
+            if previous is None:
+                return None
+            attempt = previous.get("attempt", 1) + 1
+
+        claim = {"worker": self.worker_id, "host": self.host, "pid": os.getpid(), "token": uuid.uuid4().hex,
+                 "attempt": attempt, "claimed_at": time.time()}
+        tmp_path = os.path.join(self.claims_dir, f".{task_id}.{claim['token']}.tmp")
+        with open(tmp_path, "w") as file:
+            json.dump(claim, file)
+        try:
+            os.link(tmp_path, self.claim_path(task_id))
+        except FileExistsError:
+            return None  # claimed by another worker
+        finally:
+            os.remove(tmp_path)
+
+        # the result may have been written between the check and the claim
+        if self.is_finished(task_id):
+            os.remove(self.claim_path(task_id))
+            return None
+        with self.lock:
+            self.claims[task_id] = claim
+            self.lost.discard(task_id)
+        return claim
+
+    def _reclaim(self, task_id):
+        # only the worker whose rename succeeds removes a stale claim
+        path = self.claim_path(task_id)
+        try:
+            if time.time() - os.stat(path).st_mtime < self.stale_after:
+                return None
+            stale_path = f"{path}.stale-{uuid.uuid4().hex}"
+            os.rename(path, stale_path)
+        except FileNotFoundError:
+            return None
+        try:
+            with open(stale_path, "r") as file:
+                previous = json.load(file)
+        except (OSError, ValueError):
+            previous = {}
+        os.remove(stale_path)
+        print(f"Task {task_id} reclaimed from the stale worker {previous.get('worker', '?')}\n")
+        return previous
+
+    def owns(self, task_id, touch=False):
+        """
+        Check that the claim of a task is still the one of this worker. A claim that is no longer ours
+        was reclaimed by another worker : the task is marked as lost and its result will not be written.
+
+        Parameters:
+        -----------
+        task_id : str
+            Id of a task claimed by this worker.
+        touch : bool, optional, default = False
+            Also refresh the heartbeat of the claim.
+
+        Returns:
+        --------
+        True if this worker still runs the task
+        """
+        with self.lock:
+            claim = self.claims.get(task_id)
+        if claim is None:
+            return False
+        path = self.claim_path(task_id)
+        try:
+            with open(path, "r") as file:
+                current = json.load(file)
+            if current.get("token") != claim["token"]:
+                raise FileNotFoundError(path)
+            if touch:
+                os.utime(path)
+        except (OSError, ValueError):
+            with self.lock:
+                self.lost.add(task_id)
+                self.claims.pop(task_id, None)
+            print(f"Task {task_id} was reclaimed by another worker\n")
+            return False
+        return True
+
+    def heartbeat(self):
+        """
+        Touch the claims of the running tasks of this worker (see owns).
+        """
+        with self.lock:
+            task_ids = list(self.claims)
+        for task_id in task_ids:
+            self.owns(task_id, touch=True)
+
+    def finish(self, task_id, result):
+        """
+        Write the result of a task and release its claim (unless the claim was lost).
+
+        Returns:
+        --------
+        True if the result was written
+        """
+        with self.lock:
+            claim = self.claims.pop(task_id, None)
+            lost = task_id in self.lost
+        if lost or claim is None:
+            return False
+        write_json(self.result_path(task_id), result)
+        try:
+            os.remove(self.claim_path(task_id))
+        except FileNotFoundError:
+            pass
+        return True
+
+def run_batch(batch_dir, worker, heartbeat_interval=HEARTBEAT_INTERVAL, stale_after=STALE_AFTER, poll_interval=1.0):
+    """
+    Run the tasks of a batch with a worker until every task has a result : the free slots of the
+    worker claim the tasks no other worker is running, the claims are kept alive by a heartbeat
+    thread, and the tasks of the workers that stopped beating are claimed again.
+
+    Parameters:
+    -----------
+    batch_dir : str
+        Directory of the batch (see create_batch).
+    worker : worker.Worker
+        Preloaded worker, the tasks run on its slots (max_workers).
+    heartbeat_interval : float, optional, default = HEARTBEAT_INTERVAL
+        Seconds between two heartbeats.
+    stale_after : float, optional, default = STALE_AFTER
+        Seconds without heartbeat after which a claim is abandoned.
+    poll_interval : float, optional, default = 1.0
+        Seconds between two scans of the tasks.
+
+    Returns:
+    --------
+    summary : dict
+        {'worker', 'done', 'failed', 'lost', 'elapsed'} of the tasks run by this worker
+    """
+    if stale_after <= heartbeat_interval:
+        raise ValueError("The stale delay must be longer than the heartbeat interval.")
+    batch = Batch(batch_dir, stale_after=stale_after)
+    summary = {"worker": batch.worker_id, "done": 0, "failed": 0, "lost": 0}
+    summary_lock = threading.Lock()
+    start = time.perf_counter()
+
+    def run_task(task, claim):
+        task_start = time.perf_counter()
+        try:
+            # the staging dir is private to this attempt, and the outputs are only published while the claim is ours
+            report = worker.run_job(task, run_id=f"{claim['attempt']}-{claim['token'][:8]}",
+                                    keep_outputs=lambda: batch.owns(task["id"]))
+        except Exception as e:
+            report = {"id": task["id"], "status": "failed", "error": str(e)}
+        result = {
+            "id": task["id"],
+            "status": report.get("status", "failed"),
+            "worker": batch.worker_id,
+            "host": batch.host,
+            "attempt": claim["attempt"],
+            "claimed_at": claim["claimed_at"],
+            "finished_at": time.time(),
+            "elapsed": time.perf_counter() - task_start,
+            "report": report,
+        }
+        written = batch.finish(task["id"], result)
+        with summary_lock:
+            summary["lost" if not written else "done" if result["status"] == "done" else "failed"] += 1
+
+    stop = threading.Event()
+
+    def beat():
+        while not stop.wait(heartbeat_interval):
+            batch.heartbeat()
+
+    heartbeat = threading.Thread(target=beat, name="batch-heartbeat", daemon=True)
+    heartbeat.start()
+    print(f"\033[1mWorker {batch.worker_id} running the {len(batch.tasks)} tasks of '{batch_dir}'\033[0m \n")
+
+    pending = set()
+    # every worker scans the tasks from its own position, so that they rarely race for the same claim
+    offset = random.randrange(len(batch.tasks)) if batch.tasks else 0
+    tasks = batch.tasks[offset:] + batch.tasks[:offset]
+    try:
+        while True:
+            pending = {future for future in pending if not future.done()}
+            unfinished = [task for task in tasks if not batch.is_finished(task["id"])]
+            if not unfinished and not pending:
+                break
+            for task in unfinished:
+                if len(pending) >= worker.max_workers:
+                    break
+                if task["id"] in batch.claims:
+                    continue
+                claim = batch.claim(task["id"])
+                if claim is not None:
+                    pending.add(worker.executor.submit(run_task, task, claim))
+            time.sleep(poll_interval)
+    finally:
+        stop.set()
+        heartbeat.join()
+
+    summary["elapsed"] = time.perf_counter() - start
+    print(f"\033[1mWorker {batch.worker_id} finished : {summary['done']} done, {summary['failed']} failed, "
+          f"{summary['lost']} lost in {summary['elapsed']:.4f} seconds\033[0m \n")
+    return summary
+
+def batch_status(batch_dir, stale_after=STALE_AFTER):
+    """
+    State of the tasks of a batch, and the throughput of its workers.
+
+    Parameters:
+    -----------
+    batch_dir : str
+        Directory of the batch (see create_batch).
+    stale_after : float, optional, default = STALE_AFTER
+        Seconds without heartbeat after which a claim is counted as stale.
+
+    Returns:
+    --------
+    status : dict
+        {'tasks', 'done', 'failed', 'running', 'stale', 'pending', 'elapsed' (first claim to last result),
+        'tasks_per_second', 'workers': {worker: {'tasks', 'busy_seconds'}}}
+    """
+    batch = Batch(batch_dir, worker_id="status", stale_after=stale_after)
+    status = {"tasks": len(batch.tasks), "done": 0, "failed": 0, "running": 0, "stale": 0, "pending": 0, "workers": {}}
+    first, last = None, None
+    now = time.time()
+    for task in batch.tasks:
+        try:
+            with open(batch.result_path(task["id"]), "r") as file:
+                result = json.load(file)
+        except FileNotFoundError:
+            try:
+                age = now - os.stat(batch.claim_path(task["id"])).st_mtime
+                status["stale" if age >= stale_after else "running"] += 1
+            except FileNotFoundError:
+                status["pending"] += 1
+            continue
+        status["done" if result["status"] == "done" else "failed"] += 1
+        worker = status["workers"].setdefault(result["worker"], {"tasks": 0, "busy_seconds": 0.0})
+        worker["tasks"] += 1
+        worker["busy_seconds"] += result["elapsed"]
+        first = result["claimed_at"] if first is None else min(first, result["claimed_at"])
+        last = result["finished_at"] if last is None else max(last, result["finished_at"])
+
+    status["elapsed"] = last - first if first is not None else 0.0
+    finished = status["done"] + status["failed"]
+    status["tasks_per_second"] = finished / status["elapsed"] if status["elapsed"] > 0 else None
+    return status
+
+def print_status(status):
+    """
+    Print the state of a batch (see batch_status).
+    """
+    print(f"\033[1mTasks : {status['done']} done, {status['failed']} failed, {status['running']} running, "
+          f"{status['stale']} stale, {status['pending']} pending (of {status['tasks']})\033[0m")
+    for worker, stats in sorted(status["workers"].items()):
+        print(f"    {worker:<40} {stats['tasks']:>6} tasks {stats['busy_seconds']:10.3f} s busy")
+    if status["tasks_per_second"] is not None:
+        print(f"Throughput : {status['tasks_per_second']:.3f} tasks/s over {status['elapsed']:.3f} s\n")
@@ -0,0 +1,163 @@
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+CLI_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cli.py")
+
+# (label, python arguments) measured by default
+STARTUP_COMMANDS = [
+    ("python (baseline)", ["-c", "pass"]),
+    ("fitsprocessor --help", [CLI_PATH, "--help"]),
+    ("fitsprocessor list-formats --help", [CLI_PATH, "list-formats", "--help"]),
+    ("fitsprocessor convert --help", [CLI_PATH, "convert", "--help"]),
+    ("import astropy.io.fits, numpy (eager)", ["-c", "import astropy.io.fits, numpy"]),
+]
+
+# throughput of the conversion measured on this machine, used by the preflight to project runtimes
+CALIBRATION_FILE = "./generated/benchmark_calibration.json"
+
+def measure_startup(python_args, repeats=10):
+    """
+    Measure the cold-start wall time of a fresh python process.
+
+    Parameters:
+    -----------
+    python_args : list
+        Arguments passed to the python interpreter.
+    repeats : int, optional, default = 10
+        Number of processes to launch.
+
+    Returns:
+    --------
+    List of the wall times in seconds.
+    """
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + python_args,
+                       stdout=subprocess.DEVNULL,
+                       stderr=subprocess.DEVNULL,
+                       check=True)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+def benchmark_startup(commands=None, repeats=10):
+    """
+    Print the min/median/max cold-start latency of the given commands.
+
+    Parameters:
+    -----------
+    commands : list, optional, default = None
+        List of (label, python arguments). Defaults to STARTUP_COMMANDS.
+    repeats : int, optional, default = 10
+        Number of processes to launch per command.
+
+    Returns:
+    --------
+    Dictionary {label: median time in seconds}
+    """
+    commands = commands or STARTUP_COMMANDS
+    results = {}
+
+    print(f"\033[1mCold-start latency over {repeats} runs (seconds)\033[0m \n")
+    print(f"{'command':<42} {'min':>8} {'median':>8} {'max':>8}")
+    for label, python_args in commands:
+        timings = measure_startup(python_args, repeats=repeats)
+        results[label] = statistics.median(timings)
+        print(f"{label:<42} {min(timings):8.4f} {statistics.median(timings):8.4f} {max(timings):8.4f}")
+
+    return results
+
+def load_calibration(calibration_file=CALIBRATION_FILE):
+    """
+    Read the calibration saved by calibrate_conversion.
+
+    Returns:
+    --------
+    Dictionary {'bytes_per_second', 'overhead_seconds', ...}, None if the conversion was not calibrated
+    """
+    if not calibration_file or not os.path.exists(calibration_file):
+        return None
+    with open(calibration_file, "r") as file:
+        return json.load(file)
+
+def calibrate_conversion(input_fits_path, product_id, fitsDataModel_path=None, repeats=3, calibration_file=CALIBRATION_FILE):
+    """
+    Measure the throughput of the conversion on this machine : the input is converted 'repeats' times
+    (into a temporary directory, without XML) and the bytes read and written per second of the median
+    run are saved, with the fixed cost of a conversion (schema and headers, measured by a preflight).
+
+    Parameters:
+    -----------
+    input_fits_path : str
+        Representative input FITS file (large enough for the conversion to dominate).
+    product_id : str
+        Product ID to generate.
+    fitsDataModel_path : str, optional, default = None
+        Path to the FitsDataModel xml.
+    repeats : int, optional, default = 3
+        Number of conversions.
+    calibration_file : str, optional, default = CALIBRATION_FILE
+        Where the calibration is saved.
+
+    Returns:
+    --------
+    Dictionary {'bytes_per_second', 'overhead_seconds', 'input_fits_path', 'product_id', 'measured_at'}
+    """
+    from script import FitsProcessor
+    from preflight import preflight
+
+    start = time.perf_counter()
+    report = preflight([input_fits_path], [product_id], fitsDataModel_path=fitsDataModel_path, calibration_file=None)[0]
+    overhead = time.perf_counter() - start
+    if report["status"] != "ok":
+        raise ValueError(f"Cannot calibrate on '{input_fits_path}' : {report['errors']}")
+
+    timings = []
+    output_dir = tempfile.mkdtemp(prefix="calibration-")
+    try:
+        for _ in range(repeats):
+            result = FitsProcessor().generate_catalog(product_id, input_fits_path, output_path=output_dir + os.sep,
+                                                      fitsDataModel_path=fitsDataModel_path, PAT=True)
+            if result is None:
+                raise ValueError(f"The conversion of '{input_fits_path}' failed.")
+            timings.append(result["elapsed"])
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+    elapsed = max(statistics.median(timings) - overhead, 1e-6)
+    calibration = {
+        "bytes_per_second": (report["read_bytes"] + report["output_bytes"]) / elapsed,
+        "overhead_seconds": overhead,
+        "input_fits_path": input_fits_path,
+        "product_id": product_id,
+        "measured_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    os.makedirs(os.path.dirname(calibration_file) or ".", exist_ok=True)
+    with open(calibration_file, "w") as file:
+        json.dump(calibration, file, indent=4)
+
+    print(f"\033[1mConversion throughput : {calibration['bytes_per_second'] / 1024 ** 2:.1f} MB/s "
+          f"(+ {overhead:.4f} s per conversion), saved in '{calibration_file}'\033[0m \n")
+    return calibration
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the cold-start latency of the FitsProcessor commands.")
+    parser.add_argument("--repeats", type=int, default=10, help="Number of processes to launch per command.")
+    parser.add_argument("--calibrate", type=str, default=None, metavar="INPUT",
+                        help="Measure the conversion throughput on this input FITS file instead (used by the preflight).")
+    parser.add_argument("--product_id", type=str, default="le3.id.vmpz.output.poscatalog", help="Product ID converted by --calibrate.")
+    parser.add_argument("--fits_data_model", type=str, default=None, help="Path to the FitsDataModel xml (default: raw/FitsDataModel.xml).")
+    args = parser.parse_args()
+
+    if args.calibrate:
+        calibrate_conversion(args.calibrate, args.product_id, fitsDataModel_path=args.fits_data_model,
+                             repeats=min(args.repeats, 3))
+    else:
+        benchmark_startup(repeats=args.repeats)
@@ -0,0 +1,527 @@
+import argparse
+import os
+import sys
+
+# Keep the imports of this module light : astropy, numpy, requests and the xsdata
+# bindings are only imported inside the subcommand that needs them.
+
+# default inputs yaml file, found from this file so that an installed command runs from any directory
+INPUTS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config", "inputs.yaml")
+
+def convert(args):
+    """
+    Generate the product (fits + xml) as 'src/example_run.py' does.
+
+    Parameters:
+    -----------
+    args : argparse.Namespace
+        Parsed command-line arguments of the 'convert' subcommand.
+    """
+    from example_run import load_config, run
+
+    config = load_config(args.config)
+
+    # command-line values take precedence over the config file
+    if args.input is not None:
+        config["input_fits_path"] = args.input[0] if len(args.input) == 1 else args.input
+    if args.join is not None:
+        config["input_fits_path"] = {"join": args.join, "key": args.join_key, "how": args.join_type}
+    if args.product_id is not None:
+        config["product_id"] = args.product_id
+    if args.fits_data_model is not None:
+        config["fits_data_model"] = args.fits_data_model
+    if args.display_output:
+        config["display_output"] = True
+    if args.filter is not None:
+        config["row_filter"] = args.filter
+    if args.nside is not None:
+        config["nside"] = args.nside
+    if args.sort_by is not None:
+        config["sort_by"] = args.sort_by
+    if args.sort_memory_mb is not None:
+        config["sort_memory_mb"] = args.sort_memory_mb
+    if args.sort_index:
+        config["sort_index"] = True
+    if args.column_mappings is not None:
+        config["column_mappings"] = args.column_mappings
+    if args.cast_policy is not None:
+        config["cast_policy"] = args.cast_policy
+    if args.processes is not None:
+        config["processes"] = args.processes
+    if args.xml_renderer is not None:
+        config["xml_renderer"] = args.xml_renderer
+    if args.dry_run:
+        config["dry_run"] = True
+    if args.validate:
+        config["validate"] = True
+    if args.progress is not None:
+        config["progress"] = args.progress
+
+    if args.stdout:
+        # the product goes to the pipe, the progress messages to stderr
+        from contextlib import redirect_stdout
+
+        output = sys.stdout.buffer
+        with redirect_stdout(sys.stderr):
+            run(config, output_dir=args.output_dir, output=output)
+        return
+
+    run(config, output_dir=args.output_dir)
+
+def preflight(args):
+    """
+    Check the conversions of many inputs from their headers only, without converting them.
+
+    Parameters:
+    -----------
+    args : argparse.Namespace
+        Parsed command-line arguments of the 'preflight' subcommand.
+    """
+    import json
+    import preflight as preflight_module
+
+    reports = preflight_module.preflight(args.inputs, args.product_id,
+                                         fitsDataModel_path=args.fits_data_model,
+                                         column_mappings_path=args.column_mappings,
+                                         cast_policy=args.cast_policy,
+                                         row_filter=args.filter,
+                                         sort_by=args.sort_by,
+                                         sort_memory=args.sort_memory_mb * 1024 * 1024 if args.sort_memory_mb else None,
+                                         nside=args.nside,
+                                         processes=args.processes,
+                                         fingerprint=args.fingerprint,
+                                         max_workers=args.max_workers)
+    if args.json:
+        print(json.dumps(reports, indent=4))
+    else:
+        preflight_module.print_preflight(reports)
+    return 0 if all(report["status"] == "ok" for report in reports) else 1
+
+def xml(args):
+    """
+    Generate the xml file corresponding to generated product fits file(s).
+
+    Parameters:
+    -----------
+    args : argparse.Namespace
+        Parsed command-line arguments of the 'xml' subcommand.
+    """
+    if args.template:
+        # no EDEN bindings, the xml files are rendered from the precompiled templates
+        import xmltemplate
+
+        if len(args.fits_file) == 1:
+            xmltemplate.main(args.fits_file[0], args.output_dir)
+        else:
+            xmltemplate.main_batch(args.fits_file, args.output_dir)
+        return
+
+    import xmlgenerator
+
+    if len(args.fits_file) == 1:
+        xmlgenerator.main(args.fits_file[0], args.output_dir)
+    else:
+        # the static parts of the headers are shared and the files serialised on a thread pool
+        xmlgenerator.main_batch(args.fits_file, args.output_dir, max_workers=args.max_workers)
+
+def xml_template(args):
+    """
+    Compile the xml templates from reference xml files generated with EDEN, generate these reference
+    files, or check that the templates render the same xml as the EDEN bindings.
+
+    Parameters:
+    -----------
+    args : argparse.Namespace
+        Parsed command-line arguments of the 'xml-template' subcommand.
+    """
+    import xmltemplate
+
+    if args.action == "compile":
+        for reference_xml in args.files:
+            print(f"{reference_xml} -> {xmltemplate.compile_template(reference_xml)}")
+        return 0
+
+    if args.action == "reference":
+        # the reference xml files are generated with the fixed values the tests render the templates with
+        for catalog_name in args.files or list(xmltemplate.names_database):
+            reference_xml = xmltemplate.write_reference(catalog_name)
+            print(f"{reference_xml} -> {xmltemplate.compile_template(reference_xml, catalog_name)}")
+        return 0
+
+    failed = 0
+    for fits_file in args.files:
+        diff = xmltemplate.check_equivalence(fits_file)
+        if diff:
+            failed += 1
+            print(f"\033[1m{fits_file} : the template differs from the EDEN xml\033[0m")
+            print("\n".join(diff))
+        else:
+            print(f"{fits_file} : identical")
+    return 0 if failed == 0 else 1
+
+def validate(args):
+    """
+    Validate the generated xml and fits files (requires the EDEN environment).
+
+    Parameters:
+    -----------
+    args : argparse.Namespace
+        Parsed command-line arguments of the 'validate' subcommand.
+    """
+    import validation
+
+    validation.main(xml_file=args.xml_file,
+                    fits_file=args.fits_file,
+                    product_id=args.product_id,
+                    dm_version=args.dm_version)
+
+def list_formats(args):
+    """
+    Print all the FitsFormat IDs of the FitsDataModel xml.
+
+    Parameters:
+    -----------
+    args : argparse.Namespace
+        Parsed command-line arguments of the 'list-formats' subcommand.
+    """
+    from helpers import get_all_fits_format_ids
+
+    for fits_format_id in get_all_fits_format_ids(fitsDataModel_path=args.fits_data_model):
+        print(fits_format_id)
+
+def worker(args):
+    """
+    Start a long-running worker that keeps the FitsDataModel and the xml bindings loaded.
+
+    Parameters:
+    -----------
+    args : argparse.Namespace
+        Parsed command-line arguments of the 'worker' subcommand.
+    """
+    from worker import Worker
+
+    if (args.socket is None) == (args.spool is None):
+        raise SystemExit("Provide exactly one of --socket or --spool.")
+
+    job_worker = Worker(fitsDataModel_path=args.fits_data_model, max_workers=args.max_workers, xml=not args.no_xml,
+                        xml_renderer=args.xml_renderer)
+    job_worker.preload()
+    try:
+        if args.socket is not None:
+            job_worker.serve_socket(args.socket)
+        else:
+            job_worker.serve_spool(args.spool, poll_interval=args.poll_interval)
+    finally:
+        job_worker.shutdown()
+
+def submit(args):
+    """
+    Send a conversion job to a worker listening on a Unix socket and print its report.
+
+    Parameters:
+    -----------
+    args : argparse.Namespace
+        Parsed command-line arguments of the 'submit' subcommand.
+    """
+    import json
+    from worker import submit_job
+
+    job = {
+        "input_fits_path": args.input,
+        "product_ids": args.product_id,
+        "output_dir": args.output_dir,
+    }
+    if args.fits_data_model is not None:
+        job["fits_data_model"] = args.fits_data_model
+
+    report = submit_job(args.socket, job)
+    print(json.dumps(report, indent=4))
+    return 0 if report.get("status") == "done" else 1
+
+def ingest(args):
+    """
+    Generate the products of the new or changed inputs of a directory, once or continuously.
+
+    Parameters:
+    -----------
+    args : argparse.Namespace
+        Parsed command-line arguments of the 'ingest' subcommand.
+    """
+    import ingest as ingest_module
+
+    options = dict(output_dir=args.output_dir,
+                   fitsDataModel_path=args.fits_data_model,
+                   manifest_path=args.manifest,
+                   pattern=args.pattern,
+                   max_workers=args.max_workers,
+                   xml=not args.no_xml,
+                   append=args.append)
+    if args.watch:
+        ingest_module.watch(args.input_dir, args.product_id, interval=args.interval, **options)
+    else:
+        summary = ingest_module.ingest(args.input_dir, args.product_id, **options)
+        return 0 if summary["failed"] == 0 else 1
+
+def index(args):
+    """
+    Query the product index, or register the products of a directory generated before it existed.
+
+    Parameters:
+    -----------
+    args : argparse.Namespace
+        Parsed command-line arguments of the 'index' subcommand.
+    """
+    import json
+    import time
+    from product_index import ProductIndex, scan_products
+
+    if args.action == "scan":
+        count = scan_products(args.index, args.directory or "./generated/")
+        print(f"{count} products registered in '{args.index}'")
+        return 0
+    if args.action == "prune":
+        with ProductIndex(args.index) as product_index:
+            print(f"{product_index.remove_missing()} missing products removed from '{args.index}'")
+        return 0
+
+    if (args.nside is None) != (args.pixel is None):
+        raise SystemExit("Provide both --nside and --pixel.")
+    start = time.perf_counter()
+    with ProductIndex(args.index) as product_index:
+        products = product_index.query(ra=args.ra, dec=args.dec, nside=args.nside, pixel=args.pixel,
+                                       product_id=args.product_id, catalog_type=args.catalog_type,
+                                       dm_version=args.dm_version, input_hash=args.input_hash,
+                                       min_rows=args.min_rows, limit=args.limit)
+    elapsed = time.perf_counter() - start
+    if args.json:
+        print(json.dumps(products, indent=4))
+    else:
+        for product in products:
+            print(product["fits_file"])
+        print(f"{len(products)} products found in {elapsed * 1000:.2f} ms", file=sys.stderr)
+    return 0
+
+def batch(args):
+    """
+    Create a batch of conversion tasks on a shared filesystem, run its tasks (any number of
+    'batch run' processes on one or many hosts) or print its state.
+
+    Parameters:
+    -----------
+    args : argparse.Namespace
+        Parsed command-line arguments of the 'batch' subcommand.
+    """
+    import json
+    import batch as batch_module
+
+    if args.action == "create":
+        if (args.input is None) == (args.jobs is None):
+            raise SystemExit("Provide exactly one of --input or --jobs.")
+        if args.jobs is not None:
+            with open(args.jobs, "r") as file:
+                jobs = json.load(file)
+        else:
+            import glob
+            if not args.product_id:
+                raise SystemExit("Provide the --product_id of the tasks.")
+            # one task per input file
+            inputs = [path for item in args.input for path in (sorted(glob.glob(item)) if glob.has_magic(item) else [item])]
+            jobs = [{"input_fits_path": path, "product_ids": args.product_id, "output_dir": args.output_dir} for path in inputs]
+            if args.fits_data_model is not None:
+                for job in jobs:
+                    job["fits_data_model"] = args.fits_data_model
+        tasks = batch_module.create_batch(args.batch_dir, jobs)
+        print(f"{len(tasks)} tasks created in '{args.batch_dir}'")
+        return 0
+
+    if args.action == "status":
+        status = batch_module.batch_status(args.batch_dir, stale_after=args.stale_after)
+        if args.json:
+            print(json.dumps(status, indent=4))
+        else:
+            batch_module.print_status(status)
+        return 0 if status["failed"] == 0 else 1
+
+    from worker import Worker
+
+    job_worker = Worker(fitsDataModel_path=args.fits_data_model, max_workers=args.max_workers, xml=not args.no_xml,
+                        xml_renderer=args.xml_renderer)
+    job_worker.preload()
+    try:
+        summary = batch_module.run_batch(args.batch_dir, job_worker, heartbeat_interval=args.heartbeat_interval,
+                                         stale_after=args.stale_after, poll_interval=args.poll_interval)
+    finally:
+        job_worker.shutdown()
+    return 0 if summary["failed"] == 0 else 1
+
+def build_parser():
+    """
+    Build the command-line parser with all the subcommands.
+
+    Returns:
+    --------
+    argparse.ArgumentParser
+    """
+    parser = argparse.ArgumentParser(prog="fitsprocessor",
+                                     description="Create the position, shear and proxyshear catalogs from the sim fits file and the FitsDataModel xml.")
+    subparsers = parser.add_subparsers(dest="command", metavar="<command>")
+    subparsers.required = True
+
+    convert_parser = subparsers.add_parser("convert", help="Generate the product (fits + xml).")
+    convert_parser.add_argument("--config", type=str, default=INPUTS_FILE, help="Path to the inputs yaml file (default: src/config/inputs.yaml).")
+    convert_parser.add_argument("--input", type=str, nargs="+", default=None,
+                                help="Input FITS file(s) merged into one product, e.g. 'tiles/*.fits' or 'sim.fits[*]' (overrides the config).")
+    convert_parser.add_argument("--join", type=str, nargs="+", default=None,
+                                help="Input FITS files joined on --join_key into one table, e.g. mer.fits phz.fits she.fits (overrides the config).")
+    convert_parser.add_argument("--join_key", type=str, default="OBJECT_ID", help="Column the joined inputs are matched on (default: OBJECT_ID).")
+    convert_parser.add_argument("--join_type", choices=["inner", "left"], default="inner",
+                                help="'inner' keeps the keys found in all the inputs, 'left' all the rows of the first input (default: inner).")
+    convert_parser.add_argument("--product_id", type=str, default=None, help="Product ID to generate (overrides the config).")
+    convert_parser.add_argument("--fits_data_model", type=str, default=None, help="'latest', a version or a path to the FitsDataModel xml (overrides the config).")
+    convert_parser.add_argument("--output_dir", type=str, default="./generated/", help="Directory to save the generated files.")
+    convert_parser.add_argument("--display_output", action="store_true", help="Display the generated fits file.")
+    convert_parser.add_argument("--nside", type=int, default=None, help="Split the catalog into one product per NESTED HEALPix pixel at this NSIDE (a power of 2).")
+    convert_parser.add_argument("--sort_by", type=str, default=None, help="Write the rows sorted by 'HEALPIX' (NESTED index of the position) or by a numeric column such as 'OBJECT_ID'.")
+    convert_parser.add_argument("--sort_memory_mb", type=int, default=None, help="Memory budget of the sort in MB, the rows beyond it are spilled to disk (default: 256).")
+    convert_parser.add_argument("--column_mappings", default=None, help="Column mappings yaml (renames and derived columns of every product ID, default: src/config/column_mappings.yaml).")
+    convert_parser.add_argument("--cast_policy", choices=["error", "clip", "warn"], default=None,
+                                help="What to do with the values that overflow or lose precision when cast to their catalog format (default: error).")
+    convert_parser.add_argument("--processes", type=int, default=None,
+                                help="Number of processes converting row ranges of the input in parallel (default: 1).")
+    convert_parser.add_argument("--xml_renderer", choices=["eden", "template"], default=None,
+                                help="Generate the xml with the EDEN bindings or from the precompiled templates, which need no EDEN (default: eden).")
+    convert_parser.add_argument("--sort_index", action="store_true", help="Save the key range of every block of sorted rows as '<product_id>.sort_index.json'.")
+    convert_parser.add_argument("--filter", type=str, default=None, help="Only keep the rows matching this expression, e.g. \"WEIGHT > 0 and 20 < MAG < 24.5\".")
+    convert_parser.add_argument("--progress", choices=["auto", "bar", "log", "none"], default=None,
+                                help="Report the rows done, MB/s, rows/s and ETA of the conversion as a terminal bar or JSON log lines on stderr (default: auto, a bar on a terminal).")
+    convert_parser.add_argument("--validate", action="store_true", help="Validate the generated fits and xml files, concurrently (requires EDEN).")
+    convert_parser.add_argument("--stdout", action="store_true", help="Stream the product fits to the standard output (e.g. into a pipe) instead of saving it, without XML.")
+    convert_parser.add_argument("--dry_run", action="store_true", help="Only read the input headers and report the columns, casts, output size, memory and runtime of the conversion.")
+    convert_parser.set_defaults(func=convert)
+
+    preflight_parser = subparsers.add_parser("preflight", help="Check the conversions of many inputs from their headers only (dry run).")
+    preflight_parser.add_argument("inputs", type=str, nargs="+", help="Input FITS file(s), every one converted on its own.")
+    preflight_parser.add_argument("--product_id", type=str, action="append", required=True, help="Product ID to generate (can be repeated).")
+    preflight_parser.add_argument("--fits_data_model", type=str, default=None, help="Path to the FitsDataModel xml (default: raw/FitsDataModel.xml).")
+    preflight_parser.add_argument("--filter", type=str, default=None, help="Row filter of the conversion.")
+    preflight_parser.add_argument("--sort_by", type=str, default=None, help="Sort key of the conversion.")
+    preflight_parser.add_argument("--sort_memory_mb", type=int, default=None, help="Memory budget of the sort in MB (default: 256).")
+    preflight_parser.add_argument("--nside", type=int, default=None, help="Split into one product per NESTED HEALPix pixel at this NSIDE.")
+    preflight_parser.add_argument("--processes", type=int, default=1, help="Number of processes of the conversion.")
+    preflight_parser.add_argument("--fingerprint", action="store_true", help="The conversion fingerprints its input (reads all the columns).")
+    preflight_parser.add_argument("--column_mappings", default=None, help="Column mappings yaml (default: src/config/column_mappings.yaml).")
+    preflight_parser.add_argument("--cast_policy", choices=["error", "clip", "warn"], default="error", help="Cast policy of the conversion.")
+    preflight_parser.add_argument("--max_workers", type=int, default=8, help="Number of inputs inspected at the same time.")
+    preflight_parser.add_argument("--json", action="store_true", help="Print the reports as JSON.")
+    preflight_parser.set_defaults(func=preflight)
+
+    xml_parser = subparsers.add_parser("xml", help="Generate the xml file for a generated fits file (requires EDEN).")
+    xml_parser.add_argument("fits_file", type=str, nargs="+", help="Path(s) to the generated FITS file(s).")
+    xml_parser.add_argument("--output_dir", type=str, default="./generated/", help="Directory to save the generated XML file.")
+    xml_parser.add_argument("--max_workers", type=int, default=8, help="Number of threads serialising the xml files of several fits files.")
+    xml_parser.add_argument("--template", action="store_true", help="Render the xml from the precompiled templates (no EDEN needed).")
+    xml_parser.set_defaults(func=xml)
+
+    template_parser = subparsers.add_parser("xml-template", help="Compile the xml templates from EDEN outputs, or check them against EDEN (requires EDEN).")
+    template_parser.add_argument("action", choices=["compile", "reference", "check"],
+                                 help="'compile' : reference xml files -> src/config/xml_templates, 'reference' : generate the reference xml files "
+                                      "of src/config/xml_references with EDEN and compile the templates from them, 'check' : compare the two renderers for the given fits files.")
+    template_parser.add_argument("files", type=str, nargs="*", help="Reference xml files (compile), catalog names (reference, default: all) "
+                                                                    "or product fits files '<...>.<product_id>.fits' (check).")
+    template_parser.set_defaults(func=xml_template)
+
+    validate_parser = subparsers.add_parser("validate", help="Validate the generated xml and fits files (requires EDEN).")
+    validate_parser.add_argument("--xml_file", type=str, default=None, help="XML file to validate (default: last generated).")
+    validate_parser.add_argument("--fits_file", type=str, default=None, help="FITS file to validate (default: last generated).")
+    validate_parser.add_argument("--product_id", type=str, default=None, help="Format ID of the FITS file (default: last generated).")
+    validate_parser.add_argument("--dm_version", type=str, default="10.1.3", help="Data model version for the XML validation.")
+    validate_parser.set_defaults(func=validate)
+
+    list_parser = subparsers.add_parser("list-formats", help="List the FitsFormat IDs of the FitsDataModel xml.")
+    list_parser.add_argument("--fits_data_model", type=str, default=None, help="Path to the FitsDataModel xml (default: raw/FitsDataModel.xml).")
+    list_parser.set_defaults(func=list_formats)
+
+    worker_parser = subparsers.add_parser("worker", help="Start a worker that converts the jobs sent to a Unix socket or a spool directory.")
+    worker_parser.add_argument("--socket", type=str, default=None, help="Path of the Unix socket to listen on.")
+    worker_parser.add_argument("--spool", type=str, default=None, help="Directory watched for '*.json' job files.")
+    worker_parser.add_argument("--fits_data_model", type=str, default=None, help="Path to the FitsDataModel xml preloaded for the jobs (default: raw/FitsDataModel.xml).")
+    worker_parser.add_argument("--max_workers", type=int, default=4, help="Maximum number of jobs converted concurrently.")
+    worker_parser.add_argument("--poll_interval", type=float, default=1.0, help="Seconds between two scans of the spool directory.")
+    worker_parser.add_argument("--no_xml", action="store_true", help="Only generate the fits products.")
+    worker_parser.add_argument("--xml_renderer", choices=["eden", "template"], default="eden", help="Generate the xml with the EDEN bindings or from the precompiled templates.")
+    worker_parser.set_defaults(func=worker)
+
+    submit_parser = subparsers.add_parser("submit", help="Send a conversion job to a running worker.")
+    submit_parser.add_argument("--socket", type=str, required=True, help="Path of the Unix socket of the worker.")
+    submit_parser.add_argument("--input", type=str, required=True, help="Path to the input FITS file.")
+    submit_parser.add_argument("--product_id", type=str, action="append", required=True, help="Product ID to generate (can be repeated).")
+    submit_parser.add_argument("--output_dir", type=str, default="./generated/", help="Directory to save the generated files.")
+    submit_parser.add_argument("--fits_data_model", type=str, default=None, help="Path to the FitsDataModel xml (default: the one of the worker).")
+    submit_parser.set_defaults(func=submit)
+
+    ingest_parser = subparsers.add_parser("ingest", help="Generate the products of the new or changed inputs of a directory.")
+    ingest_parser.add_argument("input_dir", type=str, help="Directory containing the input FITS files (scanned recursively).")
+    ingest_parser.add_argument("--product_id", type=str, action="append", required=True, help="Product ID to generate (can be repeated).")
+    ingest_parser.add_argument("--output_dir", type=str, default="./generated/", help="Directory to save the generated files.")
+    ingest_parser.add_argument("--fits_data_model", type=str, default=None, help="Path to the FitsDataModel xml (default: raw/FitsDataModel.xml).")
+    ingest_parser.add_argument("--manifest", type=str, default=None, help="Path of the manifest (default: <output_dir>/ingest_manifest.json).")
+    ingest_parser.add_argument("--pattern", type=str, default="*.fits", help="Shell pattern of the input file names.")
+    ingest_parser.add_argument("--max_workers", type=int, default=4, help="Number of inputs converted concurrently.")
+    ingest_parser.add_argument("--no_xml", action="store_true", help="Only generate the fits products.")
+    ingest_parser.add_argument("--append", action="store_true", help="Only convert the rows appended to an input and extend its previous product.")
+    ingest_parser.add_argument("--watch", action="store_true", help="Keep rescanning the input directory.")
+    ingest_parser.add_argument("--interval", type=float, default=30.0, help="Seconds between two rescans with --watch.")
+    ingest_parser.set_defaults(func=ingest)
+
+    index_parser = subparsers.add_parser("index", help="Query the index of the generated products by region or attribute.")
+    index_parser.add_argument("action", nargs="?", choices=["query", "scan", "prune"], default="query",
+                              help="'query' (default), 'scan' : register the products of a directory from their xml files, 'prune' : forget the deleted products.")
+    index_parser.add_argument("directory", nargs="?", default=None, help="Directory of the products to scan (default: ./generated/).")
+    index_parser.add_argument("--index", type=str, default="./generated/product_index.sqlite", help="Path of the product index.")
+    index_parser.add_argument("--ra", type=float, nargs=2, default=None, metavar=("MIN", "MAX"), help="Products overlapping this RA range in degrees (MIN > MAX wraps around 0).")
+    index_parser.add_argument("--dec", type=float, nargs=2, default=None, metavar=("MIN", "MAX"), help="Products overlapping this Dec range in degrees.")
+    index_parser.add_argument("--nside", type=int, default=None, help="NSIDE of the HEALPix cell given with --pixel.")
+    index_parser.add_argument("--pixel", type=int, default=None, help="Tiles overlapping this NESTED HEALPix cell.")
+    index_parser.add_argument("--product_id", type=str, default=None, help="Product ID, e.g. le3.id.vmpz.output.shearcatalog.")
+    index_parser.add_argument("--catalog_type", type=str, default=None, help="Catalog type : poscatalog, shearcatalog or proxyshearcatalog.")
+    index_parser.add_argument("--dm_version", type=str, default=None, help="FitsFormat version of the products.")
+    index_parser.add_argument("--input_hash", type=str, default=None, help="Content hash of the input.")
+    index_parser.add_argument("--min_rows", type=int, default=None, help="Minimum number of rows.")
+    index_parser.add_argument("--limit", type=int, default=None, help="Maximum number of products listed.")
+    index_parser.add_argument("--json", action="store_true", help="Print the full records as JSON instead of the fits files.")
+    index_parser.set_defaults(func=index)
+
+    batch_parser = subparsers.add_parser("batch", help="Run a batch of conversions with workers on one or many hosts sharing a filesystem.")
+    batch_parser.add_argument("action", choices=["create", "run", "status"],
+                              help="'create' : write the manifest of the tasks, 'run' : claim and run tasks until all are finished, 'status' : print the state of the tasks.")
+    batch_parser.add_argument("batch_dir", type=str, help="Directory of the batch, on a filesystem shared by the workers.")
+    batch_parser.add_argument("--input", type=str, nargs="+", default=None, help="Input FITS files or patterns, one task per file (create).")
+    batch_parser.add_argument("--jobs", type=str, default=None, help="JSON file with the list of the worker jobs of the tasks (create).")
+    batch_parser.add_argument("--product_id", type=str, action="append", default=None, help="Product ID to generate (create, can be repeated).")
+    batch_parser.add_argument("--output_dir", type=str, default="./generated/", help="Directory to save the generated files (create).")
+    batch_parser.add_argument("--fits_data_model", type=str, default=None, help="Path to the FitsDataModel xml (default: raw/FitsDataModel.xml).")
+    batch_parser.add_argument("--max_workers", type=int, default=1, help="Number of tasks run concurrently by this worker (run).")
+    batch_parser.add_argument("--heartbeat_interval", type=float, default=10.0, help="Seconds between two heartbeats on the claims of the running tasks (run).")
+    batch_parser.add_argument("--stale_after", type=float, default=60.0, help="Seconds without heartbeat after which a task is claimed again (run, status).")
+    batch_parser.add_argument("--poll_interval", type=float, default=1.0, help="Seconds between two scans of the tasks (run).")
+    batch_parser.add_argument("--no_xml", action="store_true", help="Only generate the fits products (run).")
+    batch_parser.add_argument("--xml_renderer", choices=["eden", "template"], default="eden", help="Generate the xml with the EDEN bindings or from the precompiled templates (run).")
+    batch_parser.add_argument("--json", action="store_true", help="Print the state as JSON (status).")
+    batch_parser.set_defaults(func=batch)
+
+    return parser
+
+def main(argv=None):
+    """
+    Entry point of the 'fitsprocessor' command.
+
+    Parameters:
+    -----------
+    argv : list, optional
+        Command-line arguments (defaults to sys.argv[1:]).
+    """
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,1599 @@
+import bz2
+import datetime
+import glob
+import gzip
+import hashlib
+import os
+import re
+import shutil
+import subprocess
+import uuid
+import warnings
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+from astropy.io import fits
+
+from expressions import Expression
+from pipeline import BufferPool, PIPELINE_DEPTH, run_pipeline
+
+# size of a FITS block, every HDU is padded to a multiple of it
+BLOCK_SIZE = 2880
+
+# numpy type of the binary table TFORM codes as they are stored on disk (big-endian), the
+# output rows use the same types so that they are written as they are (see raw_dtype for
+# the repeat counts : strings 'nA', bit arrays 'nX' and vectors such as '2E' or '3D')
+RAW_DTYPES = {
+    "L": "i1",    # logical, stored as 'T' / 'F'
+    "B": "u1",    # unsigned byte
+    "I": ">i2",   # 16-bit signed integer
+    "J": ">i4",   # 32-bit signed integer
+    "K": ">i8",   # 64-bit signed integer
+    "E": ">f4",   # 32-bit float
+    "D": ">f8",   # 64-bit float
+    "C": ">c8",   # 64-bit complex
+    "M": ">c16",  # 128-bit complex
+}
+
+# type codes whose values can be converted into one another (strings and bits are only copied)
+NUMERIC_CODES = "LBIJKEDCM"
+
+# what to do with the values a cast cannot represent : raise, clip them to the limits of the target type, or warn
+CAST_POLICIES = ("error", "clip", "warn")
+
+# header cards that change when rows are appended, left out of the header fingerprint
+VOLATILE_KEYWORDS = ("NAXIS2", "CHECKSUM", "DATASUM")
+
+# default number of bytes converted at once
+CHUNK_BYTES = 64 * 1024 * 1024
+
+# default number of bytes of a chunk of a pipelined conversion (several chunks are in flight)
+PIPELINE_CHUNK_BYTES = 16 * 1024 * 1024
+
+# magic bytes of the compressed inputs, which cannot be memory mapped and are decompressed as a stream
+COMPRESSIONS = {b"\x1f\x8b": "gzip", b"BZh": "bzip2"}
+
+# external decompressors used instead of the gzip / bz2 modules when they are installed : lbzip2 and
+# pbzip2 decompress the independent blocks of a bzip2 file on all the cores, pigz reads and checks
+# the stream in threads of its own (gzip itself can only be decompressed sequentially)
+DECOMPRESSORS = {
+    "gzip": (("pigz", "-dc"),),
+    "bzip2": (("lbzip2", "-dc"), ("pbzip2", "-dc")),
+}
+
+# number of decompressed chunks read ahead of the conversion
+DECOMPRESS_DEPTH = 2
+
+def parse_tform(tform):
+    """
+    Split a binary table TFORM into its repeat count and type code.
+
+    Parameters:
+    -----------
+    tform : str
+        TFORM value (e.g. 'D', '10A', '3E').
+
+    Returns:
+    --------
+    (repeat, code) : tuple
+    """
+    match = re.match(r"^\s*(\d*)([LXBIJKAEDCMPQ])", tform.upper())
+    if match is None:
+        raise ValueError(f"Invalid column format: {tform}")
+    repeat, code = match.groups()
+    return (int(repeat) if repeat else 1), code
+
+def raw_dtype(tform):
+    """
+    Numpy type of a binary table column as stored on disk.
+
+    Parameters:
+    -----------
+    tform : str
+        TFORM value of the column.
+
+    Returns:
+    --------
+    numpy.dtype
+    """
+    repeat, code = parse_tform(tform)
+    if code == "A":
+        return np.dtype(f"S{repeat}")
+    if code == "X":
+        return np.dtype(("u1", (repeat + 7) // 8))
+    if code in ("P", "Q"):
+        raise ValueError(f"Variable-length array columns are not supported: {tform}")
+    dtype = np.dtype(RAW_DTYPES[code])
+    return dtype if repeat == 1 else np.dtype((dtype, repeat))
+
+def check_conversion(name, source_tform, tform):
+    """
+    Check that a column can be converted from one TFORM to another : same repeat count, and
+    numeric to numeric (logicals included, complex only to complex) or string to string.
+
+    Parameters:
+    -----------
+    name : str
+        Name of the column, for the error message.
+    source_tform, tform : str
+        TFORM of the input and of the output column.
+    """
+    (source_repeat, source_code), (repeat, code) = parse_tform(source_tform), parse_tform(tform)
+    if code in ("P", "Q"):
+        raise ValueError(f"Variable-length array columns are not supported: {tform}")
+    if source_code == "A" and code == "A":
+        return
+    convertible = (source_code in NUMERIC_CODES and code in NUMERIC_CODES and source_repeat == repeat
+                   and not (source_code in "CM" and code not in "CM"))
+    if not convertible:
+        raise ValueError(f"Cannot convert column {name} from {source_tform} to {tform}.")
+
+class TableLayout:
+    """
+    Byte layout of a binary table HDU of a FITS file : its header, columns, row type and
+    where its data starts, so that its rows can be read in chunks straight from the file.
+    """
+
+    # 'gzip' or 'bzip2' for a compressed file, whose primary header is read with the table header (see CompressedTableLayout)
+    compression = None
+    primary_header = None
+
+    def __init__(self, path, header, data_offset):
+        """
+        Parameters:
+        -----------
+        path : str
+            Path of the FITS file.
+        header : astropy.io.fits.Header
+            Header of the binary table HDU.
+        data_offset : int
+            Byte offset of the table data in the file.
+        """
+        self.path = path
+        self.header = header
+        self.data_offset = data_offset
+        self.nrows = header["NAXIS2"]
+        self.row_width = header["NAXIS1"]
+
+        self.columns = []
+        for i in range(1, header["TFIELDS"] + 1):
+            self.columns.append({
+                "name": header[f"TTYPE{i}"],
+                "format": header[f"TFORM{i}"].strip(),
+                "unit": header.get(f"TUNIT{i}"),
+                "tscal": header.get(f"TSCAL{i}"),
+                "tzero": header.get(f"TZERO{i}"),
+            })
+
+        self.dtype = np.dtype([(col["name"], raw_dtype(col["format"])) for col in self.columns])
+        if self.dtype.itemsize != self.row_width:
+            raise ValueError(f"Row width of the columns ({self.dtype.itemsize}) does not match NAXIS1 ({self.row_width}).")
+
+    @classmethod
+    def from_hdu_list(cls, hdu_list, index, path):
+        """
+        Build the layout of an HDU of an opened FITS file.
+
+        Parameters:
+        -----------
+        hdu_list : astropy.io.fits.HDUList
+            The opened FITS file.
+        index : int
+            Index of the binary table HDU.
+        path : str
+            Path of the FITS file.
+        """
+        return cls(path, hdu_list[index].header, hdu_list.fileinfo(index)["datLoc"])
+
+    @classmethod
+    def from_file(cls, path, index=1):
+        """
+        Read the layout of a binary table HDU of a FITS file (only the headers are read).
+
+        Parameters:
+        -----------
+        path : str
+            Path of the FITS file.
+        index : int or str, optional, default = 1
+            Index or EXTNAME of the binary table HDU.
+        """
+        compressed = compression(path)
+        if compressed:
+            return CompressedTableLayout.from_file(path, index, compressed)
+        with fits.open(path, memmap=True) as hdu_list:
+            if not isinstance(hdu_list[index], fits.BinTableHDU):
+                raise ValueError(f"HDU {index} of '{path}' does not contain a binary table.")
+            return cls(path, hdu_list[index].header.copy(), hdu_list.fileinfo(index)["datLoc"])
+
+    def column(self, name):
+        """
+        Return the description {'name', 'format', 'unit', 'tscal', 'tzero'} of a column.
+        """
+        for col in self.columns:
+            if col["name"] == name:
+                return col
+        raise KeyError(name)
+
+    def fingerprint(self):
+        """
+        Hash of the table header without the cards that change when rows are appended.
+
+        Returns:
+        --------
+        Hexadecimal digest.
+        """
+        digest = hashlib.sha256()
+        for card in self.header.cards:
+            if card.keyword not in VOLATILE_KEYWORDS:
+                digest.update(card.image.encode("ascii"))
+        return digest.hexdigest()
+
+    def byte_ranges(self, names):
+        """
+        Byte ranges inside a row holding these columns, adjacent columns merged into one range.
+
+        Parameters:
+        -----------
+        names : list
+            Names of the columns.
+
+        Returns:
+        --------
+        (ranges, dtype) : tuple
+            The sorted [start, stop) ranges and the packed type of the columns they hold, in the order of the row.
+        """
+        fields = sorted((self.dtype.fields[name][1], name) for name in set(names))
+        ranges = []
+        for offset, name in fields:
+            stop = offset + self.dtype.fields[name][0].itemsize
+            if ranges and ranges[-1][1] == offset:
+                ranges[-1][1] = stop
+            else:
+                ranges.append([offset, stop])
+        dtype = np.dtype([(name, self.dtype.fields[name][0]) for _, name in fields])
+        return [tuple(r) for r in ranges], dtype
+
+    def default_chunk_rows(self, columns=None, chunk_bytes=CHUNK_BYTES):
+        return max(1, chunk_bytes // max(1, self.chunk_dtype(columns).itemsize))
+
+    def chunk_dtype(self, columns=None):
+        """
+        Type of the rows returned by iter_chunks (the packed type of the columns if only some are read).
+        """
+        return self.byte_ranges(columns)[1] if columns else self.dtype
+
+    def iter_chunks(self, chunk_rows=None, start=0, stop=None, columns=None, pool=None):
+        """
+        Iterate over the raw rows of the table, reading them from a memory map of the file.
+
+        Parameters:
+        -----------
+        chunk_rows : int, optional, default = None
+            Number of rows per chunk (default : CHUNK_BYTES worth of rows).
+        start : int, optional, default = 0
+            First row to read.
+        stop : int, optional, default = None
+            Row after the last row to read (default : NAXIS2).
+        columns : list, optional, default = None
+            Only read these columns : the byte ranges of the rows holding them are gathered with
+            strided copies into packed rows, the bytes of the other columns are never touched.
+        pool : pipeline.BufferPool, optional, default = None
+            Read every chunk into an array of the pool (of chunk_rows rows of type chunk_dtype(columns)),
+            to be released by the consumer, instead of returning a view of the memory map.
+
+        Returns:
+        --------
+        Generator of numpy structured arrays of type self.dtype (or of the packed type of the columns)
+        """
+        chunk_rows = chunk_rows or self.default_chunk_rows(columns)
+        stop = self.nrows if stop is None else stop
+        if stop <= start:
+            return
+
+        if not columns:
+            rows = np.memmap(self.path, dtype=self.dtype, mode="r", offset=self.data_offset, shape=(self.nrows,))
+            for begin in range(start, stop, chunk_rows):
+                chunk = rows[begin:min(begin + chunk_rows, stop)]
+                if pool is not None:
+                    # the pages of the file are read here rather than by the consumer
+                    buffer = pool.acquire(len(chunk))
+                    buffer[:] = chunk
+                    chunk = buffer
+                yield chunk
+            return
+
+        ranges, dtype = self.byte_ranges(columns)
+        raw = np.memmap(self.path, dtype=np.uint8, mode="r", offset=self.data_offset, shape=(self.nrows, self.row_width))
+        for begin in range(start, stop, chunk_rows):
+            block = raw[begin:min(begin + chunk_rows, stop)]
+            chunk = pool.acquire(len(block)) if pool is not None else np.empty(len(block), dtype=dtype)
+            yield pack_columns(block, ranges, chunk)
+
+def pack_columns(block, ranges, chunk):
+    """
+    Gather byte ranges of raw rows into packed rows with strided copies.
+
+    Parameters:
+    -----------
+    block : numpy array
+        Raw rows as a 2D array of bytes (rows, row width).
+    ranges : list
+        [start, stop) byte ranges of the rows to copy (see TableLayout.byte_ranges).
+    chunk : numpy structured array
+        Packed rows filled with the ranges, in order.
+
+    Returns:
+    --------
+    chunk
+    """
+    packed = chunk.view(np.uint8).reshape(len(block), chunk.dtype.itemsize)
+    position = 0
+    for low, high in ranges:
+        packed[:, position:position + high - low] = block[:, low:high]
+        position += high - low
+    return chunk
+
+def compression(path):
+    """
+    Compression of a file from its magic bytes : 'gzip', 'bzip2' or None.
+    """
+    with open(path, "rb") as file:
+        magic = file.read(3)
+    return next((name for prefix, name in COMPRESSIONS.items() if magic.startswith(prefix)), None)
+
+@contextmanager
+def decompressed(path, compression):
+    """
+    Open a compressed file as a stream of its decompressed bytes, decompressed by an external
+    decompressor (see DECOMPRESSORS) in its own process if one is installed, by the gzip / bz2
+    modules otherwise.
+
+    Parameters:
+    -----------
+    path : str
+        Path of the compressed file.
+    compression : str
+        'gzip' or 'bzip2'.
+
+    Returns:
+    --------
+    Binary file object that can only be read forward
+    """
+    command = next((command for command in DECOMPRESSORS[compression] if shutil.which(command[0])), None)
+    if command is None:
+        with (gzip.open if compression == "gzip" else bz2.open)(path, "rb") as file:
+            yield file
+        return
+
+    process = subprocess.Popen([*command, path], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    try:
+        yield process.stdout
+    finally:
+        # the rest of the file (padding and following HDUs) is not needed
+        process.kill()
+        process.stdout.close()
+        process.wait()
+
+def read_into(file, buffer):
+    """
+    Fill a buffer from a stream (a pipe can return fewer bytes than asked).
+
+    Returns:
+    --------
+    Number of bytes read, less than the size of the buffer at the end of the stream
+    """
+    view = memoryview(buffer).cast("B")
+    position = 0
+    while position < len(view):
+        count = file.readinto(view[position:])
+        if not count:
+            break
+        position += count
+    return position
+
+def iter_headers(file):
+    """
+    Iterate over the headers of the HDUs of a FITS stream, skipping their data.
+
+    Parameters:
+    -----------
+    file : file object
+        FITS file read forward from its beginning (e.g. see decompressed).
+
+    Returns:
+    --------
+    Generator of (header, data_offset) tuples, data_offset being the position of the data of the HDU in the stream
+    """
+    position = 0
+    while True:
+        block = file.read(BLOCK_SIZE)
+        if len(block) < BLOCK_SIZE:
+            return
+        header = block
+        # a header ends with the END card, padded to a whole block
+        while not any(header[card:card + 8] == b"END     " for card in range(len(header) - BLOCK_SIZE, len(header), 80)):
+            block = file.read(BLOCK_SIZE)
+            if len(block) < BLOCK_SIZE:
+                raise ValueError("The FITS stream ends inside a header.")
+            header += block
+        position += len(header)
+        header = fits.Header.fromstring(header.decode("ascii"))
+        yield header, position
+
+        # data size of the HDU (FITS standard 4.4.1), padded to a whole block
+        nbytes = 0
+        if header.get("NAXIS", 0) > 0:
+            nbytes = 1
+            for i in range(1, header["NAXIS"] + 1):
+                nbytes *= header[f"NAXIS{i}"]
+            nbytes = abs(header["BITPIX"]) // 8 * header.get("GCOUNT", 1) * (header.get("PCOUNT", 0) + nbytes)
+        nbytes = -(-nbytes // BLOCK_SIZE) * BLOCK_SIZE
+        position += nbytes
+        while nbytes > 0:
+            count = len(file.read(min(nbytes, CHUNK_BYTES)))
+            if not count:
+                return
+            nbytes -= count
+
+class CompressedTableLayout(TableLayout):
+    """
+    Layout of a binary table HDU of a gzip or bzip2 compressed FITS file (see TableLayout) : the
+    file cannot be memory mapped, so its rows are decompressed sequentially into chunks as they
+    are read, never the whole file.
+    """
+
+    def __init__(self, path, header, data_offset, compression, primary_header=None):
+        """
+        Parameters:
+        -----------
+        path, header, data_offset
+            See TableLayout (data_offset is an offset in the decompressed bytes).
+        compression : str
+            'gzip' or 'bzip2'.
+        primary_header : astropy.io.fits.Header, optional, default = None
+            Header of the primary HDU of the file.
+        """
+        super().__init__(path, header, data_offset)
+        self.compression = compression
+        self.primary_header = primary_header
+
+    @classmethod
+    def from_file(cls, path, index=1, compression="gzip"):
+        """
+        Read the layouts of binary table HDUs of a compressed FITS file : the headers are read
+        one after the other from the decompressed stream, which stops at the last HDU needed
+        (astropy would decompress the whole file to close it).
+
+        Parameters:
+        -----------
+        path : str
+            Path of the compressed FITS file.
+        index : int or str, optional, default = 1
+            Index or EXTNAME of the binary table HDU, or '*' for all the binary table HDUs.
+        compression : str, optional, default = "gzip"
+            'gzip' or 'bzip2'.
+
+        Returns:
+        --------
+        CompressedTableLayout, or a list of them for '*'
+        """
+        layouts = []
+        primary_header = None
+        with decompressed(path, compression) as file:
+            for i, (header, data_offset) in enumerate(iter_headers(file)):
+                if i == 0:
+                    primary_header = header
+                is_table = header.get("XTENSION") == "BINTABLE"
+                if index == "*":
+                    if is_table:
+                        layouts.append(cls(path, header, data_offset, compression, primary_header))
+                    continue
+                if i == index or (isinstance(index, str) and header.get("EXTNAME") == index):
+                    if not is_table:
+                        raise ValueError(f"HDU {index} of '{path}' does not contain a binary table.")
+                    return cls(path, header, data_offset, compression, primary_header)
+        if index != "*":
+            raise ValueError(f"'{path}' does not have an HDU {index}.")
+        return layouts
+
+    def iter_chunks(self, chunk_rows=None, start=0, stop=None, columns=None, pool=None):
+        """
+        Iterate over the raw rows of the table (see TableLayout.iter_chunks). A thread decompresses
+        the next chunks (at most DECOMPRESS_DEPTH ahead) while the previous ones are used, the
+        memory used does not depend on the size of the file. Starting at a row decompresses the
+        rows before it. Without a pool, every chunk is only valid until the next one is requested.
+        """
+        chunk_rows = chunk_rows or self.default_chunk_rows(columns)
+        stop = self.nrows if stop is None else stop
+        if stop <= start:
+            return
+        ranges, dtype = self.byte_ranges(columns) if columns else (None, self.dtype)
+        blocks = BufferPool(lambda: np.empty(chunk_rows, dtype=self.dtype), DECOMPRESS_DEPTH + 2)
+
+        def decompress():
+            with decompressed(self.path, self.compression) as file:
+                skip = self.data_offset + start * self.row_width
+                while skip > 0:
+                    count = len(file.read(min(skip, CHUNK_BYTES)))
+                    if not count:
+                        break
+                    skip -= count
+                for begin in range(start, stop, chunk_rows):
+                    block = blocks.acquire(min(chunk_rows, stop - begin))
+                    if skip > 0 or read_into(file, block.view(np.uint8)) < block.nbytes:
+                        raise ValueError(f"'{self.path}' is truncated : the data of its table ends before row {stop}.")
+                    yield block
+
+        for block in run_pipeline(decompress(), [], depth=DECOMPRESS_DEPTH, pools=(blocks,)):
+            if not columns and pool is None:
+                # the decompressed block itself, given back once the next chunk is requested
+                yield block
+                blocks.release(block)
+                continue
+            chunk = pool.acquire(len(block)) if pool is not None else np.empty(len(block), dtype=dtype)
+            if columns:
+                pack_columns(block.view(np.uint8).reshape(len(block), self.row_width), ranges, chunk)
+            else:
+                chunk[:] = block
+            blocks.release(block)
+            yield chunk
+
+class TableStream:
+    """
+    Several binary table HDUs with the same layout (e.g. the sub-tiles of a simulation) read
+    as one table : their rows are streamed one HDU after the other, never concatenated in memory.
+    It has the same interface as TableLayout.
+    """
+
+    def __init__(self, layouts):
+        """
+        Parameters:
+        -----------
+        layouts : list
+            TableLayout of every HDU, in the order of their rows.
+        """
+        first = layouts[0]
+        for layout in layouts[1:]:
+            if [(col["name"], col["format"], col["tscal"], col["tzero"]) for col in layout.columns] != \
+               [(col["name"], col["format"], col["tscal"], col["tzero"]) for col in first.columns]:
+                raise ValueError(f"The columns of '{layout.path}' do not match the columns of '{first.path}'.")
+
+        self.layouts = layouts
+        self.path = first.path
+        self.header = first.header
+        self.columns = first.columns
+        self.dtype = first.dtype
+        self.row_width = first.row_width
+        self.compression = next((layout.compression for layout in layouts if layout.compression), None)
+        self.primary_header = first.primary_header
+        self.nrows = sum(layout.nrows for layout in layouts)
+
+    def column(self, name):
+        return self.layouts[0].column(name)
+
+    def fingerprint(self):
+        """
+        Hash of the table headers (see TableLayout.fingerprint) : rows can only be appended to the last HDU.
+        """
+        digest = hashlib.sha256()
+        for layout in self.layouts:
+            digest.update(layout.fingerprint().encode("ascii"))
+        for layout in self.layouts[:-1]:
+            digest.update(str(layout.nrows).encode("ascii"))
+        return digest.hexdigest()
+
+    def byte_ranges(self, names):
+        return self.layouts[0].byte_ranges(names)
+
+    def default_chunk_rows(self, columns=None, chunk_bytes=CHUNK_BYTES):
+        return self.layouts[0].default_chunk_rows(columns, chunk_bytes)
+
+    def chunk_dtype(self, columns=None):
+        return self.layouts[0].chunk_dtype(columns)
+
+    def iter_chunks(self, chunk_rows=None, start=0, stop=None, columns=None, pool=None):
+        """
+        Iterate over the raw rows of all the HDUs (see TableLayout.iter_chunks). The rows are
+        numbered across the HDUs; a chunk never spans two HDUs.
+        """
+        stop = self.nrows if stop is None else stop
+        offset = 0
+        for layout in self.layouts:
+            begin, end = max(start - offset, 0), min(stop - offset, layout.nrows)
+            if begin < end:
+                yield from layout.iter_chunks(chunk_rows, start=begin, stop=end, columns=columns, pool=pool)
+            offset += layout.nrows
+
+def parse_input_spec(spec):
+    """
+    Expand an input specification into the list of binary table HDUs to read.
+
+    Parameters:
+    -----------
+    spec : str or list
+        A path or a list of paths. Every path can contain shell wildcards (the matching files are
+        taken in sorted order) and select its HDUs with a suffix : 'sim.fits' (HDU 1), 'sim.fits[2]',
+        'sim.fits[EXTNAME]' or 'sim.fits[*]' (all the binary table HDUs of the file).
+
+    Returns:
+    --------
+    list of (path, hdu) tuples, hdu being an index, an EXTNAME or '*'
+    """
+    items = [spec] if isinstance(spec, str) else list(spec)
+    inputs = []
+    for item in items:
+        match = re.match(r"^(.*?)(?:\[([^\]]+)\])?$", item.strip())
+        path, hdu = match.group(1), match.group(2)
+        hdu = 1 if hdu is None else int(hdu) if hdu.strip().isdigit() else hdu.strip()
+
+        paths = sorted(glob.glob(path)) if glob.has_magic(path) else [path]
+        if not paths:
+            raise FileNotFoundError(f"No input FITS file matches '{path}'.")
+        for path in paths:
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"Input FITS file '{path}' does not exist.")
+            inputs.append((path, hdu))
+    if not inputs:
+        raise ValueError("No input FITS file given.")
+    return inputs
+
+def open_input(spec):
+    """
+    Read the layout of the table(s) of an input specification (only the headers are read).
+
+    Parameters:
+    -----------
+    spec : str or list or dict
+        Input specification (see parse_input_spec), or {'join': [input specifications], ...} for
+        inputs joined on a key column (see join.open_join).
+
+    Returns:
+    --------
+    TableLayout if the input is a single HDU, TableStream for several HDUs, join.JoinedTable for a join
+    """
+    if isinstance(spec, dict):
+        from join import open_join
+        return open_join(spec)
+
+    layouts = []
+    for path, hdu in parse_input_spec(spec):
+        if hdu != "*":
+            layouts.append(TableLayout.from_file(path, hdu))
+            continue
+        compressed = compression(path)
+        if compressed:
+            tables = CompressedTableLayout.from_file(path, "*", compressed)
+            if not tables:
+                raise ValueError(f"'{path}' does not contain any binary table.")
+            layouts.extend(tables)
+            continue
+        with fits.open(path, memmap=True) as hdu_list:
+            indices = [i for i, table in enumerate(hdu_list) if isinstance(table, fits.BinTableHDU)]
+        if not indices:
+            raise ValueError(f"'{path}' does not contain any binary table.")
+        layouts.extend(TableLayout.from_file(path, i) for i in indices)
+    return layouts[0] if len(layouts) == 1 else TableStream(layouts)
+
+def source_values(rows, column):
+    """
+    Values of an input column as read from the raw rows, with TSCAL/TZERO applied and
+    logicals converted to bool.
+
+    Parameters:
+    -----------
+    rows : numpy structured array
+        Raw rows of the input table.
+    column : dict
+        Description of the input column (see TableLayout.columns).
+    """
+    values = rows[column["name"]]
+    repeat, code = parse_tform(column["format"])
+
+    if code == "L":
+        return values == ord("T")
+
+    tscal, tzero = column["tscal"], column["tzero"]
+    if tscal is None and tzero is None:
+        return values
+    tscal = 1 if tscal is None else tscal
+    tzero = 0 if tzero is None else tzero
+
+    # unsigned integers are stored as signed integers with an offset TZERO
+    if code in ("I", "J", "K") and tscal == 1 and tzero == 2 ** (8 * values.dtype.itemsize - 1):
+        unsigned = values.dtype.base.str.replace("i", "u")
+        return values.view(unsigned) ^ np.array(tzero, dtype=unsigned)
+    return values * tscal + tzero
+
+def check_cast(values, dtype, policy="error", name=None):
+    """
+    Check that the values can be cast to the target type without overflow or loss of precision.
+    The common case costs a min / max reduction : the values are only inspected one by one when
+    their range goes beyond the limits of the target type.
+
+    Issues counted :
+        out_of_range   : finite values beyond the limits of the target type (wrapped integers, inf floats)
+        non_finite     : NaN / inf values cast to an integer type
+        precision_loss : fractional values cast to an integer type, integers not exactly representable as floats
+
+    Parameters:
+    -----------
+    values : numpy array
+        Values to cast.
+    dtype : numpy.dtype
+        Target type.
+    policy : str, optional, default = "error"
+        'error' raises a ValueError, 'clip' clips the values to the limits of the target type
+        (NaN to 0 for integers), 'warn' casts them as they are (see CAST_POLICIES).
+    name : str, optional, default = None
+        Name of the column, for the error message.
+
+    Returns:
+    --------
+    (values, issues) : tuple
+        The values ready to be cast (clipped with the 'clip' policy) and the {issue: count} of the
+        values that do not survive the cast (empty when they all do).
+    """
+    if policy not in CAST_POLICIES:
+        raise ValueError(f"Unknown cast policy '{policy}'. Options: {list(CAST_POLICIES)}")
+    dtype = np.dtype(dtype)
+    kind = values.dtype.kind
+    if values.size == 0 or kind not in "biuf" or dtype.kind not in "iuf":
+        return values, {}
+    # numpy deems int64 -> float64 safe, the integers beyond 2**53 are checked below
+    if np.can_cast(values.dtype, dtype, "safe") and not (kind in "iu" and dtype.kind == "f"):
+        return values, {}
+
+    if dtype.kind in "iu":
+        info = np.iinfo(dtype)
+        low, high = info.min, info.max
+    else:
+        low, high = -np.finfo(dtype).max, np.finfo(dtype).max
+
+    if dtype.kind in "iu" and kind == "f":
+        # the maximum of a 64 bits integer rounds up to 2**63 as a float, which does not fit : the floats
+        # must stay strictly below the power of two above the maximum, so the largest float below it is the limit
+        high = np.nextafter(values.dtype.type(high + 1), values.dtype.type(0))
+
+    issues = {}
+    # min / max propagate NaN, so a NaN also takes the slow path
+    in_range = values.min() >= low and values.max() <= high
+    if not in_range:
+        if kind == "f":
+            finite = np.isfinite(values)
+            out_of_range = finite & ((values < low) | (values > high))
+            if dtype.kind in "iu":
+                issues["non_finite"] = values.size - int(np.count_nonzero(finite))
+        else:
+            out_of_range = (values < low) | (values > high)
+        issues["out_of_range"] = int(np.count_nonzero(out_of_range))
+
+    if dtype.kind in "iu" and kind == "f":
+        # fractional parts dropped by the cast
+        with np.errstate(invalid="ignore"):
+            issues["precision_loss"] = int(np.count_nonzero(np.isfinite(values) & (values != np.trunc(values))))
+    elif dtype.kind == "f" and kind in "iu":
+        # integers beyond 2**(mantissa bits) are not all representable
+        exact = 2 ** (np.finfo(dtype).nmant + 1)
+        if values.min() < -exact or values.max() > exact:
+            with np.errstate(invalid="ignore", over="ignore"):
+                issues["precision_loss"] = int(np.count_nonzero(values.astype(dtype).astype(values.dtype) != values))
+
+    issues = {issue: count for issue, count in issues.items() if count}
+    if not issues:
+        return values, issues
+
+    if policy == "error":
+        details = ", ".join(f"{count} {issue.replace('_', ' ')}" for issue, count in issues.items())
+        raise ValueError(f"Cannot cast column {name} from {values.dtype.name} to {dtype.name}: {details} values. "
+                         f"Use the 'clip' or 'warn' cast policy to convert it anyway.")
+    if policy == "clip" and not in_range:
+        if dtype.kind in "iu":
+            values = np.clip(np.nan_to_num(values, nan=0) if kind == "f" else values, low, high)
+        else:
+            values = np.where(np.isfinite(values), np.clip(values, low, high), values)
+    return values, issues
+
+class ConversionPlan:
+    """
+    Describes how the rows of an input table are converted to the columns of a FitsDataModel
+    table : which input column feeds every output column, its unit and its output type.
+    """
+
+    def __init__(self, layout, columns_info, mapping=None, cast_policy="error", verbose=True):
+        """
+        Parameters:
+        -----------
+        layout : TableLayout
+            Layout of the input table.
+        columns_info : dict
+            {'column1': {'format': 'D', 'unit': ..., 'comment': ...}} in the order of the FitsDataModel.
+        mapping : dict, optional, default = None
+            {'output name': 'input name' or 'expression'} : an input name renames the input column, an
+            expression over the input columns (see expressions.Expression) derives the output column.
+        cast_policy : str, optional, default = "error"
+            What to do with the values that do not survive the cast to their output type (see check_cast).
+        verbose : bool, optional, default = True
+            Print the columns whose format is updated.
+        """
+        if cast_policy not in CAST_POLICIES:
+            raise ValueError(f"Unknown cast policy '{cast_policy}'. Options: {list(CAST_POLICIES)}")
+        self.layout = layout
+        self.cast_policy = cast_policy
+        # kept to rebuild the plan in other processes (see sharding)
+        self.columns_info = columns_info
+        self.mapping = dict(mapping or {})
+        # {column: {issue: count}} of the values clipped or cast with a warning so far
+        self.cast_issues = {}
+
+        expressions = {name: Expression(str(text)) for name, text in (mapping or {}).items()}
+
+        # output column name -> input column (renamed columns replace an existing column of the same name)
+        sources = {col["name"]: col for col in layout.columns}
+        for new_name, expression in expressions.items():
+            old_name = expression.tree.body.id if expression.is_column else None
+            if old_name in sources:
+                sources.pop(new_name, None)
+                sources[new_name] = sources.pop(old_name)
+
+        # output column name -> expression computing it from the input columns
+        self.derived = {name: expression for name, expression in expressions.items() if not expression.is_column}
+        for name in self.derived:
+            sources.pop(name, None)
+        # the expressions read input (or renamed) columns, never other derived columns
+        for name, expression in self.derived.items():
+            for column in expression.names:
+                if column not in sources and column not in layout.dtype.names:
+                    raise ValueError(f"Unknown column '{column}' in the expression of {name} '{expression.text}'. "
+                                     f"Available columns: {sorted(set(sources) | set(layout.dtype.names))}")
+
+        self.sources = sources
+        self.missing = [name for name in columns_info if name not in sources and name not in self.derived]
+        self.excess = [name for name in sources if name not in columns_info]
+
+        # intermediate arrays of the derived columns and output rows, reused from one chunk to the next
+        self.buffers = {name: {} for name in self.derived}
+        self.out = None
+
+        self.columns = []
+        for name, info in columns_info.items():
+            source = sources.get(name)
+            tform = info["format"]
+            # the output rows have the on-disk types of the output formats
+            dtype = raw_dtype(tform)
+            copy = False
+            if name in self.derived or source is None:
+                unit = info["unit"]
+            else:
+                unit = source["unit"] if source["unit"] not in ('', None) else info["unit"]
+                # same layout as the input, the raw bytes are copied as they are
+                copy = raw_dtype(source["format"]) == dtype and source["tscal"] is None and source["tzero"] is None
+                if not copy:
+                    check_conversion(name, source["format"], tform)
+                    if source["format"] != tform and verbose:
+                        print(f"Updating column {name} format from {source['format']} to {tform}\n")
+
+            self.columns.append({"name": name, "format": tform, "unit": unit, "source": source, "dtype": dtype,
+                                 "expression": self.derived.get(name), "copy": copy})
+
+        self.dtype = np.dtype([(col["name"], col["dtype"]) for col in self.columns])
+        # input row types whose layout is the one of the output rows (see convert)
+        self.passthrough = {}
+
+    def table_header(self, extname):
+        """
+        Build the header of the output table HDU (NAXIS2 is set to 0).
+
+        Parameters:
+        -----------
+        extname : str
+            EXTNAME of the table HDU.
+
+        Returns:
+        --------
+        astropy.io.fits.Header
+        """
+        columns = [fits.Column(name=col["name"], format=col["format"], unit=col["unit"],
+                               array=np.zeros(0, dtype=col["dtype"]))
+                   for col in self.columns]
+        header = fits.BinTableHDU.from_columns(columns).header
+        header['EXTNAME'] = extname
+        return header
+
+    def column_values(self, rows, name):
+        """
+        Values of a column of the input rows, designated by its catalog (renamed) name or,
+        if no catalog column has this name, by its input name.
+
+        Parameters:
+        -----------
+        rows : numpy structured array
+            Raw rows of the input table.
+        name : str
+            Name of the column.
+        """
+        source = self.sources.get(name)
+        if source is None:
+            try:
+                source = self.layout.column(name)
+            except KeyError:
+                raise ValueError(f"Unknown column '{name}'. Available columns: {sorted(set(self.sources) | set(self.layout.dtype.names))}")
+        return source_values(rows, source)
+
+    def input_columns(self, row_filter=None):
+        """
+        Input columns read by the conversion (and by the row filter) : the columns of the input
+        that are not in the catalog are left out of the reads (see TableLayout.iter_chunks).
+
+        Parameters:
+        -----------
+        row_filter : str or expressions.Expression, optional, default = None
+            Row filter applied to the input rows.
+
+        Returns:
+        --------
+        list of input column names
+        """
+        names = [col["source"]["name"] for col in self.columns if col["source"] is not None]
+        expressions = [col["expression"] for col in self.columns if col["expression"] is not None]
+        if row_filter:
+            expressions.append(Expression(row_filter) if isinstance(row_filter, str) else row_filter)
+        for expression in expressions:
+            for name in expression.names:
+                names.append(self.sources[name]["name"] if name in self.sources else name)
+        return list(dict.fromkeys(names))
+
+    def compile_filter(self, expression):
+        """
+        Compile a row filter expression over the input or renamed column names (see expressions.Expression).
+
+        Parameters:
+        -----------
+        expression : str or expressions.Expression
+            Filter, e.g. "WEIGHT > 0 and 0 < RIGHT_ASCENSION < 10"
+
+        Returns:
+        --------
+        Function returning the boolean mask of the selected rows of a chunk of raw rows
+        """
+        expression = Expression(expression) if isinstance(expression, str) else expression
+        for name in expression.names:
+            if name not in self.sources and name not in self.layout.dtype.names:
+                raise ValueError(f"Unknown column '{name}' in filter '{expression.text}'. Available columns: {sorted(set(self.sources) | set(self.layout.dtype.names))}")
+
+        def row_mask(rows):
+            mask = np.asarray(expression.evaluate(lambda name: self.column_values(rows, name)))
+            if mask.dtype != bool:
+                raise ValueError(f"The filter '{expression.text}' does not evaluate to a boolean.")
+            return np.broadcast_to(mask, (len(rows),))
+
+        return row_mask
+
+    def empty_rows(self, nrows):
+        """
+        Array of output rows ready to be converted into : the columns missing from the input are
+        filled once (zeros, 'F' for the logicals), the other columns are written by convert.
+        """
+        out = np.zeros(nrows, dtype=self.dtype)
+        for col in self.columns:
+            if col["source"] is None and col["expression"] is None and parse_tform(col["format"])[1] == "L":
+                out[col["name"]] = ord("F")
+        return out
+
+    def convert(self, rows, reuse=False, out=None):
+        """
+        Convert a chunk of raw input rows to output rows.
+
+        Parameters:
+        -----------
+        rows : numpy structured array
+            Raw rows of the input table (see TableLayout.iter_chunks).
+        reuse : bool, optional, default = False
+            Write the output rows into the array of the previous call instead of allocating a new one
+            (for callers that write or copy the rows before converting the next chunk).
+        out : numpy structured array, optional, default = None
+            Write the output rows into the first rows of this array from empty_rows.
+
+        Returns:
+        --------
+        numpy structured array of type self.dtype, ready to be written (a view of the input rows
+        when all the output columns are the input columns, in the same order and layout)
+        """
+        if self.is_passthrough(rows.dtype):
+            return rows.view(self.dtype)
+
+        if out is not None:
+            out = out[:len(rows)]
+        elif reuse and self.out is not None and len(self.out) >= len(rows):
+            out = self.out[:len(rows)]
+        else:
+            out = self.empty_rows(len(rows))
+            if reuse:
+                self.out = out
+
+        for col in self.columns:
+            source = col["source"]
+            if col["expression"] is not None:
+                values = col["expression"].evaluate(lambda name: self.column_values(rows, name), self.buffers[col["name"]])
+            elif source is None:
+                continue
+            elif col["copy"]:
+                out[col["name"]] = rows[source["name"]]
+                continue
+            else:
+                values = source_values(rows, source)
+            self.cast_into(out, values, col)
+        return out
+
+    def is_passthrough(self, row_dtype):
+        """
+        Whether rows of this type are already output rows : every output column is copied from the
+        input column at the same byte offset, and the rows have no other bytes.
+        """
+        if row_dtype not in self.passthrough:
+            self.passthrough[row_dtype] = (
+                row_dtype.itemsize == self.dtype.itemsize
+                and len(row_dtype.names) == len(self.columns)
+                and all(col["copy"] and col["source"]["name"] == input_name
+                        and row_dtype.fields[input_name][1] == self.dtype.fields[col["name"]][1]
+                        for col, input_name in zip(self.columns, row_dtype.names))
+            )
+        return self.passthrough[row_dtype]
+
+    def cast_into(self, out, values, col):
+        """
+        Cast the values of an output column into the output rows after checking them against the
+        output type (see check_cast). The issues tolerated by the cast policy are counted in self.cast_issues.
+        """
+        if parse_tform(col["format"])[1] == "L":
+            # logicals are stored as 'T' / 'F'
+            out[col["name"]] = np.where(np.asarray(values) != 0, ord("T"), ord("F"))
+            return
+        values, issues = check_cast(np.asarray(values), col["dtype"].base, self.cast_policy, col["name"])
+        if not issues:
+            out[col["name"]] = values
+            return
+        if col["name"] not in self.cast_issues:
+            # warn once per column, the counts of all the chunks end up in cast_issues
+            action = "clipped" if self.cast_policy == "clip" else "cast as they are"
+            warnings.warn(f"Column {col['name']} ({col['format']}): {issues} values {action}.", UserWarning)
+        total = self.cast_issues.setdefault(col["name"], {})
+        for issue, count in issues.items():
+            total[issue] = total.get(issue, 0) + count
+        # already reported, numpy does not need to warn about them again
+        with np.errstate(over="ignore", invalid="ignore"):
+            out[col["name"]] = values
+
+def convert_chunks(layout, plan, chunk_rows=None, columns=None, row_mask=None, on_read=None, depth=PIPELINE_DEPTH,
+                   start=0, stop=None):
+    """
+    Read, filter and convert the rows of the input in a pipeline : a reader thread reads the
+    chunks into arrays of a pool while a converter thread converts the previous ones into
+    arrays of another pool, and the caller writes the converted chunks. The disk and the CPU
+    are kept busy at the same time, so the throughput approaches the one of the slowest stage.
+
+    Parameters:
+    -----------
+    layout : TableLayout or TableStream
+        Layout of the input.
+    plan : ConversionPlan
+        Conversion of the input rows.
+    chunk_rows : int, optional, default = None
+        Number of rows per chunk (default : PIPELINE_CHUNK_BYTES worth of input rows).
+    columns : list, optional, default = None
+        Only read these input columns (see TableLayout.iter_chunks).
+    row_mask : callable, optional, default = None
+        Function returning the mask of the rows to keep in a chunk of raw rows (see ConversionPlan.compile_filter).
+    on_read : callable, optional, default = None
+        Function called with every chunk of raw rows in the reader thread, before the filter (e.g. to hash the input).
+    depth : int, optional, default = PIPELINE_DEPTH
+        Number of chunks waiting between two stages (0 reads and converts in the caller's thread).
+    start, stop : int, optional, default = 0, None
+        Range of input rows to convert (default : all of them).
+
+    Returns:
+    --------
+    Generator of chunks of output rows : every chunk is only valid until the next one is requested
+    """
+    chunk_rows = chunk_rows or layout.default_chunk_rows(columns, chunk_bytes=PIPELINE_CHUNK_BYTES)
+    if depth <= 0:
+        for chunk in layout.iter_chunks(chunk_rows, start, stop, columns=columns):
+            if on_read is not None:
+                on_read(chunk)
+            if row_mask is not None:
+                chunk = chunk[row_mask(chunk)]
+            yield plan.convert(chunk, reuse=True)
+        return
+
+    # every stage holds one chunk while the queues hold the others
+    chunk_dtype = layout.chunk_dtype(columns)
+    inputs = BufferPool(lambda: np.empty(chunk_rows, dtype=chunk_dtype), depth + 2)
+    outputs = BufferPool(lambda: plan.empty_rows(chunk_rows), depth + 2)
+
+    def read():
+        for chunk in layout.iter_chunks(chunk_rows, start, stop, columns=columns, pool=inputs):
+            if on_read is not None:
+                on_read(chunk)
+            yield chunk
+
+    def convert(chunk):
+        selected = chunk[row_mask(chunk)] if row_mask is not None else chunk
+        if plan.is_passthrough(selected.dtype):
+            # the output rows are a view of the input rows, released once written
+            if selected is not chunk:
+                inputs.release(chunk)
+                return plan.convert(selected), None
+            return plan.convert(chunk), (inputs, chunk)
+        out = outputs.acquire(len(selected))
+        rows = plan.convert(selected, out=out)
+        inputs.release(chunk)
+        return rows, (outputs, out)
+
+    for rows, owner in run_pipeline(read(), [convert], depth=depth, pools=(inputs, outputs)):
+        yield rows
+        if owner is not None:
+            pool, buffer = owner
+            pool.release(buffer)
+
+def update_statistics(stats, rows):
+    """
+    Update the running minimum and maximum of the numeric scalar columns with a chunk of rows.
+
+    Parameters:
+    -----------
+    stats : dict
+        {column name: [min, max]} updated in place.
+    rows : numpy structured array
+        Chunk of output rows.
+    """
+    if len(rows) == 0:
+        return stats
+    for name in rows.dtype.names:
+        values = rows[name]
+        if values.ndim != 1 or values.dtype.kind not in "iuf":
+            continue
+        low, high = np.fmin.reduce(values).item(), np.fmax.reduce(values).item()
+        if name in stats:
+            low, high = min(stats[name][0], low), max(stats[name][1], high)
+        stats[name] = [low, high]
+    return stats
+
+def footprint(stats):
+    """
+    Bounding box of the catalog from its statistics.
+
+    Returns:
+    --------
+    {'ra_min', 'ra_max', 'dec_min', 'dec_max'} or None if the catalog has no positions
+    """
+    if "RIGHT_ASCENSION" not in stats or "DECLINATION" not in stats:
+        return None
+    return {
+        "ra_min": stats["RIGHT_ASCENSION"][0],
+        "ra_max": stats["RIGHT_ASCENSION"][1],
+        "dec_min": stats["DECLINATION"][0],
+        "dec_max": stats["DECLINATION"][1],
+    }
+
+################################################################################
+# FITS checksums (ones' complement sum of the big-endian 32-bit words)
+
+_CHECKSUM_EXCLUDE = (0x3A, 0x3B, 0x3C, 0x3D, 0x3E, 0x3F, 0x40, 0x5B, 0x5C, 0x5D, 0x5E, 0x5F, 0x60)
+
+def ones_complement_sum(data, sum32=0, offset=0):
+    """
+    Add bytes to a 32-bit ones' complement checksum.
+
+    Parameters:
+    -----------
+    data : bytes-like
+        Bytes to add.
+    sum32 : int, optional, default = 0
+        Checksum of the bytes preceding data.
+    offset : int, optional, default = 0
+        Position of data in the checksummed stream, so that a stream can be summed in
+        pieces whose length is not a multiple of 4.
+
+    Returns:
+    --------
+    int
+    """
+    data = np.frombuffer(data, dtype=np.uint8)
+    lead = offset % 4
+    if lead:
+        # complete the word started by the previous piece
+        head = data[:4 - lead].tobytes()
+        sum32 += int.from_bytes((b"\0" * lead + head).ljust(4, b"\0"), byteorder="big")
+        data = data[4 - lead:]
+    if extra := data.nbytes % 4:
+        sum32 += int.from_bytes(data[-extra:].tobytes() + b"\0" * (4 - extra), byteorder="big")
+        data = data[:-extra]
+    sum32 += int(data.view(">u4").sum(dtype="u8"))
+    while hi := (sum32 >> 32):
+        sum32 = (sum32 & 0xFFFFFFFF) + hi
+    return sum32
+
+def encode_checksum(value):
+    """
+    Encode a checksum as the 16 characters of a CHECKSUM card.
+
+    Parameters:
+    -----------
+    value : int
+        The 32-bit checksum to encode (already complemented).
+    """
+    asc = [0] * 16
+    for i in range(4):
+        byte = (value >> ((3 - i) * 8)) & 0xFF
+        quotient = byte // 4 + ord("0")
+        remainder = byte % 4
+        ch = [quotient + remainder, quotient, quotient, quotient]
+
+        check = True
+        while check:
+            check = False
+            for x in _CHECKSUM_EXCLUDE:
+                for j in (0, 2):
+                    if ch[j] == x or ch[j + 1] == x:
+                        ch[j] += 1
+                        ch[j + 1] -= 1
+                        check = True
+        for j in range(4):
+            asc[4 * j + i] = ch[j]
+
+    return "".join(chr(asc[(i + 15) % 16]) for i in range(16))
+
+def header_checksum(header, datasum):
+    """
+    Compute the value of the CHECKSUM card of an HDU.
+
+    Parameters:
+    -----------
+    header : astropy.io.fits.Header
+        Header of the HDU (containing a CHECKSUM card).
+    datasum : int
+        Checksum of the data of the HDU.
+    """
+    old_checksum = header["CHECKSUM"]
+    header["CHECKSUM"] = "0" * 16
+    total = ones_complement_sum(header.tostring().encode("ascii"), datasum)
+    header["CHECKSUM"] = old_checksum
+    return encode_checksum(~total & 0xFFFFFFFF)
+
+def add_checksum_cards(header):
+    """
+    Add placeholder CHECKSUM and DATASUM cards to a header.
+    """
+    when = datetime.datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
+    header.set("CHECKSUM", "0" * 16, f"HDU checksum updated {when}")
+    header.set("DATASUM", "0", f"data unit checksum updated {when}")
+
+################################################################################
+
+def update_extend(primary_header):
+    """
+    Make sure the primary header declares extensions (as HDUList.writeto does).
+    """
+    if "EXTEND" in primary_header:
+        if not primary_header["EXTEND"]:
+            primary_header["EXTEND"] = True
+    else:
+        naxis = primary_header["NAXIS"]
+        primary_header.set("EXTEND", True, after="NAXIS" + (str(naxis) if naxis else ""))
+
+@contextmanager
+def replaced_on_success(path):
+    """
+    Open a file to write a product that replaces 'path' only once it is complete : the bytes go to
+    a temporary file in the same directory, renamed to 'path' if the block succeeds and removed if
+    it fails, so that a failed conversion never leaves a truncated product behind.
+
+    Parameters:
+    -----------
+    path : str
+        Path of the product.
+
+    Returns:
+    --------
+    Binary file object opened for writing (its 'name' is the temporary path)
+    """
+    directory, name = os.path.split(path)
+    tmp_path = os.path.join(directory, f".{name}.{uuid.uuid4().hex[:8]}.tmp")
+    try:
+        with open(tmp_path, "wb") as file:
+            yield file
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+class TableWriter:
+    """
+    Writes a FITS file made of a primary HDU and one binary table HDU whose rows are
+    written in chunks, without keeping the table in memory.
+    """
+
+    def __init__(self, fileobj, primary_hdu, table_header, checksum=False):
+        """
+        Parameters:
+        -----------
+        fileobj : file object
+            Binary file opened for writing (seekable if checksum is True or if rows are filtered out).
+        primary_hdu : astropy.io.fits.PrimaryHDU
+            Primary HDU written as it is.
+        table_header : astropy.io.fits.Header
+            Header of the table HDU. If fewer rows than NAXIS2 are written (e.g. filtered rows),
+            NAXIS2 is corrected when the writer is closed (the file must be seekable).
+        checksum : bool, optional, default = False
+            Add the CHECKSUM and DATASUM cards to both HDUs.
+        """
+        self.fileobj = fileobj
+        self.header = table_header
+        self.checksum = checksum
+        self.nrows = 0
+        self.nbytes = 0
+        self.datasum = 0
+        self.stats = {}
+
+        if checksum and not fileobj.seekable():
+            raise ValueError("Checksums can only be written to a seekable file.")
+
+        update_extend(primary_hdu.header)
+        if checksum:
+            primary_hdu.add_checksum()
+            add_checksum_cards(self.header)
+        primary_hdu.writeto(fileobj)
+
+        self.header_offset = fileobj.tell() if fileobj.seekable() else None
+        fileobj.write(self.header.tostring().encode("ascii"))
+        self.data_offset = fileobj.tell() if fileobj.seekable() else None
+
+    def write(self, rows):
+        """
+        Write a chunk of output rows.
+
+        Parameters:
+        -----------
+        rows : numpy structured array
+            Rows in their on-disk (big-endian) layout.
+        """
+        data = np.ascontiguousarray(rows).view(np.uint8).reshape(-1) if len(rows) else b""
+        if self.checksum:
+            self.datasum = ones_complement_sum(data, self.datasum, self.nbytes)
+        self.fileobj.write(data)
+        update_statistics(self.stats, rows)
+        self.nrows += len(rows)
+        self.nbytes += len(rows) * rows.dtype.itemsize
+
+    def add_written(self, nrows, datasum, stats):
+        """
+        Account for rows written straight into the file after the header by other processes
+        (see sharding) : the file position is moved after them.
+
+        Parameters:
+        -----------
+        nrows : int
+            Number of rows written.
+        datasum : int
+            Ones' complement sum of their bytes (see ones_complement_sum).
+        stats : dict
+            Their statistics (see update_statistics).
+        """
+        self.datasum = ones_complement_sum(b"", self.datasum + datasum)
+        for name, (low, high) in stats.items():
+            if name in self.stats:
+                low, high = min(self.stats[name][0], low), max(self.stats[name][1], high)
+            self.stats[name] = [low, high]
+        self.nrows += nrows
+        self.nbytes += nrows * self.header["NAXIS1"]
+        self.fileobj.seek(self.data_offset + self.nbytes)
+
+    def close(self):
+        """
+        Pad the data to a full FITS block, finalise NAXIS2 and the checksums.
+        """
+        rewrite_header = self.checksum
+        if self.nrows != self.header["NAXIS2"]:
+            if self.header_offset is None:
+                raise ValueError(f"{self.nrows} rows written but NAXIS2 is {self.header['NAXIS2']}.")
+            self.header["NAXIS2"] = self.nrows
+            rewrite_header = True
+
+        padding = -self.nbytes % BLOCK_SIZE
+        self.fileobj.write(b"\0" * padding)
+
+        if self.checksum:
+            self.header["DATASUM"] = str(self.datasum)
+            self.header["CHECKSUM"] = header_checksum(self.header, self.datasum)
+
+        if rewrite_header:
+            end = self.fileobj.tell()
+            self.fileobj.seek(self.header_offset)
+            self.fileobj.write(self.header.tostring().encode("ascii"))
+            self.fileobj.seek(end)
+
+class PartitionedWriter:
+    """
+    Writes the rows of a table into one FITS file per partition (e.g. per HEALPix pixel).
+    Every partition file is created the first time it receives rows; at most
+    max_open_files of them are kept open, the least recently written ones are closed
+    and reopened in place when they receive rows again.
+    """
+
+    def __init__(self, path_for, primary_hdu, table_header, checksum=False, max_open_files=256):
+        """
+        Parameters:
+        -----------
+        path_for : callable
+            Function returning the path of the file of a partition key.
+        primary_hdu : astropy.io.fits.PrimaryHDU
+            Primary HDU of every partition file.
+        table_header : astropy.io.fits.Header
+            Header of the table HDU of every partition file (NAXIS2 is set when it is closed).
+        checksum : bool, optional, default = False
+            Add the CHECKSUM and DATASUM cards to both HDUs.
+        max_open_files : int, optional, default = 256
+            Maximum number of partition files open at the same time.
+        """
+        self.path_for = path_for
+        self.primary_hdu = primary_hdu
+        self.table_header = table_header
+        self.checksum = checksum
+        self.max_open_files = max(1, max_open_files)
+        self.writers = {}
+        self.paths = {}
+        self.open_keys = OrderedDict()
+
+    def _open(self, key):
+        while len(self.open_keys) >= self.max_open_files:
+            oldest, _ = self.open_keys.popitem(last=False)
+            self.writers[oldest].fileobj.close()
+
+        if key in self.writers:
+            fileobj = open(self.paths[key], "r+b")
+            fileobj.seek(0, os.SEEK_END)
+            self.writers[key].fileobj = fileobj
+        else:
+            self.paths[key] = self.path_for(key)
+            table_header = self.table_header.copy()
+            table_header["NAXIS2"] = 0
+            self.writers[key] = TableWriter(open(self.paths[key], "wb"), self.primary_hdu.copy(), table_header,
+                                            checksum=self.checksum)
+        self.open_keys[key] = True
+
+    def write(self, key, rows):
+        """
+        Write a chunk of output rows to the file of a partition.
+
+        Parameters:
+        -----------
+        key : hashable
+            Partition of the rows.
+        rows : numpy structured array
+            Rows in their on-disk (big-endian) layout.
+        """
+        if key not in self.open_keys:
+            self._open(key)
+        self.open_keys.move_to_end(key)
+        self.writers[key].write(rows)
+
+    def write_partitioned(self, keys, rows):
+        """
+        Write a chunk of output rows, every row to the file of its partition.
+
+        Parameters:
+        -----------
+        keys : numpy array
+            Partition key of every row.
+        rows : numpy structured array
+            Rows in their on-disk (big-endian) layout.
+        """
+        if len(rows) == 0:
+            return
+        order = np.argsort(keys, kind="stable")
+        keys = keys[order]
+        rows = rows[order]
+        unique_keys, starts = np.unique(keys, return_index=True)
+        for key, start, stop in zip(unique_keys.tolist(), starts, [*starts[1:], len(keys)]):
+            self.write(key, rows[start:stop])
+
+    def close(self):
+        """
+        Finalise every partition file.
+
+        Returns:
+        --------
+        {key: (path, TableWriter)} of the written partitions, sorted by key
+        """
+        for key in sorted(self.writers):
+            if key not in self.open_keys:
+                self._open(key)
+            writer = self.writers[key]
+            writer.close()
+            writer.fileobj.close()
+            del self.open_keys[key]
+        return {key: (self.paths[key], self.writers[key]) for key in sorted(self.writers)}
+
+def append_rows(output_fits_path, plan, chunks, stats=None):
+    """
+    Append converted rows to the table HDU of an existing product : the rows are written
+    after the existing ones, then NAXIS2, DATASUM and CHECKSUM are updated in the header.
+    The append is made on a copy of the product that replaces it once complete, so a failed
+    or interrupted append leaves the product unchanged.
+
+    Parameters:
+    -----------
+    output_fits_path : str
+        Path of the product (primary HDU + one binary table HDU).
+    plan : ConversionPlan
+        Conversion of the input rows to the product rows.
+    chunks : iterable
+        Chunks of raw input rows to convert and append.
+    stats : dict, optional, default = None
+        Statistics of the existing rows, updated with the new ones. If None, the statistics
+        of the existing rows are computed from the product.
+
+    Returns:
+    --------
+    (nrows, stats) : tuple
+        The new number of rows and the updated statistics.
+    """
+    with fits.open(output_fits_path) as hdu_list:
+        if len(hdu_list) != 2:
+            raise ValueError(f"'{output_fits_path}' must contain exactly one table HDU to append to.")
+        header = hdu_list[1].header.copy()
+        info = hdu_list.fileinfo(1)
+
+    if header["NAXIS1"] != plan.dtype.itemsize:
+        raise ValueError(f"Row width of '{output_fits_path}' ({header['NAXIS1']}) does not match the product ({plan.dtype.itemsize}).")
+
+    if stats is None:
+        # the product was generated without statistics : start from those of its rows
+        stats = {}
+        rows = np.memmap(output_fits_path, dtype=plan.dtype, mode="r", offset=info["datLoc"], shape=(header["NAXIS2"],))
+        chunk_rows = max(1, CHUNK_BYTES // plan.dtype.itemsize)
+        for begin in range(0, len(rows), chunk_rows):
+            update_statistics(stats, rows[begin:begin + chunk_rows])
+        del rows
+    stats = dict(stats)
+    old_bytes = header["NAXIS2"] * header["NAXIS1"]
+    datasum = header.get("DATASUM")
+    datasum = int(datasum) if isinstance(datasum, str) and datasum.strip().isdigit() else None
+
+    directory, name = os.path.split(os.path.abspath(output_fits_path))
+    tmp_path = os.path.join(directory, f".{name}.append-{os.getpid()}")
+    shutil.copyfile(output_fits_path, tmp_path)
+    try:
+        nbytes = old_bytes
+        with open(tmp_path, "r+b") as file:
+            file.seek(info["datLoc"] + old_bytes)
+            for chunk in chunks:
+                rows = plan.convert(chunk, reuse=True)
+                data = rows.view(np.uint8).reshape(-1)
+                if datasum is not None:
+                    datasum = ones_complement_sum(data, datasum, nbytes)
+                file.write(data)
+                update_statistics(stats, rows)
+                nbytes += data.nbytes
+
+            file.write(b"\0" * (-nbytes % BLOCK_SIZE))
+            file.truncate()
+
+            header["NAXIS2"] = nbytes // header["NAXIS1"]
+            if datasum is not None:
+                header["DATASUM"] = str(datasum)
+                if "CHECKSUM" in header:
+                    header["CHECKSUM"] = header_checksum(header, datasum)
+
+            header_bytes = header.tostring().encode("ascii")
+            if len(header_bytes) != info["datLoc"] - info["hdrLoc"]:
+                raise ValueError("The size of the updated header changed, the product cannot be updated in place.")
+            file.seek(info["hdrLoc"])
+            file.write(header_bytes)
+        os.replace(tmp_path, output_fits_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+    return header["NAXIS2"], stats
@@ -1,8 +1,5 @@
 import yaml
-import requests
 import os
-import zipfile
-from script import FitsProcessor
 import re
 
 def load_config(config_path):
@@ -48,101 +45,325 @@ def ascii_art(input_fits_path, product_id):
     print("-" * 60)
     print("Progress ⬇ \n")
 
-if __name__ == "__main__":
+def resolve_fits_data_model(config, fits_data_model, output_dir="./generated/"):
+    """
+    Resolve the FitsDataModel input to a local xml path, downloading it from GitLab if needed.
+
+    Parameters:
+    -----------
+    config : dict
+        Configuration loaded from 'src/config/inputs.yaml' (used for the PAT).
+    fits_data_model : str
+        'latest' OR '<specific_version>' OR '<path_to_file>'
+    output_dir : str, optional, default = "./generated/"
+        Directory where the downloaded FitsDataModel is extracted.
+
+    Returns:
+    --------
+    (fits_data_model_path, PAT_provided) : tuple
+        Path of the FitsDataModel xml and whether a PAT was used to fetch it.
+    """
+    if is_path_provided(fits_data_model):
+        return fits_data_model, False
+
+    # only needed when the data model has to be fetched from GitLab
+    import requests
+    import zipfile
+
+    if "PAT" not in config or config["PAT"] == "<gitlab_personal_access_token>" or config["PAT"] == "":
+        raise ValueError("Personal Access Token (PAT) is required. Please provide a valid PAT in the config file.")
+
+    print(" NOTE: With a GitLab Personal Access Token (PAT), only the fits data product will be generated. Access to EDEN env is required for generation of XML.\n")
+    headers = {"PRIVATE-TOKEN": f"{config['PAT']}"}
+
+    FitsDM_tags_url = "https://gitlab.euclid-sgs.uk/api/v4/projects/ST-DM%2FST_FitsDataModel/repository/tags"
+    response = requests.get(FitsDM_tags_url, headers=headers)
+    response.raise_for_status()
+    FitsDM_tags = response.json()
+    FitsDM_all_tags = [tag["name"] for tag in FitsDM_tags]
+
+    ## handling the 2 remaining cases of FitsDataModel input
+
+    if fits_data_model == "latest":
+        tag = FitsDM_all_tags[0]
+    elif fits_data_model in FitsDM_all_tags:
+        tag = fits_data_model
+    else:
+        raise ValueError(f"Invalid fits_data_model: {fits_data_model}. Must be 'latest', a valid tag, or a path to an XML file.")
+
+    # construct the URL for the tag
+    fits_data_model_url = f"https://gitlab.euclid-sgs.uk/ST-DM/ST_FitsDataModel/-/archive/{tag}/ST_FitsDataModel-{tag}.zip"
+
+    # download and extract the FitsDataModel zip from the fits_data_model_url
+    response = requests.get(fits_data_model_url, headers=headers)
+    response.raise_for_status()
+
+    # Save the zip file locally
+    zip_file_path = os.path.join(output_dir, f"ST_FitsDataModel-{tag}.zip")
+    with open(zip_file_path, "wb") as zip_file:
+        zip_file.write(response.content)
+
+    # Extract the zip file
+    with zipfile.ZipFile(zip_file_path, "r") as zip_ref:
+        zip_ref.extractall(output_dir)
+
+    # get the path to the fits_data_model xml file
+    fits_data_model_path = os.path.join(output_dir, f'ST_FitsDataModel-{tag}/ST_DM_FitsSchema/auxdir/ST_DM_FitsSchema/instances/fit/euc-le3-id.xml')
+
+    if not os.path.exists(fits_data_model_path):
+        raise ValueError(f"ST_DM_FitsSchema/instances/fit/euc-le3-id.xml does not exist in ST_FitsDataModel version '{tag}'.")
+
+    return fits_data_model_path, True
+
+def run_stages(config, input_fits_path, product_id, fits_data_model, output_dir="./generated/", processor_options=None,
+               catalog_options=None, validate=False):
+    """
+    Generate a catalog (fits + xml) with the stages of the run scheduled on their dependencies (see
+    scheduler.StageGraph) : the XML header, which only depends on the name of the product, is built
+    while the FitsDataModel is fetched and the fits is converted, and the fits and the XML are
+    validated concurrently. The timeline of the stages and the critical path are printed at the end.
+
+    Parameters:
+    -----------
+    config : dict
+        Configuration loaded from 'src/config/inputs.yaml' (used for the PAT).
+    input_fits_path : str or list
+        Input FITS file(s) (see conversion.parse_input_spec).
+    product_id : str
+        Product ID to generate.
+    fits_data_model : str
+        'latest' OR '<specific_version>' OR '<path_to_file>'
+    output_dir : str, optional, default = "./generated/"
+        Directory where the generated files are saved.
+    processor_options : dict, optional, default = None
+        column_mappings_path, cast_policy, xml_renderer, progress and product_index (setting, see
+        product_index.resolve_index_path) of the FitsProcessor.
+    catalog_options : dict, optional, default = None
+        Options of FitsProcessor.generate_catalog (display_output, row_filter, sort_by, ...).
+    validate : bool, optional, default = False
+        Validate the fits and xml files (requires EDEN).
+
+    Returns:
+    --------
+    result : dict
+        Result of FitsProcessor.generate_catalog, with 'xml_file' (if the XML is generated, not without
+        EDEN unless the template renderer is used) and 'stages' ({stage: (start, end)} in seconds from the
+        start of the run), None if a stage failed.
+    """
+    from scheduler import StageGraph
+
+    processor_options = dict(processor_options or {})
+    catalog_options = catalog_options or {}
+    xml_renderer = processor_options.get("xml_renderer", "eden")
+    index_setting = processor_options.pop("product_index", True)
+    # the FitsDataModel is only fetched with the PAT when no path is given, and with the PAT
+    # the EDEN bindings are not available to generate the XML
+    xml = is_path_provided(fits_data_model) or xml_renderer == "template"
+    if xml and xml_renderer != "template":
+        # without the EDEN environment only the fits is generated (as Worker.preload does)
+        try:
+            import xmlgenerator
+        except ImportError as e:
+            print(f" NOTE: XML generation skipped, the EDEN environment is not available ({e}).\n")
+            xml = False
+    fits_file = f"{output_dir}{product_id}.fits"
 
-    config = load_config("src/config/inputs.yaml")
+    def fetch_data_model(results):
+        return resolve_fits_data_model(config, fits_data_model, output_dir=output_dir)
 
+    def create_processor(results):
+        # astropy and numpy are imported while the FitsDataModel is fetched
+        from script import FitsProcessor
+        from product_index import resolve_index_path
+
+        return FitsProcessor(product_index=resolve_index_path(index_setting, output_dir), **processor_options)
+
+    def prepare_xml(results):
+        if xml_renderer == "template":
+            import xmltemplate as renderer
+        else:
+            import xmlgenerator as renderer
+        return renderer, renderer.prepare_product(fits_file, output_dir)
+
+    def extract_schema(results):
+        # the FitsDataModel is parsed once, the conversion reuses it
+        return results["processor"].load_schema(product_id, fitsDataModel_path=results["fits_data_model"][0])
+
+    def convert(results):
+        fits_data_model_path, PAT_provided = results["fits_data_model"]
+        result = results["processor"].generate_catalog(product_id=product_id, input_fits_path=input_fits_path,
+                                                       fitsDataModel_path=fits_data_model_path, output_path=output_dir,
+                                                       PAT=PAT_provided, xml=False, **catalog_options)
+        if result is None:
+            raise RuntimeError(f"The conversion of '{input_fits_path}' failed.")
+        return result
+
+    def write_xml(results):
+        renderer, prepared = results["xml_header"]
+        xml_file = renderer.write_product(prepared, footprint=results["conversion"]["footprint"])
+        print(f"\033[1mXML file generated successfully and saved in '{output_dir}' dir  \( ﾟヮﾟ)/\033[0m \n")
+        return xml_file
+
+    def validate_fits(results):
+        import validation
+        validation.validate_fits_warns(results["conversion"]["fits_file"], product_id)
+
+    def validate_xml(results):
+        import validation
+        return validation.validate_xml(results["xml"], validation.DM_VERSION)
+
+    def publish(results):
+        result = results["conversion"]
+        if xml:
+            renderer, prepared = results["xml_header"]
+            # the fits file is renamed after the xml file
+            result = dict(result, xml_file=results["xml"], fits_file=renderer.publish_product(prepared))
+        if results["processor"].product_index:
+            results["processor"].register_products([result], input_fits_path, results["fits_data_model"][0])
+        return result
+
+    graph = StageGraph()
+    graph.add("fits_data_model", fetch_data_model)
+    graph.add("processor", create_processor)
+    if xml:
+        graph.add("xml_header", prepare_xml)
+    graph.add("schema", extract_schema, deps=("fits_data_model", "processor"))
+    graph.add("conversion", convert, deps=("schema",))
+    if validate:
+        graph.add("validate_fits", validate_fits, deps=("conversion",))
+    if xml:
+        graph.add("xml", write_xml, deps=("xml_header", "conversion"))
+        if validate:
+            graph.add("validate_xml", validate_xml, deps=("xml",))
+    # the fits file is only renamed (after its XML) and registered once it is validated
+    graph.add("publish", publish, deps=("xml" if xml else "conversion",) + (("validate_fits",) if validate else ()))
+
+    graph.run()
+    graph.print_report()
+    if graph.errors or graph.skipped:
+        return None
+
+    result = graph.results["publish"]
+    result["stages"] = graph.timings
+    return result
+
+def run(config, output_dir="./generated/", output=None):
+    """
+    Generate the product (fits + xml) described by the given configuration.
+
+    Parameters:
+    -----------
+    config : dict
+        Configuration with the same keys as 'src/config/inputs.yaml'.
+    output_dir : str, optional, default = "./generated/"
+        Directory where the generated files are saved.
+    output : file object, optional, default = None
+        Binary file object (e.g. sys.stdout.buffer) the product fits is streamed to instead, without XML.
+    """
     # get the input parameters from the config else use a default
     input_fits_path = config.get("input_fits_path", None)  # Default path if not provided
-    output_dir = "./generated/"
     product_id = config.get("product_id", None)  # Default product ID if not provided
     fits_data_model = config.get("fits_data_model", "latest")  # Default to latest if not provided
-    # data_model = config.get("data_model", "latest")  # Default to latest if not provided
     display_output = config.get("display_output", False)  # Default to False if not provided
+    row_filter = config.get("row_filter", None)  # Keep all the rows if not provided
+    nside = config.get("nside", None)  # One monolithic product if not provided
+    sort_by = config.get("sort_by", None)  # Input row order if not provided
+    sort_memory_mb = config.get("sort_memory_mb", None)  # Default memory budget of the sort if not provided
+    sort_index = config.get("sort_index", False)  # Default to False if not provided
+    column_mappings = config.get("column_mappings", None)  # Default to src/config/column_mappings.yaml if not provided
+    cast_policy = config.get("cast_policy", "error")  # Default to 'error' if not provided
+    processes = config.get("processes", 1)  # Default to a single process if not provided
+    xml_renderer = config.get("xml_renderer", "eden")  # Default to the EDEN bindings if not provided
+    product_index = config.get("product_index", True)  # Default to '<output_dir>/product_index.sqlite' if not provided
+    dry_run = config.get("dry_run", False)  # Default to False if not provided
+    validate = config.get("validate", False)  # Default to False if not provided
+    progress = config.get("progress", "auto")  # Default to a bar on a terminal, JSON log lines otherwise if not provided
 
     ascii_art(input_fits_path, product_id)
 
     # sanity checks for the input parameters
-    if input_fits_path is None:
+    if not input_fits_path:
         raise ValueError("Input FITS path is required. Please provide a valid path.")
-    if not os.path.exists(input_fits_path):
+    # lists, patterns and HDU selections ('sim.fits[2]') are checked when the inputs are opened
+    if isinstance(input_fits_path, str) and not re.search(r"[\[*?]", input_fits_path) and not os.path.exists(input_fits_path):
         raise FileNotFoundError(f"Input FITS file '{input_fits_path}' does not exist.")
     if not product_id:
         raise ValueError("Product ID is required. Please provide a valid product ID.")
-    
+
+
+    # a single catalog is generated by stages running concurrently, the FitsDataModel is fetched in one of them
+    if not (dry_run or nside or output is not None):
+        return run_stages(
+            config,
+            input_fits_path=input_fits_path,
+            product_id=product_id,
+            fits_data_model=fits_data_model,
+            output_dir=output_dir,
+            processor_options=dict(column_mappings_path=column_mappings, cast_policy=cast_policy,
+                                   xml_renderer=xml_renderer, product_index=product_index, progress=progress),
+            catalog_options=dict(display_output=display_output, row_filter=row_filter, sort_by=sort_by,
+                                 sort_memory=sort_memory_mb * 1024 * 1024 if sort_memory_mb else None,
+                                 sort_index=sort_index, processes=processes),
+            validate=validate,
+        )
 
     #####################
     ## FITS DATA MODEL ##
     #####################
 
-    PAT_provided = False
-
-    if not is_path_provided(fits_data_model):
-
-        if "PAT" not in config or config["PAT"] == "<gitlab_personal_access_token>" or config["PAT"] == "":
-            raise ValueError("Personal Access Token (PAT) is required. Please provide a valid PAT in the config file.")
-        
-        PAT_provided = True
-        print(" NOTE: With a GitLab Personal Access Token (PAT), only the fits data product will be generated. Access to EDEN env is required for generation of XML.\n")
-        headers = {"PRIVATE-TOKEN": f"{config['PAT']}"}
-
-        FitsDM_tags_url = "https://gitlab.euclid-sgs.uk/api/v4/projects/ST-DM%2FST_FitsDataModel/repository/tags"
-        response = requests.get(FitsDM_tags_url, headers=headers)
-        response.raise_for_status()
-        FitsDM_tags = response.json()
-        FitsDM_all_tags = [tag["name"] for tag in FitsDM_tags]
-        fits_data_model_url = None
-
-        ## handling the 3 cases of FitsDataModel input
-
-        if fits_data_model == "latest":
-            tag = FitsDM_all_tags[0]
-            # construct the URL for the latest tag
-            fits_data_model_url = f"https://gitlab.euclid-sgs.uk/ST-DM/ST_FitsDataModel/-/archive/{tag}/ST_FitsDataModel-{tag}.zip"
-
-        elif fits_data_model in FitsDM_all_tags:
-            tag = fits_data_model
-            # construct the URL for the provided tag
-            fits_data_model_url = f"https://gitlab.euclid-sgs.uk/ST-DM/ST_FitsDataModel/-/archive/{tag}/ST_FitsDataModel-{tag}.zip"
-        elif os.path.exists(fits_data_model) and fits_data_model.endswith(".xml"):
-            # if the path is a valid XML file, use it directly
-            fits_data_model_path = fits_data_model
-        else:
-            raise ValueError(f"Invalid fits_data_model: {fits_data_model}. Must be 'latest', a valid tag, or a path to an XML file.")
-
-        # download and extract the FitsDataModel zip from the fits_data_model_url
-        if fits_data_model_url is not None:
-            response = requests.get(fits_data_model_url, headers=headers)
-            response.raise_for_status()
+    fits_data_model_path, PAT_provided = resolve_fits_data_model(config, fits_data_model, output_dir=output_dir)
 
-            # Save the zip file locally
-            zip_file_path = os.path.join(output_dir, f"ST_FitsDataModel-{tag}.zip")
-            with open(zip_file_path, "wb") as zip_file:
-                zip_file.write(response.content)
+    # only read the input headers and report what the conversion would do
+    if dry_run:
+        from preflight import preflight, print_preflight
 
-            # Extract the zip file
-            with zipfile.ZipFile(zip_file_path, "r") as zip_ref:
-                zip_ref.extractall(output_dir)
+        reports = preflight([input_fits_path], [product_id],
+                            fitsDataModel_path=fits_data_model_path,
+                            column_mappings_path=column_mappings,
+                            cast_policy=cast_policy,
+                            row_filter=row_filter,
+                            sort_by=sort_by,
+                            sort_memory=sort_memory_mb * 1024 * 1024 if sort_memory_mb else None,
+                            nside=nside,
+                            processes=1 if nside else processes)
+        print_preflight(reports)
+        return reports
 
-            # get the path to the fits_data_model xml file
-            fits_data_model_path = f'./generated/ST_FitsDataModel-{tag}/ST_DM_FitsSchema/auxdir/ST_DM_FitsSchema/instances/fit/euc-le3-id.xml'
-            
-            if not os.path.exists(fits_data_model_path):
-                raise ValueError(f"ST_DM_FitsSchema/instances/fit/euc-le3-id.xml does not exist in ST_FitsDataModel version '{tag}'.")
-
-
-    if is_path_provided(fits_data_model):
-        fits_data_model_path = fits_data_model
+    # astropy and numpy are only pulled in once there is something to convert
+    from script import FitsProcessor
+    from product_index import resolve_index_path
 
     # initializing the FitsProcessor
-    fits_handler = FitsProcessor()
+    fits_handler = FitsProcessor(column_mappings_path=column_mappings, cast_policy=cast_policy, xml_renderer=xml_renderer,
+                                 product_index=resolve_index_path(product_index, output_dir), progress=progress)
+
+    # to stream the product fits to a pipe or any file object
+    if output is not None:
+        if nside:
+            raise ValueError("A catalog split by HEALPix pixel cannot be streamed, it is made of several files.")
+        return fits_handler.stream_catalog(
+            product_id=product_id,
+            input_fits_path=input_fits_path,
+            output=output,
+            fitsDataModel_path=fits_data_model_path,
+            row_filter=row_filter,
+            sort_by=sort_by,
+            sort_memory=sort_memory_mb * 1024 * 1024 if sort_memory_mb else None,
+            processes=processes,
+        )
 
-    # to generate the catalog
-    fits_handler.generate_catalog(
+    # to generate one product per HEALPix pixel
+    return fits_handler.generate_partitioned_catalog(
         product_id=product_id,
         input_fits_path=input_fits_path,
         fitsDataModel_path=fits_data_model_path,
         output_path=output_dir,
-        display_output=display_output,
+        nside=nside,
         PAT=PAT_provided,
+        row_filter=row_filter,
     )
+
+if __name__ == "__main__":
+
+    config = load_config(os.path.join(os.path.dirname(os.path.abspath(__file__)), "config", "inputs.yaml"))
+    run(config)
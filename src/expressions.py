@@ -0,0 +1,173 @@
+import ast
+
+import numpy as np
+
+def angular_separation(ra1, dec1, ra2, dec2):
+    """
+    Angular separation in degrees between two positions given in degrees (haversine formula).
+    """
+    ra1, dec1, ra2, dec2 = (np.radians(value) for value in (ra1, dec1, ra2, dec2))
+    sin_ddec = np.sin((dec2 - dec1) / 2)
+    sin_dra = np.sin((ra2 - ra1) / 2)
+    a = sin_ddec * sin_ddec + np.cos(dec1) * np.cos(dec2) * sin_dra * sin_dra
+    return np.degrees(2 * np.arcsin(np.sqrt(np.clip(a, 0, 1))))
+
+# functions that can be called in an expression
+FUNCTIONS = {
+    "abs": np.absolute,
+    "sqrt": np.sqrt,
+    "exp": np.exp,
+    "log": np.log,
+    "log10": np.log10,
+    "sin": np.sin,
+    "cos": np.cos,
+    "arctan2": np.arctan2,
+    "radians": np.radians,
+    "degrees": np.degrees,
+    "isfinite": np.isfinite,
+    "isnan": np.isnan,
+    "where": np.where,
+    "mod": np.mod,
+    "minimum": np.minimum,
+    "maximum": np.maximum,
+    "angular_separation": angular_separation,
+}
+
+# the operators are numpy ufuncs so that their result can be written into a reused buffer
+_BINARY_OPERATORS = {
+    ast.Add: np.add,
+    ast.Sub: np.subtract,
+    ast.Mult: np.multiply,
+    ast.Div: np.true_divide,
+    ast.FloorDiv: np.floor_divide,
+    ast.Mod: np.mod,
+    ast.Pow: np.power,
+    ast.BitAnd: np.logical_and,
+    ast.BitOr: np.logical_or,
+}
+
+_COMPARE_OPERATORS = {
+    ast.Eq: np.equal,
+    ast.NotEq: np.not_equal,
+    ast.Lt: np.less,
+    ast.LtE: np.less_equal,
+    ast.Gt: np.greater,
+    ast.GtE: np.greater_equal,
+}
+
+_UNARY_OPERATORS = {
+    ast.USub: np.negative,
+    ast.UAdd: np.positive,
+    ast.Not: np.logical_not,
+    ast.Invert: np.logical_not,
+}
+
+class Expression:
+    """
+    Arithmetic / boolean expression over column names, evaluated with vectorized numpy
+    operations on whole chunks of rows. e.g. "WEIGHT > 0 and 20 < MAG < 24.5",
+    "angular_separation(RIGHT_ASCENSION, DECLINATION, 150.1, 2.2) < 1.5" or "-SHE_G1".
+
+    Only numbers, strings, column names, arithmetic, comparisons, and / or / not and the
+    FUNCTIONS are allowed.
+    """
+
+    def __init__(self, text):
+        """
+        Parameters:
+        -----------
+        text : str
+            The expression.
+        """
+        self.text = text
+        try:
+            self.tree = ast.parse(text.strip(), mode="eval")
+        except SyntaxError as e:
+            raise ValueError(f"Invalid expression '{text}': {e.msg}")
+
+        self.names = []
+        for node in ast.walk(self.tree):
+            if isinstance(node, ast.Call):
+                if not isinstance(node.func, ast.Name) or node.func.id not in FUNCTIONS or node.keywords:
+                    raise ValueError(f"Unsupported function call in expression '{text}'. Allowed functions: {sorted(FUNCTIONS)}")
+            elif isinstance(node, ast.Name):
+                if node.id not in FUNCTIONS and node.id not in self.names:
+                    self.names.append(node.id)
+            elif not isinstance(node, (ast.Expression, ast.BinOp, ast.UnaryOp, ast.BoolOp, ast.Compare, ast.Constant,
+                                       ast.Load, ast.And, ast.Or, *_BINARY_OPERATORS, *_COMPARE_OPERATORS, *_UNARY_OPERATORS)):
+                raise ValueError(f"Unsupported syntax '{type(node).__name__}' in expression '{text}'.")
+
+    @property
+    def is_column(self):
+        """
+        True if the expression is just a column name (a rename).
+        """
+        return isinstance(self.tree.body, ast.Name) and self.tree.body.id not in FUNCTIONS
+
+    def evaluate(self, values, buffers=None):
+        """
+        Evaluate the expression.
+
+        Parameters:
+        -----------
+        values : dict or callable
+            Column name -> numpy array, or a function returning the array of a column name.
+        buffers : dict, optional, default = None
+            Intermediate results kept from one call to the next : when the expression is evaluated
+            chunk by chunk, the arrays of the previous chunk are reused instead of being allocated
+            again. The result is then only valid until the next call with the same buffers.
+
+        Returns:
+        --------
+        numpy array (or scalar if the expression does not use any column)
+        """
+        resolve = values if callable(values) else values.__getitem__
+        return self._evaluate(self.tree.body, resolve, buffers)
+
+    def _apply(self, node, function, args, buffers):
+        if buffers is None or not isinstance(function, np.ufunc) or function.nout != 1:
+            return function(*args)
+
+        shape = np.broadcast_shapes(*(np.shape(arg) for arg in args))
+        buffer = buffers.get(node)
+        if shape and buffer is not None and len(buffer) >= shape[0] and buffer.shape[1:] == shape[1:]:
+            return function(*args, out=buffer[:shape[0]])
+
+        result = function(*args)
+        if isinstance(result, np.ndarray) and result.ndim:
+            buffers[node] = result
+        return result
+
+    def _evaluate(self, node, resolve, buffers=None):
+        if isinstance(node, ast.Constant):
+            return node.value.encode() if isinstance(node.value, str) else node.value
+        if isinstance(node, ast.Name):
+            return resolve(node.id)
+        if isinstance(node, ast.BinOp):
+            args = (self._evaluate(node.left, resolve, buffers), self._evaluate(node.right, resolve, buffers))
+            return self._apply(node, _BINARY_OPERATORS[type(node.op)], args, buffers)
+        if isinstance(node, ast.UnaryOp):
+            return self._apply(node, _UNARY_OPERATORS[type(node.op)], (self._evaluate(node.operand, resolve, buffers),), buffers)
+        if isinstance(node, ast.BoolOp):
+            combine = np.logical_and if isinstance(node.op, ast.And) else np.logical_or
+            result = self._evaluate(node.values[0], resolve, buffers)
+            for value in node.values[1:]:
+                result = combine(result, self._evaluate(value, resolve, buffers))
+            return result
+        if isinstance(node, ast.Compare):
+            # chained comparisons : a < b < c is (a < b) and (b < c)
+            left = self._evaluate(node.left, resolve, buffers)
+            result = None
+            for op, comparator in zip(node.ops, node.comparators):
+                right = self._evaluate(comparator, resolve, buffers)
+                test = _COMPARE_OPERATORS[type(op)](left, right)
+                result = test if result is None else np.logical_and(result, test)
+                left = right
+            return result
+        if isinstance(node, ast.Call):
+            args = tuple(self._evaluate(arg, resolve, buffers) for arg in node.args)
+            return self._apply(node, FUNCTIONS[node.func.id], args, buffers)
+        raise ValueError(f"Unsupported syntax '{type(node).__name__}' in expression '{self.text}'.")
+
+    def __repr__(self):
+        return f"Expression({self.text!r})"
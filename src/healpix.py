@@ -0,0 +1,85 @@
+import numpy as np
+
+# Vectorized HEALPix pixelisation (Gorski et al. 2005) in the NESTED scheme, so that
+# the catalogs can be partitioned by sky patch without depending on healpy.
+
+def check_nside(nside):
+    """
+    Check that NSIDE is a power of 2 (required by the NESTED scheme).
+    """
+    if not isinstance(nside, (int, np.integer)) or nside < 1 or nside & (nside - 1) or nside > 2**29:
+        raise ValueError(f"Invalid NSIDE {nside}: it must be a power of 2 between 1 and 2**29.")
+
+def npix(nside):
+    """
+    Number of pixels of the sphere at this NSIDE.
+    """
+    return 12 * nside * nside
+
+def _spread_bits(values):
+    """
+    Interleave the bits of the integers with zeros (bit i goes to bit 2i).
+    """
+    values = values.astype(np.int64)
+    values = (values | (values << 16)) & 0x0000FFFF0000FFFF
+    values = (values | (values << 8)) & 0x00FF00FF00FF00FF
+    values = (values | (values << 4)) & 0x0F0F0F0F0F0F0F0F
+    values = (values | (values << 2)) & 0x3333333333333333
+    values = (values | (values << 1)) & 0x5555555555555555
+    return values
+
+def ang2pix_nested(nside, ra, dec):
+    """
+    NESTED HEALPix pixel of positions on the sky.
+
+    Parameters:
+    -----------
+    nside : int
+        HEALPix resolution (a power of 2).
+    ra, dec : array-like
+        Right ascension and declination in degrees.
+
+    Returns:
+    --------
+    numpy array of int64 pixel indices (between 0 and 12 * nside**2 - 1)
+    """
+    check_nside(nside)
+    ra = np.asarray(ra, dtype=np.float64)
+    dec = np.asarray(dec, dtype=np.float64)
+
+    z = np.sin(np.radians(dec))
+    za = np.abs(z)
+    tt = np.mod(ra / 90.0, 4.0)  # in [0, 4)
+    tt = np.where(tt >= 4.0, 0.0, tt)
+
+    face = np.empty(z.shape, dtype=np.int64)
+    ix = np.empty(z.shape, dtype=np.int64)
+    iy = np.empty(z.shape, dtype=np.int64)
+
+    # equatorial region
+    equatorial = za <= 2.0 / 3.0
+    t = tt[equatorial]
+    temp1 = nside * (0.5 + t)
+    temp2 = nside * z[equatorial] * 0.75
+    jp = (temp1 - temp2).astype(np.int64)  # index of the ascending edge line
+    jm = (temp1 + temp2).astype(np.int64)  # index of the descending edge line
+    ifp = jp // nside
+    ifm = jm // nside
+    face[equatorial] = np.where(ifp == ifm, ifp | 4, np.where(ifp < ifm, ifp, ifm + 8))
+    ix[equatorial] = jm & (nside - 1)
+    iy[equatorial] = nside - (jp & (nside - 1)) - 1
+
+    # polar caps
+    polar = ~equatorial
+    t = tt[polar]
+    ntt = np.minimum(t.astype(np.int64), 3)
+    tp = t - ntt
+    tmp = nside * np.sqrt(3.0 * (1.0 - za[polar]))
+    jp = np.minimum((tp * tmp).astype(np.int64), nside - 1)
+    jm = np.minimum(((1.0 - tp) * tmp).astype(np.int64), nside - 1)
+    north = z[polar] >= 0
+    face[polar] = np.where(north, ntt, ntt + 8)
+    ix[polar] = np.where(north, nside - jm - 1, jp)
+    iy[polar] = np.where(north, nside - jp - 1, jm)
+
+    return face * nside * nside + _spread_bits(ix) + (_spread_bits(iy) << 1)
@@ -1,9 +1,22 @@
 import xml.etree.ElementTree as ET
 import json
+import os
+from functools import lru_cache
 
-def get_all_fits_format_ids(fitsDataModel_path=None):
+# configuration files shipped with the package, found from this file so that the commands run from any directory
+CONFIG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config")
+
+# default column mappings of the products
+COLUMN_MAPPINGS_FILE = os.path.join(CONFIG_DIR, "column_mappings.yaml")
+
+@lru_cache(maxsize=None)
+def _parse_fits_data_model(fitsDataModel_path, mtime_ns):
+    return ET.parse(fitsDataModel_path).getroot()
+
+def load_fits_data_model(fitsDataModel_path=None):
     """
-    Gets a list of all the FitsFormat IDs from the FitsDataModel xml file
+    Parses the FitsDataModel xml file once and keeps it in memory (DM registry).
+    The file is parsed again only if it is modified on disk.
 
     Parameters:
     -----------
@@ -12,20 +25,87 @@ def get_all_fits_format_ids(fitsDataModel_path=None):
 
     Returns:
     -----------
-    List of all the FitsFormat IDs
+    Root element of the FitsDataModel xml
     
     """
     # check if the path is present else define what consider as the FitsDataModel xml
     if fitsDataModel_path is None:
         fitsDataModel_path = 'raw/FitsDataModel.xml'
 
-    tree = ET.parse(fitsDataModel_path)
-    root = tree.getroot()
+    fitsDataModel_path = os.path.abspath(fitsDataModel_path)
+    return _parse_fits_data_model(fitsDataModel_path, os.stat(fitsDataModel_path).st_mtime_ns)
+
+@lru_cache(maxsize=None)
+def _parse_column_mappings(mappings_path, mtime_ns):
+    import yaml
+
+    with open(mappings_path, "r") as file:
+        return yaml.safe_load(file) or {}
+
+def load_column_mappings(product_id, mappings_path=None):
+    """
+    Gets the column mapping of a product ID from the column mappings yaml file.
+    The file is parsed again only if it is modified on disk.
+
+    Parameters:
+    -----------
+    product_id : str
+        FitsFormat ID of the product
+    mappings_path : str, optional, default = None
+        optional argument to get the column mappings yaml (default : src/config/column_mappings.yaml)
+
+    Returns:
+    -----------
+    {'catalog column': 'input column' or 'expression'} of the product (empty if it is not in the file)
+
+    """
+    if mappings_path is None:
+        mappings_path = COLUMN_MAPPINGS_FILE
+
+    mappings_path = os.path.abspath(mappings_path)
+    mappings = _parse_column_mappings(mappings_path, os.stat(mappings_path).st_mtime_ns)
+    return dict(mappings.get(product_id) or {})
+
+def get_all_fits_format_ids(fitsDataModel_path=None):
+    """
+    Gets a list of all the FitsFormat IDs from the FitsDataModel xml file
+
+    Parameters:
+    -----------
+    fitsDataModel_path : str, optional, default = None
+        optional argument to get the fitsDataModel xml of a Data Product
+
+    Returns:
+    -----------
+    List of all the FitsFormat IDs
+    
+    """
+    root = load_fits_data_model(fitsDataModel_path)
 
     fits_formats = root.findall(".//FitsFormat")
     ids = [fits_format.get("id") for fits_format in fits_formats if fits_format.get("id") is not None]
     return ids
 
+def get_fits_format_version(fits_format_id, fitsDataModel_path=None):
+    """
+    Gets the version of a FitsFormat ID from the FitsDataModel xml file
+
+    Parameters:
+    -----------
+    fits_format_id : str
+        FitsFormat ID whose version is needed
+    fitsDataModel_path : str, optional, default = None
+        optional argument to get the fitsDataModel xml of a Data Product
+
+    Returns:
+    -----------
+    The version of the FitsFormat, None if the ID is not found
+    
+    """
+    root = load_fits_data_model(fitsDataModel_path)
+    fits_format = root.find(f".//FitsFormat[@id='{fits_format_id}']")
+    return fits_format.get("version") if fits_format is not None else None
+
 def extract_keywords(header_keyword_list):
     """
     Extracts header keywords from a GenericHDU or TableHDU
@@ -63,13 +143,12 @@ def extract_data_for_id(fits_format_id, fitsDataModel_path=None):
     fitsDataModel_path : str, optional, default = None
         optional argument to get the fitsDataModel xml of a Data Product
 
-    """
-    # check if the path is present else define what consider as the FitsDataModel xml
-    if fitsDataModel_path is None:
-        fitsDataModel_path = 'raw/FitsDataModel.xml'
+    Returns:
+    -----------
+    Dictionary with the extracted data (also saved as JSON), or None if the ID is not found.
 
-    tree = ET.parse(fitsDataModel_path)
-    root = tree.getroot()
+    """
+    root = load_fits_data_model(fitsDataModel_path)
     
     # Find the FitsFormat element by 'id' attribute
     fits_format = root.find(f".//FitsFormat[@id='{fits_format_id}']")
@@ -121,9 +200,11 @@ def extract_data_for_id(fits_format_id, fitsDataModel_path=None):
 
         # Save the extracted data as a JSON file
         output_filename = f"./generated/extracted_data_{fits_format_id}.json"
+        os.makedirs(os.path.dirname(output_filename), exist_ok=True)
         with open(output_filename, "w") as json_file:
             json.dump(extracted_data, json_file, indent=4)
 
         print(f"Data successfully extracted from the FitsDataModel and saved as '{output_filename}'\n")
+        return extracted_data
     else:
         print(f"No FitsFormat with id '{fits_format_id}' found in the XML.")
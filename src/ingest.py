@@ -0,0 +1,390 @@
+import datetime
+import fnmatch
+import hashlib
+import json
+import os
+import time
+
+from helpers import get_fits_format_version
+
+MANIFEST_VERSION = 1
+
+def file_content_hash(path, chunk_size=4 * 1024 * 1024):
+    """
+    Compute the sha256 of a file, reading it sequentially in chunks.
+
+    Parameters:
+    -----------
+    path : str
+        Path of the file.
+    chunk_size : int, optional
+        Number of bytes read at once.
+
+    Returns:
+    --------
+    Hexadecimal digest of the file content.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def scan_inputs(input_dir, pattern="*.fits"):
+    """
+    Recursively list the files of a directory matching a pattern, with their stat.
+
+    Parameters:
+    -----------
+    input_dir : str
+        Directory to scan.
+    pattern : str, optional, default = "*.fits"
+        Shell pattern the file names must match.
+
+    Returns:
+    --------
+    Generator of (absolute path, os.stat_result)
+    """
+    stack = [os.path.abspath(input_dir)]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file() and fnmatch.fnmatch(entry.name, pattern):
+                    yield entry.path, entry.stat()
+
+class Manifest:
+    """
+    Record of the processed inputs, saved as JSON :
+        'files'    : {input path: {'size', 'mtime_ns', 'content_hash'}} used to skip the hashing of unchanged files
+        'products' : {'<content_hash>|<dm_version>|<product_id>': {'input', 'product_id', 'dm_version', 'fits_file',
+                      'xml_file', 'processed_at', 'nrows', 'stats', 'input_fingerprint'}}
+    """
+
+    def __init__(self, path):
+        """
+        Parameters:
+        -----------
+        path : str
+            Path of the JSON manifest (created if it does not exist).
+        """
+        self.path = path
+        self.files = {}
+        self.products = {}
+        self._by_input = None
+        if os.path.exists(path):
+            with open(path, "r") as file:
+                data = json.load(file)
+            self.files = data.get("files", {})
+            self.products = data.get("products", {})
+
+    def save(self):
+        """
+        Atomically write the manifest to disk.
+        """
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as file:
+            json.dump({"version": MANIFEST_VERSION, "files": self.files, "products": self.products}, file)
+        os.replace(tmp_path, self.path)
+
+    def content_hash(self, path, stat):
+        """
+        Return the content hash of an input, only reading the file if its size or
+        modification time changed since it was last hashed.
+
+        Parameters:
+        -----------
+        path : str
+            Absolute path of the input.
+        stat : os.stat_result
+            Current stat of the input.
+
+        Returns:
+        --------
+        Hexadecimal content hash.
+        """
+        record = self.files.get(path)
+        if record is not None and record["size"] == stat.st_size and record["mtime_ns"] == stat.st_mtime_ns:
+            return record["content_hash"]
+
+        content_hash = file_content_hash(path)
+        self.files[path] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "content_hash": content_hash}
+        return content_hash
+
+    @staticmethod
+    def product_key(content_hash, dm_version, product_id):
+        return f"{content_hash}|{dm_version}|{product_id}"
+
+    def is_processed(self, key):
+        """
+        Check if a product was generated and its output is still present.
+
+        Parameters:
+        -----------
+        key : str
+            Product key (see product_key).
+        """
+        record = self.products.get(key)
+        return record is not None and os.path.exists(record["fits_file"])
+
+    def find_previous(self, input_path, dm_version, product_id):
+        """
+        Find the last product generated from an input path (whatever its content was).
+
+        Returns:
+        --------
+        (key, record) or (None, None)
+        """
+        if self._by_input is None:
+            self._by_input = {(record["input"], record.get("dm_version"), record.get("product_id")): key
+                              for key, record in self.products.items()}
+        key = self._by_input.get((input_path, dm_version, product_id))
+        return (key, self.products[key]) if key in self.products else (None, None)
+
+    def record(self, key, input_path, dm_version, product, replaces=None):
+        """
+        Record a generated product.
+
+        Parameters:
+        -----------
+        key : str
+            Product key (see product_key).
+        input_path : str
+            Path of the input the product was generated from.
+        dm_version : str
+            DM version of the product (see describe_dm_version).
+        product : dict
+            Product report of Worker.run_job.
+        replaces : str, optional, default = None
+            Key of the record superseded by this one (after an append).
+
+        Raises:
+        -------
+        ValueError
+            If the product file is already recorded for another input.
+        """
+        for other_key, other in list(self.products.items()):
+            if other_key == key or other["fits_file"] != product["fits_file"]:
+                continue
+            if other["input"] != input_path:
+                raise ValueError(f"'{product['fits_file']}' is already the product of '{other['input']}'.")
+            # the product of a previous content of the same input was overwritten
+            self.products.pop(other_key)
+        if replaces is not None:
+            self.products.pop(replaces, None)
+        self.products[key] = {
+            "input": input_path,
+            "product_id": product["product_id"],
+            "dm_version": dm_version,
+            "fits_file": product["fits_file"],
+            "xml_file": product["xml_file"],
+            "processed_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        }
+        for field in ("nrows", "stats", "input_fingerprint"):
+            if field in product:
+                self.products[key][field] = product[field]
+        if self._by_input is not None:
+            self._by_input[(input_path, dm_version, product["product_id"])] = key
+
+def describe_dm_version(product_id, dm_hash, fitsDataModel_path=None):
+    """
+    Identify the data model used for a product : the FitsFormat version and the hash of the
+    FitsDataModel xml, so that a new DM release triggers a new conversion.
+
+    Parameters:
+    -----------
+    product_id : str
+        FitsFormat ID of the product.
+    dm_hash : str
+        Content hash of the FitsDataModel xml.
+    fitsDataModel_path : str, optional, default = None
+        Path to the FitsDataModel xml.
+
+    Returns:
+    --------
+    str '<version>+<first 12 characters of the DM hash>'
+    """
+    version = get_fits_format_version(product_id, fitsDataModel_path=fitsDataModel_path)
+    if version is None:
+        raise ValueError(f"Provided catalog type '{product_id}' is not in the FitsDataModel.")
+    return f"{version}+{dm_hash[:12]}"
+
+def append_or_convert(job_worker, job, previous, fitsDataModel_path=None):
+    """
+    Extend the product of a previous version of an input with its new rows (see
+    FitsProcessor.append_catalog), or convert the input again if it is not an extension.
+
+    Parameters:
+    -----------
+    job_worker : worker.Worker
+        Worker running the full conversion if needed.
+    job : dict
+        Job of a single product, used for the full conversion.
+    previous : dict
+        Manifest record of the previous product.
+    fitsDataModel_path : str, optional, default = None
+        Path to the FitsDataModel xml.
+
+    Returns:
+    --------
+    Report in the format of Worker.run_job, with 'appended' set on the product if it was appended to.
+    """
+    from script import FitsProcessor
+
+    start = time.perf_counter()
+    try:
+        result = FitsProcessor().append_catalog(job["product_ids"][0], job["input_fits_path"], previous["fits_file"],
+                                                previous, fitsDataModel_path=fitsDataModel_path)
+    except ValueError as e:
+        print(f"Cannot append to '{previous['fits_file']}' ({e}), converting '{job['input_fits_path']}' again.\n")
+        return job_worker.run_job(job)
+
+    product = {
+        "product_id": result["product_id"],
+        "status": "done",
+        "fits_file": previous["fits_file"],
+        "xml_file": previous["xml_file"],
+        "nrows": result["nrows"],
+        "stats": result["stats"],
+        "input_fingerprint": result["input_fingerprint"],
+        "appended": result["appended"],
+        "latency": time.perf_counter() - start,
+    }
+    return {"id": job.get("id"), "status": "done", "latency": product["latency"], "products": [product]}
+
+def ingest(input_dir, product_ids, output_dir="./generated/", fitsDataModel_path=None, manifest_path=None,
+           pattern="*.fits", max_workers=4, xml=True, append=False, save_every=50):
+    """
+    Scan an input directory once and generate the products of the new or changed inputs only.
+
+    Parameters:
+    -----------
+    input_dir : str
+        Directory containing the input FITS files (scanned recursively).
+    product_ids : list
+        Product IDs to generate for every input.
+    output_dir : str, optional, default = "./generated/"
+        Directory where the products are saved.
+    fitsDataModel_path : str, optional, default = None
+        Path to the FitsDataModel xml.
+    manifest_path : str, optional, default = None
+        Path of the JSON manifest. Defaults to '<output_dir>/ingest_manifest.json'.
+    pattern : str, optional, default = "*.fits"
+        Shell pattern of the input file names.
+    max_workers : int, optional, default = 4
+        Number of inputs converted concurrently.
+    xml : bool, optional, default = True
+        Generate the XML of the products (requires the EDEN environment).
+    append : bool, optional, default = False
+        When an input grew by appended rows, only convert the new rows and extend its previous product.
+    save_every : int, optional, default = 50
+        Save the manifest every 'save_every' converted inputs.
+
+    Returns:
+    --------
+    summary : dict
+        {'scanned', 'skipped', 'converted', 'failed', 'elapsed'}
+    """
+    from worker import Worker
+
+    job_worker = Worker(fitsDataModel_path=fitsDataModel_path, max_workers=max_workers, xml=xml)
+    job_worker.preload()
+    try:
+        return _ingest_once(job_worker, input_dir, product_ids, output_dir, fitsDataModel_path,
+                            manifest_path, pattern, append, save_every)
+    finally:
+        job_worker.shutdown()
+
+def watch(input_dir, product_ids, output_dir="./generated/", fitsDataModel_path=None, manifest_path=None,
+          pattern="*.fits", max_workers=4, xml=True, append=False, interval=30.0):
+    """
+    Rescan an input directory every 'interval' seconds and generate the products of the
+    new or changed inputs (see ingest). Stops on Ctrl-C.
+    """
+    from worker import Worker
+
+    job_worker = Worker(fitsDataModel_path=fitsDataModel_path, max_workers=max_workers, xml=xml)
+    job_worker.preload()
+    try:
+        while True:
+            _ingest_once(job_worker, input_dir, product_ids, output_dir, fitsDataModel_path,
+                         manifest_path, pattern, append)
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        job_worker.shutdown()
+
+def _ingest_once(job_worker, input_dir, product_ids, output_dir, fitsDataModel_path, manifest_path,
+                 pattern, append=False, save_every=50):
+    start = time.perf_counter()
+    manifest = Manifest(manifest_path or os.path.join(output_dir, "ingest_manifest.json"))
+    dm_path = os.path.abspath(fitsDataModel_path or 'raw/FitsDataModel.xml')
+    dm_hash = manifest.content_hash(dm_path, os.stat(dm_path))
+    dm_versions = {product_id: describe_dm_version(product_id, dm_hash, fitsDataModel_path) for product_id in product_ids}
+
+    summary = {"scanned": 0, "skipped": 0, "converted": 0, "appended": 0, "failed": 0}
+    pending = []
+    submitted = set()  # inputs with identical content are only converted once
+    for path, stat in scan_inputs(input_dir, pattern):
+        summary["scanned"] += 1
+        content_hash = manifest.content_hash(path, stat)
+
+        todo = {}
+        for product_id in product_ids:
+            key = manifest.product_key(content_hash, dm_versions[product_id], product_id)
+            if key in submitted or manifest.is_processed(key):
+                summary["skipped"] += 1
+            else:
+                todo[product_id] = key
+                submitted.add(key)
+
+        if not todo:
+            continue
+
+        # named after the path relative to the input dir : inputs of the same name in different
+        # sub-directories of a recursive scan do not overwrite each other's products
+        output_name = os.path.relpath(path, os.path.abspath(input_dir))
+        output_name = output_name[:-len(".fits")] if output_name.endswith(".fits") else output_name
+        job = {"input_fits_path": path, "product_ids": list(todo), "output_dir": output_dir, "output_name": output_name,
+               "fingerprint": append}
+        if fitsDataModel_path is not None:
+            job["fits_data_model"] = fitsDataModel_path
+
+        if append:
+            # products whose input was converted before (with another content) are appended to
+            for product_id in list(todo):
+                previous_key, previous = manifest.find_previous(path, dm_versions[product_id], product_id)
+                if previous is None or "input_fingerprint" not in previous or not os.path.exists(previous["fits_file"]):
+                    continue
+                product_job = dict(job, product_ids=[product_id])
+                future = job_worker.executor.submit(append_or_convert, job_worker, product_job, previous, fitsDataModel_path)
+                pending.append((path, {product_id: todo.pop(product_id)}, future, previous_key))
+            job["product_ids"] = list(todo)
+
+        if todo:
+            pending.append((path, todo, job_worker.submit(job), None))
+
+    for count, (path, todo, future, replaces) in enumerate(pending, start=1):
+        for product in future.result()["products"]:
+            product_id = product["product_id"]
+            if product["status"] == "done":
+                try:
+                    manifest.record(todo[product_id], path, dm_versions[product_id], product, replaces=replaces)
+                except ValueError as e:
+                    print(f"Error recording the product of '{path}' : {e} \n")
+                    summary["failed"] += 1
+                    continue
+                summary["appended" if product.get("appended") is not None else "converted"] += 1
+            else:
+                summary["failed"] += 1
+        if count % save_every == 0:
+            manifest.save()
+
+    manifest.save()
+    summary["elapsed"] = time.perf_counter() - start
+    print(f"\033[1mIngest of '{input_dir}' : {summary['scanned']} files scanned, {summary['converted']} products converted, "
+          f"{summary['appended']} appended to, {summary['skipped']} skipped, {summary['failed']} failed "
+          f"in {summary['elapsed']:.4f} seconds\033[0m \n")
+    return summary
@@ -0,0 +1,301 @@
+import hashlib
+import warnings
+
+import numpy as np
+
+from conversion import CHUNK_BYTES, open_input
+from sorting import ExternalSorter, SORT_MEMORY_BYTES
+
+# column the inputs of a join are matched on
+JOIN_KEY = "OBJECT_ID"
+
+# 'inner' keeps the keys found in all the inputs, 'left' keeps all the rows of the first input
+JOIN_TYPES = ("inner", "left")
+
+# number of unmatched keys of every input kept as examples in the report
+UNMATCHED_SAMPLE = 10
+
+def missing_values(dtype):
+    """
+    Value of the columns of a left join whose input has no row for the key : NaN for the
+    floats, zero (or an empty string) otherwise.
+    """
+    value = np.zeros((), dtype=dtype)
+    if dtype.base.kind in "fc":
+        value = np.full((), np.nan, dtype=dtype.base)
+    return value
+
+class JoinedTable:
+    """
+    Rows of several tables (e.g. the MER, PHZ and SHE catalogs of the same objects) joined on a
+    key column, read as one table with the columns of all the inputs. It has the same interface
+    as conversion.TableLayout, so the joined rows go straight into the conversion.
+
+    The join is a sort-merge join : every input is sorted by key with an external sort
+    (sorting.ExternalSorter, spilled to disk beyond the memory budget), then the sorted streams
+    are merged block by block with vectorized intersections of their keys. Only the first row of
+    a key repeated in an input is joined, except in the first input of a left join whose rows are
+    all kept. The keys of every input without a match in another input are counted in the report
+    of the join.
+
+    The key is an integer column (e.g. OBJECT_ID) : a float key could hold NaN, which matches nothing.
+    """
+
+    def __init__(self, layouts, names=None, key=JOIN_KEY, how="inner", memory_bytes=SORT_MEMORY_BYTES, tmp_dir=None):
+        """
+        Parameters:
+        -----------
+        layouts : list
+            TableLayout (or TableStream) of every input, at least two.
+        names : list, optional, default = None
+            Name of every input in the report (default : their paths).
+        key : str, optional, default = JOIN_KEY
+            Integer column of all the inputs the rows are matched on.
+        how : str, optional, default = "inner"
+            'inner' or 'left' (see JOIN_TYPES), the columns of the missing rows of a left join are
+            NaN for the floats and zero otherwise.
+        memory_bytes : int, optional, default = SORT_MEMORY_BYTES
+            Memory budget of the sorts of all the inputs.
+        tmp_dir : str, optional, default = None
+            Directory of the spill files of the sorts (default : the system temporary directory).
+        """
+        if len(layouts) < 2:
+            raise ValueError("A join needs at least two inputs.")
+        if how not in JOIN_TYPES:
+            raise ValueError(f"Unknown join type '{how}'. Options: {list(JOIN_TYPES)}")
+        self.names = list(names) if names is not None else [layout.path for layout in layouts]
+
+        owners = {}
+        for name, layout in zip(self.names, layouts):
+            if key not in layout.dtype.names:
+                raise ValueError(f"The join column {key} is not in '{name}'.")
+            if layout.dtype[key].shape or layout.dtype[key].kind not in "iu":
+                raise ValueError(f"Cannot join on {key} : it is not an integer scalar column in '{name}'.")
+            for column in layout.dtype.names:
+                if column != key and column in owners:
+                    raise ValueError(f"Column {column} is both in '{owners[column]}' and in '{name}'.")
+                owners.setdefault(column, name)
+
+        first = layouts[0]
+        self.layouts = layouts
+        self.key = key
+        self.how = how
+        self.memory_bytes = memory_bytes
+        self.tmp_dir = tmp_dir
+        self.path = first.path
+        self.primary_header = first.primary_header
+        self.compression = next((layout.compression for layout in layouts if layout.compression), None)
+        # the columns of every input in order, the key column once
+        self.columns = list(first.columns)
+        for layout in layouts[1:]:
+            self.columns.extend(col for col in layout.columns if col["name"] != key)
+        self.dtype = np.dtype([(col["name"], layout.dtype[col["name"]]) for layout in layouts
+                               for col in layout.columns if col["name"] != key or layout is first])
+        self.row_width = self.dtype.itemsize
+        # exact for a left join, an upper bound of an inner join until it is done : the writer corrects NAXIS2 once the rows are written
+        self.nrows = first.nrows if how == "left" else min(layout.nrows for layout in layouts)
+        self.report = None
+
+    def column(self, name):
+        for col in self.columns:
+            if col["name"] == name:
+                return col
+        raise KeyError(name)
+
+    def fingerprint(self):
+        """
+        Hash of the headers of the inputs and of the join (see TableLayout.fingerprint).
+        """
+        digest = hashlib.sha256()
+        for layout in self.layouts:
+            digest.update(layout.fingerprint().encode("ascii"))
+            digest.update(str(layout.nrows).encode("ascii"))
+        digest.update(f"{self.how} join on {self.key}".encode("ascii"))
+        return digest.hexdigest()
+
+    def default_chunk_rows(self, columns=None, chunk_bytes=CHUNK_BYTES):
+        return max(1, chunk_bytes // max(1, self.chunk_dtype(columns).itemsize))
+
+    def chunk_dtype(self, columns=None):
+        """
+        Type of the rows returned by iter_chunks (the columns in the order of the joined rows).
+        """
+        if not columns:
+            return self.dtype
+        columns = set(columns)
+        return np.dtype([(name, self.dtype[name]) for name in self.dtype.names if name in columns])
+
+    def iter_chunks(self, chunk_rows=None, start=0, stop=None, columns=None, pool=None):
+        """
+        Join the inputs and iterate over the joined rows (see TableLayout.iter_chunks). All the
+        inputs are read and sorted before the first chunk; the rows of a join can only be read
+        all at once. Without a pool, every chunk is only valid until the next one is requested.
+        The report of the join is available once all the rows are read.
+        """
+        if start != 0 or (stop is not None and stop < self.nrows):
+            raise ValueError("The rows of a join can only be read all at once, not from or up to a row.")
+        chunk_rows = chunk_rows or self.default_chunk_rows(columns)
+        dtype = self.chunk_dtype(columns)
+
+        report = {"key": self.key, "how": self.how, "nrows": 0,
+                  "inputs": [{"input": name, "nrows": layout.nrows, "unmatched": 0, "unmatched_sample": [], "duplicates": 0}
+                             for name, layout in zip(self.names, self.layouts)]}
+        sorters = []
+        try:
+            for layout in self.layouts:
+                # only the key and the columns asked for are read and sorted
+                names = [self.key] + [name for name in layout.dtype.names if name != self.key and name in dtype.names]
+                sorter = ExternalSorter(layout.chunk_dtype(names), self.key, memory_bytes=self.memory_bytes // len(self.layouts),
+                                        tmp_dir=self.tmp_dir)
+                sorters.append(sorter)
+                for chunk in layout.iter_chunks(columns=names):
+                    sorter.add(chunk)
+
+            for joined in self._merge(sorters, dtype, report):
+                for begin in range(0, len(joined), chunk_rows):
+                    chunk = joined[begin:begin + chunk_rows]
+                    if pool is not None:
+                        buffer = pool.acquire(len(chunk))
+                        buffer[:] = chunk
+                        chunk = buffer
+                    report["nrows"] += len(chunk)
+                    yield chunk
+        finally:
+            for sorter in sorters:
+                sorter.cleanup()
+
+        self.report = report
+        for entry in report["inputs"]:
+            if entry["unmatched"]:
+                sample = ", ".join(str(value) for value in entry["unmatched_sample"])
+                warnings.warn(f"{entry['unmatched']} {self.key} of '{entry['input']}' have no match in the other inputs "
+                              f"(e.g. {sample}).", UserWarning)
+            if entry["duplicates"]:
+                warnings.warn(f"{entry['duplicates']} rows of '{entry['input']}' repeat a {self.key}, only the first one is joined.",
+                              UserWarning)
+
+    def _merge(self, sorters, dtype, report):
+        streams = [sorter.sorted_chunks() for sorter in sorters]
+        count = len(streams)
+        keys = [np.empty(0)] * count
+        rows = [np.empty(0, dtype=sorter.dtype) for sorter in sorters]
+        finished = [False] * count
+        last = [None] * count
+        # last joined row of every input, for the rows of the first input of a left join repeating its key in the next block
+        carry = [None] * count
+
+        while True:
+            for i in range(count):
+                while not finished[i] and len(keys[i]) == 0:
+                    try:
+                        keys[i], rows[i] = next(streams[i])
+                    except StopIteration:
+                        finished[i] = True
+            if all(finished[i] and len(keys[i]) == 0 for i in range(count)):
+                return
+
+            # every key up to the smallest last buffered key of the unfinished inputs is buffered for all the inputs
+            bounds = [keys[i][-1] for i in range(count) if not finished[i]]
+            bound = min(bounds) if bounds else None
+
+            parts = []
+            for i in range(count):
+                size = len(keys[i]) if bound is None else int(np.searchsorted(keys[i], bound, side="right"))
+                block_keys, block_rows = keys[i][:size], rows[i][:size]
+                keys[i], rows[i] = keys[i][size:], rows[i][size:]
+
+                if i == 0 and self.how == "left":
+                    # a left join keeps all the rows of the first input
+                    parts.append((block_keys, block_rows))
+                    continue
+                # a key repeated in an input (also across two blocks) is only joined once
+                unique = np.ones(len(block_keys), dtype=bool)
+                unique[1:] = block_keys[1:] != block_keys[:-1]
+                if len(block_keys) and last[i] is not None:
+                    unique[0] = block_keys[0] != last[i]
+                if len(block_keys):
+                    last[i] = block_keys[-1]
+                report["inputs"][i]["duplicates"] += int(len(block_keys) - np.count_nonzero(unique))
+                part_keys, part_rows = block_keys[unique], block_rows[unique]
+                if self.how == "left":
+                    previous = carry[i]
+                    if len(part_keys):
+                        carry[i] = (part_keys[-1:], part_rows[-1:])
+                    if previous is not None and len(parts[0][0]) and parts[0][0][0] == previous[0][0]:
+                        part_keys = np.concatenate([previous[0], part_keys])
+                        part_rows = np.concatenate([previous[1], part_rows])
+                parts.append((part_keys, part_rows))
+
+            joined = self._join(parts, dtype, report)
+            if len(joined):
+                yield joined
+
+    def _join(self, parts, dtype, report):
+        common = parts[0][0]
+        if self.how == "inner":
+            for part_keys, _ in parts[1:]:
+                common = np.intersect1d(common, part_keys, assume_unique=True)
+
+        joined = np.empty(len(common), dtype=dtype)
+        # keys of the first input missing from another input (only kept by a left join)
+        incomplete = np.zeros(len(common), dtype=bool)
+        for i, (part_keys, part_rows) in enumerate(parts):
+            if i == 0 and self.how == "left":
+                # every row of the first input, repeated keys included
+                positions = np.arange(len(common))
+                found = np.ones(len(common), dtype=bool)
+            else:
+                positions = np.minimum(np.searchsorted(part_keys, common), max(len(part_keys) - 1, 0))
+                found = part_keys[positions] == common if len(part_keys) else np.zeros(len(common), dtype=bool)
+            matched = np.zeros(len(part_keys), dtype=bool)
+            matched[positions[found]] = True
+            incomplete |= ~found
+            if i > 0:
+                self._count_unmatched(report["inputs"][i], part_keys[~matched])
+
+            for name in part_rows.dtype.names:
+                if name not in dtype.names or (name == self.key and i > 0):
+                    continue
+                if found.all():
+                    joined[name] = part_rows[name][positions]
+                else:
+                    joined[name] = missing_values(dtype[name])
+                    joined[name][found] = part_rows[name][positions[found]]
+
+        first_keys = parts[0][0]
+        if self.how == "inner":
+            self._count_unmatched(report["inputs"][0], first_keys[~np.isin(first_keys, common, assume_unique=True)])
+        else:
+            self._count_unmatched(report["inputs"][0], common[incomplete])
+        return joined
+
+    def _count_unmatched(self, entry, unmatched):
+        entry["unmatched"] += len(unmatched)
+        room = UNMATCHED_SAMPLE - len(entry["unmatched_sample"])
+        if room > 0 and len(unmatched):
+            entry["unmatched_sample"].extend(value.item() for value in unmatched[:room])
+
+def open_join(spec):
+    """
+    Join of the inputs of a join specification.
+
+    Parameters:
+    -----------
+    spec : dict
+        {'join': list of input specifications (see conversion.parse_input_spec), every one
+        read as one table, e.g. ['mer.fits', 'phz.fits', 'she/*.fits'];
+        'key' (optional, default JOIN_KEY); 'how' (optional, 'inner' or 'left', default 'inner');
+        'memory_mb' (optional, memory budget of the sorts); 'tmp_dir' (optional, directory of the spill files)}
+
+    Returns:
+    --------
+    JoinedTable
+    """
+    unknown = set(spec) - {"join", "key", "how", "memory_mb", "tmp_dir"}
+    if unknown:
+        raise ValueError(f"Unknown join options : {sorted(unknown)}.")
+    inputs = spec["join"]
+    memory_bytes = int(spec["memory_mb"] * 1024 * 1024) if spec.get("memory_mb") else SORT_MEMORY_BYTES
+    return JoinedTable([open_input(item) for item in inputs], names=[str(item) for item in inputs],
+                       key=spec.get("key", JOIN_KEY), how=spec.get("how", "inner"), memory_bytes=memory_bytes,
+                       tmp_dir=spec.get("tmp_dir"))
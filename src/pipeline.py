@@ -0,0 +1,182 @@
+import queue
+import threading
+
+# number of chunks waiting between two stages of a pipeline
+PIPELINE_DEPTH = 2
+
+# how often (in seconds) a blocked stage checks whether the pipeline was stopped
+POLL_INTERVAL = 0.1
+
+class PipelineStopped(Exception):
+    """
+    Raised in the stages of a pipeline stopped by an error or by its consumer.
+    """
+
+class BufferPool:
+    """
+    Fixed set of preallocated chunk arrays handed out to the stages of a pipeline and given back
+    once the chunk is consumed : the chunks are not reallocated, and the number of chunks in
+    flight (so the memory used) is bounded by the size of the pool.
+    """
+
+    def __init__(self, factory, count):
+        """
+        Parameters:
+        -----------
+        factory : callable
+            Function returning a new array of the pool.
+        count : int
+            Number of arrays of the pool.
+        """
+        self.free = queue.Queue()
+        for _ in range(count):
+            self.free.put(factory())
+        # views handed out -> array they belong to
+        self.owners = {}
+        self.closed = threading.Event()
+
+    def acquire(self, rows=None):
+        """
+        Take an array of the pool, waiting for one to be released if they are all in use.
+
+        Parameters:
+        -----------
+        rows : int, optional, default = None
+            Only return the first rows of the array.
+
+        Returns:
+        --------
+        numpy array (or a view of its first rows), to be given back with release
+        """
+        while True:
+            if self.closed.is_set():
+                raise PipelineStopped()
+            try:
+                buffer = self.free.get(timeout=POLL_INTERVAL)
+                break
+            except queue.Empty:
+                continue
+        view = buffer if rows is None else buffer[:rows]
+        self.owners[id(view)] = (view, buffer)
+        return view
+
+    def release(self, view):
+        """
+        Give back an array (or the view returned by acquire) to the pool.
+        """
+        _, buffer = self.owners.pop(id(view))
+        self.free.put(buffer)
+
+    def close(self):
+        """
+        Wake up and stop the stages waiting for an array.
+        """
+        self.closed.set()
+
+def _put(items, item, stop):
+    while not stop.is_set():
+        try:
+            items.put(item, timeout=POLL_INTERVAL)
+            return
+        except queue.Full:
+            continue
+    raise PipelineStopped()
+
+def _get(items, stop):
+    while not stop.is_set():
+        try:
+            return items.get(timeout=POLL_INTERVAL)
+        except queue.Empty:
+            continue
+    raise PipelineStopped()
+
+def run_pipeline(source, stages, depth=PIPELINE_DEPTH, pools=()):
+    """
+    Run the iteration of a source and the stages processing its items in their own threads,
+    connected by bounded queues, so that reading, processing and consuming overlap. The items
+    are processed one at a time by every stage, in the order of the source.
+
+    Parameters:
+    -----------
+    source : iterable
+        Items to process (e.g. chunks of rows read from a file), iterated in the reader thread.
+    stages : list
+        Functions applied to every item one after the other, each in its own thread; an item for
+        which a stage returns None is dropped.
+    depth : int, optional, default = PIPELINE_DEPTH
+        Maximum number of items waiting between two stages (0 runs everything in the caller's thread).
+    pools : tuple, optional, default = ()
+        BufferPools of the items, closed when the pipeline stops.
+
+    Returns:
+    --------
+    Generator of the items returned by the last stage, consumed in the caller's thread
+    """
+    if depth <= 0:
+        for item in source:
+            for stage in stages:
+                item = stage(item)
+                if item is None:
+                    break
+            else:
+                yield item
+        return
+
+    stop = threading.Event()
+    errors = []
+    done = object()
+    queues = [queue.Queue(maxsize=depth) for _ in range(len(stages) + 1)]
+
+    def read():
+        try:
+            for item in source:
+                _put(queues[0], item, stop)
+            _put(queues[0], done, stop)
+        except PipelineStopped:
+            pass
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+
+    def process(stage, inputs, outputs):
+        try:
+            while True:
+                item = _get(inputs, stop)
+                if item is not done:
+                    item = stage(item)
+                    if item is None:
+                        continue
+                _put(outputs, item, stop)
+                if item is done:
+                    return
+        except PipelineStopped:
+            pass
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+
+    threads = [threading.Thread(target=read, name="pipeline-read", daemon=True)]
+    for i, stage in enumerate(stages):
+        threads.append(threading.Thread(target=process, args=(stage, queues[i], queues[i + 1]),
+                                        name=f"pipeline-stage-{i}", daemon=True))
+    for thread in threads:
+        thread.start()
+
+    try:
+        while True:
+            try:
+                item = _get(queues[-1], stop)
+            except PipelineStopped:
+                break
+            if item is done:
+                break
+            yield item
+    finally:
+        stop.set()
+        for pool in pools:
+            pool.close()
+        for thread in threads:
+            thread.join()
+
+    if errors:
+        raise errors[0]
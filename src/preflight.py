@@ -0,0 +1,337 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from astropy.io import fits
+
+from benchmark import CALIBRATION_FILE, load_calibration
+from conversion import open_input, ConversionPlan, BLOCK_SIZE, DECOMPRESS_DEPTH, PIPELINE_CHUNK_BYTES, raw_dtype
+from healpix import check_nside, npix
+from join import JoinedTable
+from helpers import load_column_mappings
+from pipeline import PIPELINE_DEPTH
+from sharding import MIN_SHARD_ROWS, shard_ranges
+from sorting import SORT_MEMORY_BYTES, check_sort_key
+
+# number of inputs whose headers are inspected at the same time
+PREFLIGHT_WORKERS = 8
+
+# throughput (bytes read + written per second) assumed when the conversion was not calibrated
+DEFAULT_BYTES_PER_SECOND = 100 * 1024 * 1024
+
+def padded(nbytes):
+    """
+    Size of a FITS header or data unit padded to a whole number of blocks.
+    """
+    return -(-nbytes // BLOCK_SIZE) * BLOCK_SIZE
+
+def cast_report(plan):
+    """
+    Casts done by the conversion of a plan : every output column that is not a raw copy of its input.
+
+    Parameters:
+    -----------
+    plan : conversion.ConversionPlan
+        Conversion of the input rows.
+
+    Returns:
+    --------
+    list of {'column', 'from', 'to', 'narrowing'} where 'from' is the input format (or the expression
+    of a derived column) and 'narrowing' tells if values may overflow or lose precision (see conversion.check_cast)
+    """
+    casts = []
+    for col in plan.columns:
+        if col["expression"] is not None:
+            casts.append({"column": col["name"], "from": col["expression"].text, "to": col["format"], "narrowing": True})
+            continue
+        source = col["source"]
+        if source is None or col["copy"]:
+            continue
+        source_dtype = raw_dtype(source["format"]).base
+        dtype = col["dtype"].base
+        scaled = source["tscal"] is not None or source["tzero"] is not None
+        narrowing = dtype.kind in "iub" and (source_dtype.kind in "fc" or scaled) or dtype.itemsize < source_dtype.itemsize
+        casts.append({"column": col["name"], "from": source["format"], "to": col["format"], "narrowing": bool(narrowing)})
+    return casts
+
+def peak_memory(layout, plan, columns=None, chunk_rows=None, pipeline_depth=PIPELINE_DEPTH, processes=1,
+                sort_by=None, sort_memory=None):
+    """
+    Estimated peak memory of the conversion buffers (chunks of input and output rows, derived
+    columns and sort buffer) for the chosen mode, see generate_catalog.
+
+    Returns:
+    --------
+    Number of bytes
+    """
+    in_width = layout.chunk_dtype(columns).itemsize
+    out_width = plan.dtype.itemsize
+    chunk_rows = min(chunk_rows or layout.default_chunk_rows(columns, chunk_bytes=PIPELINE_CHUNK_BYTES), max(1, layout.nrows))
+    # every derived column keeps its intermediate float64 arrays
+    derived = chunk_rows * 8 * len(plan.derived)
+
+    if processes > 1:
+        # every process converts its chunks one after the other
+        shards = len(shard_ranges(layout.nrows, min(processes, max(1, layout.nrows // MIN_SHARD_ROWS))))
+        memory = shards * (chunk_rows * (in_width + out_width) + derived)
+    elif pipeline_depth <= 0:
+        memory = chunk_rows * (in_width + out_width) + derived
+    else:
+        # the pools of the pipeline hold depth + 2 chunks of input and output rows
+        memory = (pipeline_depth + 2) * chunk_rows * (in_width + out_width) + derived
+    if layout.compression:
+        # whole rows are decompressed ahead of the reads
+        memory += (DECOMPRESS_DEPTH + 2) * chunk_rows * layout.row_width
+    if isinstance(layout, JoinedTable):
+        # the inputs are sorted by key within the budget of the join
+        memory += min(layout.memory_bytes, sum(table.nrows for table in layout.layouts) * in_width)
+    if sort_by:
+        memory += min(sort_memory or SORT_MEMORY_BYTES, layout.nrows * out_width)
+    return memory
+
+def projected_runtime(read_bytes, write_bytes, calibration=None, processes=1):
+    """
+    Projected runtime of a conversion from the throughput measured by benchmark.calibrate_conversion.
+
+    Parameters:
+    -----------
+    read_bytes, write_bytes : int
+        Bytes read from the input and written to the output (and the spill files of a sort).
+    calibration : dict, optional, default = None
+        Calibration of the machine (see benchmark.load_calibration), DEFAULT_BYTES_PER_SECOND if None.
+    processes : int, optional, default = 1
+        Number of processes converting the rows.
+
+    Returns:
+    --------
+    Number of seconds
+    """
+    rate = calibration["bytes_per_second"] if calibration else DEFAULT_BYTES_PER_SECOND
+    overhead = calibration.get("overhead_seconds", 0.0) if calibration else 0.0
+    return overhead + (read_bytes + write_bytes) / rate / max(1, min(processes, os.cpu_count() or 1))
+
+def preflight_input(processor, schema, product_id, input_fits_path, row_filter=None, sort_by=None, sort_memory=None,
+                    nside=None, processes=1, fingerprint=False, chunk_rows=None, pipeline_depth=PIPELINE_DEPTH,
+                    calibration=None):
+    """
+    Check the conversion of an input to a product and estimate its cost from the headers only.
+
+    Parameters:
+    -----------
+    processor : script.FitsProcessor
+        Processor of the conversion (column mappings and cast policy).
+    schema : tuple
+        (json_data, columns_info) of the product (see FitsProcessor.load_schema).
+    product_id : str
+        The product_id of the catalog.
+    input_fits_path : str or list
+        Input specification (see conversion.parse_input_spec).
+    Other parameters : see FitsProcessor.generate_catalog (nside : generate_partitioned_catalog).
+
+    Returns:
+    --------
+    report : dict
+        {'input', 'product_id', 'status' ('ok' or 'fail'), 'errors', 'warnings', 'nrows', 'missing', 'excess',
+         'casts', 'read_bytes', 'output_bytes', 'peak_memory', 'projected_seconds'}
+    """
+    report = {"input": input_fits_path, "product_id": product_id, "status": "ok", "errors": [], "warnings": []}
+    json_data, columns_info = schema
+    try:
+        layout = open_input(input_fits_path)
+        plan = ConversionPlan(layout, columns_info, mapping=load_column_mappings(product_id, processor.column_mappings_path),
+                              cast_policy=processor.cast_policy, verbose=False)
+    except Exception as e:
+        report.update(status="fail", errors=[str(e)])
+        return report
+
+    report.update(nrows=layout.nrows, missing=plan.missing, excess=plan.excess, casts=cast_report(plan))
+    if plan.missing:
+        report["warnings"].append(f"Columns missing from the input, written as zeros : {plan.missing}")
+
+    # the options are checked as generate_catalog checks them before converting
+    checks = []
+    if row_filter:
+        checks.append(lambda: plan.compile_filter(row_filter))
+    if sort_by:
+        checks.append(lambda: check_sort_key(plan.dtype, sort_by))
+    if processes > 1 and (row_filter or sort_by or fingerprint):
+        report["errors"].append("Several processes cannot be used with row_filter, sort_by or fingerprint.")
+    if processes > 1 and layout.compression:
+        report["errors"].append("Several processes cannot read a compressed input, it is decompressed as a stream.")
+    if isinstance(layout, JoinedTable):
+        if processes > 1:
+            report["errors"].append("Several processes cannot read a join, its rows are only known once all the inputs are sorted.")
+        report["warnings"].append(f"The inputs are joined on {layout.key} : the output size is an upper bound and "
+                                  "the sorts of the join are not calibrated, its projected runtime is a lower bound.")
+    if nside:
+        checks.append(lambda: check_nside(nside))
+        if "RIGHT_ASCENSION" not in plan.dtype.names or "DECLINATION" not in plan.dtype.names:
+            report["errors"].append("Splitting by HEALPix pixel requires the RIGHT_ASCENSION and DECLINATION columns.")
+    for check in checks:
+        try:
+            check()
+        except Exception as e:
+            report["errors"].append(str(e))
+
+    # output headers, as prepare_conversion builds them
+    try:
+        primary_header = (layout.primary_header if layout.primary_header is not None else fits.getheader(layout.path, 0)).copy()
+        processor.process_header(primary_header, json_data.get("generic_hdu", {}).get("header_keywords", []))
+        table_header = plan.table_header(json_data.get("table_hdu", {}).get("name"))
+        processor.process_header(table_header, json_data.get("table_hdu", {}).get("header_keywords", []))
+        header_bytes = padded(len(primary_header.tostring())) + padded(len(table_header.tostring()))
+    except Exception as e:
+        report["errors"].append(f"Cannot build the output headers : {e}")
+        header_bytes = 2 * BLOCK_SIZE
+
+    data_bytes = layout.nrows * plan.dtype.itemsize
+    if nside and not report["errors"]:
+        # at most one tile per pixel, every tile padded to whole blocks
+        tiles = min(npix(nside), max(1, layout.nrows))
+        output_bytes = tiles * (header_bytes + BLOCK_SIZE) + data_bytes
+        report["warnings"].append(f"Sizes of the NSIDE={nside} tiles are upper bounds (at most {tiles} tiles).")
+    else:
+        output_bytes = header_bytes + padded(data_bytes)
+    if row_filter:
+        report["warnings"].append("With a row filter, the output size and runtime are upper bounds.")
+
+    try:
+        columns = plan.input_columns(row_filter) if not fingerprint else None
+        read_bytes = layout.nrows * layout.chunk_dtype(columns).itemsize
+    except (KeyError, ValueError):
+        # the row filter is invalid (reported above), the reads are estimated without it
+        columns = plan.input_columns()
+        read_bytes = layout.nrows * layout.chunk_dtype(columns).itemsize
+    if layout.compression:
+        # all the columns are decompressed, whatever the columns read
+        read_bytes = layout.nrows * layout.row_width
+        report["warnings"].append(f"The input is {layout.compression} compressed, its projected runtime is a lower bound.")
+    write_bytes = output_bytes
+    sort_budget = sort_memory or SORT_MEMORY_BYTES
+    if sort_by and data_bytes > sort_budget:
+        # the rows beyond the budget are spilled to run files and read back once
+        write_bytes += data_bytes
+        read_bytes += data_bytes
+    if sort_by:
+        report["warnings"].append("The calibration does not include the sort, its projected runtime is a lower bound.")
+
+    report.update(
+        read_bytes=read_bytes,
+        output_bytes=output_bytes,
+        peak_memory=peak_memory(layout, plan, columns, chunk_rows=chunk_rows, pipeline_depth=pipeline_depth,
+                                processes=processes, sort_by=sort_by, sort_memory=sort_memory),
+        projected_seconds=projected_runtime(read_bytes, write_bytes, calibration, processes=processes),
+    )
+    if report["errors"]:
+        report["status"] = "fail"
+    return report
+
+def preflight(inputs, product_ids, fitsDataModel_path=None, column_mappings_path=None, cast_policy="error",
+              row_filter=None, sort_by=None, sort_memory=None, nside=None, processes=1, fingerprint=False,
+              chunk_rows=None, pipeline_depth=PIPELINE_DEPTH, max_workers=PREFLIGHT_WORKERS,
+              calibration_file=CALIBRATION_FILE):
+    """
+    Dry run of a batch of conversions : only the headers of the inputs are read, in parallel, to
+    report for every input and product the missing and excess columns, the casts, the errors the
+    conversion would stop on, the output size, the peak memory and the projected runtime.
+
+    Parameters:
+    -----------
+    inputs : list
+        Input specifications (see conversion.parse_input_spec), every one converted on its own.
+    product_ids : list
+        Product IDs generated from every input.
+    fitsDataModel_path : str, optional, default = None
+        Path to the FitsDataModel xml.
+    column_mappings_path, cast_policy : optional
+        See FitsProcessor.
+    row_filter, sort_by, sort_memory, processes, fingerprint, chunk_rows, pipeline_depth : optional
+        Options of the conversion (see FitsProcessor.generate_catalog).
+    nside : int, optional, default = None
+        Split into HEALPix tiles (see FitsProcessor.generate_partitioned_catalog).
+    max_workers : int, optional, default = PREFLIGHT_WORKERS
+        Number of inputs inspected at the same time.
+    calibration_file : str, optional, default = CALIBRATION_FILE
+        Throughput measured by benchmark.calibrate_conversion (DEFAULT_BYTES_PER_SECOND if it does not exist).
+
+    Returns:
+    --------
+    List of the reports (see preflight_input), input by input and product by product
+    """
+    from script import FitsProcessor
+
+    processor = FitsProcessor(column_mappings_path=column_mappings_path, cast_policy=cast_policy)
+    calibration = load_calibration(calibration_file)
+
+    # the schema of every product is extracted once for all the inputs
+    schemas = {}
+    for product_id in product_ids:
+        try:
+            schemas[product_id] = processor.load_schema(product_id, fitsDataModel_path=fitsDataModel_path)
+        except Exception as e:
+            schemas[product_id] = e
+
+    def inspect(task):
+        input_fits_path, product_id = task
+        if isinstance(schemas[product_id], Exception):
+            return {"input": input_fits_path, "product_id": product_id, "status": "fail",
+                    "errors": [str(schemas[product_id])], "warnings": []}
+        return preflight_input(processor, schemas[product_id], product_id, input_fits_path, row_filter=row_filter,
+                               sort_by=sort_by, sort_memory=sort_memory, nside=nside, processes=processes,
+                               fingerprint=fingerprint, chunk_rows=chunk_rows, pipeline_depth=pipeline_depth,
+                               calibration=calibration)
+
+    tasks = [(input_fits_path, product_id) for input_fits_path in inputs for product_id in product_ids]
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        reports = list(executor.map(inspect, tasks))
+
+    for report in reports:
+        report["calibrated"] = calibration is not None
+    return reports
+
+def format_bytes(nbytes):
+    for unit in ("B", "KB", "MB", "GB"):
+        if nbytes < 1024:
+            return f"{nbytes:.1f} {unit}"
+        nbytes /= 1024
+    return f"{nbytes:.1f} TB"
+
+def print_preflight(reports):
+    """
+    Print the reports of a preflight and their totals.
+
+    Parameters:
+    -----------
+    reports : list
+        Reports returned by preflight.
+    """
+    for report in reports:
+        status = "OK" if report["status"] == "ok" else "FAIL"
+        print(f"\033[1m[{status}] {report['input']} -> {report['product_id']}\033[0m")
+        for error in report["errors"]:
+            print(f"    error    : {error}")
+        for warning in report["warnings"]:
+            print(f"    warning  : {warning}")
+        if "nrows" not in report:
+            print()
+            continue
+        print(f"    rows     : {report['nrows']}")
+        print(f"    missing  : {report['missing'] or '-'}")
+        print(f"    excess   : {report['excess'] or '-'}")
+        for cast in report["casts"]:
+            flag = " (may overflow or lose precision)" if cast["narrowing"] else ""
+            print(f"    cast     : {cast['column']} {cast['from']} -> {cast['to']}{flag}")
+        if "output_bytes" in report:
+            print(f"    output   : {format_bytes(report['output_bytes'])}")
+            print(f"    memory   : {format_bytes(report['peak_memory'])} peak")
+            print(f"    runtime  : {report['projected_seconds']:.2f} s projected")
+        print()
+
+    failed = sum(report["status"] != "ok" for report in reports)
+    estimated = [report for report in reports if "output_bytes" in report]
+    calibrated = reports[0]["calibrated"] if reports else False
+    print(f"\033[1mPreflight : {len(reports) - failed} of {len(reports)} conversions ready, {failed} would fail\033[0m")
+    if estimated:
+        print(f"Output   : {format_bytes(sum(report['output_bytes'] for report in estimated))}")
+        print(f"Memory   : {format_bytes(max(report['peak_memory'] for report in estimated))} peak per conversion")
+        print(f"Runtime  : {sum(report['projected_seconds'] for report in estimated):.2f} s projected "
+              f"({'calibrated' if calibrated else 'not calibrated, run: python src/benchmark.py --calibrate <input> --product_id <id>'})\n")
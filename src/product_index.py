@@ -0,0 +1,315 @@
+import datetime
+import os
+import sqlite3
+import threading
+
+# name of the index in the output directory
+INDEX_FILE = "product_index.sqlite"
+
+# seconds a writer waits for the lock of the database held by another process
+BUSY_TIMEOUT = 30.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS products (
+    fits_file    TEXT PRIMARY KEY,
+    xml_file     TEXT,
+    product_uid  TEXT,
+    product_id   TEXT NOT NULL,
+    catalog_type TEXT,
+    dm_version   TEXT,
+    nrows        INTEGER,
+    input_path   TEXT,
+    input_hash   TEXT,
+    elapsed      REAL,
+    created_at   TEXT,
+    ra_min       REAL,
+    ra_max       REAL,
+    dec_min      REAL,
+    dec_max      REAL,
+    nside        INTEGER,
+    pixel        INTEGER
+);
+CREATE INDEX IF NOT EXISTS products_product_id ON products (product_id);
+CREATE INDEX IF NOT EXISTS products_catalog_type ON products (catalog_type);
+CREATE INDEX IF NOT EXISTS products_input_hash ON products (input_hash);
+CREATE INDEX IF NOT EXISTS products_dec ON products (dec_min, dec_max);
+CREATE INDEX IF NOT EXISTS products_ra ON products (ra_min, ra_max);
+CREATE INDEX IF NOT EXISTS products_pixel ON products (nside, pixel);
+"""
+
+COLUMNS = ("fits_file", "xml_file", "product_uid", "product_id", "catalog_type", "dm_version", "nrows",
+           "input_path", "input_hash", "elapsed", "created_at", "ra_min", "ra_max", "dec_min", "dec_max",
+           "nside", "pixel")
+
+def resolve_index_path(setting, output_dir):
+    """
+    Path of the product index from the 'product_index' setting of a run or a job.
+
+    Parameters:
+    -----------
+    setting : str or bool or None
+        Path of the index, True or None for '<output_dir>/product_index.sqlite', False to disable it.
+    output_dir : str
+        Output directory of the products.
+
+    Returns:
+    --------
+    Path of the index, None if disabled
+    """
+    if setting is None or setting is True:
+        return os.path.join(output_dir, INDEX_FILE)
+    return setting or None
+
+class ProductIndex:
+    """
+    SQLite index of the generated products : one row per product fits file with its product ID,
+    catalog type, DM version, row count, input (path and content hash), generation time and
+    footprint (RA / Dec bounding box of its rows, and HEALPix pixel for the tiles of a partitioned
+    catalog), so that region and attribute lookups do not have to open the products.
+    """
+
+    def __init__(self, path):
+        """
+        Parameters:
+        -----------
+        path : str
+            Path of the SQLite database (created if it does not exist).
+        """
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(path, timeout=BUSY_TIMEOUT, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        # the jobs of a worker register their products from several threads
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def register(self, fits_file, product_id, **fields):
+        """
+        Add a product to the index, or update it if its fits file is already indexed.
+
+        Parameters:
+        -----------
+        fits_file : str
+            Path of the product fits file (key of the index).
+        product_id : str
+            FitsFormat ID of the product.
+        **fields
+            Any of 'xml_file', 'product_uid', 'dm_version', 'nrows', 'input_path', 'input_hash',
+            'elapsed', 'nside', 'pixel', and 'footprint' ({'ra_min', 'ra_max', 'dec_min', 'dec_max'},
+            see conversion.footprint). 'catalog_type' and 'created_at' are filled in if not given.
+        """
+        footprint = fields.pop("footprint", None) or {}
+        unknown = set(fields) - set(COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown product index fields : {sorted(unknown)}.")
+
+        record = dict.fromkeys(COLUMNS)
+        record.update(fields)
+        record.update({key: footprint.get(key) for key in ("ra_min", "ra_max", "dec_min", "dec_max")})
+        record["fits_file"] = os.path.abspath(fits_file)
+        if record["xml_file"] is not None:
+            record["xml_file"] = os.path.abspath(record["xml_file"])
+        record["product_id"] = product_id
+        record["catalog_type"] = record["catalog_type"] or product_id.rsplit(".", 1)[-1]
+        record["created_at"] = record["created_at"] or datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+        placeholders = ", ".join("?" for _ in COLUMNS)
+        with self.lock, self.connection:
+            self.connection.execute(f"INSERT OR REPLACE INTO products ({', '.join(COLUMNS)}) VALUES ({placeholders})",
+                                    [record[column] for column in COLUMNS])
+
+    def remove_missing(self):
+        """
+        Remove the products whose fits file no longer exists.
+
+        Returns:
+        --------
+        Number of removed products
+        """
+        with self.lock:
+            missing = [(row["fits_file"],) for row in self.connection.execute("SELECT fits_file FROM products")
+                       if not os.path.exists(row["fits_file"])]
+            with self.connection:
+                self.connection.executemany("DELETE FROM products WHERE fits_file = ?", missing)
+        return len(missing)
+
+    def query(self, ra=None, dec=None, nside=None, pixel=None, product_id=None, catalog_type=None, dm_version=None,
+              input_hash=None, min_rows=None, limit=None):
+        """
+        Find the indexed products matching all the given criteria.
+
+        Parameters:
+        -----------
+        ra : tuple, optional, default = None
+            (ra_min, ra_max) in degrees, the products whose footprint overlaps this range.
+            ra_min > ra_max selects a range wrapping around RA = 0.
+        dec : tuple, optional, default = None
+            (dec_min, dec_max) in degrees, the products whose footprint overlaps this range.
+        nside, pixel : int, optional, default = None
+            NESTED HEALPix cell, the tiles (of any NSIDE) overlapping it.
+        product_id, catalog_type, dm_version, input_hash : str, optional, default = None
+            Exact value of the attribute.
+        min_rows : int, optional, default = None
+            Minimum number of rows.
+        limit : int, optional, default = None
+            Maximum number of products returned.
+
+        Returns:
+        --------
+        List of the matching products as dicts (columns of the index), sorted by fits file
+        """
+        clauses = []
+        params = []
+        for column, value in (("product_id", product_id), ("catalog_type", catalog_type),
+                              ("dm_version", dm_version), ("input_hash", input_hash)):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        if min_rows is not None:
+            clauses.append("nrows >= ?")
+            params.append(min_rows)
+        if dec is not None:
+            clauses.append("dec_max >= ? AND dec_min <= ?")
+            params += [dec[0], dec[1]]
+        if ra is not None:
+            if ra[0] <= ra[1]:
+                clauses.append("ra_max >= ? AND ra_min <= ?")
+            else:
+                clauses.append("(ra_max >= ? OR ra_min <= ?)")
+            params += [ra[0], ra[1]]
+        if nside is not None and pixel is not None:
+            # NESTED cells : a cell at a finer NSIDE overlaps the cell of its index divided by (ratio of NSIDEs)^2
+            clauses.append("((nside <= ? AND ? / ((? / nside) * (? / nside)) = pixel)"
+                           " OR (nside > ? AND pixel / ((nside / ?) * (nside / ?)) = ?))")
+            params += [nside, pixel, nside, nside, nside, nside, nside, pixel]
+
+        sql = "SELECT * FROM products"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY fits_file"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        with self.lock:
+            return [dict(row) for row in self.connection.execute(sql, params)]
+
+    def count(self):
+        """
+        Number of indexed products.
+        """
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM products").fetchone()[0]
+
+def register_result(index_path, result, input_path=None, dm_version=None, input_hash=None):
+    """
+    Register a product generated by FitsProcessor.generate_catalog (or a tile of
+    generate_partitioned_catalog) in the index of its output directory.
+
+    Parameters:
+    -----------
+    index_path : str
+        Path of the SQLite index.
+    result : dict
+        Result of the generation ('product_id', 'fits_file', and optionally 'xml_file', 'nrows',
+        'footprint', 'elapsed', 'nside', 'pixel', 'input_fingerprint').
+    input_path : str or list, optional, default = None
+        Input(s) of the product.
+    dm_version : str, optional, default = None
+        FitsFormat version of the product.
+    input_hash : str, optional, default = None
+        Content hash of the input (default : the data hash of the input fingerprint, if any).
+    """
+    if input_hash is None and result.get("input_fingerprint"):
+        input_hash = result["input_fingerprint"].get("data_hash")
+    if isinstance(input_path, dict):
+        input_path = input_path["join"]
+    if input_path is not None and not isinstance(input_path, str):
+        input_path = ",".join(input_path)
+    product_uid = None
+    if result.get("xml_file"):
+        import xml.etree.ElementTree as ET
+        product_uid = ET.parse(result["xml_file"]).getroot().findtext("Header/ProductId")
+    with ProductIndex(index_path) as index:
+        index.register(result["fits_file"], result["product_id"],
+                       xml_file=result.get("xml_file"),
+                       product_uid=product_uid,
+                       dm_version=dm_version,
+                       nrows=result.get("nrows"),
+                       input_path=input_path,
+                       input_hash=input_hash,
+                       elapsed=result.get("elapsed"),
+                       nside=result.get("nside"),
+                       pixel=result.get("pixel"),
+                       footprint=result.get("footprint"))
+
+def scan_products(index_path, directory):
+    """
+    Register the products of a directory that were generated before the index existed, from
+    their xml files (ProductId, ProductType, CreationDate and SpatialCoverage) and file names.
+
+    Parameters:
+    -----------
+    index_path : str
+        Path of the SQLite index.
+    directory : str
+        Directory containing the generated xml and fits files.
+
+    Returns:
+    --------
+    Number of registered products
+    """
+    import re
+    import xml.etree.ElementTree as ET
+    from xmltemplate import names_database
+
+    products = {entry["product"]: entry["id"] for entry in names_database.values()}
+    count = 0
+    with ProductIndex(index_path) as index:
+        for name in sorted(os.listdir(directory)):
+            if not name.endswith(".xml"):
+                continue
+            xml_file = os.path.join(directory, name)
+            fits_file = xml_file[:-len(".xml")] + ".fits"
+            if not os.path.exists(fits_file):
+                continue
+            try:
+                root = ET.parse(xml_file).getroot()
+            except ET.ParseError:
+                continue
+            product_type = root.findtext("Header/ProductType")
+            if product_type not in products:
+                continue
+
+            # the default coverage is a single (0, 0) vertex, not a footprint
+            vertices = [(float(vertex.findtext("C1")), float(vertex.findtext("C2")))
+                        for vertex in root.iterfind("Data/SpatialCoverage/Polygon/Vertex")]
+            footprint = None
+            if len(vertices) >= 3:
+                ras, decs = zip(*vertices)
+                footprint = {"ra_min": min(ras), "ra_max": max(ras), "dec_min": min(decs), "dec_max": max(decs)}
+
+            # the tiles of a partitioned catalog have the instance ID 'HPX<nside>-<pixel>'
+            tile = re.search(r"_HPX(\d+)-(\d+)_", name)
+
+            index.register(fits_file, products[product_type],
+                           xml_file=xml_file,
+                           product_uid=root.findtext("Header/ProductId"),
+                           created_at=root.findtext("Header/CreationDate"),
+                           nside=int(tile.group(1)) if tile else None,
+                           pixel=int(tile.group(2)) if tile else None,
+                           footprint=footprint)
+            count += 1
+    return count
@@ -0,0 +1,173 @@
+import json
+import sys
+import time
+
+# minimum number of seconds between two progress events of a stage
+PROGRESS_INTERVAL = 2.0
+
+# how the progress of the conversions is reported : 'bar' on a terminal, 'log' as JSON lines, 'auto' picks one
+PROGRESS_MODES = ("auto", "bar", "log", "none")
+
+# width of the progress bar in characters
+BAR_WIDTH = 30
+
+class Progress:
+    """
+    Progress of a stage of a conversion (rows done out of the rows of the stage). The hot loop only
+    adds to the counters; an event is sent to the callback at most every 'interval' seconds, and a
+    last one when the stage is closed.
+
+    An event is a dict {'stage', 'label', 'rows', 'total_rows', 'fraction', 'bytes', 'elapsed',
+    'rows_per_second', 'mb_per_second', 'eta', 'done'} where 'fraction' and 'eta' (seconds) are
+    None when the number of rows of the stage is not known.
+    """
+
+    def __init__(self, stage, total_rows=None, callback=None, label=None, interval=PROGRESS_INTERVAL):
+        """
+        Parameters:
+        -----------
+        stage : str
+            Name of the stage, e.g. 'conversion' or 'sort'.
+        total_rows : int, optional, default = None
+            Number of rows of the stage, for the fraction done and the ETA.
+        callback : callable, optional, default = None
+            Function called with every event (see make_progress). Nothing is reported if None.
+        label : str, optional, default = None
+            What is converted, e.g. the product ID.
+        interval : float, optional, default = PROGRESS_INTERVAL
+            Minimum number of seconds between two events.
+        """
+        self.stage = stage
+        self.total_rows = total_rows
+        self.callback = callback
+        self.label = label
+        self.interval = interval
+        self.rows = 0
+        self.nbytes = 0
+        self.start = time.monotonic()
+        self.next_event = self.start + interval
+
+    def add(self, rows, nbytes=0):
+        """
+        Count rows done by the stage.
+
+        Parameters:
+        -----------
+        rows : int
+            Number of rows.
+        nbytes : int, optional, default = 0
+            Number of bytes they were read from or written to.
+        """
+        self.rows += rows
+        self.nbytes += nbytes
+        self._tick()
+
+    def set(self, rows, nbytes=0):
+        """
+        Set the rows done by the stage, e.g. from counters shared with other processes.
+        """
+        self.rows = rows
+        self.nbytes = nbytes
+        self._tick()
+
+    def _tick(self):
+        if self.callback is None:
+            return
+        now = time.monotonic()
+        if now >= self.next_event:
+            self.next_event = now + self.interval
+            self.callback(self.event(now))
+
+    def close(self):
+        """
+        Send the last event of the stage.
+        """
+        if self.callback is not None:
+            self.callback(self.event(time.monotonic(), done=True))
+
+    def event(self, now=None, done=False):
+        elapsed = max((now or time.monotonic()) - self.start, 1e-9)
+        rows_per_second = self.rows / elapsed
+        fraction = eta = None
+        if self.total_rows:
+            fraction = min(1.0, self.rows / self.total_rows)
+            eta = 0.0 if done else (self.total_rows - self.rows) / rows_per_second if self.rows else None
+        return {
+            "stage": self.stage,
+            "label": self.label,
+            "rows": self.rows,
+            "total_rows": self.total_rows,
+            "fraction": fraction,
+            "bytes": self.nbytes,
+            "elapsed": elapsed,
+            "rows_per_second": rows_per_second,
+            "mb_per_second": self.nbytes / elapsed / 1024 ** 2,
+            "eta": eta,
+            "done": done,
+        }
+
+def format_duration(seconds):
+    if seconds is None:
+        return "?"
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds}s"
+
+class ProgressBar:
+    """
+    Progress callback redrawing a bar on one line of a terminal, e.g.
+    'conversion [##########          ]  50.0% 1500000/3000000 rows 480.2 MB/s 2.1e+06 rows/s ETA 1s'
+    """
+
+    def __init__(self, stream=None, width=BAR_WIDTH):
+        self.stream = stream or sys.stderr
+        self.width = width
+
+    def __call__(self, event):
+        if event["fraction"] is not None:
+            filled = int(event["fraction"] * self.width)
+            bar = f"[{'#' * filled}{' ' * (self.width - filled)}] {event['fraction'] * 100:5.1f}% {event['rows']}/{event['total_rows']} rows"
+        else:
+            bar = f"{event['rows']} rows"
+        timing = f"in {format_duration(event['elapsed'])}" if event["done"] else f"ETA {format_duration(event['eta'])}"
+        line = (f"{event['label'] + ' ' if event['label'] else ''}{event['stage']} {bar} "
+                f"{event['mb_per_second']:.1f} MB/s {event['rows_per_second']:.3g} rows/s {timing}")
+        # the end of a longer previous line is cleared
+        self.stream.write("\r" + line + "\033[K" + ("\n" if event["done"] else ""))
+        self.stream.flush()
+
+def log_progress(event, stream=None):
+    """
+    Progress callback writing every event as a JSON line, for batch systems and log collectors.
+    """
+    print(json.dumps({"event": "progress", **event}), file=stream or sys.stderr, flush=True)
+
+def make_progress(progress):
+    """
+    Progress callback of a 'progress' setting.
+
+    Parameters:
+    -----------
+    progress : str or callable or None
+        One of PROGRESS_MODES : 'bar' (ProgressBar), 'log' (log_progress), 'auto' (a bar if the
+        standard error is a terminal, log lines otherwise) or 'none', or a callable receiving the
+        events (see Progress).
+
+    Returns:
+    --------
+    callable or None
+    """
+    if progress is None or callable(progress):
+        return progress
+    if progress not in PROGRESS_MODES:
+        raise ValueError(f"Unknown progress mode '{progress}', expected one of {PROGRESS_MODES} or a callable.")
+    if progress == "auto":
+        progress = "bar" if sys.stderr.isatty() else "log"
+    if progress == "bar":
+        return ProgressBar()
+    if progress == "log":
+        return log_progress
+    return None
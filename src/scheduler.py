@@ -0,0 +1,128 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+# number of stages running at the same time
+STAGE_WORKERS = 4
+
+class StageGraph:
+    """
+    Dependency graph of the stages of a run : every stage starts on a pool of threads as soon as
+    the stages it depends on are done, so independent stages (e.g. building the XML header and
+    converting the fits) run concurrently. The start and end of every stage are recorded to
+    report the critical path, the chain of dependent stages that sets the duration of the run.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.results = {}
+        self.errors = {}
+        self.skipped = []
+        self.timings = {}
+        self.lock = threading.Lock()
+
+    def add(self, name, func, deps=()):
+        """
+        Add a stage to the graph.
+
+        Parameters:
+        -----------
+        name : str
+            Name of the stage.
+        func : callable
+            Function of the stage, called with the dictionary {stage name: result} of the finished stages.
+        deps : tuple, optional, default = ()
+            Names of the stages (already added) that must be done before it starts.
+        """
+        if name in self.stages:
+            raise ValueError(f"Stage '{name}' is already in the graph.")
+        unknown = [dep for dep in deps if dep not in self.stages]
+        if unknown:
+            raise ValueError(f"Stage '{name}' depends on unknown stages {unknown}.")
+        self.stages[name] = (func, tuple(deps))
+
+    def _run_stage(self, name, start):
+        func, _ = self.stages[name]
+        begin = time.perf_counter() - start
+        try:
+            result = func(self.results)
+        finally:
+            with self.lock:
+                self.timings[name] = (begin, time.perf_counter() - start)
+        return result
+
+    def run(self, max_workers=STAGE_WORKERS):
+        """
+        Run all the stages. A stage that fails is reported and the stages depending on it are skipped,
+        the other ones still run.
+
+        Parameters:
+        -----------
+        max_workers : int, optional, default = STAGE_WORKERS
+            Number of stages running at the same time.
+
+        Returns:
+        --------
+        Dictionary {stage name: result} of the stages that succeeded
+        """
+        start = time.perf_counter()
+        pending = dict(self.stages)
+        running = {}
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            while pending or running:
+                for name, (_, deps) in list(pending.items()):
+                    if any(dep in self.errors or dep in self.skipped for dep in deps):
+                        # a stage whose input failed cannot run
+                        self.skipped.append(name)
+                        del pending[name]
+                    elif all(dep in self.results for dep in deps):
+                        running[executor.submit(self._run_stage, name, start)] = name
+                        del pending[name]
+                if not running:
+                    continue
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        self.results[name] = future.result()
+                    except Exception as e:
+                        self.errors[name] = e
+                        print(f"Error in the '{name}' stage : {e} \n")
+        self.elapsed = time.perf_counter() - start
+        return self.results
+
+    def critical_path(self):
+        """
+        Longest chain of dependent stages, weighted by their durations.
+
+        Returns:
+        --------
+        (stages, seconds) : tuple
+            Names of the stages of the chain in order, and the sum of their durations.
+        """
+        longest = {}
+        for name, (_, deps) in self.stages.items():
+            if name not in self.timings:
+                continue
+            begin, end = self.timings[name]
+            before = max((longest[dep] for dep in deps if dep in longest), key=lambda path: path[1], default=([], 0.0))
+            longest[name] = (before[0] + [name], before[1] + end - begin)
+        return max(longest.values(), key=lambda path: path[1], default=([], 0.0))
+
+    def print_report(self):
+        """
+        Print the timeline of the stages and the critical path.
+        """
+        print("\033[1mStages\033[0m")
+        for name in self.stages:
+            if name in self.timings:
+                begin, end = self.timings[name]
+                status = "failed" if name in self.errors else "done"
+                print(f"    {name:<16} {begin:8.3f} s -> {end:8.3f} s  ({end - begin:.3f} s, {status})")
+            else:
+                print(f"    {name:<16} skipped")
+        stages, seconds = self.critical_path()
+        busy = sum(end - begin for begin, end in self.timings.values())
+        print(f"Critical path : {' -> '.join(stages)} ({seconds:.3f} s)")
+        print(f"Wall time : {self.elapsed:.3f} s for {busy:.3f} s of stages \n")
@@ -1,14 +1,46 @@
 from astropy.io import fits
-from astropy.table import Table
-import numpy as np
 from datetime import datetime
+import hashlib
+import io
+import os
 import json
-from helpers import *
+import shutil
+import tempfile
+import warnings
+from contextlib import nullcontext
+from helpers import get_all_fits_format_ids, extract_data_for_id, load_column_mappings, get_fits_format_version
+from conversion import open_input, ConversionPlan, TableWriter, PartitionedWriter, append_rows, convert_chunks, footprint, check_cast, check_conversion, parse_tform, raw_dtype, replaced_on_success, PIPELINE_DEPTH
+from progress import Progress, make_progress
 import subprocess
 
 class FitsProcessor:
-    def __init__(self):
+    def __init__(self, column_mappings_path=None, cast_policy="error", xml_renderer="eden", product_index=None, progress=None):
+        """
+        Parameters:
+        -----------
+        column_mappings_path : str, optional, default = None
+            yaml file mapping the input columns to the catalog columns of every product ID
+            (renames and derived expressions, default : src/config/column_mappings.yaml)
+        cast_policy : str, optional, default = "error"
+            what to do with the values that overflow or lose precision when a column is cast to
+            its catalog format : 'error', 'clip' or 'warn' (see conversion.check_cast)
+        xml_renderer : str, optional, default = "eden"
+            how the xml files are generated : 'eden' (xsdata bindings, requires the EDEN environment)
+            or 'template' (precompiled templates of src/config/xml_templates, also used with a PAT)
+        product_index : str, optional, default = None
+            SQLite index (see product_index.ProductIndex) where the generated products are registered
+        progress : str or callable, optional, default = None
+            how the progress of the conversions (rows done, MB/s, rows/s and ETA of every stage) is
+            reported : 'bar', 'log', 'auto' or 'none', or a callback receiving the events (see progress.make_progress)
+        """
         self.hdu_list = None
+        self.column_mappings_path = column_mappings_path
+        self.cast_policy = cast_policy
+        # {column: {issue: count}} of the values tolerated by the cast policy in check_column_properties
+        self.cast_issues = {}
+        self.xml_renderer = xml_renderer
+        self.product_index = product_index
+        self.progress = make_progress(progress)
 
     def open_fits(self, input_fits_path):
         """
@@ -35,27 +67,72 @@ class FitsProcessor:
         None
 
         """
-        if self.hdu_list:
+        if self.hdu_list is not None:
             self.hdu_list.close()
+            self.hdu_list = None
             # print("\033[1mFITS file closed.\033[0m \n")
 
-    def create_xml(self, fits_file):
+    def create_xml(self, fits_file, output_dir="./generated/"):
         """
-        Run the xmlgenerator.py script to create and save the catalog.
+        Run the xmlgenerator.py script to create and save the catalog, or render it from the
+        templates in-process (xmltemplate.py) with the 'template' xml renderer.
 
         Parameters:
         -----------
         fits_file : str
             Path to the input FITS file.
+        output_dir : str, optional, default = "./generated/"
+            Directory to save the XML file (and the renamed fits file).
+
+        Returns:
+        --------
+        Path of the generated XML file (the fits file is renamed alongside), None if the generation failed
         """
+        if self.xml_renderer == "template":
+            import xmltemplate
+            return xmltemplate.main(fits_file, output_dir)
         try:
             subprocess.run(
-                ["python", "./src/xmlgenerator.py", fits_file, "--output_dir", "./generated/"],
+                ["python", os.path.join(os.path.dirname(os.path.abspath(__file__)), "xmlgenerator.py"), fits_file,
+                 "--output_dir", output_dir],
                 check=True
             )
             # print(f"Catalog created and saved in generated/ dir.")
         except subprocess.CalledProcessError as e:
             print(f"Error creating XML: {e}")
+            return None
+
+        # the paths of the last generated product are saved in the yaml file by xmlgenerator.py
+        from xmltemplate import load_config, CONFIG_FILE
+        conf = load_config(CONFIG_FILE)
+        if os.path.exists(fits_file) or not os.path.exists(conf.get("fits_filepath") or ""):
+            return None
+        return conf.get("xml_filepath")
+
+    def register_products(self, products, input_fits_path, fitsDataModel_path=None):
+        """
+        Register generated products in the product index (see product_index.ProductIndex).
+
+        Parameters:
+        -----------
+        products : list
+            Results of the generation ('product_id', 'fits_file', 'xml_file', 'nrows', 'footprint', ...).
+        input_fits_path : str or list
+            Input(s) of the products.
+        fitsDataModel_path : str, optional, default = None
+            FitsDataModel xml of the products, for their DM version.
+        """
+        from product_index import register_result
+
+        try:
+            for product in products:
+                # the fits file is renamed after the xml file by the XML generation
+                if product.get("xml_file"):
+                    product = dict(product, fits_file=product["xml_file"].replace(".xml", ".fits"))
+                register_result(self.product_index, product, input_path=input_fits_path,
+                                dm_version=get_fits_format_version(product["product_id"], fitsDataModel_path=fitsDataModel_path))
+        except Exception as e:
+            print(f"Error registering the products in '{self.product_index}' : {e} \n")
 
     def display_contents(self, input_fits_path):
         """
@@ -67,6 +144,9 @@ class FitsProcessor:
             Path of the input FITS file.
 
         """        
+        # astropy.table is only needed for displaying
+        from astropy.table import Table
+
         try:
             self.open_fits(input_fits_path)
 
@@ -88,7 +168,6 @@ class FitsProcessor:
             print(evt_data)
 
             self.close_fits()
-            del self.hdu_list
 
 
         except Exception as e:
@@ -98,6 +177,7 @@ class FitsProcessor:
         """
         Checks if the columns in the existing FITS files have the proper format as compared to the catalog.
         Only updates and converts the format if necessary. Does not handle the unit.
+        The values tolerated by the cast policy are counted in self.cast_issues.
         
         Parameters:
         -----------
@@ -130,17 +210,24 @@ class FitsProcessor:
                 col.format = catalog_info[colname]['format']
                 print(f"Updating column {colname} format from {col_format} to {col.format}\n")
                 
-                # Convert the column data to the new format
-                if col.format == "K":  # 64-bit signed integer
-                    column_data = column_data.astype(np.int64)
-                elif col.format == "J":  # 32-bit signed integer
-                    column_data = column_data.astype(np.int32)
-                elif col.format == "E":  # 32-bit float
-                    column_data = column_data.astype(np.float32)
-                elif col.format == "D":  # 64-bit float
-                    column_data = column_data.astype(np.float64)
+                # Convert the column data to the new format, checking for overflow and loss of precision
+                check_conversion(colname, col_format, col.format)
+                dtype = raw_dtype(col.format).base
+                if parse_tform(col.format)[1] == "L":
+                    column_data = column_data != 0
+                elif dtype.kind == "S":
+                    column_data = column_data.astype(dtype)
                 else:
-                    raise ValueError(f"Unsupported target format: {col.format}")
+                    dtype = dtype.newbyteorder("=")
+                    column_data, issues = check_cast(column_data, dtype, self.cast_policy, colname)
+                    if issues:
+                        # counted as ConversionPlan.cast_into counts them
+                        action = "clipped" if self.cast_policy == "clip" else "cast as they are"
+                        warnings.warn(f"Column {colname} ({col.format}): {issues} values {action}.", UserWarning)
+                        total = self.cast_issues.setdefault(colname, {})
+                        for issue, count in issues.items():
+                            total[issue] = total.get(issue, 0) + count
+                    column_data = column_data.astype(dtype)
 
             # Update the column with the converted data
             col = fits.Column(name=colname, format=col.format, unit=col.unit, array=column_data)
@@ -193,22 +280,277 @@ class FitsProcessor:
                     header.comments[name] = kw["comment"]
 
 
-    def generate_catalog(self, product_id, input_fits_path, output_path=None, fitsDataModel_path=None, display_output=False, PAT=False):
+    def load_schema(self, product_id, fitsDataModel_path=None):
+        """
+        Extract the description of a product from the FitsDataModel xml.
+
+        Parameters:
+        -----------
+        product_id : str
+            The product_id of the catalog
+        fitsDataModel_path : str, optional, default = None
+            optional argument to get the fitsDataModel xml of a Data Product
+
+        Returns:
+        --------
+        (json_data, columns_info) : tuple
+            The extracted data of the product and the dictionary of its columns
+            {'column1': {'format': 'D', 'unit': ..., 'comment': ...}} in the order of the catalog.
+        """
+        # generate the json data file from FitsDataModel xml
+        FitsFormat_ids = get_all_fits_format_ids(fitsDataModel_path=fitsDataModel_path)
+
+        if product_id not in FitsFormat_ids:
+            raise ValueError(f"Provided catalog type '{product_id}' is not in the FitsDataModel. \nDid you mean to use one of these? \n{FitsFormat_ids}")
+
+        json_data = extract_data_for_id(product_id, fitsDataModel_path=fitsDataModel_path)
+
+        # extract the column list from the 'table_hdu' section
+        table_hdu_info = json_data.get("table_hdu", {})
+        columns_info = {}
+        
+        # check if 'columns' exists in the 'table_hdu'
+        if "columns" in table_hdu_info:
+            for column in table_hdu_info["columns"]:
+                unit = column.get("unit")
+                if unit == "NA" and (product_id == "le3.id.vmpz.output.poscatalog" or product_id == "le3.id.vmpz.output.proxyshearcatalog"):
+                    unit = None
+                column_name = column.get("name")
+                column_info = {
+                    "format": column.get("format"),
+                    "unit": unit,
+                    "comment": column.get("comment")
+                }
+                columns_info[column_name] = column_info
+
+        return json_data, columns_info
+
+    def prepare_conversion(self, product_id, input_fits_path, fitsDataModel_path=None):
+        """
+        Open the input FITS file and map its columns (renamed for some product IDs) to the catalog columns.
+
+        Parameters:
+        -----------
+        product_id : str
+            The product_id of the catalog
+        input_fits_path : str or list
+            Path(s) of the input FITS file(s), with optional HDU selection (see conversion.parse_input_spec).
+        fitsDataModel_path : str, optional, default = None
+            optional argument to get the fitsDataModel xml of a Data Product
+
+        Returns:
+        --------
+        (layout, plan, primary_hdu, table_header) : tuple
+            The input TableLayout (TableStream for several HDUs), the ConversionPlan and the processed
+            primary HDU and table header of the product.
+        """
+        json_data, columns_info = self.load_schema(product_id, fitsDataModel_path=fitsDataModel_path)
+
+        # only the headers of the inputs are read, their rows are streamed one HDU after the other
+        layout = open_input(input_fits_path)
+
+        # the primary header of the product comes from the first input (read with the table header if it is compressed)
+        if layout.primary_header is not None:
+            primary_hdu = fits.PrimaryHDU(header=layout.primary_header)
+        else:
+            self.open_fits(layout.path)
+            primary_hdu = self.hdu_list[0]
+
+        plan = ConversionPlan(layout, columns_info, mapping=load_column_mappings(product_id, self.column_mappings_path),
+                              cast_policy=self.cast_policy)
+
+        # print(f"Missing : {plan.missing}")
+        # print(f"Excess : {plan.excess}")
+
+        table_hdu_name = json_data.get("table_hdu", {}).get("name")
+        table_header = plan.table_header(table_hdu_name)
+
+        self.process_header(primary_hdu.header, json_data.get("generic_hdu", [])["header_keywords"])
+        self.process_header(table_header, json_data.get("table_hdu", [])["header_keywords"])
+
+        return layout, plan, primary_hdu, table_header
+
+    def write_catalog(self, output, product_id, input_fits_path, fitsDataModel_path=None, checksum=False, fingerprint=False,
+                      chunk_rows=None, row_filter=None, sort_by=None, sort_memory=None, sort_dir=None, index_file=None,
+                      pipeline_depth=PIPELINE_DEPTH, processes=1):
+        """
+        Convert the input and write the product fits to a path or to any binary file object
+        (file, pipe, socket, BytesIO ...). The other parameters are those of generate_catalog.
+
+        Parameters:
+        -----------
+        output : str or file object
+            Path of the product, or binary file object opened for writing. A path is only written once
+            the product is complete (see conversion.replaced_on_success). A file object that
+            cannot seek only receives the bytes in order : with a row filter or checksums the
+            product is first spooled to a temporary file (in sort_dir) and then copied to it.
+        sort_dir : str, optional, default = None
+            directory of the spill files of the sort (default : the temporary directory)
+        index_file : str, optional, default = None
+            where the key range of every block of sorted rows is saved
+
+        Returns:
+        --------
+        written : dict
+            {'nrows', 'stats', 'footprint', 'cast_issues'} of the product (and 'sort_index', 'input_fingerprint' if requested)
+        """
+        if processes > 1 and (row_filter or sort_by or fingerprint):
+            raise ValueError("Several processes cannot be used with row_filter, sort_by or fingerprint.")
+        output_name = output if isinstance(output, str) else getattr(output, "name", None)
+        if processes > 1 and not isinstance(output_name, str):
+            raise ValueError("Several processes can only write to a file on disk.")
+
+        layout, plan, primary_hdu, table_header = self.prepare_conversion(product_id, input_fits_path, fitsDataModel_path)
+        if processes > 1 and layout.compression:
+            raise ValueError("Several processes cannot read a compressed input, it is decompressed as a stream.")
+        # a join specification is read as a join (see conversion.open_input)
+        joined = isinstance(input_fits_path, dict)
+        if processes > 1 and joined:
+            raise ValueError("Several processes cannot read a join, its rows are only known once all the inputs are sorted.")
+        # the number of rows of a join is only known once it is done
+        rows_known = not row_filter and not joined
+        row_mask = plan.compile_filter(row_filter) if row_filter else None
+
+        # with a filter or a join, NAXIS2 is corrected once the rows are written
+        table_header['NAXIS2'] = layout.nrows
+
+        # convert the columns (add/remove/cast if required) and write them in the order of the FitsDataModel xml, chunk by chunk
+        data_hash = hashlib.sha256() if fingerprint else None
+        # only the input columns used by the catalog are read, unless the whole input rows are hashed
+        columns = plan.input_columns(row_filter) if not fingerprint else None
+        sorter = None
+        if sort_by:
+            from sorting import ExternalSorter, SORT_MEMORY_BYTES
+            sorter = ExternalSorter(plan.dtype, sort_by, memory_bytes=sort_memory or SORT_MEMORY_BYTES, tmp_dir=sort_dir)
+        progress = Progress("conversion", layout.nrows, self.progress, label=product_id)
+
+        def on_read(chunk):
+            if data_hash is not None:
+                data_hash.update(chunk)
+            progress.add(len(chunk), chunk.nbytes)
+
+        # a stream cannot go back to correct NAXIS2 or write the checksums
+        spool = None
+        if not isinstance(output, str) and not output.seekable() and (not rows_known or checksum):
+            spool = tempfile.TemporaryFile(dir=sort_dir)
+
+        # the spill files of the sort are removed even if the conversion fails
+        with replaced_on_success(output) if isinstance(output, str) else nullcontext(output) as output_file, \
+                spool if spool is not None else nullcontext(), sorter if sorter is not None else nullcontext():
+            writer = TableWriter(spool if spool is not None else output_file, primary_hdu, table_header, checksum=checksum)
+            if processes > 1:
+                from sharding import write_sharded
+                # every process writes its range of rows in place
+                write_sharded(writer, input_fits_path, plan, processes, chunk_rows=chunk_rows,
+                              progress=progress if self.progress is not None else None)
+            else:
+                # the input is read and converted in other threads while the rows are written here
+                for rows in convert_chunks(layout, plan, chunk_rows, columns=columns, row_mask=row_mask,
+                                           on_read=on_read, depth=pipeline_depth):
+                    if sorter is not None:
+                        sorter.add(rows)
+                    else:
+                        writer.write(rows)
+            progress.close()
+
+            # the sorted rows are only written once all the input has been read
+            if sorter is not None:
+                from sorting import RowRangeIndex
+                row_index = RowRangeIndex(sort_by) if index_file else None
+                sort_progress = Progress("sort", sorter.nrows, self.progress, label=product_id)
+                for keys, rows in sorter.sorted_chunks():
+                    writer.write(rows)
+                    sort_progress.add(len(rows), rows.nbytes)
+                    if row_index is not None:
+                        row_index.update(keys)
+                sort_progress.close()
+                if row_index is not None:
+                    row_index.save(index_file, product_id=product_id, fits_file=output_name)
+            writer.close()
+            if spool is not None:
+                spool.seek(0)
+                shutil.copyfileobj(spool, output_file)
+            output_file.flush()
+
+        self.close_fits()
+
+        written = {
+            "nrows": writer.nrows,
+            "stats": writer.stats,
+            "footprint": footprint(writer.stats),
+            "cast_issues": plan.cast_issues,
+        }
+        if index_file:
+            written["sort_index"] = index_file
+        if joined:
+            written["join"] = layout.report
+        if fingerprint:
+            written["input_fingerprint"] = {
+                "header_fingerprint": layout.fingerprint(),
+                "nrows": layout.nrows,
+                "data_hash": data_hash.hexdigest(),
+                "row_filter": row_filter,
+                "sort_by": sort_by,
+                "column_mapping": load_column_mappings(product_id, self.column_mappings_path),
+            }
+        return written
+
+    def generate_catalog(self, product_id, input_fits_path, output_path=None, fitsDataModel_path=None, display_output=False, PAT=False,
+                         checksum=False, fingerprint=False, chunk_rows=None, row_filter=None, sort_by=None, sort_memory=None,
+                         sort_index=False, pipeline_depth=PIPELINE_DEPTH, processes=1, xml=True):
         """
         Generate the desired CATALOG (either 'POS' or 'SHEAR' or 'PROXYSHEAR') from the input FITS file.
+        The rows are converted and written in chunks, the input table is never loaded in memory as a whole.
 
         Parameters:
         -----------
         product_id : str
             The product_id of catalog to be genrated (either 'POS' or 'SHEAR' or 'PROXYSHEAR')
-        input_fits_path : str
-            Path of the input FITS file.
+        input_fits_path : str or list
+            Path(s) of the input FITS file(s), a list or a pattern of sub-tiles or HDUs (see conversion.parse_input_spec).
         display_output : bool, optional, default = False
             display the output after catalog generation (if set to True)
         output_path : str, optional, default = None
             path where the output catalog is to be saved
         fitsDataModel_path : str, optional, default = None
             optional argument to get the fitsDataModel xml of a Data Product
+        checksum : bool, optional, default = False
+            add the CHECKSUM and DATASUM cards to the output
+        fingerprint : bool, optional, default = False
+            hash the input table (header and data) so that the product can later be extended with append_catalog
+        chunk_rows : int, optional, default = None
+            number of rows converted at once (default : 16 MB worth of rows)
+        row_filter : str, optional, default = None
+            only keep the rows matching this expression over the input or renamed column names
+            (e.g. "WEIGHT > 0 and 20 < MAG < 24.5", see expressions.Expression). It is evaluated
+            on every chunk before the conversion, so only the selected rows are cast and written.
+            Only the input columns used by the catalog and the filter are read (all of them with fingerprint).
+        sort_by : str, optional, default = None
+            write the rows sorted by 'HEALPIX' (NESTED HEALPix index of the position) or by a numeric
+            column such as 'OBJECT_ID', with an external merge sort (see sorting.ExternalSorter)
+        sort_memory : int, optional, default = None
+            memory budget of the sort in bytes, the rows beyond it are spilled to disk (default : 256 MB)
+        sort_index : bool, optional, default = False
+            save the key range of every block of sorted rows as '<product_id>.sort_index.json'
+        pipeline_depth : int, optional, default = PIPELINE_DEPTH
+            number of chunks waiting between the reader, converter and writer stages, which run in
+            their own threads (0 reads, converts and writes one chunk after the other)
+        processes : int, optional, default = 1
+            number of processes converting the rows : every process converts a range of input rows and
+            writes it at its place in the preallocated output (see sharding.write_sharded). Not
+            available with row_filter, sort_by or fingerprint, which need the rows in a single stream.
+        xml : bool, optional, default = True
+            generate the XML file (see PAT) and register the product in the index once the fits file is
+            written. False when the caller does it itself (see example_run.run, which runs them concurrently)
+
+        Returns:
+        --------
+        result : dict
+            {'product_id', 'fits_file', 'nrows', 'stats', 'elapsed', 'cast_issues'} of the generated product
+            (and 'input_fingerprint' if requested), None if the generation failed. 'cast_issues' counts
+            the values clipped or cast with a warning per column (see conversion.check_cast).
+            When the XML is generated, 'xml_file' is its path and 'fits_file' the path of the fits file
+            renamed after it.
 
         """
         
@@ -220,177 +562,339 @@ class FitsProcessor:
                 print("Error: Please provide an output path to save the file. \n")
                 return
 
-            # generate the json data file from FitsDataModel xml
-            FitsFormat_ids = get_all_fits_format_ids(fitsDataModel_path=fitsDataModel_path)
+            index_file = output_path + f'{product_id}.sort_index.json' if sort_by and sort_index else None
+            output_dir = output_path
+            # the spill files go next to the product, output_path may be a directory or a name prefix
+            sort_dir = os.path.dirname(output_path) or "."
+            output_path = output_path + f'{product_id}.fits'
+            written = self.write_catalog(output_path, product_id, input_fits_path, fitsDataModel_path=fitsDataModel_path,
+                                         checksum=checksum, fingerprint=fingerprint, chunk_rows=chunk_rows,
+                                         row_filter=row_filter, sort_by=sort_by, sort_memory=sort_memory,
+                                         sort_dir=sort_dir, index_file=index_file, pipeline_depth=pipeline_depth,
+                                         processes=processes)
 
-            if product_id not in FitsFormat_ids:
-                raise ValueError(f"Provided catalog type '{product_id}' is not in the FitsDataModel. \nDid you mean to use one of these? \n{FitsFormat_ids}")
+            print(f"\033[1mFits file generated successfully and saved in '{output_dir}' dir  \( ﾟヮﾟ)/\033[0m \n")
 
-            extract_data_for_id(product_id, fitsDataModel_path=fitsDataModel_path)
+            if display_output:
+                print("To display output \n")
+                self.display_contents(input_fits_path=output_path)
+            
+            # create the XML file using the xmlgenerator.py logic
 
-            # access the input fits file
-            self.open_fits(input_fits_path)
+            xml_file = None
+            if xml and (not PAT or self.xml_renderer == "template"):
+                xml_file = self.create_xml(output_path, output_dir)
 
-            hdu = self.hdu_list[1]
-            primary_hdu = self.hdu_list[0]
-
-            # get the column names form the input catalog
-            if isinstance(hdu, fits.BinTableHDU):
-                columns = hdu.columns
-                # print(columns)
-                column_names = [col.name for col in columns]
-                # print(f"Columns in input : {column_names}")
-            else:
-                print("The specified HDU does not contain a binary table.")
-                return []
+            end_time = datetime.now()
             
-            # Rename specific columns for the 'proxyshear' product ID
-            if product_id == "le3.id.vmpz.output.proxyshearcatalog":
-                rename_map = {
-                    "SHE_RA": "RIGHT_ASCENSION",
-                    "SHE_DEC": "DECLINATION",
-                    "SHE_G1": "G1",
-                    "SHE_G2": "G2",
-                    "SHE_WEIGHT": "WEIGHT"
-                }
+            # calculate the time taken
+            elapsed_time = end_time - start_time
+            print(f"Execution time: {elapsed_time.total_seconds():.4f} seconds")
 
-                for old_name, new_name in rename_map.items():
-                    if old_name in column_names:
-                        # If the new name already exists, delete it
-                        if new_name in column_names:
-                            columns.del_col(new_name)
-                            column_names.remove(new_name)
-
-                        # Rename the column
-                        col_index = column_names.index(old_name)
-                        columns[col_index].name = new_name
-                        column_names[col_index] = new_name
-            
-            # Rename specific columns for the 'poscatalog' product ID
-            if product_id == "le3.id.vmpz.output.poscatalog":
-                rename_map = {
-                    "MER_RA": "RIGHT_ASCENSION",
-                    "MER_DEC": "DECLINATION",
-                    "PHZ_WEIGHT": "WEIGHT"
-                }
+            result = {
+                "product_id": product_id,
+                "fits_file": output_path,
+                **written,
+                "elapsed": elapsed_time.total_seconds(),
+            }
+            if xml_file is not None:
+                # the fits file is renamed after the xml file
+                result.update(xml_file=xml_file, fits_file=xml_file.replace(".xml", ".fits"))
+            if xml and self.product_index:
+                self.register_products([result], input_fits_path, fitsDataModel_path)
+            return result
 
-                for old_name, new_name in rename_map.items():
-                    if old_name in column_names:
-                        # If the new name already exists, delete it
-                        if new_name in column_names:
-                            columns.del_col(new_name)
-                            column_names.remove(new_name)
+        except Exception as e:
+            print(f"Error generating the catalog for {product_id} : {e} \n")
 
-                        # Rename the column
-                        col_index = column_names.index(old_name)
-                        columns[col_index].name = new_name
-                        column_names[col_index] = new_name
+    def stream_catalog(self, product_id, input_fits_path, output, fitsDataModel_path=None, **options):
+        """
+        Generate the CATALOG as generate_catalog does, but write the product fits to a binary file object
+        (pipe, socket, BytesIO, sys.stdout.buffer ...) so that it can be consumed without a round trip through
+        the disk. No XML is generated and the product is not registered in the product index.
 
+        Parameters:
+        -----------
+        product_id : str
+            The product_id of the catalog
+        input_fits_path : str or list
+            Path(s) of the input FITS file(s) (see conversion.parse_input_spec).
+        output : file object
+            Binary file object opened for writing, left open.
+        fitsDataModel_path : str, optional, default = None
+            optional argument to get the fitsDataModel xml of a Data Product
+        **options
+            checksum, fingerprint, chunk_rows, row_filter, sort_by, sort_memory, pipeline_depth
+            (see generate_catalog), and sort_dir (see write_catalog).
 
-            ## get the column info from the json file
-            json_file = f'./generated/extracted_data_{product_id}.json'
+        Returns:
+        --------
+        result : dict
+            {'product_id', 'nrows', 'stats', 'footprint', 'elapsed', 'cast_issues'} (and 'input_fingerprint' if requested)
 
-            with open(json_file, 'r') as file:
-                json_data = json.load(file)
-            
-            # extract the column list from the 'table_hdu' section
-            table_hdu_info = json_data.get("table_hdu", {})
-            columns_info = {}
-            
-            # check if 'columns' exists in the 'table_hdu'
-            if "columns" in table_hdu_info:
-                for column in table_hdu_info["columns"]:
-                    unit = column.get("unit")
-                    if unit == "NA" and (product_id == "le3.id.vmpz.output.poscatalog" or product_id == "le3.id.vmpz.output.proxyshearcatalog"):
-                        unit = None
-                    column_name = column.get("name")
-                    column_info = {
-                        "format": column.get("format"),
-                        "unit": unit,
-                        "comment": column.get("comment")
-                    }
-                    columns_info[column_name] = column_info
-
-
-            catalog_colnames = list(columns_info.keys()) #this is the order in which the columns should appear
-            # print(f"Columns required : {catalog_colnames}")
-
-
-            # convert both lists to set to count the frequency of each element
-            set_input = set(column_names)
-            set_catalog = set(catalog_colnames)
-            
-            # Elements missing from input
-            missing_from_input = list(set_catalog - set_input)
-            
-            # Excess elements in input
-            excess_in_input = list(set_input - set_catalog)
+        Raises:
+        -------
+        ValueError
+            If the input cannot be converted.
+        """
+        start_time = datetime.now()
+        written = self.write_catalog(output, product_id, input_fits_path, fitsDataModel_path=fitsDataModel_path, **options)
+        return {"product_id": product_id, **written, "elapsed": (datetime.now() - start_time).total_seconds()}
 
-            # print(f"Missing : {missing_from_input}")
-            # print(f"Excess : {excess_in_input}")
+    def catalog_hdulist(self, product_id, input_fits_path, fitsDataModel_path=None, **options):
+        """
+        Generate the CATALOG in memory and return it as an HDUList, e.g. to hand it over to the next
+        step of a Python pipeline. The whole product is held in memory.
 
-            # modify the columns (add/remove if required) and then order them according to the FitsDataModel xml [this is done in-memory]
-            for item in excess_in_input:
-                columns.del_col(item)
+        Parameters:
+        -----------
+        product_id : str
+            The product_id of the catalog
+        input_fits_path : str or list
+            Path(s) of the input FITS file(s) (see conversion.parse_input_spec).
+        fitsDataModel_path : str, optional, default = None
+            optional argument to get the fitsDataModel xml of a Data Product
+        **options
+            See stream_catalog.
 
-            length_rows = hdu.header['NAXIS2']
+        Returns:
+        --------
+        astropy.io.fits.HDUList
+            Primary HDU and catalog table of the product, byte for byte the fits generate_catalog writes.
+        """
+        buffer = io.BytesIO()
+        self.stream_catalog(product_id, input_fits_path, buffer, fitsDataModel_path=fitsDataModel_path, **options)
+        buffer.seek(0)
+        hdu_list = fits.open(buffer, lazy_load_hdus=False)
+        # the table is read out of the buffer, which can then be released
+        for hdu in hdu_list:
+            hdu.data
+        buffer.close()
+        return hdu_list
+
+    def generate_partitioned_catalog(self, product_id, input_fits_path, output_path=None, fitsDataModel_path=None, nside=8, PAT=False,
+                                     checksum=False, chunk_rows=None, row_filter=None, max_open_files=256):
+        """
+        Generate the CATALOG split by sky patch : every row is assigned the NESTED HEALPix pixel of its
+        RIGHT_ASCENSION / DECLINATION and written to the product of its pixel. Every tile gets its own XML,
+        whose spatial coverage is the footprint of its rows, and an index file maps the pixels to the products.
 
-            columns = self.check_column_properties(columns, columns_info)
+        Parameters:
+        -----------
+        product_id : str
+            The product_id of catalog to be genrated (either 'POS' or 'SHEAR' or 'PROXYSHEAR')
+        input_fits_path : str or list
+            Path(s) of the input FITS file(s), a list or a pattern of sub-tiles or HDUs (see conversion.parse_input_spec).
+        output_path : str, optional, default = None
+            path where the tiles and the index are to be saved
+        fitsDataModel_path : str, optional, default = None
+            optional argument to get the fitsDataModel xml of a Data Product
+        nside : int, optional, default = 8
+            HEALPix resolution of the tiles (a power of 2, 12 * nside**2 tiles over the sky)
+        PAT : bool, optional, default = False
+            only generate the fits tiles (the XML requires the EDEN environment)
+        checksum : bool, optional, default = False
+            add the CHECKSUM and DATASUM cards to the tiles
+        chunk_rows : int, optional, default = None
+            number of rows converted at once (default : 16 MB worth of rows)
+        row_filter : str, optional, default = None
+            only keep the rows matching this expression (see generate_catalog)
+        max_open_files : int, optional, default = 256
+            maximum number of tiles written at the same time
 
-            columns_to_add = []
-            for item in missing_from_input:
-                data = np.zeros(length_rows)
-                format = columns_info[item]['format']
-                unit = columns_info[item]['unit']
-                newcol = fits.Column(name=item, format=format, unit=unit, array=data)
-                columns_to_add.append(newcol)
+        Returns:
+        --------
+        result : dict
+            {'product_id', 'nside', 'index_file', 'nrows', 'tiles', 'elapsed', 'cast_issues'} where 'tiles' maps every
+            non-empty pixel to its {'fits_file', 'xml_file', 'nrows', 'footprint'}, None if the generation failed.
+        """
+        start_time = datetime.now()
 
-            # print(f"Columns to add : {[col.name for col in columns_to_add]}")
-            # print(f"Columns already present : {[col.name for col in columns]}")
+        try:
+            if output_path is None:
+                print("Error: Please provide an output path to save the file. \n")
+                return
 
-            # Combine existing and new columns
-            all_columns = fits.ColDefs(columns + columns_to_add)
+            from healpix import ang2pix_nested, check_nside, npix
+            check_nside(nside)
+            layout, plan, primary_hdu, table_header = self.prepare_conversion(product_id, input_fits_path, fitsDataModel_path)
+            row_mask = plan.compile_filter(row_filter) if row_filter else None
+            if "RIGHT_ASCENSION" not in plan.dtype.names or "DECLINATION" not in plan.dtype.names:
+                raise ValueError(f"{product_id} has no RIGHT_ASCENSION / DECLINATION columns to partition on.")
 
-            reordered_columns = [col for col_name in catalog_colnames
-                                for col in all_columns
-                                if col.name == col_name]
+            digits = len(str(npix(nside) - 1))
 
-            # Create a new HDU with the reordered columns
-            new_hdu = fits.BinTableHDU.from_columns(reordered_columns)
+            def tile_path(pixel):
+                return output_path + f"hpx{nside}-{pixel:0{digits}d}.{product_id}.fits"
 
-            table_hdu_info = json_data.get("table_hdu", {})
-            table_hdu_name = table_hdu_info.get("name")
+            writer = PartitionedWriter(tile_path, primary_hdu, table_header, checksum=checksum, max_open_files=max_open_files)
+            progress = Progress("partition", layout.nrows, self.progress, label=product_id)
+            for rows in convert_chunks(layout, plan, chunk_rows, columns=plan.input_columns(row_filter), row_mask=row_mask,
+                                       on_read=lambda chunk: progress.add(len(chunk), chunk.nbytes)):
+                writer.write_partitioned(ang2pix_nested(nside, rows["RIGHT_ASCENSION"], rows["DECLINATION"]), rows)
+            progress.close()
+            partitions = writer.close()
 
-            new_hdu.header['EXTNAME'] = table_hdu_name
+            self.close_fits()
 
-            self.process_header(primary_hdu.header, json_data.get("generic_hdu", [])["header_keywords"])
-            self.process_header(new_hdu.header, json_data.get("table_hdu", [])["header_keywords"])
+            print(f"\033[1m{len(partitions)} tiles (NSIDE={nside}) generated and saved in '{output_path}' dir\033[0m \n")
+
+            xml = not PAT or self.xml_renderer == "template"
+            if xml:
+                # in-process, the xml bindings (or templates) are imported once for all the tiles
+                try:
+                    if self.xml_renderer == "template":
+                        import xmltemplate as renderer
+                    else:
+                        import xmlgenerator as renderer
+                    header_defaults = renderer.load_header_defaults()
+                except ImportError as e:
+                    print(f" NOTE: XML generation of the tiles skipped, the EDEN environment is not available ({e}).\n")
+                    xml = False
+
+            tiles = {}
+            for pixel, (fits_file, tile_writer) in partitions.items():
+                tiles[pixel] = {
+                    "fits_file": fits_file,
+                    "xml_file": None,
+                    "nrows": tile_writer.nrows,
+                    "footprint": footprint(tile_writer.stats),
+                }
+            if xml:
+                # the header and catalog description are shared by the tiles, serialised on a thread pool
+                xml_files = renderer.main_batch([tile["fits_file"] for tile in tiles.values()], output_path,
+                                                header_defaults=header_defaults,
+                                                instance_ids=[f"HPX{nside}-{pixel}" for pixel in tiles],
+                                                footprints=[tile["footprint"] for tile in tiles.values()])
+                for tile, xml_file in zip(tiles.values(), xml_files):
+                    if xml_file is not None:
+                        tile.update(xml_file=xml_file, fits_file=xml_file.replace(".xml", ".fits"))
+
+            index_file = output_path + f"{product_id}.hpx{nside}.index.json"
+            index = {
+                "product_id": product_id,
+                "input_fits_path": input_fits_path,
+                "nside": nside,
+                "ordering": "NESTED",
+                "coordinates": ["RIGHT_ASCENSION", "DECLINATION"],
+                "nrows": sum(tile["nrows"] for tile in tiles.values()),
+                "tiles": {str(pixel): tile for pixel, tile in tiles.items()},
+            }
+            with open(index_file, "w") as file:
+                json.dump(index, file, indent=4)
+
+            elapsed_time = datetime.now() - start_time
+            print(f"Index of the tiles saved as '{index_file}'")
+            print(f"Execution time: {elapsed_time.total_seconds():.4f} seconds")
 
-            # print(new_hdu)
-  
-            output_hdu = fits.HDUList([primary_hdu, new_hdu])
-            output_path = output_path + f'{product_id}.fits'
-            output_hdu.writeto(output_path, overwrite=True)
+            if self.product_index:
+                self.register_products([dict(tile, product_id=product_id, nside=nside, pixel=pixel)
+                                        for pixel, tile in tiles.items()], input_fits_path, fitsDataModel_path)
 
-            self.close_fits()
-            del self.hdu_list
+            return {
+                "product_id": product_id,
+                "nside": nside,
+                "index_file": index_file,
+                "nrows": index["nrows"],
+                "tiles": tiles,
+                "elapsed": elapsed_time.total_seconds(),
+                "cast_issues": plan.cast_issues,
+            }
 
-            print(f"\033[1mFits file generated successfully and saved in './generated/' dir  \( ﾟヮﾟ)/\033[0m \n")
+        except Exception as e:
+            print(f"Error generating the tiles of {product_id} : {e} \n")
 
-            if display_output:
-                print("To display output \n")
-                self.display_contents(input_fits_path=output_path)
-            
-            # create the XML file using the xmlgenerator.py logic
+    def append_catalog(self, product_id, input_fits_path, output_fits_path, previous, fitsDataModel_path=None, chunk_rows=None):
+        """
+        Extend a product generated by generate_catalog with the rows appended to its input since then.
+        The input must be an extension of the converted one : same table header (apart from NAXIS2
+        and the checksums) and the same first rows. Only the new rows are converted and written
+        at the end of the product, whose NAXIS2, DATASUM and CHECKSUM are updated (on a copy that
+        replaces the product once complete, see conversion.append_rows).
 
-            if not PAT:
-                self.create_xml(output_path)
+        Parameters:
+        -----------
+        product_id : str
+            The product_id of the catalog
+        input_fits_path : str or list
+            Path(s) of the extended input FITS file(s), only the last HDU may have grown.
+        output_fits_path : str
+            Path of the product to extend.
+        previous : dict
+            'input_fingerprint' (and optionally 'nrows' and 'stats') returned by generate_catalog when the
+            product was generated. The row filter of the product, if any, is applied to the new rows.
+        fitsDataModel_path : str, optional, default = None
+            optional argument to get the fitsDataModel xml of a Data Product
+        chunk_rows : int, optional, default = None
+            number of rows converted at once (default : 64 MB worth of rows)
 
-            end_time = datetime.now()
-            
-            # calculate the time taken
-            elapsed_time = end_time - start_time
-            print(f"Execution time: {elapsed_time.total_seconds():.4f} seconds")
+        Returns:
+        --------
+        result : dict
+            Same as generate_catalog, with 'appended' the number of new rows.
 
-        except Exception as e:
-            print(f"Error generating the catalog for {product_id} : {e} \n")
+        Raises:
+        -------
+        ValueError
+            If the input is not an extension of the converted one or if the product is sorted.
+        """
+        start_time = datetime.now()
+        old_fingerprint = previous["input_fingerprint"]
+
+        layout = open_input(input_fits_path)
+        if layout.fingerprint() != old_fingerprint["header_fingerprint"]:
+            raise ValueError(f"'{input_fits_path}' does not have the same table header as the converted input.")
+        if layout.nrows < old_fingerprint["nrows"]:
+            raise ValueError(f"'{input_fits_path}' has fewer rows than the converted input.")
+        row_filter = old_fingerprint.get("row_filter")
+        mapping = load_column_mappings(product_id, self.column_mappings_path)
+        if old_fingerprint.get("column_mapping", mapping) != mapping:
+            raise ValueError(f"The column mapping of {product_id} changed since '{output_fits_path}' was generated.")
+        if old_fingerprint.get("sort_by"):
+            raise ValueError(f"'{output_fits_path}' is sorted by {old_fingerprint['sort_by']}, appended rows would break its order.")
+
+        # the first rows must be the converted ones
+        data_hash = hashlib.sha256()
+        for chunk in layout.iter_chunks(chunk_rows, stop=old_fingerprint["nrows"]):
+            data_hash.update(chunk)
+        if data_hash.hexdigest() != old_fingerprint["data_hash"]:
+            raise ValueError(f"The first {old_fingerprint['nrows']} rows of '{input_fits_path}' differ from the converted input.")
+
+        _, columns_info = self.load_schema(product_id, fitsDataModel_path=fitsDataModel_path)
+        plan = ConversionPlan(layout, columns_info, mapping=mapping, cast_policy=self.cast_policy)
+        # the new rows go through the same filter as the converted ones
+        row_mask = plan.compile_filter(row_filter) if row_filter else None
+
+        progress = Progress("append", layout.nrows - old_fingerprint["nrows"], self.progress, label=product_id)
+
+        def new_chunks():
+            for chunk in layout.iter_chunks(chunk_rows, start=old_fingerprint["nrows"]):
+                data_hash.update(chunk)
+                progress.add(len(chunk), chunk.nbytes)
+                yield chunk if row_mask is None else chunk[row_mask(chunk)]
+
+        old_rows = previous.get("nrows", old_fingerprint["nrows"])
+        nrows, stats = append_rows(output_fits_path, plan, new_chunks(), stats=previous.get("stats"))
+        progress.close()
+
+        elapsed_time = datetime.now() - start_time
+        print(f"\033[1mAppended {nrows - old_rows} rows to '{output_fits_path}'\033[0m \n")
+        print(f"Execution time: {elapsed_time.total_seconds():.4f} seconds")
+
+        return {
+            "product_id": product_id,
+            "fits_file": output_fits_path,
+            "nrows": nrows,
+            "appended": nrows - old_rows,
+            "stats": stats,
+            "footprint": footprint(stats),
+            "elapsed": elapsed_time.total_seconds(),
+            "cast_issues": plan.cast_issues,
+            "input_fingerprint": {
+                "header_fingerprint": old_fingerprint["header_fingerprint"],
+                "nrows": layout.nrows,
+                "data_hash": data_hash.hexdigest(),
+                "row_filter": row_filter,
+                "column_mapping": mapping,
+            },
+        }
@@ -0,0 +1,135 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, wait
+
+from conversion import ConversionPlan, convert_chunks, ones_complement_sum, open_input, update_statistics
+
+# below this number of rows per process, the start of the processes costs more than it saves
+MIN_SHARD_ROWS = 100000
+
+# rows converted by all the processes, shared with them when the progress is reported
+_rows_done = None
+
+def _share_rows_done(counter):
+    global _rows_done
+    _rows_done = counter
+
+def shard_ranges(nrows, shards):
+    """
+    Split the rows of a table into contiguous ranges of (almost) the same size.
+
+    Parameters:
+    -----------
+    nrows : int
+        Number of rows.
+    shards : int
+        Number of ranges.
+
+    Returns:
+    --------
+    list of (start, stop) tuples
+    """
+    shards = max(1, min(shards, nrows))
+    bounds = [nrows * i // shards for i in range(shards + 1)]
+    return [(start, stop) for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+
+def convert_shard(task):
+    """
+    Convert a range of input rows and write them at their place in the preallocated output file.
+    Runs in a worker process : the input is reopened and the conversion plan rebuilt from the task.
+
+    Parameters:
+    -----------
+    task : dict
+        {'input_fits_path', 'columns_info', 'mapping', 'cast_policy', 'start', 'stop',
+         'output_path', 'data_offset', 'chunk_rows', 'checksum'}
+
+    Returns:
+    --------
+    dict
+        {'start', 'nrows', 'datasum', 'stats', 'cast_issues'} of the range
+    """
+    layout = open_input(task["input_fits_path"])
+    plan = ConversionPlan(layout, task["columns_info"], mapping=task["mapping"], cast_policy=task["cast_policy"])
+    offset = task["start"] * plan.dtype.itemsize
+    datasum = 0
+    stats = {}
+    nrows = 0
+    with open(task["output_path"], "r+b") as file:
+        file.seek(task["data_offset"] + offset)
+        # the processes already keep the cores busy, the chunks are converted one after the other
+        for rows in convert_chunks(layout, plan, task["chunk_rows"], columns=plan.input_columns(), depth=0,
+                                   start=task["start"], stop=task["stop"]):
+            data = rows.view("u1").reshape(-1)
+            if task["checksum"]:
+                datasum = ones_complement_sum(data, datasum, offset)
+            file.write(data)
+            update_statistics(stats, rows)
+            offset += data.nbytes
+            nrows += len(rows)
+            if _rows_done is not None:
+                with _rows_done.get_lock():
+                    _rows_done.value += len(rows)
+    return {"start": task["start"], "nrows": nrows, "datasum": datasum, "stats": stats, "cast_issues": plan.cast_issues}
+
+def write_sharded(writer, input_fits_path, plan, processes, chunk_rows=None, progress=None):
+    """
+    Convert the rows of the input with several processes : the output file is preallocated (the
+    row width is fixed, so every range of input rows has a fixed place in it) and every process
+    converts a range of rows and writes it in place. The checksums, statistics and cast issues of
+    the ranges are then merged into the writer, which is left to be closed by the caller.
+
+    Parameters:
+    -----------
+    writer : conversion.TableWriter
+        Writer of the output, whose headers are written and NAXIS2 set to the number of input rows.
+    input_fits_path : str or list
+        Input specification (see conversion.parse_input_spec), reopened by every process.
+    plan : conversion.ConversionPlan
+        Conversion of the input rows (rebuilt by every process).
+    processes : int
+        Number of processes.
+    chunk_rows : int, optional, default = None
+        Number of rows converted at once by every process.
+    progress : progress.Progress, optional, default = None
+        Progress of the conversion, updated with the rows done by all the processes.
+    """
+    nrows = plan.layout.nrows
+    shards = shard_ranges(nrows, min(processes, max(1, nrows // MIN_SHARD_ROWS)))
+
+    # the rows are written in place : the file is extended to its final size first
+    data_bytes = nrows * plan.dtype.itemsize
+    writer.fileobj.flush()
+    os.truncate(writer.fileobj.name, writer.data_offset + data_bytes)
+
+    tasks = [{
+        "input_fits_path": input_fits_path,
+        "columns_info": plan.columns_info,
+        "mapping": plan.mapping,
+        "cast_policy": plan.cast_policy,
+        "start": start,
+        "stop": stop,
+        "output_path": writer.fileobj.name,
+        "data_offset": writer.data_offset,
+        "chunk_rows": chunk_rows,
+        "checksum": writer.checksum,
+    } for start, stop in shards]
+
+    counter = multiprocessing.Value("q", 0) if progress is not None else None
+    with ProcessPoolExecutor(max_workers=len(tasks), initializer=_share_rows_done if counter is not None else None,
+                             initargs=(counter,) if counter is not None else ()) as executor:
+        futures = [executor.submit(convert_shard, task) for task in tasks]
+        if counter is not None:
+            # the counter shared with the processes is polled while they convert their ranges
+            row_bytes = plan.layout.chunk_dtype(plan.input_columns()).itemsize
+            while wait(futures, timeout=progress.interval).not_done:
+                progress.set(counter.value, counter.value * row_bytes)
+            progress.set(counter.value, counter.value * row_bytes)
+        results = [future.result() for future in futures]
+
+    for result in results:
+        writer.add_written(result["nrows"], result["datasum"], result["stats"])
+        for name, issues in result["cast_issues"].items():
+            total = plan.cast_issues.setdefault(name, {})
+            for issue, count in issues.items():
+                total[issue] = total.get(issue, 0) + count
@@ -0,0 +1,298 @@
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from healpix import ang2pix_nested, check_nside
+
+# default memory budget of the sort (rows kept in memory before they are spilled to disk)
+SORT_MEMORY_BYTES = 256 * 1024 * 1024
+
+# NSIDE of the HEALPix sort key : the NESTED index at a fine resolution is a
+# space-filling curve, close rows on the sky end up close in the file
+SORT_NSIDE = 2**16
+
+# sort key computed from the positions instead of a column
+HEALPIX_KEY = "HEALPIX"
+
+def sort_keys(rows, sort_by, nside=SORT_NSIDE):
+    """
+    Sort key of every row of a chunk.
+
+    Parameters:
+    -----------
+    rows : numpy structured array
+        Output rows.
+    sort_by : str
+        'HEALPIX' (NESTED HEALPix index of RIGHT_ASCENSION / DECLINATION) or the name of a numeric column (e.g. 'OBJECT_ID').
+    nside : int, optional, default = SORT_NSIDE
+        Resolution of the HEALPix key.
+
+    Returns:
+    --------
+    numpy array of native int64 or float64 keys
+    """
+    if sort_by.upper() == HEALPIX_KEY:
+        return ang2pix_nested(nside, rows["RIGHT_ASCENSION"], rows["DECLINATION"])
+    values = rows[sort_by]
+    if values.dtype.kind in "iub":
+        return values.astype(np.int64)
+    return values.astype(np.float64)
+
+def check_sort_key(dtype, sort_by, nside=SORT_NSIDE):
+    """
+    Check that the rows of this type can be sorted by this key.
+
+    Parameters:
+    -----------
+    dtype : numpy.dtype
+        Type of the output rows.
+    sort_by : str
+        Sort key (see sort_keys).
+    nside : int, optional, default = SORT_NSIDE
+        Resolution of the HEALPix key.
+    """
+    if sort_by.upper() == HEALPIX_KEY:
+        check_nside(nside)
+        if "RIGHT_ASCENSION" not in dtype.names or "DECLINATION" not in dtype.names:
+            raise ValueError("Sorting by HEALPix index requires the RIGHT_ASCENSION and DECLINATION columns.")
+        return
+    if sort_by not in dtype.names:
+        raise ValueError(f"Unknown sort column '{sort_by}'. Available columns: {list(dtype.names)} or '{HEALPIX_KEY}'.")
+    if dtype[sort_by].shape or dtype[sort_by].kind not in "iubf":
+        raise ValueError(f"Cannot sort by '{sort_by}': only numeric scalar columns can be used as sort keys.")
+
+def key_order(key):
+    """
+    Position of a sort key in the order of numpy's sorts, where the NaN keys come after all the
+    numbers (a NaN compares as neither smaller nor larger than a number).
+    """
+    if np.isnan(key):
+        return (1, 0.0)
+    return (0, key)
+
+class ExternalSorter:
+    """
+    Sorts a stream of rows larger than the memory budget : the rows are buffered and, whenever
+    the buffer is full, sorted and spilled to a run file on disk. The runs are then merged in
+    vectorized batches, reading at most a budget's worth of rows at a time.
+
+    Rows are ordered by (key, input position), so the sort is stable. Rows with a NaN key come
+    last, as in numpy's sorts.
+    """
+
+    def __init__(self, dtype, sort_by, nside=SORT_NSIDE, memory_bytes=SORT_MEMORY_BYTES, tmp_dir=None):
+        """
+        Parameters:
+        -----------
+        dtype : numpy.dtype
+            Type of the rows.
+        sort_by : str
+            Sort key (see sort_keys).
+        nside : int, optional, default = SORT_NSIDE
+            Resolution of the HEALPix key.
+        memory_bytes : int, optional, default = SORT_MEMORY_BYTES
+            Memory budget of the rows held by the sort.
+        tmp_dir : str, optional, default = None
+            Directory of the spill files (default : the system temporary directory).
+        """
+        check_sort_key(dtype, sort_by, nside)
+        self.dtype = dtype
+        self.sort_by = sort_by
+        self.nside = nside
+        self.memory_bytes = memory_bytes
+        self.tmp_dir = tmp_dir
+        self.spill_dir = None
+        self.runs = []
+        self.buffer = []
+        self.buffered_rows = 0
+        self.nrows = 0
+        self.record_dtype = None
+
+    def _records(self, rows):
+        keys = sort_keys(rows, self.sort_by, self.nside)
+        if self.record_dtype is None:
+            self.record_dtype = np.dtype([("key", keys.dtype), ("seq", np.int64), ("row", self.dtype)])
+        records = np.empty(len(rows), dtype=self.record_dtype)
+        records["key"] = keys
+        records["seq"] = np.arange(self.nrows, self.nrows + len(rows))
+        records["row"] = rows
+        return records
+
+    def _budget_rows(self):
+        itemsize = self.record_dtype.itemsize if self.record_dtype is not None else self.dtype.itemsize
+        return max(1, self.memory_bytes // itemsize)
+
+    def add(self, rows):
+        """
+        Add a chunk of rows to sort.
+
+        Parameters:
+        -----------
+        rows : numpy structured array
+            Rows of type self.dtype.
+        """
+        if len(rows) == 0:
+            return
+        self.buffer.append(self._records(rows))
+        self.buffered_rows += len(rows)
+        self.nrows += len(rows)
+        if self.buffered_rows >= self._budget_rows():
+            self._spill()
+
+    def _sorted_buffer(self):
+        # the dtype is given so that the rows keep their on-disk (big-endian) byte order
+        records = np.concatenate(self.buffer, dtype=self.record_dtype) if len(self.buffer) > 1 else self.buffer[0]
+        self.buffer = []
+        self.buffered_rows = 0
+        # the records are already in input order, a stable sort on the key is enough
+        return records[np.argsort(records["key"], kind="stable")]
+
+    def _spill(self):
+        if self.spill_dir is None:
+            self.spill_dir = tempfile.mkdtemp(prefix="fitsprocessor-sort-", dir=self.tmp_dir)
+        path = os.path.join(self.spill_dir, f"run-{len(self.runs):05d}.bin")
+        records = self._sorted_buffer()
+        records.tofile(path)
+        self.runs.append((path, len(records)))
+
+    def sorted_chunks(self):
+        """
+        Iterate over all the added rows in sorted order. The spill files are removed at the end.
+
+        Returns:
+        --------
+        Generator of (keys, rows) chunks, the rows of type self.dtype
+        """
+        try:
+            if not self.runs:
+                if self.buffer:
+                    records = self._sorted_buffer()
+                    for start in range(0, len(records), self._budget_rows()):
+                        block = records[start:start + self._budget_rows()]
+                        yield block["key"], block["row"]
+                return
+
+            if self.buffer:
+                self._spill()
+            yield from self._merge()
+        finally:
+            self.cleanup()
+
+    def _merge(self):
+        # every run is read through a memory map, one block at a time
+        block_rows = max(1, self._budget_rows() // (len(self.runs) + 1))
+        runs = [np.memmap(path, dtype=self.record_dtype, mode="r", shape=(nrows,)) for path, nrows in self.runs]
+        positions = [0] * len(runs)
+        blocks = [np.array(run[:block_rows]) for run in runs]
+        for i, block in enumerate(blocks):
+            positions[i] = len(block)
+
+        while True:
+            active = [i for i, block in enumerate(blocks) if len(block)]
+            if not active:
+                break
+
+            # every row up to the smallest last (key, seq) of the blocks of the unfinished runs
+            # is smaller than all the rows still on disk
+            bounds = [(blocks[i]["key"][-1], blocks[i]["seq"][-1]) for i in active if positions[i] < len(runs[i])]
+            if bounds:
+                key, seq = min(bounds, key=lambda bound: (key_order(bound[0]), bound[1]))
+            else:
+                key, seq = None, None
+
+            selected = []
+            for i in active:
+                block = blocks[i]
+                if key is None:
+                    count = len(block)
+                elif np.isnan(key):
+                    # a NaN bound : all the numbers and the NaN keys up to its seq
+                    count = int(np.count_nonzero(~np.isnan(block["key"]) | (block["seq"] <= seq)))
+                else:
+                    count = int(np.count_nonzero((block["key"] < key) | ((block["key"] == key) & (block["seq"] <= seq))))
+                selected.append(block[:count])
+                blocks[i] = block[count:]
+                if len(blocks[i]) == 0 and positions[i] < len(runs[i]):
+                    blocks[i] = np.array(runs[i][positions[i]:positions[i] + block_rows])
+                    positions[i] += len(blocks[i])
+
+            records = np.concatenate(selected, dtype=self.record_dtype)
+            records = records[np.lexsort((records["seq"], records["key"]))]
+            if len(records):
+                yield records["key"], records["row"]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.cleanup()
+
+    def cleanup(self):
+        """
+        Remove the spill files.
+        """
+        if self.spill_dir is not None:
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
+            self.spill_dir = None
+        self.runs = []
+
+class RowRangeIndex:
+    """
+    Key range covered by every block of consecutive rows of a sorted catalog, so that a
+    region query only reads the blocks whose range intersects the region.
+    """
+
+    def __init__(self, sort_by, block_rows=10000, nside=SORT_NSIDE):
+        """
+        Parameters:
+        -----------
+        sort_by : str
+            Sort key of the catalog (see sort_keys).
+        block_rows : int, optional, default = 10000
+            Number of rows of a block.
+        nside : int, optional, default = SORT_NSIDE
+            Resolution of the HEALPix key.
+        """
+        self.sort_by = sort_by
+        self.block_rows = block_rows
+        self.nside = nside
+        self.blocks = []
+        self.nrows = 0
+
+    def update(self, keys):
+        """
+        Record the keys of the next sorted rows written to the catalog.
+        """
+        start = 0
+        while start < len(keys):
+            if not self.blocks or self.blocks[-1]["stop"] - self.blocks[-1]["start"] >= self.block_rows:
+                self.blocks.append({"start": self.nrows, "stop": self.nrows, "key_min": keys[start].item(), "key_max": None})
+            block = self.blocks[-1]
+            count = min(len(keys) - start, self.block_rows - (block["stop"] - block["start"]))
+            block["stop"] += count
+            block["key_max"] = keys[start + count - 1].item()
+            self.nrows += count
+            start += count
+
+    def to_dict(self):
+        index = {"sort_by": self.sort_by, "nrows": self.nrows, "block_rows": self.block_rows, "blocks": self.blocks}
+        if self.sort_by.upper() == HEALPIX_KEY:
+            index.update(nside=self.nside, ordering="NESTED")
+        return index
+
+    def save(self, path, **extra):
+        """
+        Save the index as a JSON file.
+
+        Parameters:
+        -----------
+        path : str
+            Path of the index file.
+        extra : dict
+            Additional keys of the index (e.g. the fits file).
+        """
+        with open(path, "w") as file:
+            json.dump({**extra, **self.to_dict()}, file, indent=4)
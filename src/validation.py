@@ -1,3 +1,4 @@
+import os
 import warnings
 import yaml
 
@@ -11,6 +12,9 @@ from ST_DM_CheckFitsStructure.common import (
 from ST_DM_CheckFitsStructure.validator import FitsValidator
 from ST_DM_FitsSchema.SchemaApi import get_dm_schema_file_path
 
+# data model version of the xml validation
+DM_VERSION = "10.1.3"
+
 def validate_xml(xml_file_name, dm_version="10.1.1"):
     """
     Validate XML file against LE3-ID XML DM
@@ -75,17 +79,35 @@ def validate_fits(fits_file_name, format_id):
 
     return bad_results
 
-# saving the xml file path in the yaml file
-config_file = "./src/config/XmlHeaderDetails.yaml"
-with open(config_file, 'r') as file:
-    data = yaml.safe_load(file)
+def main(xml_file=None, fits_file=None, product_id=None, dm_version=DM_VERSION):
+    """
+    Validate the generated xml and fits files.
+
+    Parameters:
+    ----------
+    xml_file : str, optional
+        XML file to validate. Defaults to 'xml_filepath' in 'src/config/XmlHeaderDetails.yaml'
+    fits_file : str, optional
+        Fits file to validate. Defaults to 'fits_filepath' in 'src/config/XmlHeaderDetails.yaml'
+    product_id : str, optional
+        Format ID of the fits file. Defaults to 'product_id' in 'src/config/XmlHeaderDetails.yaml'
+    dm_version : str
+        Data model version to be used for the xml validation
+    """
+    # reading the last generated products from the yaml file
+    config_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config", "XmlHeaderDetails.yaml")
+    with open(config_file, 'r') as file:
+        data = yaml.safe_load(file)
+
+    xml_file = xml_file or data.get("xml_filepath", None)
+    fits_file = fits_file or data.get("fits_filepath", None)
+    product_id = product_id or data.get("product_id", None)
 
-xml_file = data.get("xml_filepath", None)
-fits_file = data.get("fits_filepath", None)
-product_id = data.get("product_id", None)
+    print(f"\nValidating XML file: {xml_file}\n")
+    validate_xml(xml_file, dm_version)
 
-print(f"\nValidating XML file: {xml_file}\n")
-validate_xml(xml_file, "10.1.3")
+    print(f"\nValidating FITS file: {fits_file}\n")
+    validate_fits_warns(fits_file, product_id)
 
-print(f"\nValidating FITS file: {fits_file}\n")
-validate_fits_warns(fits_file, product_id)
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,326 @@
+import json
+import os
+import shutil
+import socket
+import socketserver
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from helpers import load_fits_data_model
+
+# A job is a JSON object :
+# {
+#     "id": "optional job name",
+#     "input_fits_path": "raw/sim.fits",  (or a list / pattern of inputs merged into one product, or
+#                                           {"join": ["mer.fits", "phz.fits", "she.fits"], "key": "OBJECT_ID", "how": "inner"}
+#                                           for inputs joined on a key column)
+#     "product_ids": ["le3.id.vmpz.output.poscatalog", "le3.id.vmpz.output.shearcatalog"],
+#     "output_dir": "./generated/",
+#     "output_name": "tile",  (optional, without XML the products are named '<output_name>.<product_id>.fits',
+#                               default : the input name; may contain sub-directories of the output dir)
+#     "fits_data_model": "optional path, defaults to the one preloaded by the worker",
+#     "checksum": false,     (optional, add the CHECKSUM and DATASUM cards)
+#     "fingerprint": false,  (optional, hash the input so that the products can be appended to)
+#     "row_filter": "WEIGHT > 0",  (optional, only keep the rows matching the expression)
+#     "sort_by": "HEALPIX",  (optional, write the rows sorted by HEALPix index or by a column)
+#     "column_mappings": "src/config/column_mappings.yaml",  (optional, renames and derived columns)
+#     "processes": 1,        (optional, number of processes converting row ranges of the input)
+#     "cast_policy": "error",  (optional, 'error', 'clip' or 'warn' for the values that do not survive a cast)
+#     "progress": "log",     (optional, report the progress of the conversions as JSON lines on stderr, default 'none')
+#     "product_index": true    (optional, SQLite index the products are registered in : a path, true for
+#                               '<output_dir>/product_index.sqlite' (default) or false)
+# }
+
+class Worker:
+    """
+    Long-running worker that preloads the FitsDataModel, the xml serializer and the
+    header defaults once and then converts the submitted jobs on a bounded thread pool.
+    """
+
+    def __init__(self, fitsDataModel_path=None, max_workers=4, xml=True, xml_renderer="eden"):
+        """
+        Parameters:
+        -----------
+        fitsDataModel_path : str, optional, default = None
+            FitsDataModel xml used by the jobs that do not provide one.
+        max_workers : int, optional, default = 4
+            Maximum number of jobs converted at the same time.
+        xml : bool, optional, default = True
+            Generate the XML of the products.
+        xml_renderer : str, optional, default = "eden"
+            'eden' (xsdata bindings, requires the EDEN environment) or 'template' (precompiled templates).
+        """
+        self.fitsDataModel_path = fitsDataModel_path
+        self.max_workers = max_workers
+        self.xml = xml
+        self.xml_renderer = xml_renderer
+        self.xmlgenerator = None
+        self.header_defaults = None
+        self.executor = None
+
+    def preload(self):
+        """
+        Load everything that the jobs have in common : the DM registry, the conversion
+        code and, if XML is requested, the xsdata bindings, serializer and header defaults.
+        """
+        start = time.perf_counter()
+
+        load_fits_data_model(self.fitsDataModel_path)
+
+        # importing here keeps the start of the worker process itself light
+        import script
+
+        if self.xml:
+            try:
+                if self.xml_renderer == "template":
+                    import xmltemplate as xmlgenerator
+                else:
+                    import xmlgenerator
+                    xmlgenerator.get_serializer()
+                self.header_defaults = xmlgenerator.load_header_defaults()
+                self.xmlgenerator = xmlgenerator
+            except ImportError as e:
+                print(f" NOTE: XML generation disabled, the EDEN environment is not available ({e}).\n")
+                self.xml = False
+
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        print(f"\033[1mWorker ready in {time.perf_counter() - start:.4f} seconds ({self.max_workers} slots)\033[0m \n")
+
+    def shutdown(self):
+        """
+        Wait for the running jobs and release the thread pool.
+        """
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+    def submit(self, job):
+        """
+        Queue a job on the thread pool.
+
+        Parameters:
+        -----------
+        job : dict
+            Job description (see the top of this module).
+
+        Returns:
+        --------
+        concurrent.futures.Future resolving to the job report (see run_job)
+        """
+        return self.executor.submit(self.run_job, job)
+
+    def run_job(self, job, run_id=None, keep_outputs=None):
+        """
+        Convert all the products of a job.
+
+        Parameters:
+        -----------
+        job : dict
+            Job description (see the top of this module).
+        run_id : str, optional, default = None
+            Name of this run of the job in the name of its staging dir (default : a random one), so that
+            two runs of the same job never share it.
+        keep_outputs : callable, optional, default = None
+            Called before the outputs of every product are published : if it returns False this run was
+            superseded (e.g. its batch claim was taken over), its outputs are dropped and not registered.
+
+        Returns:
+        --------
+        report : dict
+            {'id', 'status', 'latency', 'products': [...]} where every product has
+            its 'product_id', 'status' ('done', 'failed' or 'dropped'), 'fits_file', 'xml_file' and 'latency'
+            in seconds (and 'nrows', 'stats', 'footprint', 'cast_issues', 'input_fingerprint' when it is generated).
+        """
+        from script import FitsProcessor
+        from product_index import resolve_index_path, register_result
+        from helpers import get_fits_format_version
+
+        start = time.perf_counter()
+        job_id = job.get("id") or uuid.uuid4().hex
+        run_id = run_id or uuid.uuid4().hex[:8]
+        output_dir = job.get("output_dir", "./generated/")
+        if not output_dir.endswith(os.sep):
+            output_dir += os.sep
+        fitsDataModel_path = job.get("fits_data_model", self.fitsDataModel_path)
+        index_path = resolve_index_path(job.get("product_index"), output_dir)
+
+        report = {"id": job_id, "products": []}
+        for product_id in job.get("product_ids", []):
+            if report["products"] and report["products"][-1]["status"] == "dropped":
+                # the run was superseded, its next products are left to the run that replaced it
+                report["products"].append({"product_id": product_id, "status": "dropped", "fits_file": None,
+                                           "xml_file": None, "latency": 0.0})
+                continue
+            product_start = time.perf_counter()
+
+            # every run of a job converts in its own staging dir so that concurrent jobs (or two runs
+            # of the same job) of the same product do not overwrite each other's '<product_id>.fits'
+            staging_dir = os.path.join(output_dir, f".staging-{job_id}-{run_id}", "")
+            os.makedirs(staging_dir, exist_ok=True)
+
+            # the XML is generated below with the preloaded bindings instead of a subprocess
+            result = FitsProcessor(column_mappings_path=job.get("column_mappings"),
+                                   cast_policy=job.get("cast_policy", "error"),
+                                   progress=job.get("progress", "none")).generate_catalog(
+                product_id=product_id,
+                input_fits_path=job["input_fits_path"],
+                fitsDataModel_path=fitsDataModel_path,
+                output_path=staging_dir,
+                PAT=True,
+                checksum=job.get("checksum", False),
+                fingerprint=job.get("fingerprint", False),
+                row_filter=job.get("row_filter"),
+                sort_by=job.get("sort_by"),
+                processes=job.get("processes", 1),
+            )
+
+            product = {"product_id": product_id, "status": "failed", "fits_file": None, "xml_file": None}
+            if result is not None:
+                for key in ("nrows", "stats", "footprint", "cast_issues", "input_fingerprint", "join"):
+                    if key in result:
+                        product[key] = result[key]
+                if keep_outputs is not None and not keep_outputs():
+                    # a superseded run leaves the output dir and the index to the run that replaced it
+                    product["status"] = "dropped"
+                elif self.xml:
+                    xml_file = self.xmlgenerator.main(result["fits_file"], output_dir, header_defaults=self.header_defaults)
+                    if xml_file is not None:
+                        product.update(status="done", xml_file=xml_file, fits_file=xml_file.replace(".xml", ".fits"))
+                else:
+                    # prefixed with the input name so that the jobs of different inputs do not collide
+                    input_name = job.get("output_name")
+                    if input_name is None:
+                        input_path = job["input_fits_path"]
+                        if isinstance(input_path, dict):
+                            input_path = input_path["join"]
+                        input_path = input_path if isinstance(input_path, str) else input_path[0]
+                        input_name = os.path.basename(input_path).split(".fits")[0]
+                    fits_file = os.path.join(output_dir, f"{input_name}.{os.path.basename(result['fits_file'])}")
+                    os.makedirs(os.path.dirname(fits_file), exist_ok=True)
+                    os.replace(result["fits_file"], fits_file)
+                    product.update(status="done", fits_file=fits_file)
+
+            if product["status"] == "done" and index_path:
+                # registered under its final name, once it left the staging dir
+                try:
+                    register_result(index_path, dict(result, fits_file=product["fits_file"], xml_file=product["xml_file"]),
+                                    input_path=job["input_fits_path"],
+                                    dm_version=get_fits_format_version(product_id, fitsDataModel_path=fitsDataModel_path))
+                except Exception as e:
+                    print(f"Error registering '{product['fits_file']}' in '{index_path}' : {e} \n")
+
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            product["latency"] = time.perf_counter() - product_start
+            report["products"].append(product)
+
+        report["status"] = "done" if all(p["status"] == "done" for p in report["products"]) else "failed"
+        report["latency"] = time.perf_counter() - start
+        print(f"\033[1mJob {job_id} {report['status']} in {report['latency']:.4f} seconds\033[0m "
+              + " ".join(f"[{p['product_id']}: {p['latency']:.4f} s]" for p in report["products"]) + "\n")
+        return report
+
+    def serve_socket(self, socket_path):
+        """
+        Accept jobs on a local Unix socket. Every connection sends one job as a JSON line
+        and receives the job report as a JSON line once the job is done.
+
+        Parameters:
+        -----------
+        socket_path : str
+            Path of the Unix socket.
+        """
+        worker = self
+
+        class JobHandler(socketserver.StreamRequestHandler):
+            def handle(self):
+                try:
+                    job = json.loads(self.rfile.readline())
+                    report = worker.submit(job).result()
+                except Exception as e:
+                    report = {"status": "failed", "error": str(e)}
+                self.wfile.write((json.dumps(report) + "\n").encode())
+
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+
+        with socketserver.ThreadingUnixStreamServer(socket_path, JobHandler) as server:
+            print(f"Listening for jobs on '{socket_path}'\n")
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                os.remove(socket_path)
+
+    def serve_spool(self, spool_dir, poll_interval=1.0):
+        """
+        Process the job files ('*.json') dropped in a spool directory. A job is claimed by
+        renaming it to '*.json.running'; its report is written as '*.result.json' and the
+        job file is moved to the 'done/' subdirectory.
+
+        Parameters:
+        -----------
+        spool_dir : str
+            Directory watched for job files.
+        poll_interval : float, optional, default = 1.0
+            Seconds between two scans of the spool directory.
+        """
+        done_dir = os.path.join(spool_dir, "done")
+        os.makedirs(done_dir, exist_ok=True)
+
+        def run_spooled(running_path, job_name):
+            try:
+                with open(running_path, "r") as file:
+                    job = json.load(file)
+                job.setdefault("id", job_name)
+                report = self.run_job(job)
+            except Exception as e:
+                report = {"id": job_name, "status": "failed", "error": str(e)}
+            with open(os.path.join(spool_dir, f"{job_name}.result.json"), "w") as file:
+                json.dump(report, file, indent=4)
+            os.replace(running_path, os.path.join(done_dir, f"{job_name}.json"))
+
+        print(f"Watching '{spool_dir}' for jobs\n")
+        pending = set()
+        try:
+            while True:
+                # only claim as many jobs as there are free slots, the rest stays available to other workers
+                pending = {future for future in pending if not future.done()}
+                for entry in sorted(os.listdir(spool_dir)):
+                    if len(pending) >= self.max_workers:
+                        break
+                    if not entry.endswith(".json") or entry.endswith(".result.json"):
+                        continue
+                    job_name = entry[:-len(".json")]
+                    running_path = os.path.join(spool_dir, f"{entry}.running")
+                    try:
+                        os.rename(os.path.join(spool_dir, entry), running_path)
+                    except FileNotFoundError:
+                        continue  # claimed by another worker
+                    pending.add(self.executor.submit(run_spooled, running_path, job_name))
+                time.sleep(poll_interval)
+        except KeyboardInterrupt:
+            pass
+
+def submit_job(socket_path, job):
+    """
+    Send a job to a worker listening on a Unix socket and wait for its report.
+
+    Parameters:
+    -----------
+    socket_path : str
+        Path of the Unix socket of the worker.
+    job : dict
+        Job description (see the top of this module).
+
+    Returns:
+    --------
+    report : dict
+        The job report (see Worker.run_job)
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(socket_path)
+        client.sendall((json.dumps(job) + "\n").encode())
+        with client.makefile("r") as response:
+            return json.loads(response.readline())
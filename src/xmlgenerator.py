@@ -1,9 +1,8 @@
 import sys
 import os
-import datetime
-import yaml
+import copy
 import argparse
-import re
+from concurrent.futures import ThreadPoolExecutor
 import xml.etree.ElementTree as ET
 from xml.dom import minidom
 
@@ -31,30 +30,44 @@ from ST_DataModelBindingsXsData.dictionary.sys import (GenericHeader, ToBeChecke
 
 #####################################
 
-names_database = {
-        'poscatalog': {'capitalised':'PosCatalog', 'shortname': 'Position', 'product': 'DpdWLPosCatalog', 'id': 'le3.id.vmpz.output.poscatalog'},
-        'shearcatalog': {'capitalised':'ShearCatalog', 'shortname': 'Shear', 'product': 'DpdWLShearCatalog', 'id': 'le3.id.vmpz.output.shearcatalog'},
-        'proxyshearcatalog': {'capitalised':'ProxyShearCatalog', 'shortname': 'ProxyShear', 'product': 'DpdWLProxyShearCatalog', 'id': 'le3.id.vmpz.output.proxyshearcatalog'}
-    }
+from xmltemplate import (names_database, CONFIG_FILE, update_config, load_config, load_header_defaults,
+                         extract_word_before_fits, catalog_name_of, footprint_polygon, header_dates)
 
-def extract_word_before_fits(filepath):
-    """Extracts the word before ".fits" in the given file path.
+_serializer = None
 
-    Parameters
-    ----------
-    filepath: str
-        The file path from which to extract the word.
+_filename_provider = None
+
+# number of threads serialising the products of a batch
+BATCH_WORKERS = 8
+
+def get_serializer():
+    """Returns the XmlSerializer shared by all the saved products.
 
     Returns
     -------
-    str
-        The extracted word before ".fits" or None if not found."""
-    
-    match = re.search(r'\.([^.]+)\.fits$', filepath)
-    return match.group(1) if match else None
+    object
+        The XmlSerializer.
+    """
+    global _serializer
+    if _serializer is None:
+        config = SerializerConfig(pretty_print=True, encoding="UTF-8")
+        _serializer = XmlSerializer(config=config)
+    return _serializer
 
+def get_filename_provider():
+    """Returns the FileNameProvider shared by all the products.
 
-def create_catalog(fits_file, file_name):
+    Returns
+    -------
+    object
+        The FileNameProvider.
+    """
+    global _filename_provider
+    if _filename_provider is None:
+        _filename_provider = FileNameProvider()
+    return _filename_provider
+
+def create_catalog(fits_file, file_name, header_defaults=None, header=None, description=None):
     """Creates the output catalog bindings.
 
     Parameters
@@ -63,26 +76,21 @@ def create_catalog(fits_file, file_name):
         The name of the fits file to be wrapped in the binding.
     file_name: str
         The name of the generated file
+    header_defaults: dict, optional
+        Preloaded 'header.default.*' values (see load_header_defaults).
+        Read from the configuration file if None.
+    header: object, optional
+        Generic header shared by the products of a batch (see create_batch), only its ProductId is
+        renewed. A new header is created (and the product_id saved in the yaml file) if None.
+    description: object, optional
+        Catalog description shared by the products of a batch. Created if None.
     Returns
     -------
     object:
         The output catalog bindings.
 
     """
-    catalog_name = extract_word_before_fits(fits_file)
-    # print(f"Catalog name: {catalog_name}")
-    
-
-    if catalog_name not in names_database:
-        raise ValueError(f"Invalid catalog name: {catalog_name}. Expected one of {list(names_database.keys())} for generating the xml.")
-    
-    # saving the product_id in the yaml file
-    config_file = "./src/config/XmlHeaderDetails.yaml"
-    with open(config_file, 'r') as file:
-        data = yaml.safe_load(file)
-    data['product_id'] = names_database[catalog_name]['id']
-    with open(config_file, 'w') as file:
-        yaml.dump(data, file)
+    catalog_name = catalog_name_of(fits_file)
 
     # Create the appropriate data product binding based on the catalog name
     if catalog_name == 'poscatalog':
@@ -93,7 +101,14 @@ def create_catalog(fits_file, file_name):
         dpd = out.euc_le3_id_vmpz_proxy_shear_catalog.DpdWLProxyShearCatalog()
 
     # Add the generic header to the data product
-    dpd.Header = create_generic_header(names_database[catalog_name]['product'])
+    if header is None:
+        # saving the product_id in the yaml file
+        update_config({'product_id': names_database[catalog_name]['id']})
+        dpd.Header = create_generic_header(names_database[catalog_name]['product'], defaults=header_defaults)
+    else:
+        # the static fields are shared, every product has its own id
+        dpd.Header = copy.copy(header)
+        dpd.Header.ProductId = get_uuid_as_string()
 
     #create simple data for the catalog based on the catalog name
     if catalog_name == 'poscatalog':
@@ -102,19 +117,9 @@ def create_catalog(fits_file, file_name):
         dpd.Data = __create_simple_data(vmpz_pro.WLShearCatalog)
     elif catalog_name == 'proxyshearcatalog':
         dpd.Data = __create_simple_data(vmpz_pro.ProxyShearCatalogWL)
-        
-    
-    # Add the catalog descriptions
-    description = cat.CatalogDescription()
-    description.PathToCatalogFile = f"{names_database[catalog_name]['product']}.Data.{names_database[catalog_name]['capitalised']}.DataContainer.FileName"
-    # description.PathToCatalogFile = f"DpdWLPosCatalog.Data.PosCatalog.DataContainer.FileName"
-    description.CatalogType = "NOT_PROXY"
-    description.CatalogOrigin = "OTHERS"
-    description.CatalogOrigin = "MEASURED_WIDE"
-    description.CatalogName = f"Le3-Id-Vmpz-Output-{names_database[catalog_name]['shortname']}-Catalog"
-    description.CatalogFormatHDU = 1
-    dpd.Data.CatalogDescription.append(description)
 
+    # Add the catalog descriptions
+    dpd.Data.CatalogDescription.append(description or create_catalog_description(catalog_name))
 
     # Add the files for the catalog bas based on the catalog name
     if catalog_name == 'poscatalog':
@@ -138,6 +143,30 @@ def create_catalog(fits_file, file_name):
 
     return dpd
 
+def create_catalog_description(catalog_name):
+    """Creates the catalog description binding of a catalog type.
+
+    Parameters
+    ----------
+    catalog_name: str
+        The catalog name (key of names_database).
+
+    Returns
+    -------
+    object
+        The catalog description binding.
+    """
+    description = cat.CatalogDescription()
+    description.PathToCatalogFile = f"{names_database[catalog_name]['product']}.Data.{names_database[catalog_name]['capitalised']}.DataContainer.FileName"
+    # description.PathToCatalogFile = f"DpdWLPosCatalog.Data.PosCatalog.DataContainer.FileName"
+    description.CatalogType = "NOT_PROXY"
+    description.CatalogOrigin = "OTHERS"
+    description.CatalogOrigin = "MEASURED_WIDE"
+    description.CatalogName = f"Le3-Id-Vmpz-Output-{names_database[catalog_name]['shortname']}-Catalog"
+    description.CatalogFormatHDU = 1
+
+    return description
+
 def save_product_metadata(product, xml_file_name):
     """Saves an XML instance of a given data product.
 
@@ -153,8 +182,7 @@ def save_product_metadata(product, xml_file_name):
 
     """
 
-    config = SerializerConfig(pretty_print=True, encoding="UTF-8")
-    serializer = XmlSerializer(config=config)
+    serializer = get_serializer()
 
     try:
         with open(xml_file_name, "w") as f:
@@ -187,7 +215,7 @@ def filename_provider(instance_id=None, release=None, product=None):
 
     """
     product = extract_word_before_fits(product)
-    filename = FileNameProvider().get_allowed_filename(
+    filename = get_filename_provider().get_allowed_filename(
         processing_function='le3',
         type_name=f'{names_database[product]["capitalised"]}',
         instance_id=instance_id or '',
@@ -260,13 +288,16 @@ def create_data_container(file_name, file_status="PROPOSED"):
     return data_container
 
 
-def create_generic_header(product_type):
+def create_generic_header(product_type, defaults=None):
     """Creates a generic header binding.
 
     Parameters
     ----------
     product_type: str
         The product type.
+    defaults: dict, optional
+        Preloaded 'header.default.*' values (see load_header_defaults).
+        Read from the configuration file if None.
 
     Returns
     -------
@@ -274,34 +305,12 @@ def create_generic_header(product_type):
         The generic header binding.
 
     """
-    # path to the configuration file and read it
-    config_file = "./src/config/XmlHeaderDetails.yaml"
+    # Save the dates back to the YAML file
+    dates = header_dates()
+    data = update_config(dates)
 
-    # Load the existing YAML file
-    with open(config_file, 'r') as file:
-        data = yaml.safe_load(file)
-
-    
-    # get the time
-    now = datetime.datetime.now(datetime.timezone.utc)
-    try:
-        new_time = now.replace(year=now.year + 2)
-    except ValueError:
-        new_time = now.replace(year=now.year + 2, day=28)
-
-    exp_time = new_time.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
-    creation_time = now.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
-
-    # Add a new element
-    data['header.default.ExpirationDate'] = exp_time
-    data['header.default.CreationDate'] = creation_time
-
-    # Save the updated data back to the YAML file
-    with open(config_file, 'w') as file:
-        yaml.dump(data, file)
-
-
-    conf = load_config(config_file)
+    conf = dict(defaults) if defaults is not None else data
+    conf.update(dates)
 
     GenericHeaderContent = GenericHeader()
     GenericHeaderContent.ProductId = get_uuid_as_string()
@@ -339,81 +348,164 @@ def create_generic_header(product_type):
     return GenericHeaderContent
 
 
-def load_config(config_path):
-    """Load configuration from a YAML file.
-    Parameters
-    ----------
-    config_path : str
-        Path to the YAML configuration file.
-    """
-    with open(config_path, "r") as file:
-        return yaml.safe_load(file)
-
-def add_spatial_coverage(xml_file_name):
+def add_spatial_coverage(xml_file_name, vertices=None):
     """
     Create a catalog, save it as an XML file, and add the <SpatialCoverage> element
     before <CatalogDescription> in the <Data> section of the XML file.
 
     Parameters:
     -----------
-    fits_file : str
-        Path to the input FITS file.
-    output_dir : str, optional
-        Directory to save the generated XML file. Default is "generated/".
+    xml_file_name : str
+        Path to the saved XML file.
+    vertices : list, optional
+        Vertices [{"C1": ra, "C2": dec}, ...] of the coverage polygon (see footprint_polygon).
+        A single (0.0, 0.0) vertex is written if None.
     """
     try:
-        # Step 3: Parse the saved XML file
-        tree = ET.parse(xml_file_name)
-        root = tree.getroot()
-
-        # Step 4: Find the <Data> element
-        data_element = root.find("Data")
-        if data_element is None:
-            print("Error: <Data> element not found in the XML file.")
+        # Step 3: Read the saved XML file
+        with open(xml_file_name, "r", encoding="UTF-8") as f:
+            lines = insert_spatial_coverage(f.read(), vertices)
+        if lines is None:
             return
 
-        # Step 5: Create the <SpatialCoverage> element
-        spatial_coverage = ET.Element("SpatialCoverage")
-        polygon = ET.SubElement(spatial_coverage, "Polygon")
+        # Step 9: Write the formatted XML back to the file
+        with open(xml_file_name, "w", encoding="UTF-8") as f:
+            f.write(lines)
+
+        # print(f"Catalog created and saved to {xml_file_name} with <SpatialCoverage> added.")
+    except Exception as e:
+        print(f"Error creating catalog or adding <SpatialCoverage>: {e}")
+
+def insert_spatial_coverage(xml_string, vertices=None):
+    """
+    Add the <SpatialCoverage> element before <CatalogDescription> in the <Data> section
+    of a serialised product and pretty-print it.
+
+    Parameters:
+    -----------
+    xml_string : str
+        The serialised product.
+    vertices : list, optional
+        Vertices [{"C1": ra, "C2": dec}, ...] of the coverage polygon (see footprint_polygon).
+        A single (0.0, 0.0) vertex is written if None.
+
+    Returns:
+    --------
+    str
+        The XML with the coverage, None if the product has no <Data> or <CatalogDescription>.
+    """
+    root = ET.fromstring(xml_string)
+
+    # Step 4: Find the <Data> element
+    data_element = root.find("Data")
+    if data_element is None:
+        print("Error: <Data> element not found in the XML file.")
+        return
 
-        # Define the vertices
+    # Step 5: Create the <SpatialCoverage> element
+    spatial_coverage = ET.Element("SpatialCoverage")
+    polygon = ET.SubElement(spatial_coverage, "Polygon")
+
+    # Define the vertices
+    if vertices is None:
         vertices = [
             {"C1": "0.0", "C2": "0.0"},
         ]
 
-        for vertex in vertices:
-            vertex_element = ET.SubElement(polygon, "Vertex")
-            ET.SubElement(vertex_element, "C1").text = vertex["C1"]
-            ET.SubElement(vertex_element, "C2").text = vertex["C2"]
-
-        # Step 6: Insert <SpatialCoverage> before <CatalogDescription>
-        catalog_description = data_element.find("CatalogDescription")
-        if catalog_description is not None:
-            data_element.insert(list(data_element).index(catalog_description), spatial_coverage)
-        else:
-            print("Error: <CatalogDescription> element not found in <Data>.")
-            return
+    for vertex in vertices:
+        vertex_element = ET.SubElement(polygon, "Vertex")
+        ET.SubElement(vertex_element, "C1").text = vertex["C1"]
+        ET.SubElement(vertex_element, "C2").text = vertex["C2"]
 
-        # Step 7: Convert the modified XML tree to a string
-        xml_string = ET.tostring(root, encoding="unicode")
+    # Step 6: Insert <SpatialCoverage> before <CatalogDescription>
+    catalog_description = data_element.find("CatalogDescription")
+    if catalog_description is not None:
+        data_element.insert(list(data_element).index(catalog_description), spatial_coverage)
+    else:
+        print("Error: <CatalogDescription> element not found in <Data>.")
+        return
 
-        # Step 8: Pretty-print the XML using minidom
-        pretty_xml = minidom.parseString(xml_string).toprettyxml(indent="  ")
-        # Remove unnecessary blank lines
-        lines = [line for line in pretty_xml.splitlines() if line.strip()]
-        lines = "\n".join(lines)
+    # Step 7: Convert the modified XML tree to a string
+    xml_string = ET.tostring(root, encoding="unicode")
 
-        # Step 9: Write the formatted XML back to the file
-        with open(xml_file_name, "w", encoding="UTF-8") as f:
-            f.write(lines)
-
-        # print(f"Catalog created and saved to {xml_file_name} with <SpatialCoverage> added.")
-    except Exception as e:
-        print(f"Error creating catalog or adding <SpatialCoverage>: {e}")
+    # Step 8: Pretty-print the XML using minidom
+    pretty_xml = minidom.parseString(xml_string).toprettyxml(indent="  ")
+    # Remove unnecessary blank lines
+    lines = [line for line in pretty_xml.splitlines() if line.strip()]
+    return "\n".join(lines)
 
  
 
-def main(fits_file, output_dir="./generated/"):
+def prepare_product(fits_file, output_dir="./generated/", header_defaults=None, instance_id=None):
+    """
+    Build the bindings of a product before its fits file is written : they only depend on its name.
+
+    Parameters:
+    -----------
+    fits_file : str
+        Path of the product FITS file ('<...>.<product_id>.fits'), which does not have to exist yet.
+    output_dir : str, optional
+        Directory to save the generated XML file. Default is "generated/".
+    header_defaults : dict, optional
+        Preloaded 'header.default.*' values (see load_header_defaults).
+    instance_id : str, optional
+        Instance ID of the file names.
+
+    Returns:
+    --------
+    dict
+        {'fits_file', 'xml_file', 'dpd'}, see write_product and publish_product.
+    """
+    filename = filename_provider(instance_id=instance_id, product=fits_file)
+    return {
+        "fits_file": fits_file,
+        "xml_file": f"{output_dir}{filename}",
+        "dpd": create_catalog(fits_file, filename, header_defaults=header_defaults),
+    }
+
+def write_product(prepared, footprint=None):
+    """
+    Save the XML of a product prepared by prepare_product, with the footprint of its rows.
+
+    Parameters:
+    -----------
+    prepared : dict
+        Returned by prepare_product.
+    footprint : dict, optional
+        {'ra_min', 'ra_max', 'dec_min', 'dec_max'} of the catalog, written as its <SpatialCoverage>.
+
+    Returns:
+    --------
+    str
+        Path of the XML file.
+    """
+    save_product_metadata(prepared["dpd"], prepared["xml_file"])
+    add_spatial_coverage(prepared["xml_file"], vertices=footprint_polygon(footprint) if footprint else None)
+    return prepared["xml_file"]
+
+def publish_product(prepared):
+    """
+    Rename the fits file of a product to the name of its XML file and save their paths in the yaml file.
+
+    Parameters:
+    -----------
+    prepared : dict
+        Returned by prepare_product.
+
+    Returns:
+    --------
+    str
+        New path of the fits file.
+    """
+    xml_file_name = prepared["xml_file"]
+    os.rename(prepared["fits_file"], xml_file_name.replace(".xml", ".fits"))
+    update_config({
+        'xml_filepath': xml_file_name,
+        'fits_filepath': xml_file_name.replace(".xml", ".fits"),
+    })
+    return xml_file_name.replace(".xml", ".fits")
+
+def main(fits_file, output_dir="./generated/", header_defaults=None, instance_id=None, footprint=None):
     """
     Main function to create and save the catalog.
 
@@ -423,37 +515,126 @@ def main(fits_file, output_dir="./generated/"):
         Path to the input FITS file.
     output_dir : str, optional
         Directory to save the generated XML file. Default is "generated/".
+    header_defaults : dict, optional
+        Preloaded 'header.default.*' values (see load_header_defaults).
+    instance_id : str, optional
+        Instance ID of the file names, to tell apart the products of the same type (e.g. the tiles of a catalog).
+    footprint : dict, optional
+        {'ra_min', 'ra_max', 'dec_min', 'dec_max'} of the catalog, written as its <SpatialCoverage>.
+
+    Returns:
+    --------
+    str
+        Path of the generated XML file (the fits file is renamed alongside), None if the generation failed.
     """
     try:
 
-        filename = filename_provider(product=fits_file)
-        xml_file_name = f"{output_dir}{filename}"
-        
         # Create the catalog
-        dpd = create_catalog(fits_file, filename)
+        prepared = prepare_product(fits_file, output_dir, header_defaults=header_defaults, instance_id=instance_id)
 
         # Save the product metadata to an XML file
-        save_product_metadata(dpd, xml_file_name)
-        add_spatial_coverage(xml_file_name)
-
-        # renaming the fits file to the xml file name
-        os.rename(fits_file, xml_file_name.replace(".xml", ".fits"))
+        xml_file_name = write_product(prepared, footprint=footprint)
 
-        # saving the xml and fits file paths in the yaml file
-        config_file = "./src/config/XmlHeaderDetails.yaml"
-        with open(config_file, 'r') as file:
-            data = yaml.safe_load(file)
-        data['xml_filepath'] = xml_file_name
-        data['fits_filepath'] = xml_file_name.replace(".xml", ".fits")
-        with open(config_file, 'w') as file:
-            yaml.dump(data, file)
+        # renaming the fits file to the xml file name, and saving the xml and fits file paths in the yaml file
+        publish_product(prepared)
 
+        print(f"\033[1mXML file generated successfully and saved in '{output_dir}' dir  \( ﾟヮﾟ)/\033[0m \n")
 
-        print(f"\033[1mXML file generated successfully and saved in './generated/' dir  \( ﾟヮﾟ)/\033[0m \n")
+        return xml_file_name
 
     except Exception as e:
         print(f"Error creating catalog: {e}")
 
+def main_batch(fits_files, output_dir="./generated/", header_defaults=None, instance_ids=None, footprints=None,
+               max_workers=BATCH_WORKERS):
+    """
+    Create and save the catalogs of many fits files at once. The generic header (dates and
+    defaults) and the catalog description are built once per product type and shared, only the
+    ProductId, the file names and the coverage are set per product, and the products are
+    serialised on a thread pool with the shared serializer.
+
+    Parameters:
+    -----------
+    fits_files : list
+        Paths of the input FITS files.
+    output_dir : str, optional
+        Directory to save the generated XML files. Default is "generated/".
+    header_defaults : dict, optional
+        Preloaded 'header.default.*' values (see load_header_defaults).
+    instance_ids : list, optional
+        Instance ID of the file names of every fits file, to tell apart the products of the same type
+        (e.g. the tiles of a catalog).
+    footprints : list, optional
+        {'ra_min', 'ra_max', 'dec_min', 'dec_max'} of every fits file, written as its <SpatialCoverage>.
+    max_workers : int, optional
+        Number of threads serialising the products. Default is BATCH_WORKERS.
+
+    Returns:
+    --------
+    list
+        Path of the generated XML file of every fits file (the fits files are renamed alongside),
+        None for the ones whose generation failed.
+    """
+    instance_ids = instance_ids or [None] * len(fits_files)
+    footprints = footprints or [None] * len(fits_files)
+    if header_defaults is None:
+        header_defaults = load_header_defaults()
+
+    # static parts, one per product type
+    templates = {}
+    products = []
+    names = set()
+    for fits_file, instance_id, footprint in zip(fits_files, instance_ids, footprints):
+        try:
+            catalog_name = catalog_name_of(fits_file)
+            if catalog_name not in templates:
+                templates[catalog_name] = (create_generic_header(names_database[catalog_name]['product'], defaults=header_defaults),
+                                           create_catalog_description(catalog_name))
+            filename = filename_provider(instance_id=instance_id, product=fits_file)
+            if filename in names:
+                raise ValueError(f"Duplicate XML file name {filename}, give every product its own instance ID.")
+            names.add(filename)
+            header, description = templates[catalog_name]
+            dpd = create_catalog(fits_file, filename, header=header, description=description)
+            products.append((fits_file, f"{output_dir}{filename}", dpd, footprint))
+        except Exception as e:
+            print(f"Error creating catalog of {fits_file}: {e}")
+            products.append((fits_file, None, None, None))
+
+    def save(product):
+        fits_file, xml_file_name, dpd, footprint = product
+        if dpd is None:
+            return None
+        try:
+            xml = insert_spatial_coverage(get_serializer().render(dpd),
+                                          vertices=footprint_polygon(footprint) if footprint else None)
+            if xml is None:
+                return None
+            with open(xml_file_name, "w", encoding="UTF-8") as f:
+                f.write(xml)
+            # renaming the fits file to the xml file name
+            os.rename(fits_file, xml_file_name.replace(".xml", ".fits"))
+            return xml_file_name
+        except Exception as e:
+            print(f"Error saving catalog {xml_file_name}: {e}")
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        xml_files = list(executor.map(save, products))
+
+    # saving the last product in the yaml file, as main does for every product
+    done = [(fits_file, xml_file) for (fits_file, *_), xml_file in zip(products, xml_files) if xml_file is not None]
+    if done:
+        fits_file, xml_file_name = done[-1]
+        update_config({
+            'product_id': names_database[catalog_name_of(fits_file)]['id'],
+            'xml_filepath': xml_file_name,
+            'fits_filepath': xml_file_name.replace(".xml", ".fits"),
+        })
+
+    print(f"\033[1m{len(done)} of {len(fits_files)} XML files generated and saved in '{output_dir}' dir\033[0m \n")
+
+    return xml_files
+
 if __name__ == "__main__":
     # Parse command-line arguments
     parser = argparse.ArgumentParser(description="Create and save a catalog from a FITS file.")
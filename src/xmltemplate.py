@@ -0,0 +1,664 @@
+import os
+import re
+import uuid
+import datetime
+import threading
+import argparse
+from functools import lru_cache
+from string import Template
+
+import yaml
+
+# Keep the imports of this module light : xml.etree and difflib
+# are only needed to compile and check the templates, and are imported there.
+
+names_database = {
+        'poscatalog': {'capitalised':'PosCatalog', 'shortname': 'Position', 'product': 'DpdWLPosCatalog', 'id': 'le3.id.vmpz.output.poscatalog'},
+        'shearcatalog': {'capitalised':'ShearCatalog', 'shortname': 'Shear', 'product': 'DpdWLShearCatalog', 'id': 'le3.id.vmpz.output.shearcatalog'},
+        'proxyshearcatalog': {'capitalised':'ProxyShearCatalog', 'shortname': 'ProxyShear', 'product': 'DpdWLProxyShearCatalog', 'id': 'le3.id.vmpz.output.proxyshearcatalog'}
+    }
+
+# configuration files shipped with the package, found from this file so that the commands run from any directory
+CONFIG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config")
+
+# path to the configuration file of the xml header
+CONFIG_FILE = os.path.join(CONFIG_DIR, "XmlHeaderDetails.yaml")
+
+# precompiled xml of every catalog type, <catalog_name>.xml
+TEMPLATE_DIR = os.path.join(CONFIG_DIR, "xml_templates")
+
+# xml of every catalog type generated with the EDEN bindings, <catalog_name>.xml : the templates are
+# compiled from them and checked against them
+REFERENCE_DIR = os.path.join(CONFIG_DIR, "xml_references")
+
+# fixed per-product values of the reference xml files (ProductId, date of the header and of the file name, footprint)
+REFERENCE_PRODUCT_ID = "00000000-0000-4000-8000-000000000000"
+REFERENCE_TIME = datetime.datetime(2025, 1, 1, tzinfo=datetime.timezone.utc)
+REFERENCE_FOOTPRINT = {"ra_min": 10.0, "ra_max": 20.0, "dec_min": -5.0, "dec_max": 5.0}
+
+# renderers of the xml files : the xsdata bindings of EDEN or the precompiled templates
+XML_RENDERERS = ("eden", "template")
+
+# indentation of the <SpatialCoverage> element in the <Data> section
+COVERAGE_INDENT = "    "
+
+# serialises the read-modify-write of CONFIG_FILE when several products are generated concurrently
+_config_lock = threading.Lock()
+
+
+def update_config(updates, config_file=CONFIG_FILE):
+    """Updates the given keys of the YAML configuration file.
+
+    Parameters
+    ----------
+    updates: dict
+        The keys and values to write in the configuration file.
+    config_file: str, optional
+        Path to the YAML configuration file.
+
+    Returns
+    -------
+    dict
+        The updated configuration.
+    """
+    with _config_lock:
+        with open(config_file, 'r') as file:
+            data = yaml.safe_load(file)
+        data.update(updates)
+        with open(config_file, 'w') as file:
+            yaml.dump(data, file)
+    return data
+
+def load_config(config_path):
+    """Load configuration from a YAML file.
+    Parameters
+    ----------
+    config_path : str
+        Path to the YAML configuration file.
+    """
+    with open(config_path, "r") as file:
+        return yaml.safe_load(file)
+
+def load_header_defaults(config_file=CONFIG_FILE):
+    """Loads the 'header.default.*' values of the YAML configuration file.
+
+    Parameters
+    ----------
+    config_file: str, optional
+        Path to the YAML configuration file.
+
+    Returns
+    -------
+    dict
+        The configuration restricted to the 'header.default.*' keys.
+    """
+    conf = load_config(config_file)
+    return {key: value for key, value in conf.items() if key.startswith("header.default.")}
+
+def extract_word_before_fits(filepath):
+    """Extracts the word before ".fits" in the given file path.
+
+    Parameters
+    ----------
+    filepath: str
+        The file path from which to extract the word.
+
+    Returns
+    -------
+    str
+        The extracted word before ".fits" or None if not found."""
+
+    match = re.search(r'\.([^.]+)\.fits$', filepath)
+    return match.group(1) if match else None
+
+def catalog_name_of(fits_file):
+    """Returns the catalog name (key of names_database) of a product fits file.
+
+    Parameters
+    ----------
+    fits_file: str
+        The name of the fits file ('<...>.<product_id>.fits').
+
+    Returns
+    -------
+    str
+        The catalog name.
+    """
+    catalog_name = extract_word_before_fits(fits_file)
+
+    if catalog_name not in names_database:
+        raise ValueError(f"Invalid catalog name: {catalog_name}. Expected one of {list(names_database.keys())} for generating the xml.")
+    return catalog_name
+
+def footprint_polygon(footprint):
+    """Vertices of the polygon covering a catalog footprint.
+
+    Parameters
+    ----------
+    footprint: dict
+        {'ra_min', 'ra_max', 'dec_min', 'dec_max'} of the catalog (see conversion.footprint).
+
+    Returns
+    -------
+    list
+        The 4 corners of the footprint as [{"C1": ra, "C2": dec}, ...].
+    """
+    corners = [
+        (footprint["ra_min"], footprint["dec_min"]),
+        (footprint["ra_max"], footprint["dec_min"]),
+        (footprint["ra_max"], footprint["dec_max"]),
+        (footprint["ra_min"], footprint["dec_max"]),
+    ]
+    return [{"C1": repr(float(ra)), "C2": repr(float(dec))} for ra, dec in corners]
+
+def header_dates(now=None):
+    """Creation and expiration (2 years later) dates of a generic header.
+
+    Parameters
+    ----------
+    now: datetime, optional
+        The creation time (UTC). Default is the current time.
+
+    Returns
+    -------
+    dict
+        The 'header.default.ExpirationDate' and 'header.default.CreationDate' values.
+    """
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    try:
+        new_time = now.replace(year=now.year + 2)
+    except ValueError:
+        new_time = now.replace(year=now.year + 2, day=28)
+
+    return {
+        'header.default.ExpirationDate': new_time.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z",
+        'header.default.CreationDate': now.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z",
+    }
+
+def xml_file_name(catalog_name, instance_id=None, release=None, now=None):
+    """Name of the xml file of a product, following the Euclid file naming convention
+    (EUC_LE3_<TYPE>_<instance_id>_<date>Z_<release>.xml) as the FileNameProvider of EDEN does.
+
+    Parameters
+    ----------
+    catalog_name: str
+        The catalog name (key of names_database).
+    instance_id: str, optional
+        The instance ID. Default is None.
+    release: str, optional
+        The release version. Default is '00.00'.
+    now: datetime, optional
+        Date of the file name. Default is the current time.
+
+    Returns
+    -------
+    str
+        The xml file name.
+    """
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    type_name = names_database[catalog_name]["capitalised"].upper()
+    return f"EUC_LE3_{type_name}_{instance_id or ''}_{now.strftime('%Y%m%dT%H%M%S.%f')}Z_{release or '00.00'}.xml"
+
+@lru_cache(maxsize=None)
+def load_template(catalog_name, template_dir=TEMPLATE_DIR):
+    """Reads the precompiled xml of a catalog type (cached).
+
+    Parameters
+    ----------
+    catalog_name: str
+        The catalog name (key of names_database).
+    template_dir: str, optional
+        Directory of the templates.
+
+    Returns
+    -------
+    string.Template
+        The template of the xml file.
+    """
+    with open(os.path.join(template_dir, f"{catalog_name}.xml"), "r", encoding="UTF-8") as f:
+        return Template(f.read().rstrip("\n"))
+
+def render_spatial_coverage(vertices=None, indent=COVERAGE_INDENT):
+    """Renders the <SpatialCoverage> element as xmlgenerator.insert_spatial_coverage pretty-prints it.
+
+    Parameters
+    ----------
+    vertices: list, optional
+        Vertices [{"C1": ra, "C2": dec}, ...] of the coverage polygon (see footprint_polygon).
+        A single (0.0, 0.0) vertex is written if None.
+    indent: str, optional
+        Indentation of the element.
+
+    Returns
+    -------
+    str
+        The indented lines of the element.
+    """
+    if vertices is None:
+        vertices = [
+            {"C1": "0.0", "C2": "0.0"},
+        ]
+    lines = [f"{indent}<SpatialCoverage>", f"{indent}  <Polygon>"]
+    for vertex in vertices:
+        lines += [f"{indent}    <Vertex>",
+                  f"{indent}      <C1>{_text(vertex['C1'])}</C1>",
+                  f"{indent}      <C2>{_text(vertex['C2'])}</C2>",
+                  f"{indent}    </Vertex>"]
+    lines += [f"{indent}  </Polygon>", f"{indent}</SpatialCoverage>"]
+    return "\n".join(lines)
+
+def _text(value):
+    # text nodes are escaped as minidom writes them
+    text = "" if value is None else str(value)
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;").replace('"', "&quot;")
+
+def render(catalog_name, file_name, header_defaults=None, product_id=None, vertices=None, template_dir=TEMPLATE_DIR):
+    """Renders the xml of a product from the template of its catalog type.
+
+    Parameters
+    ----------
+    catalog_name: str
+        The catalog name (key of names_database).
+    file_name: str
+        The name of the xml file (the fits file is 'generated/<file_name>.fits').
+    header_defaults: dict, optional
+        'header.default.*' values of the generic header, with its dates (see header_dates).
+        Read from the configuration file if None.
+    product_id: str, optional
+        The ProductId of the header. A new uuid if None.
+    vertices: list, optional
+        Vertices of the <SpatialCoverage> polygon (see footprint_polygon).
+    template_dir: str, optional
+        Directory of the templates.
+
+    Returns
+    -------
+    str
+        The xml of the product.
+    """
+    if header_defaults is None:
+        header_defaults = load_header_defaults()
+    values = {key[len("header.default."):]: _text(value) for key, value in header_defaults.items()
+              if key.startswith("header.default.")}
+    # the numeric flags are written as integers, as the bindings do
+    for key in ("ToBePublished", "Published"):
+        if header_defaults.get(f"header.default.{key}") is not None:
+            values[key] = str(int(header_defaults[f"header.default.{key}"]))
+    values.update(
+        ProductId=_text(product_id or str(uuid.uuid4())),
+        FileName=_text('generated/' + file_name.replace('.xml', '.fits')),
+        SpatialCoverage=render_spatial_coverage(vertices),
+    )
+    return load_template(catalog_name, template_dir).substitute(values)
+
+def compile_template(reference_xml, catalog_name=None, template_dir=TEMPLATE_DIR):
+    """Compiles the template of a catalog type from an xml file generated by xmlgenerator :
+    the per-product fields (ProductId, header defaults and dates, FileName and SpatialCoverage)
+    are replaced by placeholders, the rest of the file is kept as is.
+
+    Parameters
+    ----------
+    reference_xml: str
+        Path of an xml file generated with the EDEN bindings.
+    catalog_name: str, optional
+        The catalog name (key of names_database). Found from the root element if None.
+    template_dir: str, optional
+        Directory of the templates.
+
+    Returns
+    -------
+    str
+        Path of the written template.
+    """
+    import xml.etree.ElementTree as ET
+
+    with open(reference_xml, "r", encoding="UTF-8") as f:
+        xml = f.read()
+
+    if catalog_name is None:
+        product = ET.fromstring(xml).tag.split("}")[-1]
+        matches = [name for name, entry in names_database.items() if entry["product"] == product]
+        if not matches:
+            raise ValueError(f"{reference_xml} is not a product of {list(names_database.keys())}.")
+        catalog_name = matches[0]
+
+    template = xml.replace("$", "$$")
+    header = re.search(r"<Header>.*?</Header>", template, flags=re.S)
+    if header is None:
+        raise ValueError(f"<Header> element not found in {reference_xml}.")
+    fields = ["ProductId"] + [key[len("header.default."):] for key in load_header_defaults()]
+    header_text = header.group(0)
+    for field in fields:
+        header_text = re.sub(rf"<{field}>[^<]*</{field}>", f"<{field}>${{{field}}}</{field}>", header_text, count=1)
+    template = template[:header.start()] + header_text + template[header.end():]
+
+    template, found = re.subn(r"<FileName>[^<]*</FileName>", "<FileName>${FileName}</FileName>", template, count=1)
+    if not found:
+        raise ValueError(f"<FileName> element not found in {reference_xml}.")
+    template, found = re.subn(r"^[ \t]*<SpatialCoverage>.*?</SpatialCoverage>", "${SpatialCoverage}", template,
+                              count=1, flags=re.S | re.M)
+    if not found:
+        raise ValueError(f"<SpatialCoverage> element not found in {reference_xml}.")
+
+    os.makedirs(template_dir, exist_ok=True)
+    template_path = os.path.join(template_dir, f"{catalog_name}.xml")
+    with open(template_path, "w", encoding="UTF-8") as f:
+        f.write(template + "\n")
+    load_template.cache_clear()
+    return template_path
+
+def check_equivalence(fits_file, header_defaults=None, footprint=None, template_dir=TEMPLATE_DIR):
+    """Renders the xml of a product with the EDEN bindings (xmlgenerator) and with the template,
+    with the same ProductId, dates and file name, and compares them (requires the EDEN environment).
+
+    Parameters
+    ----------
+    fits_file: str
+        Name of a product fits file ('<...>.<product_id>.fits'), only used for its catalog type.
+    header_defaults: dict, optional
+        Preloaded 'header.default.*' values (see load_header_defaults).
+    footprint: dict, optional
+        {'ra_min', 'ra_max', 'dec_min', 'dec_max'} written as the <SpatialCoverage>.
+    template_dir: str, optional
+        Directory of the templates.
+
+    Returns
+    -------
+    list
+        Lines of the unified diff between the two xml files, empty if they are identical.
+    """
+    import difflib
+    import xmlgenerator
+
+    if header_defaults is None:
+        header_defaults = load_header_defaults()
+    catalog_name = catalog_name_of(fits_file)
+    vertices = footprint_polygon(footprint) if footprint else None
+
+    file_name = xmlgenerator.filename_provider(product=fits_file)
+    dpd = xmlgenerator.create_catalog(fits_file, file_name, header_defaults=header_defaults)
+    reference = xmlgenerator.insert_spatial_coverage(xmlgenerator.get_serializer().render(dpd), vertices=vertices)
+
+    # the fields that change at every generation are taken from the reference
+    defaults = dict(header_defaults)
+    defaults['header.default.ExpirationDate'] = dpd.Header.ExpirationDate
+    defaults['header.default.CreationDate'] = dpd.Header.CreationDate
+    rendered = render(catalog_name, file_name, header_defaults=defaults, product_id=dpd.Header.ProductId,
+                      vertices=vertices, template_dir=template_dir)
+
+    return list(difflib.unified_diff(reference.splitlines(), rendered.splitlines(),
+                                     fromfile="eden", tofile="template", lineterm=""))
+
+def reference_product(catalog_name, header_defaults=None):
+    """Fixed per-product values of the reference xml of a catalog type.
+
+    Parameters
+    ----------
+    catalog_name: str
+        The catalog name (key of names_database).
+    header_defaults: dict, optional
+        Preloaded 'header.default.*' values (see load_header_defaults), whose dates are replaced.
+
+    Returns
+    -------
+    dict
+        {'file_name', 'product_id', 'header_defaults', 'vertices'} of the reference xml.
+    """
+    header_defaults = dict(load_header_defaults() if header_defaults is None else header_defaults)
+    header_defaults.update(header_dates(REFERENCE_TIME))
+    return {
+        "file_name": xml_file_name(catalog_name, now=REFERENCE_TIME),
+        "product_id": REFERENCE_PRODUCT_ID,
+        "header_defaults": header_defaults,
+        "vertices": footprint_polygon(REFERENCE_FOOTPRINT),
+    }
+
+def render_reference(catalog_name, header_defaults=None, template_dir=TEMPLATE_DIR):
+    """Renders the xml of a catalog type from its template with the values of its reference xml.
+
+    Parameters
+    ----------
+    catalog_name: str
+        The catalog name (key of names_database).
+    header_defaults: dict, optional
+        Preloaded 'header.default.*' values (see load_header_defaults).
+    template_dir: str, optional
+        Directory of the templates.
+
+    Returns
+    -------
+    str
+        The xml, identical to the reference xml if the template is right.
+    """
+    reference = reference_product(catalog_name, header_defaults)
+    return render(catalog_name, reference["file_name"], header_defaults=reference["header_defaults"],
+                  product_id=reference["product_id"], vertices=reference["vertices"], template_dir=template_dir)
+
+def write_reference(catalog_name, reference_dir=REFERENCE_DIR, header_defaults=None):
+    """Generates the reference xml of a catalog type with the EDEN bindings (xmlgenerator) and the fixed
+    values of reference_product (requires the EDEN environment).
+
+    Parameters
+    ----------
+    catalog_name: str
+        The catalog name (key of names_database).
+    reference_dir: str, optional
+        Directory of the reference xml files.
+    header_defaults: dict, optional
+        Preloaded 'header.default.*' values (see load_header_defaults).
+
+    Returns
+    -------
+    str
+        Path of the written reference xml.
+    """
+    import xmlgenerator
+
+    reference = reference_product(catalog_name, header_defaults)
+    dpd = xmlgenerator.create_catalog(f"reference.{names_database[catalog_name]['id']}.fits", reference["file_name"],
+                                      header_defaults=reference["header_defaults"])
+    # the values drawn at every generation are replaced by the fixed ones
+    dpd.Header.ProductId = reference["product_id"]
+    dpd.Header.ExpirationDate = reference["header_defaults"]['header.default.ExpirationDate']
+    dpd.Header.CreationDate = reference["header_defaults"]['header.default.CreationDate']
+    xml = xmlgenerator.insert_spatial_coverage(xmlgenerator.get_serializer().render(dpd), vertices=reference["vertices"])
+
+    os.makedirs(reference_dir, exist_ok=True)
+    reference_path = os.path.join(reference_dir, f"{catalog_name}.xml")
+    with open(reference_path, "w", encoding="UTF-8") as f:
+        f.write(xml + "\n")
+    return reference_path
+
+def prepare_product(fits_file, output_dir="./generated/", header_defaults=None, instance_id=None):
+    """
+    Fix the file name and the header of a product before its fits file is written : they only depend on its name.
+
+    Parameters:
+    -----------
+    fits_file : str
+        Path of the product FITS file ('<...>.<product_id>.fits'), which does not have to exist yet.
+    output_dir : str, optional
+        Directory to save the generated XML file. Default is "generated/".
+    header_defaults : dict, optional
+        Preloaded 'header.default.*' values (see load_header_defaults).
+    instance_id : str, optional
+        Instance ID of the file names.
+
+    Returns:
+    --------
+    dict
+        {'fits_file', 'xml_file', 'catalog_name', 'header_defaults', 'product_id'}, see write_product and publish_product.
+    """
+    catalog_name = catalog_name_of(fits_file)
+    header_defaults = dict(load_header_defaults() if header_defaults is None else header_defaults)
+    header_defaults.update(header_dates())
+    # the template is read now, the rendering only substitutes the values
+    load_template(catalog_name)
+    return {
+        "fits_file": fits_file,
+        "xml_file": f"{output_dir}{xml_file_name(catalog_name, instance_id=instance_id)}",
+        "catalog_name": catalog_name,
+        "header_defaults": header_defaults,
+        "product_id": str(uuid.uuid4()),
+    }
+
+def write_product(prepared, footprint=None):
+    """
+    Render and save the XML of a product prepared by prepare_product, with the footprint of its rows.
+
+    Parameters:
+    -----------
+    prepared : dict
+        Returned by prepare_product.
+    footprint : dict, optional
+        {'ra_min', 'ra_max', 'dec_min', 'dec_max'} of the catalog, written as its <SpatialCoverage>.
+
+    Returns:
+    --------
+    str
+        Path of the XML file.
+    """
+    xml = render(prepared["catalog_name"], os.path.basename(prepared["xml_file"]),
+                 header_defaults=prepared["header_defaults"], product_id=prepared["product_id"],
+                 vertices=footprint_polygon(footprint) if footprint else None)
+    with open(prepared["xml_file"], "w", encoding="UTF-8") as f:
+        f.write(xml)
+    return prepared["xml_file"]
+
+def publish_product(prepared):
+    """
+    Rename the fits file of a product to the name of its XML file and save its header dates and paths in the yaml file.
+
+    Parameters:
+    -----------
+    prepared : dict
+        Returned by prepare_product.
+
+    Returns:
+    --------
+    str
+        New path of the fits file.
+    """
+    xml_file = prepared["xml_file"]
+    os.rename(prepared["fits_file"], xml_file.replace(".xml", ".fits"))
+    update_config({
+        'header.default.ExpirationDate': prepared["header_defaults"]['header.default.ExpirationDate'],
+        'header.default.CreationDate': prepared["header_defaults"]['header.default.CreationDate'],
+        'product_id': names_database[prepared["catalog_name"]]['id'],
+        'xml_filepath': xml_file,
+        'fits_filepath': xml_file.replace(".xml", ".fits"),
+    })
+    return xml_file.replace(".xml", ".fits")
+
+def main(fits_file, output_dir="./generated/", header_defaults=None, instance_id=None, footprint=None):
+    """
+    Create and save the catalog xml from the template of its type, without the EDEN bindings.
+
+    Parameters:
+    -----------
+    fits_file : str
+        Path to the input FITS file.
+    output_dir : str, optional
+        Directory to save the generated XML file. Default is "generated/".
+    header_defaults : dict, optional
+        Preloaded 'header.default.*' values (see load_header_defaults).
+    instance_id : str, optional
+        Instance ID of the file names, to tell apart the products of the same type (e.g. the tiles of a catalog).
+    footprint : dict, optional
+        {'ra_min', 'ra_max', 'dec_min', 'dec_max'} of the catalog, written as its <SpatialCoverage>.
+
+    Returns:
+    --------
+    str
+        Path of the generated XML file (the fits file is renamed alongside), None if the generation failed.
+    """
+    xml_files = main_batch([fits_file], output_dir, header_defaults=header_defaults,
+                           instance_ids=[instance_id], footprints=[footprint], quiet=True)
+    if xml_files[0] is not None:
+        print(f"\033[1mXML file generated successfully and saved in '{output_dir}' dir  \( ﾟヮﾟ)/\033[0m \n")
+    return xml_files[0]
+
+def main_batch(fits_files, output_dir="./generated/", header_defaults=None, instance_ids=None, footprints=None,
+               quiet=False):
+    """
+    Create and save the catalog xml of many fits files from the templates.
+
+    Parameters:
+    -----------
+    fits_files : list
+        Paths of the input FITS files.
+    output_dir : str, optional
+        Directory to save the generated XML files. Default is "generated/".
+    header_defaults : dict, optional
+        Preloaded 'header.default.*' values (see load_header_defaults).
+    instance_ids : list, optional
+        Instance ID of the file names of every fits file (e.g. the tiles of a catalog).
+    footprints : list, optional
+        {'ra_min', 'ra_max', 'dec_min', 'dec_max'} of every fits file, written as its <SpatialCoverage>.
+    quiet : bool, optional
+        Do not print the summary.
+
+    Returns:
+    --------
+    list
+        Path of the generated XML file of every fits file (the fits files are renamed alongside),
+        None for the ones whose generation failed.
+    """
+    instance_ids = instance_ids or [None] * len(fits_files)
+    footprints = footprints or [None] * len(fits_files)
+    if header_defaults is None:
+        header_defaults = load_header_defaults()
+
+    # the dates of the header are shared by the batch, and saved in the yaml file as xmlgenerator does
+    header_defaults = dict(header_defaults)
+    header_defaults.update(header_dates())
+
+    xml_files = []
+    names = set()
+    for fits_file, instance_id, footprint in zip(fits_files, instance_ids, footprints):
+        try:
+            catalog_name = catalog_name_of(fits_file)
+            filename = xml_file_name(catalog_name, instance_id=instance_id)
+            if filename in names:
+                raise ValueError(f"Duplicate XML file name {filename}, give every product its own instance ID.")
+            names.add(filename)
+            xml = render(catalog_name, filename, header_defaults=header_defaults,
+                         vertices=footprint_polygon(footprint) if footprint else None)
+            xml_file = f"{output_dir}{filename}"
+            with open(xml_file, "w", encoding="UTF-8") as f:
+                f.write(xml)
+            # renaming the fits file to the xml file name
+            os.rename(fits_file, xml_file.replace(".xml", ".fits"))
+            xml_files.append(xml_file)
+        except Exception as e:
+            print(f"Error creating catalog of {fits_file}: {e}")
+            xml_files.append(None)
+
+    done = [(fits_file, xml_file) for fits_file, xml_file in zip(fits_files, xml_files) if xml_file is not None]
+    if done:
+        fits_file, xml_file = done[-1]
+        update_config({
+            'header.default.ExpirationDate': header_defaults['header.default.ExpirationDate'],
+            'header.default.CreationDate': header_defaults['header.default.CreationDate'],
+            'product_id': names_database[catalog_name_of(fits_file)]['id'],
+            'xml_filepath': xml_file,
+            'fits_filepath': xml_file.replace(".xml", ".fits"),
+        })
+
+    if not quiet:
+        print(f"\033[1m{len(done)} of {len(fits_files)} XML files generated and saved in '{output_dir}' dir\033[0m \n")
+
+    return xml_files
+
+if __name__ == "__main__":
+    # Parse command-line arguments
+    parser = argparse.ArgumentParser(description="Create and save a catalog xml from a FITS file with the templates.")
+    parser.add_argument("fits_file", type=str, help="Path to the input FITS file.")
+    parser.add_argument("--output_dir",
+                        type=str,
+                        default="./generated/",
+                        help="Directory to save the generated XML file."
+                        )
+    args = parser.parse_args()
+
+    main(args.fits_file, args.output_dir)
@@ -0,0 +1,123 @@
+import datetime
+import shutil
+import types
+
+import numpy as np
+import pytest
+from astropy.io import fits
+
+POSCATALOG = "le3.id.vmpz.output.poscatalog"
+PROXYSHEARCATALOG = "le3.id.vmpz.output.proxyshearcatalog"
+
+# columns of the catalogs of the FitsDataModel written by 'data_model' : (name, TFORM, unit)
+CATALOG_COLUMNS = {
+    POSCATALOG: [("OBJECT_ID", "K", "NA"), ("RIGHT_ASCENSION", "D", "deg"), ("DECLINATION", "D", "deg"),
+                 ("Z", "E", "NA"), ("WEIGHT", "E", "NA"), ("FLAG", "J", "NA")],
+    PROXYSHEARCATALOG: [("OBJECT_ID", "K", "NA"), ("RIGHT_ASCENSION", "D", "deg"), ("DECLINATION", "D", "deg"),
+                        ("G1", "E", "NA"), ("G2", "E", "NA"), ("WEIGHT", "E", "NA")],
+}
+
+def pytest_addoption(parser):
+    parser.addoption("--require-xml-references", action="store_true",
+                     help="fail instead of skipping the template tests of the product types without a reference xml "
+                          "(for the EDEN environment, where the references can be generated)")
+
+def write_data_model(path, catalogs=CATALOG_COLUMNS, version="0.1"):
+    xml = ['<?xml version="1.0"?>', "<FitsFormatList>"]
+    for product_id, columns in catalogs.items():
+        keywords = ["XTENSION", "BITPIX", "NAXIS", "NAXIS1", "NAXIS2", "PCOUNT", "GCOUNT", "TFIELDS", "EXTNAME"]
+        for i in range(1, len(columns) + 1):
+            keywords += [f"TTYPE{i}", f"TFORM{i}", f"TUNIT{i}"]
+        xml.append(f'<FitsFormat id="{product_id}" version="{version}"><GenericHDU name="PRIMARY"><HeaderKeywordList>')
+        xml += [f'<BooleanKeyword name="{keyword}" comment="c"/>' for keyword in ("SIMPLE", "BITPIX", "NAXIS", "EXTEND")]
+        xml.append('<StringKeyword name="TELESCOP" comment="telescope"/>')
+        xml.append('</HeaderKeywordList></GenericHDU><TableHDU name="CATALOG"><HeaderKeywordList>')
+        xml += [f'<StringKeyword name="{keyword}" comment="c {keyword}"/>' for keyword in keywords]
+        xml.append("</HeaderKeywordList><ColumnList>")
+        xml += [f'<Column name="{name}" unit="{unit}" format="{fmt}" comment="{name} col"/>' for name, fmt, unit in columns]
+        xml.append("</ColumnList></TableHDU></FitsFormat>")
+    xml.append("</FitsFormatList>")
+    path.write_text("\n".join(xml))
+    return str(path)
+
+def sim_columns(nrows, seed=1):
+    rng = np.random.default_rng(seed)
+    return {
+        "OBJECT_ID": ("K", np.arange(nrows, dtype=np.int64)),
+        "SHE_RA": ("D", rng.uniform(0, 360, nrows)),
+        "SHE_DEC": ("D", rng.uniform(-90, 90, nrows)),
+        "MER_RA": ("D", rng.uniform(0, 360, nrows)),
+        "MER_DEC": ("D", rng.uniform(-90, 90, nrows)),
+        "SHE_G1": ("D", rng.normal(0, 0.3, nrows)),
+        "SHE_G2": ("D", rng.normal(0, 0.3, nrows)),
+        "SHE_WEIGHT": ("D", rng.uniform(0, 1, nrows)),
+        "PHZ_WEIGHT": ("D", rng.uniform(0, 1, nrows)),
+        "Z": ("D", rng.uniform(0, 3, nrows)),
+        "FLAG": ("K", rng.integers(0, 10, nrows)),
+    }
+
+def write_sim(path, nrows=1000, seed=1, **columns):
+    """
+    Write a simulated input : the columns of sim_columns, replaced or extended by 'columns' (name=(TFORM, values)).
+    """
+    columns = dict(sim_columns(nrows, seed), **columns)
+    primary = fits.PrimaryHDU()
+    primary.header["TELESCOP"] = "Euclid"
+    table = fits.BinTableHDU.from_columns([fits.Column(name=name, format=fmt, array=values)
+                                          for name, (fmt, values) in columns.items()])
+    fits.HDUList([primary, table]).writeto(path)
+    return str(path)
+
+def generate(data_model, input_fits_path, output_dir, product_id=POSCATALOG, processor=None, **options):
+    """
+    Convert an input with FitsProcessor.generate_catalog (without XML), the result is checked to be there.
+    """
+    from script import FitsProcessor
+
+    result = (processor or FitsProcessor()).generate_catalog(product_id, input_fits_path, output_path=f"{output_dir}/",
+                                                             fitsDataModel_path=data_model, PAT=True, **options)
+    assert result is not None
+    return result
+
+def read_rows(path, hdu=1):
+    with fits.open(path) as hdul:
+        return np.array(hdul[hdu].data)
+
+@pytest.fixture
+def data_model(tmp_path):
+    return write_data_model(tmp_path / "FitsDataModel.xml")
+
+@pytest.fixture
+def sim_input(tmp_path):
+    return write_sim(tmp_path / "sim.fits")
+
+@pytest.fixture(autouse=True)
+def run_in_tmp_path(tmp_path, monkeypatch):
+    # the conversions write their extracted data model to './generated/'
+    monkeypatch.chdir(tmp_path)
+
+@pytest.fixture(autouse=True)
+def checksum_date(monkeypatch):
+    # the checksum cards are dated to the second (by astropy in the primary header), the products compared
+    # byte for byte get the same date
+    import conversion
+    from astropy.io.fits.hdu.base import _ValidHDU
+
+    class FrozenDatetime(datetime.datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return cls(2024, 1, 1, tzinfo=tz)
+
+    monkeypatch.setattr(conversion, "datetime", types.SimpleNamespace(datetime=FrozenDatetime))
+    monkeypatch.setattr(_ValidHDU, "_get_timestamp", lambda hdu: FrozenDatetime.now().isoformat()[:19])
+
+@pytest.fixture(autouse=True)
+def header_config(tmp_path_factory, monkeypatch):
+    # the XML of a product saves its dates and paths in XmlHeaderDetails.yaml, a copy is updated instead
+    import xmltemplate
+
+    config_file = str(tmp_path_factory.mktemp("config") / "XmlHeaderDetails.yaml")
+    shutil.copyfile(xmltemplate.CONFIG_FILE, config_file)
+    update_config = xmltemplate.update_config
+    monkeypatch.setattr(xmltemplate, "update_config", lambda updates, config_file=config_file: update_config(updates, config_file))
+    return config_file
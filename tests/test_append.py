@@ -0,0 +1,87 @@
+import os
+
+import numpy as np
+import pytest
+from astropy.io import fits
+
+from conftest import generate, read_rows, sim_columns, write_sim
+from script import FitsProcessor
+
+def write_prefix(path, nrows, total=1500, seed=1):
+    """
+    Write the first 'nrows' rows of a simulated input of 'total' rows (replacing the file if it exists).
+    """
+    if os.path.exists(path):
+        os.remove(path)
+    columns = {name: (fmt, values[:nrows]) for name, (fmt, values) in sim_columns(total, seed).items()}
+    return write_sim(path, **columns)
+
+def test_appended_product_matches_a_full_conversion(tmp_path, data_model):
+    input_path = write_prefix(tmp_path / "sim.fits", 1000)
+    (tmp_path / "out").mkdir()
+    result = generate(data_model, input_path, tmp_path / "out", checksum=True, fingerprint=True)
+
+    write_prefix(input_path, 1500)
+    appended = FitsProcessor().append_catalog(result["product_id"], input_path, result["fits_file"], result,
+                                              fitsDataModel_path=data_model)
+
+    (tmp_path / "full").mkdir()
+    full = generate(data_model, input_path, tmp_path / "full", checksum=True)
+    assert appended["nrows"] == full["nrows"] == 1500 and appended["appended"] == 500
+    assert appended["stats"] == full["stats"]
+    assert np.array_equal(read_rows(result["fits_file"]), read_rows(full["fits_file"]))
+    with fits.open(result["fits_file"], checksum=True) as hdul:
+        assert hdul[1].header["DATASUM"] == fits.getheader(full["fits_file"], 1)["DATASUM"]
+    assert not [name for name in os.listdir(tmp_path / "out") if name.startswith(".")]
+
+def test_fingerprint_mismatch_leaves_the_product_unchanged(tmp_path, data_model):
+    input_path = write_prefix(tmp_path / "sim.fits", 1000)
+    result = generate(data_model, input_path, tmp_path, fingerprint=True)
+    with open(result["fits_file"], "rb") as f:
+        product = f.read()
+
+    # same header, different first rows
+    write_prefix(input_path, 1500, seed=2)
+    with pytest.raises(ValueError, match="differ from the converted input"):
+        FitsProcessor().append_catalog(result["product_id"], input_path, result["fits_file"], result,
+                                       fitsDataModel_path=data_model)
+    with open(result["fits_file"], "rb") as f:
+        assert f.read() == product
+
+def test_failed_append_leaves_the_product_unchanged(tmp_path, data_model, monkeypatch):
+    input_path = write_prefix(tmp_path / "sim.fits", 1000)
+    result = generate(data_model, input_path, tmp_path, fingerprint=True)
+    with open(result["fits_file"], "rb") as f:
+        product = f.read()
+    write_prefix(input_path, 1500)
+
+    import conversion
+    convert = conversion.ConversionPlan.convert
+    calls = []
+    def failing_convert(plan, chunk, **kwargs):
+        # the first chunk is written, the second one fails
+        calls.append(len(chunk))
+        if len(calls) == 2:
+            raise OSError("disk full")
+        return convert(plan, chunk, **kwargs)
+    monkeypatch.setattr(conversion.ConversionPlan, "convert", failing_convert)
+    with pytest.raises(OSError):
+        FitsProcessor().append_catalog(result["product_id"], input_path, result["fits_file"], result,
+                                       fitsDataModel_path=data_model, chunk_rows=100)
+
+    with open(result["fits_file"], "rb") as f:
+        assert f.read() == product
+    assert not [name for name in os.listdir(tmp_path) if name.startswith(".")]
+
+def test_append_without_recorded_stats_computes_them_from_the_product(tmp_path, data_model):
+    input_path = write_prefix(tmp_path / "sim.fits", 1000)
+    result = generate(data_model, input_path, tmp_path, fingerprint=True)
+    write_prefix(input_path, 1500)
+
+    previous = {"input_fingerprint": result["input_fingerprint"]}
+    appended = FitsProcessor().append_catalog(result["product_id"], input_path, result["fits_file"], previous,
+                                              fitsDataModel_path=data_model)
+
+    rows = read_rows(result["fits_file"])
+    assert appended["stats"]["RIGHT_ASCENSION"] == [rows["RIGHT_ASCENSION"].min(), rows["RIGHT_ASCENSION"].max()]
+    assert appended["stats"]["OBJECT_ID"] == [0, 1499]
@@ -0,0 +1,175 @@
+import glob
+import json
+import multiprocessing
+import os
+import threading
+import time
+
+import pytest
+
+from batch import Batch, batch_status, create_batch, run_batch
+from conftest import POSCATALOG
+from worker import Worker
+
+def make_batch(batch_dir, ntasks):
+    return create_batch(str(batch_dir), [{"input_fits_path": f"tile_{i}.fits"} for i in range(ntasks)])
+
+def make_stale(batch, task_id, age=3600):
+    then = time.time() - age
+    os.utime(batch.claim_path(task_id), (then, then))
+
+def result_of(batch, task_id, status="done", elapsed=1.0):
+    now = time.time()
+    return {"id": task_id, "status": status, "worker": batch.worker_id, "host": batch.host, "attempt": 1,
+            "claimed_at": now - elapsed, "finished_at": now, "elapsed": elapsed, "report": {}}
+
+def claim_all(batch_dir, worker_id, start):
+    # every worker waits for the others, then claims all the tasks in the same order
+    batch = Batch(batch_dir, worker_id=worker_id)
+    start.wait()
+    claimed = [task["id"] for task in batch.tasks if batch.claim(task["id"]) is not None]
+    with open(os.path.join(batch_dir, f"{worker_id}.json"), "w") as file:
+        json.dump(claimed, file)
+    return claimed
+
+def test_create_batch(tmp_path):
+    tasks = create_batch(str(tmp_path / "batch"), [{"input_fits_path": "a.fits"}, {"id": "b", "input_fits_path": "b.fits"}])
+    assert [task["id"] for task in tasks] == ["task-00000", "b"]
+    assert Batch(str(tmp_path / "batch")).tasks == tasks
+    with pytest.raises(FileExistsError):
+        make_batch(tmp_path / "batch", 1)
+    with pytest.raises(ValueError):
+        create_batch(str(tmp_path / "other"), [{"id": "a"}, {"id": "a"}])
+
+def test_concurrent_workers_claim_every_task_once_in_threads(tmp_path):
+    make_batch(tmp_path, 50)
+    start = threading.Barrier(8)
+    claimed = [None] * 8
+
+    def run(i):
+        claimed[i] = claim_all(str(tmp_path), f"worker-{i}", start)
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    ids = sorted(task_id for task_ids in claimed for task_id in task_ids)
+    assert ids == [f"task-{i:05d}" for i in range(50)]
+    # no temporary file of the claims is left
+    assert len(os.listdir(tmp_path / "claims")) == 50
+
+def test_concurrent_workers_claim_every_task_once_in_processes(tmp_path):
+    make_batch(tmp_path, 50)
+    context = multiprocessing.get_context("fork")
+    start = context.Barrier(4)
+    processes = [context.Process(target=claim_all, args=(str(tmp_path), f"worker-{i}", start)) for i in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    assert all(process.exitcode == 0 for process in processes)
+
+    # every claim is the one of the worker that claimed it
+    claimed = {}
+    for i in range(4):
+        for task_id in json.loads((tmp_path / f"worker-{i}.json").read_text()):
+            claimed.setdefault(task_id, []).append(f"worker-{i}")
+    assert sorted(claimed) == [f"task-{i:05d}" for i in range(50)]
+    assert all(len(workers) == 1 for workers in claimed.values())
+    for task_id, (worker_id,) in claimed.items():
+        assert json.loads((tmp_path / "claims" / f"{task_id}.claim").read_text())["worker"] == worker_id
+
+def test_stale_claim_is_reclaimed(tmp_path):
+    make_batch(tmp_path, 1)
+    first = Batch(str(tmp_path), worker_id="first", stale_after=0.5)
+    second = Batch(str(tmp_path), worker_id="second", stale_after=0.5)
+    assert first.claim("task-00000")["attempt"] == 1
+
+    # a live claim is not taken over, and a heartbeat keeps it alive
+    assert second.claim("task-00000") is None
+    make_stale(first, "task-00000")
+    first.heartbeat()
+    assert second.claim("task-00000") is None
+
+    make_stale(first, "task-00000")
+    claim = second.claim("task-00000")
+    assert claim is not None and claim["worker"] == "second" and claim["attempt"] == 2
+    assert os.listdir(tmp_path / "claims") == ["task-00000.claim"]
+
+    # the first worker finds out that it lost the task : it writes no result, the second one does
+    assert not first.owns("task-00000")
+    assert "task-00000" in first.lost
+    assert not first.finish("task-00000", result_of(first, "task-00000"))
+    assert not first.is_finished("task-00000")
+    assert second.finish("task-00000", result_of(second, "task-00000"))
+    assert json.loads((tmp_path / "results" / "task-00000.json").read_text())["worker"] == "second"
+    assert os.listdir(tmp_path / "claims") == []
+
+    # a finished task is not claimed again
+    assert Batch(str(tmp_path), stale_after=0.5).claim("task-00000") is None
+
+def test_lost_claim_drops_the_outputs(tmp_path, data_model, sim_input):
+    output_dir = str(tmp_path / "out")
+    create_batch(str(tmp_path / "batch"), [{"input_fits_path": sim_input, "output_dir": output_dir,
+                                            "product_ids": [POSCATALOG, "le3.id.vmpz.output.proxyshearcatalog"]}])
+    first = Batch(str(tmp_path / "batch"), worker_id="first", stale_after=0.5)
+    task = first.tasks[0]
+    first.claim(task["id"])
+    # another worker reclaims the task while the first one converts it
+    make_stale(first, task["id"])
+    Batch(str(tmp_path / "batch"), worker_id="second", stale_after=0.5).claim(task["id"])
+
+    worker = Worker(data_model, max_workers=1, xml=False)
+    worker.preload()
+    try:
+        report = worker.run_job(task, run_id="1-test", keep_outputs=lambda: first.owns(task["id"]))
+    finally:
+        worker.shutdown()
+
+    assert report["status"] == "failed"
+    assert [product["status"] for product in report["products"]] == ["dropped", "dropped"]
+    assert all(product["fits_file"] is None for product in report["products"])
+    # neither the staging dir nor any product or index is left in the output dir
+    assert os.listdir(output_dir) == []
+    assert not first.finish(task["id"], result_of(first, task["id"]))
+
+def test_run_batch_converts_every_task(tmp_path, data_model, sim_input):
+    output_dir = str(tmp_path / "out")
+    create_batch(str(tmp_path / "batch"), [{"input_fits_path": sim_input, "output_dir": output_dir, "product_ids": [POSCATALOG],
+                                            "output_name": f"tile_{i}", "product_index": False} for i in range(3)])
+    worker = Worker(data_model, max_workers=2, xml=False)
+    worker.preload()
+    try:
+        summary = run_batch(str(tmp_path / "batch"), worker, heartbeat_interval=0.05, stale_after=5, poll_interval=0.01)
+    finally:
+        worker.shutdown()
+
+    assert (summary["done"], summary["failed"], summary["lost"]) == (3, 0, 0)
+    assert sorted(glob.glob(f"{output_dir}/*.fits")) == [f"{output_dir}/tile_{i}.{POSCATALOG}.fits" for i in range(3)]
+    status = batch_status(str(tmp_path / "batch"))
+    assert (status["done"], status["pending"], status["running"]) == (3, 0, 0)
+    assert status["workers"][summary["worker"]]["tasks"] == 3
+
+def test_batch_status_counts(tmp_path):
+    make_batch(tmp_path, 6)
+    batch = Batch(str(tmp_path), worker_id="w1")
+    other = Batch(str(tmp_path), worker_id="w2")
+    for task_id, status, owner in (("task-00000", "done", batch), ("task-00001", "done", other),
+                                   ("task-00002", "failed", batch)):
+        owner.claim(task_id)
+        assert owner.finish(task_id, result_of(owner, task_id, status=status, elapsed=2.0))
+    batch.claim("task-00003")
+    batch.claim("task-00004")
+    make_stale(batch, "task-00004")
+
+    status = batch_status(str(tmp_path), stale_after=60)
+    assert {key: status[key] for key in ("tasks", "done", "failed", "running", "stale", "pending")} == \
+        {"tasks": 6, "done": 2, "failed": 1, "running": 1, "stale": 1, "pending": 1}
+    assert status["workers"] == {"w1": {"tasks": 2, "busy_seconds": 4.0}, "w2": {"tasks": 1, "busy_seconds": 2.0}}
+    assert status["elapsed"] >= 2.0 and status["tasks_per_second"] > 0
+
+    make_batch(tmp_path / "empty", 2)
+    status = batch_status(str(tmp_path / "empty"))
+    assert status["pending"] == 2 and status["elapsed"] == 0.0 and status["tasks_per_second"] is None
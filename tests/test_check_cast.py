@@ -0,0 +1,42 @@
+import warnings
+
+import numpy as np
+import pytest
+
+from conversion import check_cast
+
+INTEGER_TYPES = [">i2", ">i4", ">i8", "u1", ">u8"]
+
+@pytest.mark.parametrize("float_type", [np.float64, np.float32])
+@pytest.mark.parametrize("integer_type", INTEGER_TYPES)
+def test_float_to_integer_upper_bound(float_type, integer_type):
+    info = np.iinfo(integer_type)
+    # the power of two above the maximum (2**63 for >i8, which the maximum rounds up to as a float) does not fit
+    limit = float_type(info.max + 1)
+    below = np.nextafter(limit, float_type(0))
+    values = np.array([info.min, below, limit, np.inf], dtype=float_type)
+
+    with pytest.raises(ValueError, match="1 out of range"):
+        check_cast(values, np.dtype(integer_type), name="FLAG")
+
+    clipped, issues = check_cast(values, np.dtype(integer_type), policy="clip")
+    assert issues["out_of_range"] == 1 and issues["non_finite"] == 1
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        # the clipped values cast without overflow, to the largest integers below the limit
+        cast = clipped.astype(integer_type)
+    assert cast[0] == info.min
+    assert cast[1] == cast[2] == cast[3] == min(int(below), info.max)
+
+@pytest.mark.parametrize("integer_type", INTEGER_TYPES)
+def test_float_to_integer_in_range(integer_type):
+    info = np.iinfo(integer_type)
+    values = np.array([info.min, 0, np.nextafter(float(info.max + 1), 0)], dtype=np.float64)
+    values = np.trunc(values)
+
+    assert check_cast(values, np.dtype(integer_type))[1] == {}
+
+def test_integer_to_float_precision():
+    values = np.array([2**53, 2**53 + 1, -(2**53) - 1], dtype=np.int64)
+    assert check_cast(values, np.dtype(">f8"), policy="warn")[1] == {"precision_loss": 2}
+    assert check_cast(values[:1], np.dtype(">f8"))[1] == {}
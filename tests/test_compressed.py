@@ -0,0 +1,92 @@
+import bz2
+import gzip
+import shutil
+
+import numpy as np
+import pytest
+from astropy.io import fits
+
+import conversion
+from conftest import generate, sim_columns, write_sim
+from script import FitsProcessor
+
+OPENERS = {"gzip": gzip.open, "bzip2": bz2.open}
+
+# the decompressors of the tests : the modules, or the standard tools in place of pigz / lbzip2
+DECOMPRESSORS = {"gzip": (("gzip", "-dc"),), "bzip2": (("bzip2", "-dc"),)}
+
+def compress(path, compression):
+    compressed = f"{path}.{'gz' if compression == 'gzip' else 'bz2'}"
+    with open(path, "rb") as source, OPENERS[compression](compressed, "wb") as target:
+        shutil.copyfileobj(source, target)
+    return compressed
+
+def write_multi(path):
+    tables = [fits.BinTableHDU.from_columns([fits.Column(name=name, format=fmt, array=values)
+                                             for name, (fmt, values) in sim_columns(nrows, seed).items()])
+              for nrows, seed in ((300, 1), (457, 2))]
+    fits.HDUList([fits.PrimaryHDU(), *tables]).writeto(path)
+    return str(path)
+
+@pytest.fixture(params=["module", "external"])
+def decompressor(request, monkeypatch):
+    if request.param == "module":
+        monkeypatch.setattr(conversion, "DECOMPRESSORS", {"gzip": (), "bzip2": ()})
+    else:
+        if not all(shutil.which(command[0][0]) for command in DECOMPRESSORS.values()):
+            pytest.skip("gzip / bzip2 are not installed")
+        monkeypatch.setattr(conversion, "DECOMPRESSORS", DECOMPRESSORS)
+    return request.param
+
+def convert_both(data_model, plain, compressed, tmp_path, **options):
+    products = []
+    for name, input_path in (("plain", plain), ("compressed", compressed)):
+        (tmp_path / name).mkdir()
+        result = generate(data_model, input_path, tmp_path / name, **options)
+        with open(result["fits_file"], "rb") as file:
+            products.append(file.read())
+    return products
+
+@pytest.mark.parametrize("compression", ["gzip", "bzip2"])
+def test_compressed_product_is_the_uncompressed_product(tmp_path, data_model, decompressor, compression):
+    plain = write_sim(tmp_path / "sim.fits", nrows=1001)
+    assert conversion.compression(compress(plain, compression)) == compression
+
+    plain_product, compressed_product = convert_both(data_model, plain, compress(plain, compression), tmp_path,
+                                                     chunk_rows=128, checksum=True)
+    assert compressed_product == plain_product
+
+@pytest.mark.parametrize("compression", ["gzip", "bzip2"])
+def test_compressed_hdus_are_the_uncompressed_hdus(tmp_path, data_model, decompressor, compression):
+    plain = write_multi(tmp_path / "multi.fits")
+    compressed = compress(plain, compression)
+
+    plain_product, compressed_product = convert_both(data_model, f"{plain}[*]", f"{compressed}[*]", tmp_path,
+                                                     chunk_rows=100)
+    assert compressed_product == plain_product
+    assert fits.getheader(tmp_path / "compressed" / "le3.id.vmpz.output.poscatalog.fits", 1)["NAXIS2"] == 757
+
+def test_processor_converts_several_compressed_inputs(tmp_path, data_model):
+    # the primary header of a compressed input is read without opening the file with astropy
+    processor = FitsProcessor()
+    for seed in (1, 2):
+        compressed = compress(write_sim(tmp_path / f"sim_{seed}.fits", seed=seed), "gzip")
+        (tmp_path / str(seed)).mkdir()
+        result = generate(data_model, compressed, tmp_path / str(seed), processor=processor)
+        assert result["nrows"] == 1000
+    assert processor.hdu_list is None
+
+@pytest.mark.filterwarnings("ignore::UserWarning")
+def test_processor_converts_a_join_after_an_input(tmp_path, data_model):
+    # the inputs of the join are compressed, so none of them is opened with astropy
+    processor = FitsProcessor()
+    sim = write_sim(tmp_path / "sim.fits")
+    extra = fits.BinTableHDU.from_columns([fits.Column(name="OBJECT_ID", format="K", array=np.arange(1000)[::-1]),
+                                           fits.Column(name="EXTRA", format="D", array=np.arange(1000.0))])
+    extra.writeto(tmp_path / "extra.fits")
+    join = {"join": [compress(sim, "gzip"), compress(str(tmp_path / "extra.fits"), "bzip2")], "tmp_dir": str(tmp_path)}
+
+    for name, input_path in (("plain", sim), ("join", join)):
+        (tmp_path / name).mkdir()
+        assert generate(data_model, input_path, tmp_path / name, processor=processor)["nrows"] == 1000
+        assert processor.hdu_list is None
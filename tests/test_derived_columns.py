@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from conftest import PROXYSHEARCATALOG, generate, read_rows, sim_columns, write_sim
+from script import FitsProcessor
+
+MAPPINGS = f"""
+{PROXYSHEARCATALOG}:
+  RIGHT_ASCENSION: "mod(SHE_RA + 180, 360)"
+  DECLINATION: SHE_DEC
+  G1: "-SHE_G1"
+  G2: "where(SHE_G2 > 0, SHE_G2, 0)"
+  WEIGHT: "cos(radians(DECLINATION)) * SHE_WEIGHT"
+"""
+
+def test_derived_columns(tmp_path, data_model):
+    input_path = write_sim(tmp_path / "sim.fits", nrows=2000)
+    mappings = tmp_path / "column_mappings.yaml"
+    mappings.write_text(MAPPINGS)
+    columns = {name: values for name, (_, values) in sim_columns(2000).items()}
+
+    # several chunks, so that the buffers of the expressions are reused
+    result = generate(data_model, input_path, tmp_path, product_id=PROXYSHEARCATALOG, chunk_rows=300,
+                      processor=FitsProcessor(column_mappings_path=str(mappings)))
+
+    rows = read_rows(result["fits_file"])
+    assert len(rows) == 2000
+    assert np.array_equal(rows["RIGHT_ASCENSION"], np.mod(columns["SHE_RA"] + 180, 360))
+    assert np.array_equal(rows["DECLINATION"], columns["SHE_DEC"])
+    # G1, G2 and WEIGHT are single precision ('E') in the catalog
+    assert rows["G1"].dtype == ">f4"
+    assert np.array_equal(rows["G1"], (-columns["SHE_G1"]).astype(np.float32))
+    assert np.array_equal(rows["G2"], np.where(columns["SHE_G2"] > 0, columns["SHE_G2"], 0).astype(np.float32))
+    assert np.array_equal(rows["WEIGHT"], (np.cos(np.radians(columns["SHE_DEC"])) * columns["SHE_WEIGHT"]).astype(np.float32))
+    assert result["stats"]["G2"][0] == 0
+
+def test_expression_over_an_unknown_column_fails(tmp_path, data_model, capsys):
+    input_path = write_sim(tmp_path / "sim.fits", nrows=10)
+    mappings = tmp_path / "column_mappings.yaml"
+    mappings.write_text(f"{PROXYSHEARCATALOG}:\n  G1: \"-SHE_G3\"\n")
+
+    result = FitsProcessor(column_mappings_path=str(mappings)).generate_catalog(
+        PROXYSHEARCATALOG, input_path, output_path=f"{tmp_path}/", fitsDataModel_path=data_model, PAT=True)
+
+    assert result is None
+    assert "Unknown column 'SHE_G3' in the expression of G1" in capsys.readouterr().out
+
+@pytest.mark.parametrize("policy, expected", [("clip", [-2147483648, 5, 2147483647]), ("warn", None)])
+def test_derived_values_go_through_the_cast_policy(tmp_path, data_model, policy, expected):
+    input_path = write_sim(tmp_path / "sim.fits", nrows=3, SHE_G1=("D", np.array([-1e12, 5, 1e12])))
+    mappings = tmp_path / "column_mappings.yaml"
+    # FLAG is a 32 bits integer ('J') of the poscatalog
+    mappings.write_text("le3.id.vmpz.output.poscatalog:\n  FLAG: \"SHE_G1 * 1\"\n")
+
+    with pytest.warns(UserWarning, match="Column FLAG"):
+        result = generate(data_model, input_path, tmp_path, processor=FitsProcessor(column_mappings_path=str(mappings),
+                                                                                    cast_policy=policy))
+
+    assert result["cast_issues"]["FLAG"] == {"out_of_range": 2}
+    if expected is not None:
+        assert read_rows(result["fits_file"])["FLAG"].tolist() == expected
+
+    # the default policy refuses them
+    result = FitsProcessor(column_mappings_path=str(mappings)).generate_catalog(
+        "le3.id.vmpz.output.poscatalog", input_path, output_path=f"{tmp_path}/", fitsDataModel_path=data_model, PAT=True)
+    assert result is None
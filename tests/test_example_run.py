@@ -0,0 +1,41 @@
+import importlib.util
+import os
+
+import pytest
+
+from conftest import POSCATALOG, write_sim
+from example_run import run_stages
+
+def eden_available():
+    try:
+        return importlib.util.find_spec("ST_DM_FilenameProvider") is not None
+    except ImportError:
+        return False
+
+@pytest.mark.skipif(eden_available(), reason="the EDEN environment generates the XML")
+def test_stages_without_eden_generate_the_fits_only(tmp_path, data_model, capsys):
+    input_path = write_sim(tmp_path / "sim.fits", nrows=1000)
+    output_dir = f"{tmp_path}/out/"
+    os.makedirs(output_dir)
+
+    result = run_stages({}, input_path, POSCATALOG, data_model, output_dir=output_dir,
+                        processor_options={"xml_renderer": "eden", "product_index": False})
+
+    assert result is not None
+    assert "xml_file" not in result
+    assert result["fits_file"] == f"{output_dir}{POSCATALOG}.fits" and os.path.exists(result["fits_file"])
+    assert set(result["stages"]) == {"fits_data_model", "processor", "schema", "conversion", "publish"}
+    assert "XML generation skipped, the EDEN environment is not available" in capsys.readouterr().out
+
+def test_stages_with_the_template_renderer(tmp_path, data_model):
+    input_path = write_sim(tmp_path / "sim.fits", nrows=1000)
+    output_dir = f"{tmp_path}/out/"
+    os.makedirs(output_dir)
+
+    result = run_stages({}, input_path, POSCATALOG, data_model, output_dir=output_dir,
+                        processor_options={"xml_renderer": "template", "product_index": False})
+
+    assert result is not None
+    assert os.path.exists(result["xml_file"]) and os.path.exists(result["fits_file"])
+    assert result["fits_file"] == result["xml_file"].replace(".xml", ".fits")
+    assert {"xml_header", "xml"} <= set(result["stages"])
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from conftest import generate, read_rows, sim_columns, write_sim
+from expressions import Expression
+from script import FitsProcessor
+
+@pytest.mark.parametrize("text", [
+    "__import__('os').system('true')",
+    "SHE_G1.__class__",
+    "SHE_G1[0]",
+    "(lambda: 1)()",
+    "open('/etc/passwd')",
+    "sqrt(SHE_G1, out=SHE_G2)",
+    "[SHE_G1]",
+    "SHE_G1 if Z else SHE_G2",
+    "Z in (1, 2)",
+])
+def test_unsupported_syntax_is_rejected(text):
+    with pytest.raises(ValueError, match="Unsupported"):
+        Expression(text)
+
+def test_invalid_expression_is_rejected():
+    with pytest.raises(ValueError, match="Invalid expression"):
+        Expression("Z >")
+
+def test_chained_comparisons_and_boolean_operators():
+    rng = np.random.default_rng(4)
+    values = {"Z": rng.uniform(0, 3, 1000), "WEIGHT": rng.uniform(-1, 1, 1000)}
+    expression = Expression("WEIGHT > 0 and 0.5 <= Z < 1.5 or not isfinite(WEIGHT)")
+
+    assert expression.names == ["WEIGHT", "Z"]
+    mask = expression.evaluate(values)
+    expected = ((values["WEIGHT"] > 0) & (0.5 <= values["Z"]) & (values["Z"] < 1.5)) | ~np.isfinite(values["WEIGHT"])
+    assert np.array_equal(mask, expected)
+    # a chain evaluates every comparator once : 1 < Z > 2 is (1 < Z) and (Z > 2)
+    assert np.array_equal(Expression("1 < Z > 2").evaluate(values), values["Z"] > 2)
+
+def test_reused_buffers_give_the_result_of_every_chunk():
+    rng = np.random.default_rng(5)
+    g1, g2 = rng.normal(size=(2, 1000))
+    expression = Expression("sqrt(G1**2 + G2**2) * 2")
+    buffers = {}
+    for start in (0, 400, 800):
+        chunk = {"G1": g1[start:start + 400], "G2": g2[start:start + 400]}
+        result = expression.evaluate(chunk, buffers=buffers)
+        assert np.array_equal(result, np.sqrt(chunk["G1"]**2 + chunk["G2"]**2) * 2)
+
+def test_row_filter_keeps_the_matching_rows(tmp_path, data_model):
+    input_path = write_sim(tmp_path / "sim.fits", nrows=5000)
+    columns = sim_columns(5000)
+
+    # WEIGHT is the renamed PHZ_WEIGHT of the poscatalog
+    result = generate(data_model, input_path, tmp_path, row_filter="WEIGHT > 0.25 and 1 < Z < 2", chunk_rows=700)
+
+    selected = (columns["PHZ_WEIGHT"][1] > 0.25) & (columns["Z"][1] > 1) & (columns["Z"][1] < 2)
+    rows = read_rows(result["fits_file"])
+    assert result["nrows"] == len(rows) == np.count_nonzero(selected)
+    assert np.array_equal(rows["OBJECT_ID"], columns["OBJECT_ID"][1][selected])
+
+def test_row_filter_on_an_unknown_column_fails(tmp_path, data_model, capsys):
+    input_path = write_sim(tmp_path / "sim.fits", nrows=100)
+    result = FitsProcessor().generate_catalog("le3.id.vmpz.output.poscatalog", input_path, output_path=f"{tmp_path}/",
+                                              fitsDataModel_path=data_model, PAT=True, row_filter="MAG < 24")
+    assert result is None
+    assert "Unknown column 'MAG'" in capsys.readouterr().out
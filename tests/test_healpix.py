@@ -0,0 +1,71 @@
+import json
+
+import numpy as np
+import pytest
+
+from conftest import read_rows, sim_columns, write_sim
+from healpix import ang2pix_nested, check_nside, npix
+from script import FitsProcessor
+
+def uniform_sphere(n, seed=6):
+    rng = np.random.default_rng(seed)
+    return rng.uniform(0, 360, n), np.degrees(np.arcsin(rng.uniform(-1, 1, n)))
+
+def test_base_pixels():
+    # centres of the 12 base pixels : 4 around the north cap, 4 on the equator, 4 around the south cap
+    ra = np.array([45, 135, 225, 315, 0, 90, 180, 270, 45, 135, 225, 315], dtype=float)
+    dec = np.degrees(np.arcsin(np.array([2 / 3] * 4 + [0] * 4 + [-2 / 3] * 4))) + np.array([1] * 4 + [0] * 4 + [-1] * 4)
+    assert np.array_equal(ang2pix_nested(1, ra, dec), np.arange(12))
+
+@pytest.mark.parametrize("nside", [1, 2, 4, 1024])
+def test_poles_and_ra_wrap(nside):
+    # the north pole is the last sub-pixel of its base pixel, the south pole the first one
+    assert ang2pix_nested(nside, [0, 100, 360], [90, 90, 90]).tolist() == [nside**2 - 1, 2 * nside**2 - 1, nside**2 - 1]
+    assert ang2pix_nested(nside, [0, 100], [-90, -90]).tolist() == [8 * nside**2, 9 * nside**2]
+    ra, dec = uniform_sphere(1000)
+    assert np.array_equal(ang2pix_nested(nside, ra + 360, dec), ang2pix_nested(nside, ra, dec))
+    assert np.array_equal(ang2pix_nested(nside, ra - 360, dec), ang2pix_nested(nside, ra, dec))
+
+def test_nested_pixels_are_subdivided_in_four():
+    ra, dec = uniform_sphere(100000)
+    for nside in (1, 2, 4, 8, 64):
+        assert np.array_equal(ang2pix_nested(2 * nside, ra, dec) // 4, ang2pix_nested(nside, ra, dec))
+
+def test_pixels_have_equal_areas():
+    nside = 4
+    ra, dec = uniform_sphere(480000)
+    counts = np.bincount(ang2pix_nested(nside, ra, dec), minlength=npix(nside))
+    expected = len(ra) / npix(nside)
+    assert len(counts) == npix(nside)
+    # ~5 sigma of a Poisson count
+    assert np.abs(counts - expected).max() < 5 * np.sqrt(expected)
+
+@pytest.mark.parametrize("nside", [0, 3, 2**30, 2.0])
+def test_invalid_nside(nside):
+    with pytest.raises(ValueError):
+        check_nside(nside)
+
+def test_partitioned_catalog_tiles(tmp_path, data_model):
+    input_path = write_sim(tmp_path / "sim.fits", nrows=3000)
+    columns = sim_columns(3000)
+    ra, dec = columns["MER_RA"][1], columns["MER_DEC"][1]
+
+    result = FitsProcessor().generate_partitioned_catalog("le3.id.vmpz.output.poscatalog", input_path,
+                                                          output_path=f"{tmp_path}/", fitsDataModel_path=data_model,
+                                                          nside=2, PAT=True, chunk_rows=500, max_open_files=5)
+
+    pixels = ang2pix_nested(2, ra, dec)
+    counts = np.bincount(pixels, minlength=npix(2))
+    assert result["nrows"] == 3000
+    assert sorted(result["tiles"]) == np.flatnonzero(counts).tolist()
+    for pixel, tile in result["tiles"].items():
+        rows = read_rows(tile["fits_file"])
+        assert tile["nrows"] == len(rows) == counts[pixel]
+        # the rows of a tile keep the input order
+        assert np.array_equal(rows["OBJECT_ID"], np.flatnonzero(pixels == pixel))
+        assert tile["footprint"]["dec_min"] == rows["DECLINATION"].min()
+    with open(result["index_file"]) as f:
+        index = json.load(f)
+    assert index["ordering"] == "NESTED" and index["nside"] == 2
+    assert {int(pixel): tile["nrows"] for pixel, tile in index["tiles"].items()} == \
+        {pixel: tile["nrows"] for pixel, tile in result["tiles"].items()}
@@ -0,0 +1,38 @@
+import os
+
+import numpy as np
+import pytest
+
+from conftest import POSCATALOG, read_rows, write_sim
+from ingest import Manifest, ingest
+
+def test_inputs_of_the_same_name_in_different_directories_get_their_own_product(tmp_path, data_model):
+    input_dir = tmp_path / "raw"
+    for name, seed in (("a", 1), ("b", 2)):
+        (input_dir / name).mkdir(parents=True)
+        write_sim(input_dir / name / "tile.fits", seed=seed)
+    output_dir = str(tmp_path / "generated") + os.sep
+
+    summary = ingest(str(input_dir), [POSCATALOG], output_dir=output_dir, fitsDataModel_path=data_model, xml=False)
+
+    assert summary["converted"] == 2 and summary["failed"] == 0
+    records = Manifest(os.path.join(output_dir, "ingest_manifest.json")).products.values()
+    products = {os.path.relpath(record["input"], input_dir): record["fits_file"] for record in records}
+    assert products == {os.path.join(name, "tile.fits"): os.path.join(output_dir, name, f"tile.{POSCATALOG}.fits")
+                        for name in ("a", "b")}
+    for name in ("a", "b"):
+        rows = read_rows(products[os.path.join(name, "tile.fits")])
+        assert np.array_equal(rows["RIGHT_ASCENSION"], read_rows(input_dir / name / "tile.fits")["MER_RA"])
+
+def test_manifest_refuses_two_inputs_for_one_product(tmp_path):
+    manifest = Manifest(str(tmp_path / "manifest.json"))
+    product = {"product_id": POSCATALOG, "fits_file": str(tmp_path / "tile.fits"), "xml_file": None}
+    manifest.record("old|v|p", "raw/a/tile.fits", "v", product)
+
+    # a new content of the same input replaces its record
+    manifest.record("new|v|p", "raw/a/tile.fits", "v", product)
+    assert list(manifest.products) == ["new|v|p"]
+
+    with pytest.raises(ValueError, match="raw/a/tile.fits"):
+        manifest.record("other|v|p", "raw/b/tile.fits", "v", product)
+    assert list(manifest.products) == ["new|v|p"]
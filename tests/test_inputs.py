@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+from astropy.io import fits
+
+from conftest import generate, read_rows, sim_columns
+from conversion import TableStream, open_input, parse_input_spec
+
+def sim_table(nrows, seed, name=None):
+    return fits.BinTableHDU.from_columns([fits.Column(name=column, format=fmt, array=values)
+                                         for column, (fmt, values) in sim_columns(nrows, seed).items()], name=name)
+
+def write_hdus(path, *tables):
+    fits.HDUList([fits.PrimaryHDU(), *tables]).writeto(path)
+    return str(path)
+
+def test_input_specifications(tmp_path):
+    for name in ("tile_2.fits", "tile_0.fits", "tile_1.fits"):
+        write_hdus(tmp_path / name, sim_table(10, 0), sim_table(10, 1, name="SHE"))
+
+    assert parse_input_spec(str(tmp_path / "tile_*.fits")) == [(str(tmp_path / f"tile_{i}.fits"), 1) for i in range(3)]
+    assert parse_input_spec([f"{tmp_path}/tile_0.fits[2]", f"{tmp_path}/tile_1.fits[SHE]", f"{tmp_path}/tile_2.fits[*]"]) == \
+        [(str(tmp_path / "tile_0.fits"), 2), (str(tmp_path / "tile_1.fits"), "SHE"), (str(tmp_path / "tile_2.fits"), "*")]
+    with pytest.raises(FileNotFoundError):
+        parse_input_spec(str(tmp_path / "missing_*.fits"))
+    with pytest.raises(FileNotFoundError):
+        parse_input_spec(str(tmp_path / "missing.fits"))
+
+def test_hdus_are_streamed_one_after_the_other(tmp_path):
+    path = write_hdus(tmp_path / "multi.fits", sim_table(300, 1), sim_table(500, 2), fits.ImageHDU(), sim_table(200, 3))
+    layout = open_input(f"{path}[*]")
+    assert isinstance(layout, TableStream) and layout.nrows == 1000
+
+    expected = np.concatenate([read_rows(path, hdu) for hdu in (1, 2, 4)])
+    chunks = list(layout.iter_chunks(chunk_rows=128, start=250, stop=900))
+    # a chunk never spans two HDUs
+    assert [len(chunk) for chunk in chunks] == [50, 128, 128, 128, 116, 100]
+    assert np.concatenate(chunks).tobytes() == expected[250:900].tobytes()
+
+def test_tables_with_other_columns_are_not_merged(tmp_path):
+    other = fits.BinTableHDU.from_columns([fits.Column(name="OBJECT_ID", format="J", array=np.arange(10))])
+    path = write_hdus(tmp_path / "multi.fits", sim_table(10, 1), other)
+    with pytest.raises(ValueError, match="do not match"):
+        open_input(f"{path}[*]")
+
+def test_product_of_several_inputs(tmp_path, data_model):
+    paths = [write_hdus(tmp_path / f"tile_{i}.fits", sim_table(400 + i, i)) for i in range(3)]
+    paths.append(write_hdus(tmp_path / "extra.fits", sim_table(5, 9, name="EXTRA"), sim_table(7, 10, name="MER")))
+    (tmp_path / "out").mkdir()
+
+    result = generate(data_model, [str(tmp_path / "tile_*.fits"), f"{paths[3]}[MER]"], tmp_path / "out", chunk_rows=100)
+
+    rows = read_rows(result["fits_file"])
+    inputs = [read_rows(path) for path in paths[:3]] + [read_rows(paths[3], "MER")]
+    assert result["nrows"] == len(rows) == 400 + 401 + 402 + 7
+    assert np.array_equal(rows["RIGHT_ASCENSION"], np.concatenate([table["MER_RA"] for table in inputs]))
+    assert np.array_equal(rows["OBJECT_ID"], np.concatenate([table["OBJECT_ID"] for table in inputs]))
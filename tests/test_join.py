@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+from astropy.io import fits
+
+from join import open_join
+
+def write_table(path, **columns):
+    fits.BinTableHDU.from_columns([fits.Column(name=name, format=fmt, array=values)
+                                   for name, (fmt, values) in columns.items()]).writeto(path)
+    return str(path)
+
+def read_join(spec):
+    table = open_join(spec)
+    with pytest.warns(UserWarning):
+        rows = np.concatenate(list(table.iter_chunks(chunk_rows=1000)))
+    return table, rows
+
+def inputs(tmp_path, nrows=20000):
+    rng = np.random.default_rng(3)
+    left_ids = rng.integers(0, nrows, nrows)
+    right_ids = rng.permutation(nrows)[:nrows // 2]
+    left = write_table(tmp_path / "mer.fits", OBJECT_ID=("K", left_ids), SEQ=("K", np.arange(nrows)))
+    right = write_table(tmp_path / "she.fits", OBJECT_ID=("K", right_ids), SHE_E1=("D", right_ids * 0.5))
+    return left_ids, right_ids, left, right
+
+def test_left_join_keeps_every_row_of_the_first_input(tmp_path):
+    left_ids, right_ids, left, right = inputs(tmp_path)
+
+    table, rows = read_join({"join": [left, right], "how": "left", "memory_mb": 0.1, "tmp_dir": str(tmp_path)})
+
+    assert len(rows) == len(left_ids) == table.nrows
+    assert np.array_equal(np.sort(rows["SEQ"]), np.arange(len(left_ids)))
+    assert np.array_equal(rows["OBJECT_ID"], left_ids[rows["SEQ"]])
+    matched = np.isin(rows["OBJECT_ID"], right_ids)
+    assert np.array_equal(rows["SHE_E1"][matched], rows["OBJECT_ID"][matched] * 0.5)
+    assert np.isnan(rows["SHE_E1"][~matched]).all()
+    assert table.report["inputs"][0]["unmatched"] == np.count_nonzero(~matched)
+    assert table.report["inputs"][0]["duplicates"] == 0
+
+def test_inner_join_keeps_the_first_row_of_a_repeated_key(tmp_path):
+    left_ids, right_ids, left, right = inputs(tmp_path)
+
+    table, rows = read_join({"join": [left, right], "memory_mb": 0.1, "tmp_dir": str(tmp_path)})
+
+    common = np.intersect1d(left_ids, right_ids)
+    assert np.array_equal(rows["OBJECT_ID"], common)
+    first_rows = {key: seq for seq, key in reversed(list(enumerate(left_ids)))}
+    assert [first_rows[key] for key in rows["OBJECT_ID"]] == list(rows["SEQ"])
+    assert table.report["inputs"][0]["duplicates"] == len(left_ids) - len(np.unique(left_ids))
+
+def test_float_keys_are_rejected(tmp_path):
+    left = write_table(tmp_path / "a.fits", OBJECT_ID=("D", [1.0, np.nan]), A=("E", [1, 2]))
+    right = write_table(tmp_path / "b.fits", OBJECT_ID=("D", [1.0, 2.0]), B=("E", [1, 2]))
+    with pytest.raises(ValueError, match="integer"):
+        open_join({"join": [left, right]})
@@ -0,0 +1,80 @@
+import io
+import os
+
+import numpy as np
+import pytest
+from astropy.io import fits
+
+import sharding
+from conftest import POSCATALOG, generate, read_rows, sim_columns, write_sim
+from script import FitsProcessor
+
+class Stream(io.RawIOBase):
+    """
+    Binary stream that cannot seek, like a pipe or a socket.
+    """
+
+    def __init__(self):
+        self.data = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.data += memoryview(data).cast("B")
+        return len(data)
+
+def write_overflowing_input(tmp_path, nrows=5000):
+    # FLAG is a 32 bits integer of the poscatalog : the last row does not fit
+    flag = sim_columns(nrows)["FLAG"][1].copy()
+    flag[-1] = 2**40
+    return write_sim(tmp_path / "overflow.fits", nrows=nrows, FLAG=("K", flag))
+
+@pytest.mark.parametrize("processes", [1, 2])
+def test_failed_conversion_leaves_the_previous_product(tmp_path, data_model, monkeypatch, processes):
+    monkeypatch.setattr(sharding, "MIN_SHARD_ROWS", 1000)
+    output = str(tmp_path / "out" / "product.fits")
+    os.makedirs(os.path.dirname(output))
+    with open(output, "wb") as f:
+        f.write(b"previous product")
+
+    with pytest.raises(ValueError, match="Cannot cast column FLAG"):
+        FitsProcessor().write_catalog(output, POSCATALOG, write_overflowing_input(tmp_path), fitsDataModel_path=data_model,
+                                      chunk_rows=500, processes=processes)
+
+    with open(output, "rb") as f:
+        assert f.read() == b"previous product"
+    assert os.listdir(tmp_path / "out") == ["product.fits"]
+
+def test_failed_conversion_does_not_create_the_product(tmp_path, data_model):
+    result = FitsProcessor().generate_catalog(POSCATALOG, write_overflowing_input(tmp_path), output_path=f"{tmp_path}/out_",
+                                              fitsDataModel_path=data_model, PAT=True, chunk_rows=500)
+    assert result is None
+    assert not [name for name in os.listdir(tmp_path) if "out_" in name]
+
+@pytest.mark.parametrize("options", [{}, {"checksum": True}, {"row_filter": "Z > 1", "checksum": True}])
+def test_streamed_product_is_the_written_product(tmp_path, data_model, options):
+    input_path = write_sim(tmp_path / "sim.fits", nrows=3000)
+    with open(generate(data_model, input_path, tmp_path, chunk_rows=700, **options)["fits_file"], "rb") as f:
+        product = f.read()
+
+    buffer = io.BytesIO()
+    result = FitsProcessor().stream_catalog(POSCATALOG, input_path, buffer, fitsDataModel_path=data_model, chunk_rows=700,
+                                            **options)
+    assert buffer.getvalue() == product
+    assert result["nrows"] == fits.getheader(io.BytesIO(product), 1)["NAXIS2"]
+
+    # a stream that cannot seek gets the product spooled when its header is only known at the end
+    stream = Stream()
+    FitsProcessor().stream_catalog(POSCATALOG, input_path, stream, fitsDataModel_path=data_model, chunk_rows=700,
+                                   sort_dir=str(tmp_path), **options)
+    assert bytes(stream.data) == product
+
+def test_catalog_hdulist(tmp_path, data_model):
+    input_path = write_sim(tmp_path / "sim.fits", nrows=3000)
+    product = generate(data_model, input_path, tmp_path, checksum=True)["fits_file"]
+
+    with FitsProcessor().catalog_hdulist(POSCATALOG, input_path, fitsDataModel_path=data_model, checksum=True) as hdul:
+        assert len(hdul) == 2
+        assert hdul[1].header == fits.getheader(product, 1)
+        assert np.array_equal(hdul[1].data, read_rows(product))
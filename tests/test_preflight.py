@@ -0,0 +1,81 @@
+import gzip
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+from conftest import POSCATALOG, PROXYSHEARCATALOG, generate, write_sim
+from preflight import preflight, print_preflight
+
+def run_preflight(inputs, data_model, tmp_path, product_ids=(POSCATALOG,), **options):
+    return preflight(inputs, list(product_ids), fitsDataModel_path=data_model,
+                     calibration_file=str(tmp_path / "no_calibration.json"), **options)
+
+def test_report_of_a_conversion(tmp_path, data_model):
+    input_path = write_sim(tmp_path / "sim.fits", nrows=5000)
+
+    [report] = run_preflight([input_path], data_model, tmp_path)
+
+    assert report["status"] == "ok" and report["errors"] == [] and not report["calibrated"]
+    assert report["nrows"] == 5000
+    assert report["missing"] == [] and "SHE_G1" in report["excess"]
+    casts = {cast["column"]: cast for cast in report["casts"]}
+    assert (casts["Z"]["from"], casts["Z"]["to"], casts["Z"]["narrowing"]) == ("D", "E", True)
+    assert (casts["FLAG"]["from"], casts["FLAG"]["to"], casts["FLAG"]["narrowing"]) == ("K", "J", True)
+    assert "OBJECT_ID" not in casts
+    # the projected size is the size of the product
+    assert report["output_bytes"] == os.path.getsize(generate(data_model, input_path, tmp_path)["fits_file"])
+
+@pytest.mark.parametrize("options, error", [
+    ({"row_filter": "MAG < 24"}, "Unknown column 'MAG'"),
+    ({"row_filter": "Z >"}, "Invalid expression"),
+    ({"row_filter": "Z > 1", "processes": 2}, "Several processes cannot be used with row_filter"),
+    ({"sort_by": "NAME"}, "NAME"),
+    ({"nside": 3}, "Invalid NSIDE 3"),
+])
+def test_options_the_conversion_would_stop_on(tmp_path, data_model, options, error):
+    input_path = write_sim(tmp_path / "sim.fits", nrows=100)
+
+    [report] = run_preflight([input_path], data_model, tmp_path, **options)
+
+    assert report["status"] == "fail"
+    assert any(error in message for message in report["errors"]), report["errors"]
+
+def test_inputs_the_conversion_would_stop_on(tmp_path, data_model, capsys):
+    good = write_sim(tmp_path / "good.fits", nrows=100)
+    text_ra = write_sim(tmp_path / "text_ra.fits", nrows=100, MER_RA=("10A", np.array(["12.5"] * 100)))
+    compressed = str(tmp_path / "good.fits.gz")
+    with open(good, "rb") as source, gzip.open(compressed, "wb") as target:
+        shutil.copyfileobj(source, target)
+    inputs = [good, text_ra, str(tmp_path / "missing.fits"), compressed]
+
+    reports = run_preflight(inputs, data_model, tmp_path, product_ids=(POSCATALOG, "le3.id.vmpz.output.unknown"),
+                            processes=2)
+
+    status = {(os.path.basename(report["input"]), report["product_id"].rsplit(".", 1)[-1]): report for report in reports}
+    assert len(reports) == 8
+    assert status["good.fits", "poscatalog"]["status"] == "ok"
+    assert "Cannot convert column RIGHT_ASCENSION from 10A to D" in status["text_ra.fits", "poscatalog"]["errors"][0]
+    assert "does not exist" in status["missing.fits", "poscatalog"]["errors"][0]
+    assert status["good.fits.gz", "poscatalog"]["errors"] == [
+        "Several processes cannot read a compressed input, it is decompressed as a stream."]
+    assert all(status[name, "unknown"]["status"] == "fail" for name in ("good.fits", "text_ra.fits"))
+
+    print_preflight(reports)
+    out = capsys.readouterr().out
+    assert out.count("[FAIL]") == 7 and out.count("[OK]") == 1
+    assert "1 of 8 conversions ready, 7 would fail" in out
+
+def test_missing_columns_are_reported(tmp_path, data_model):
+    input_path = write_sim(tmp_path / "sim.fits", nrows=10)
+    mappings = tmp_path / "column_mappings.yaml"
+    # no G1 / G2 in the input without the mapping of the proxy shear catalog
+    mappings.write_text(f"{PROXYSHEARCATALOG}: {{}}\n")
+
+    [report] = run_preflight([input_path], data_model, tmp_path, product_ids=(PROXYSHEARCATALOG,),
+                             column_mappings_path=str(mappings))
+
+    assert report["status"] == "ok"
+    assert report["missing"] == ["RIGHT_ASCENSION", "DECLINATION", "G1", "G2", "WEIGHT"]
+    assert report["warnings"][0].startswith("Columns missing from the input, written as zeros")
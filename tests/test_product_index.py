@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+
+from product_index import ProductIndex
+
+def overlaps(low, high, query_low, query_high):
+    return high >= query_low and low <= query_high
+
+@pytest.fixture
+def index(tmp_path):
+    with ProductIndex(str(tmp_path / "product_index.sqlite")) as index:
+        yield index
+
+@pytest.fixture
+def footprints(index):
+    rng = np.random.default_rng(10)
+    footprints = {}
+    for i in range(300):
+        ra_min, dec_min = rng.uniform(0, 350), rng.uniform(-90, 80)
+        footprint = {"ra_min": ra_min, "ra_max": ra_min + rng.uniform(0, 10),
+                     "dec_min": dec_min, "dec_max": dec_min + rng.uniform(0, 10)}
+        fits_file = f"/products/{i:03d}.fits"
+        index.register(fits_file, "le3.id.vmpz.output.poscatalog", nrows=i, footprint=footprint)
+        footprints[fits_file] = footprint
+    return footprints
+
+def files(products):
+    return [product["fits_file"] for product in products]
+
+@pytest.mark.parametrize("ra, dec", [((10, 40), (-20, 5)), ((0, 360), (-90, 90)), ((355, 5), (-90, 90)),
+                                     ((340, 20), (0, 30)), ((100, 100), (-30, -30))])
+def test_region_queries(index, footprints, ra, dec):
+    expected = []
+    for fits_file, footprint in sorted(footprints.items()):
+        if ra[0] <= ra[1]:
+            in_ra = overlaps(footprint["ra_min"], footprint["ra_max"], *ra)
+        else:
+            # the range wraps around RA = 0 : [ra_min, 360) or [0, ra_max]
+            in_ra = overlaps(footprint["ra_min"], footprint["ra_max"], ra[0], 360) or \
+                overlaps(footprint["ra_min"], footprint["ra_max"], 0, ra[1])
+        if in_ra and overlaps(footprint["dec_min"], footprint["dec_max"], *dec):
+            expected.append(fits_file)
+
+    assert files(index.query(ra=ra, dec=dec)) == expected
+
+def test_wrapping_ra_query_finds_both_sides(index):
+    index.register("/products/east.fits", "le3.id.vmpz.output.poscatalog",
+                   footprint={"ra_min": 355.0, "ra_max": 359.5, "dec_min": 0.0, "dec_max": 1.0})
+    index.register("/products/west.fits", "le3.id.vmpz.output.poscatalog",
+                   footprint={"ra_min": 0.5, "ra_max": 3.0, "dec_min": 0.0, "dec_max": 1.0})
+    index.register("/products/middle.fits", "le3.id.vmpz.output.poscatalog",
+                   footprint={"ra_min": 150.0, "ra_max": 160.0, "dec_min": 0.0, "dec_max": 1.0})
+
+    assert files(index.query(ra=(358, 1))) == ["/products/east.fits", "/products/west.fits"]
+    assert files(index.query(ra=(359.8, 0.2))) == []
+    # not a wrapping range : the products overlapping [1, 358]
+    assert files(index.query(ra=(1, 358))) == ["/products/east.fits", "/products/middle.fits", "/products/west.fits"]
+
+def test_healpix_cell_queries(index):
+    # the 192 tiles of NSIDE 4
+    for pixel in range(192):
+        index.register(f"/tiles/hpx4-{pixel:03d}.fits", "le3.id.vmpz.output.poscatalog", nside=4, pixel=pixel)
+
+    # a coarser cell holds the 4 (NSIDE 2) or 16 (NSIDE 1) tiles of its NESTED sub-pixels
+    assert files(index.query(nside=2, pixel=5)) == [f"/tiles/hpx4-{pixel:03d}.fits" for pixel in range(20, 24)]
+    assert files(index.query(nside=1, pixel=11)) == [f"/tiles/hpx4-{pixel:03d}.fits" for pixel in range(176, 192)]
+    # a finer cell is inside one tile
+    assert files(index.query(nside=4, pixel=77)) == ["/tiles/hpx4-077.fits"]
+    assert files(index.query(nside=16, pixel=77 * 16 + 9)) == ["/tiles/hpx4-077.fits"]
+
+def test_attribute_queries(index, footprints, tmp_path):
+    index.register("/products/shear.fits", "le3.id.vmpz.output.shearcatalog", nrows=5, dm_version="9.2.3")
+
+    assert files(index.query(catalog_type="shearcatalog")) == ["/products/shear.fits"]
+    assert files(index.query(dm_version="9.2.3", product_id="le3.id.vmpz.output.shearcatalog")) == ["/products/shear.fits"]
+    assert files(index.query(min_rows=298)) == ["/products/298.fits", "/products/299.fits"]
+    assert len(index.query(product_id="le3.id.vmpz.output.poscatalog", limit=7)) == 7
+    assert index.count() == 301
+
+    # registering a product again replaces it
+    index.register("/products/shear.fits", "le3.id.vmpz.output.shearcatalog", nrows=6)
+    assert [product["nrows"] for product in index.query(catalog_type="shearcatalog")] == [6]
+
+    product = tmp_path / "kept.fits"
+    product.write_bytes(b"")
+    index.register(str(product), "le3.id.vmpz.output.poscatalog")
+    assert index.remove_missing() == 301
+    assert files(index.query()) == [str(product)]
+
+def test_unknown_fields_are_refused(index):
+    with pytest.raises(ValueError, match="ra_center"):
+        index.register("/products/a.fits", "le3.id.vmpz.output.poscatalog", ra_center=10)
@@ -0,0 +1,120 @@
+import io
+import json
+
+import pytest
+
+import progress as progress_module
+import sharding
+from conftest import generate, write_sim
+from progress import Progress, ProgressBar, log_progress, make_progress
+from script import FitsProcessor
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(progress_module.time, "monotonic", clock)
+    return clock
+
+def test_events_are_sent_at_most_every_interval(clock):
+    events = []
+    progress = Progress("conversion", total_rows=1000, callback=events.append, label="cat", interval=2.0)
+    progress.add(100, 800)
+    clock.now += 1.0
+    progress.add(100, 800)
+    assert events == []
+
+    clock.now += 1.5
+    progress.add(100, 800)
+    assert len(events) == 1
+    event = events[0]
+    assert event["stage"] == "conversion" and event["label"] == "cat"
+    assert event["rows"] == 300 and event["total_rows"] == 1000 and event["bytes"] == 2400
+    assert event["fraction"] == pytest.approx(0.3)
+    assert event["elapsed"] == pytest.approx(2.5)
+    assert event["rows_per_second"] == pytest.approx(120)
+    assert event["eta"] == pytest.approx(700 / 120)
+    assert not event["done"]
+
+    # the next event is 'interval' seconds after the last one
+    clock.now += 1.0
+    progress.add(100)
+    assert len(events) == 1
+
+    progress.close()
+    assert len(events) == 2
+    assert events[-1]["done"] and events[-1]["eta"] == 0.0 and events[-1]["rows"] == 400
+
+def test_events_without_the_number_of_rows(clock):
+    events = []
+    progress = Progress("sort", callback=events.append, interval=0)
+    progress.set(50)
+    progress.close()
+    assert [event["rows"] for event in events] == [50, 50]
+    assert all(event["fraction"] is None and event["eta"] is None for event in events)
+
+def test_no_callback_sends_nothing():
+    progress = Progress("conversion", total_rows=10, interval=0)
+    progress.add(10)
+    progress.close()
+    assert progress.rows == 10
+
+def test_make_progress_modes(monkeypatch):
+    callback = lambda event: None
+    assert make_progress(callback) is callback
+    assert make_progress(None) is None
+    assert make_progress("none") is None
+    assert make_progress("log") is log_progress
+    assert isinstance(make_progress("bar"), ProgressBar)
+    monkeypatch.setattr("sys.stderr", io.StringIO())
+    assert make_progress("auto") is log_progress
+    with pytest.raises(ValueError):
+        make_progress("verbose")
+
+def test_log_and_bar_output():
+    event = Progress("conversion", total_rows=4, label="cat").event(done=True)
+    stream = io.StringIO()
+    log_progress(event, stream=stream)
+    line = json.loads(stream.getvalue())
+    assert line["event"] == "progress" and line["stage"] == "conversion" and line["done"]
+
+    stream = io.StringIO()
+    ProgressBar(stream=stream, width=10)(dict(event, rows=2, fraction=0.5, done=False, eta=3))
+    assert stream.getvalue().startswith("\rcat conversion [#####     ]  50.0% 2/4 rows")
+    assert stream.getvalue().endswith("ETA 3s\033[K")
+
+def completed_stages(events):
+    return {event["stage"]: event for event in events if event["done"]}
+
+def test_conversion_reports_its_stages(tmp_path, data_model, sim_input):
+    events = []
+    result = generate(data_model, sim_input, tmp_path, processor=FitsProcessor(progress=events.append),
+                      chunk_rows=300, sort_by="DECLINATION")
+    done = completed_stages(events)
+    assert set(done) == {"conversion", "sort"}
+    for stage in ("conversion", "sort"):
+        assert done[stage]["rows"] == done[stage]["total_rows"] == result["nrows"] == 1000
+        assert done[stage]["fraction"] == 1.0 and done[stage]["bytes"] > 0
+        assert done[stage]["label"] == "le3.id.vmpz.output.poscatalog"
+    assert all(event["rows"] <= 1000 for event in events)
+
+def test_row_filter_reports_the_rows_read(tmp_path, data_model, sim_input):
+    events = []
+    result = generate(data_model, sim_input, tmp_path, processor=FitsProcessor(progress=events.append),
+                      row_filter="FLAG < 5")
+    assert result["nrows"] < 1000
+    assert completed_stages(events)["conversion"]["rows"] == 1000
+
+def test_sharded_conversion_reports_the_rows_of_all_the_processes(tmp_path, data_model, monkeypatch):
+    monkeypatch.setattr(sharding, "MIN_SHARD_ROWS", 1000)
+    input_path = write_sim(tmp_path / "sim.fits", nrows=4000)
+    events = []
+    generate(data_model, input_path, tmp_path, processor=FitsProcessor(progress=events.append), processes=2)
+    done = completed_stages(events)["conversion"]
+    assert done["rows"] == done["total_rows"] == 4000
@@ -0,0 +1,67 @@
+import numpy as np
+from astropy.io import fits
+
+from conftest import generate, read_rows, write_sim
+from conversion import ConversionPlan, TableLayout
+from helpers import load_column_mappings
+from pipeline import BufferPool
+from script import FitsProcessor
+
+def write_table(path, nrows=1000):
+    rng = np.random.default_rng(7)
+    columns = [fits.Column(name="A", format="K", array=np.arange(nrows)),
+               fits.Column(name="B", format="D", array=rng.normal(size=nrows)),
+               fits.Column(name="C", format="10A", array=np.array([f"row{i}" for i in range(nrows)])),
+               fits.Column(name="D", format="E", array=rng.normal(size=nrows)),
+               fits.Column(name="E", format="2J", array=rng.integers(0, 100, (nrows, 2)))]
+    fits.BinTableHDU.from_columns(columns).writeto(path)
+    return str(path)
+
+def test_byte_ranges_merge_adjacent_columns(tmp_path):
+    layout = TableLayout.from_file(write_table(tmp_path / "table.fits"))
+
+    ranges, dtype = layout.byte_ranges(["D", "A", "B", "A"])
+
+    # A (8 bytes) and B (8 bytes) are adjacent, C (10 bytes) is skipped, D (4 bytes) follows it
+    assert ranges == [(0, 16), (26, 30)]
+    assert dtype.names == ("A", "B", "D") and dtype.itemsize == 20
+    assert layout.byte_ranges(["E"]) == ([(30, 38)], np.dtype([("E", ">i4", (2,))]))
+
+def test_projected_chunks_hold_the_values_of_the_columns(tmp_path):
+    path = write_table(tmp_path / "table.fits")
+    layout = TableLayout.from_file(path)
+    rows = read_rows(path)
+    columns = ["E", "B", "A"]
+
+    chunks = list(layout.iter_chunks(chunk_rows=300, start=100, stop=900, columns=columns))
+    assert [len(chunk) for chunk in chunks] == [300, 300, 200]
+    projected = np.concatenate(chunks)
+    for name in columns:
+        assert np.array_equal(projected[name], rows[name][100:900])
+
+    pool = BufferPool(lambda: np.empty(300, dtype=layout.chunk_dtype(columns)), 2)
+    for begin, chunk in zip(range(0, 1000, 300), layout.iter_chunks(chunk_rows=300, columns=columns, pool=pool)):
+        assert np.array_equal(chunk["E"], rows["E"][begin:begin + 300])
+        pool.release(chunk)
+
+def test_only_the_used_input_columns_are_read(tmp_path, data_model):
+    layout = TableLayout.from_file(write_sim(tmp_path / "sim.fits", nrows=10))
+    product_id = "le3.id.vmpz.output.poscatalog"
+    _, columns_info = FitsProcessor().load_schema(product_id, fitsDataModel_path=data_model)
+    plan = ConversionPlan(layout, columns_info, mapping=load_column_mappings(product_id), verbose=False)
+
+    assert plan.input_columns() == ["OBJECT_ID", "MER_RA", "MER_DEC", "Z", "PHZ_WEIGHT", "FLAG"]
+    # the filter uses an input column that is not in the catalog, and a renamed one
+    assert plan.input_columns("SHE_G1 > 0 and WEIGHT > 0.5") == ["OBJECT_ID", "MER_RA", "MER_DEC", "Z", "PHZ_WEIGHT",
+                                                                 "FLAG", "SHE_G1"]
+
+def test_unused_columns_do_not_change_the_product(tmp_path, data_model):
+    narrow = write_sim(tmp_path / "narrow.fits", nrows=2000)
+    wide = write_sim(tmp_path / "wide.fits", nrows=2000, NOTES=("1000A", np.array(["x" * 1000] * 2000)))
+    for name in ("narrow", "wide"):
+        (tmp_path / name).mkdir()
+
+    products = [generate(data_model, path, tmp_path / name, chunk_rows=300, row_filter="SHE_G1 > 0")["fits_file"]
+                for name, path in (("narrow", narrow), ("wide", wide))]
+
+    assert read_rows(products[0]).tobytes() == read_rows(products[1]).tobytes()
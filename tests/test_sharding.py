@@ -0,0 +1,49 @@
+import warnings
+
+import numpy as np
+import pytest
+from astropy.io import fits
+
+import sharding
+from conftest import PROXYSHEARCATALOG, generate, write_sim
+from sharding import shard_ranges
+
+def test_shard_ranges_cover_the_rows():
+    assert shard_ranges(10, 3) == [(0, 3), (3, 6), (6, 10)]
+    assert shard_ranges(2, 5) == [(0, 1), (1, 2)]
+    assert shard_ranges(0, 4) == []
+    ranges = shard_ranges(1000003, 7)
+    assert ranges[0][0] == 0 and ranges[-1][1] == 1000003
+    assert all(stop == start for (_, stop), (start, _) in zip(ranges, ranges[1:]))
+
+@pytest.mark.parametrize("product_id", ["le3.id.vmpz.output.poscatalog", PROXYSHEARCATALOG])
+def test_sharded_product_is_the_single_process_product(tmp_path, data_model, monkeypatch, product_id):
+    # several ranges of rows without a large input
+    monkeypatch.setattr(sharding, "MIN_SHARD_ROWS", 1000)
+    calls = []
+    write_sharded = sharding.write_sharded
+    def spy(writer, input_fits_path, plan, processes, **options):
+        calls.append(processes)
+        return write_sharded(writer, input_fits_path, plan, processes, **options)
+    monkeypatch.setattr(sharding, "write_sharded", spy)
+    # an odd number of rows, so that the ranges do not start on a 4 bytes boundary of the checksum
+    input_path = write_sim(tmp_path / "sim.fits", nrows=10001)
+
+    products = []
+    for processes in (1, 3):
+        (tmp_path / str(processes)).mkdir()
+        products.append(generate(data_model, input_path, tmp_path / str(processes), product_id=product_id,
+                                 checksum=True, chunk_rows=777, processes=processes))
+
+    single, sharded = products
+    assert calls == [3]
+    assert sharded["nrows"] == single["nrows"] == 10001
+    assert sharded["stats"] == single["stats"]
+    with open(single["fits_file"], "rb") as f1, open(sharded["fits_file"], "rb") as f2:
+        assert f1.read() == f2.read()
+    with warnings.catch_warnings():
+        # a wrong CHECKSUM or DATASUM is reported as a warning
+        warnings.simplefilter("error")
+        with fits.open(sharded["fits_file"], checksum=True) as hdul:
+            assert hdul[1].verify_checksum() == 1 and hdul[1].verify_datasum() == 1
+            assert len(hdul[1].data) == 10001
@@ -0,0 +1,58 @@
+import os
+
+import numpy as np
+
+from conftest import read_rows, sim_columns, write_sim
+from script import FitsProcessor
+from sorting import ExternalSorter
+
+def spilled_sorter(rows, sort_by, tmp_path, memory_bytes=32 * 1024, chunk_rows=700):
+    sorter = ExternalSorter(rows.dtype, sort_by, memory_bytes=memory_bytes, tmp_dir=str(tmp_path))
+    for start in range(0, len(rows), chunk_rows):
+        sorter.add(rows[start:start + chunk_rows])
+    assert len(sorter.runs) > 1
+    return sorter
+
+def test_spilled_sort_is_stable(tmp_path):
+    rng = np.random.default_rng(1)
+    rows = np.zeros(20000, dtype=[("OBJECT_ID", ">i8"), ("SEQ", ">i8")])
+    rows["OBJECT_ID"] = rng.integers(0, 500, len(rows))
+    rows["SEQ"] = np.arange(len(rows))
+
+    sorter = spilled_sorter(rows, "OBJECT_ID", tmp_path)
+    result = np.concatenate([chunk for _, chunk in sorter.sorted_chunks()])
+
+    assert np.array_equal(result, rows[np.argsort(rows["OBJECT_ID"], kind="stable")])
+    # the spill files are removed
+    assert not any(tmp_path.iterdir())
+
+def test_spilled_sort_puts_nan_keys_last(tmp_path):
+    rng = np.random.default_rng(2)
+    rows = np.zeros(20000, dtype=[("SHE_E1", ">f8"), ("SEQ", ">i8")])
+    rows["SHE_E1"] = rng.normal(size=len(rows))
+    rows["SHE_E1"][rng.random(len(rows)) < 0.3] = np.nan
+    # whole runs of NaN keys
+    rows["SHE_E1"][5000:9000] = np.nan
+    rows["SEQ"] = np.arange(len(rows))
+
+    sorter = spilled_sorter(rows, "SHE_E1", tmp_path)
+    result = np.concatenate([chunk for _, chunk in sorter.sorted_chunks()])
+
+    assert np.array_equal(result["SEQ"], rows["SEQ"][np.argsort(rows["SHE_E1"], kind="stable")])
+    nans = np.count_nonzero(np.isnan(rows["SHE_E1"]))
+    assert np.isnan(result["SHE_E1"][-nans:]).all() and not np.isnan(result["SHE_E1"][:-nans]).any()
+
+def test_sorted_catalog_with_a_prefix_output_path(tmp_path, data_model):
+    input_path = write_sim(tmp_path / "sim.fits", nrows=5000)
+    (tmp_path / "products").mkdir()
+    # the spill files and the spool of the filtered rows go to the directory of the prefix
+    result = FitsProcessor().generate_catalog("le3.id.vmpz.output.poscatalog", input_path,
+                                              output_path=str(tmp_path / "products" / "sort_"), fitsDataModel_path=data_model,
+                                              PAT=True, sort_by="DECLINATION", sort_memory=32 * 1024, chunk_rows=700,
+                                              row_filter="WEIGHT > 0.1")
+
+    assert result["fits_file"] == str(tmp_path / "products" / "sort_le3.id.vmpz.output.poscatalog.fits")
+    columns = sim_columns(5000)
+    dec = columns["MER_DEC"][1][columns["PHZ_WEIGHT"][1] > 0.1]
+    assert np.array_equal(read_rows(result["fits_file"])["DECLINATION"], np.sort(dec))
+    assert os.listdir(tmp_path / "products") == ["sort_le3.id.vmpz.output.poscatalog.fits"]
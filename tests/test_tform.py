@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+from astropy.io import fits
+
+from conftest import CATALOG_COLUMNS, POSCATALOG, generate, read_rows
+from conversion import ConversionPlan, TableLayout, check_conversion, parse_tform, raw_dtype
+from script import FitsProcessor
+
+FORMATS = ["L", "B", "I", "J", "K", "E", "D", "C", "M", "10A", "3E", "2K", "12X"]
+
+def test_raw_types_match_the_bytes_on_disk(tmp_path):
+    nrows = 50
+    rng = np.random.default_rng(8)
+    arrays = {
+        "L": rng.random(nrows) > 0.5, "B": rng.integers(0, 255, nrows), "I": rng.integers(-2**15, 2**15, nrows),
+        "J": rng.integers(-2**31, 2**31, nrows), "K": rng.integers(-2**63, 2**63 - 1, nrows), "E": rng.normal(size=nrows),
+        "D": rng.normal(size=nrows), "C": rng.normal(size=nrows) + 1j, "M": rng.normal(size=nrows) - 1j,
+        "10A": np.array([f"s{i}" for i in range(nrows)]), "3E": rng.normal(size=(nrows, 3)),
+        "2K": rng.integers(0, 100, (nrows, 2)), "12X": rng.random((nrows, 12)) > 0.5,
+    }
+    path = tmp_path / "formats.fits"
+    fits.BinTableHDU.from_columns([fits.Column(name=f"C{i}", format=fmt, array=arrays[fmt])
+                                   for i, fmt in enumerate(FORMATS)]).writeto(path)
+
+    layout = TableLayout.from_file(str(path))
+    assert [layout.dtype[f"C{i}"] for i in range(len(FORMATS))] == [raw_dtype(fmt) for fmt in FORMATS]
+    with open(path, "rb") as f:
+        f.seek(layout.data_offset)
+        data = f.read(layout.row_width * nrows)
+    assert next(layout.iter_chunks()).tobytes() == data
+
+def test_parse_tform():
+    assert parse_tform("D") == (1, "D")
+    assert parse_tform("10A") == (10, "A")
+    assert parse_tform(" 3e") == (3, "E")
+    assert parse_tform("1PJ(20)") == (1, "P")
+    with pytest.raises(ValueError):
+        parse_tform("Z")
+    with pytest.raises(ValueError, match="Variable-length"):
+        raw_dtype("1PJ(20)")
+
+@pytest.mark.parametrize("source, target", [("D", "E"), ("K", "J"), ("E", "K"), ("L", "J"), ("J", "L"), ("C", "M"),
+                                            ("3D", "3E"), ("10A", "20A")])
+def test_convertible_formats(source, target):
+    check_conversion("COLUMN", source, target)
+
+@pytest.mark.parametrize("source, target", [("C", "D"), ("2E", "E"), ("10A", "J"), ("J", "10A"), ("J", "1PJ(2)")])
+def test_unconvertible_formats(source, target):
+    with pytest.raises(ValueError):
+        check_conversion("COLUMN", source, target)
+
+def write_catalog_input(path, columns, nrows=1000):
+    rng = np.random.default_rng(9)
+    fits.HDUList([fits.PrimaryHDU(), fits.BinTableHDU.from_columns(
+        [fits.Column(name=name, format=fmt, array=rng.uniform(0, 100, nrows)) for name, fmt, _ in columns])]).writeto(path)
+    return str(path)
+
+def schema(data_model):
+    return FitsProcessor().load_schema(POSCATALOG, fitsDataModel_path=data_model)[1]
+
+def test_rows_in_the_catalog_layout_are_not_copied(tmp_path, data_model):
+    layout = TableLayout.from_file(write_catalog_input(tmp_path / "catalog.fits", CATALOG_COLUMNS[POSCATALOG]))
+    plan = ConversionPlan(layout, schema(data_model), verbose=False)
+
+    chunk = next(layout.iter_chunks(chunk_rows=100))
+    assert plan.is_passthrough(chunk.dtype)
+    rows = plan.convert(chunk)
+    assert rows.dtype == plan.dtype and np.shares_memory(rows, chunk)
+
+def test_rows_in_another_layout_are_converted(tmp_path, data_model):
+    # same columns, DECLINATION before RIGHT_ASCENSION
+    columns = CATALOG_COLUMNS[POSCATALOG]
+    layout = TableLayout.from_file(write_catalog_input(tmp_path / "catalog.fits", [columns[0], columns[2], columns[1], *columns[3:]]))
+    plan = ConversionPlan(layout, schema(data_model), verbose=False)
+
+    chunk = next(layout.iter_chunks(chunk_rows=100))
+    assert not plan.is_passthrough(chunk.dtype)
+    rows = plan.convert(chunk)
+    assert not np.shares_memory(rows, chunk)
+    assert np.array_equal(rows["DECLINATION"], chunk["DECLINATION"])
+
+def test_product_of_an_input_in_the_catalog_layout(tmp_path, data_model):
+    input_path = write_catalog_input(tmp_path / "catalog.fits", CATALOG_COLUMNS[POSCATALOG], nrows=5000)
+    mappings = tmp_path / "column_mappings.yaml"
+    mappings.write_text(f"{POSCATALOG}: {{}}\n")
+    (tmp_path / "out").mkdir()
+
+    result = generate(data_model, input_path, tmp_path / "out", chunk_rows=700,
+                      processor=FitsProcessor(column_mappings_path=str(mappings)))
+
+    assert read_rows(result["fits_file"]).tobytes() == read_rows(input_path).tobytes()
@@ -0,0 +1,36 @@
+import os
+
+import pytest
+
+import xmltemplate
+
+CATALOGS = sorted(xmltemplate.names_database)
+
+def read_xml(path):
+    with open(path, "r", encoding="UTF-8") as f:
+        return f.read().rstrip("\n")
+
+@pytest.mark.parametrize("catalog_name", CATALOGS)
+def test_template_renders_the_eden_reference(catalog_name, request):
+    reference_xml = os.path.join(xmltemplate.REFERENCE_DIR, f"{catalog_name}.xml")
+    if not os.path.exists(reference_xml):
+        message = "No reference xml : generate it in the EDEN environment with 'fitsprocessor xml-template reference'."
+        if request.config.getoption("require_xml_references"):
+            pytest.fail(message)
+        pytest.skip(message)
+    assert xmltemplate.render_reference(catalog_name) == read_xml(reference_xml)
+
+@pytest.mark.parametrize("catalog_name", CATALOGS)
+def test_template_compiles_back_from_its_rendering(catalog_name, tmp_path):
+    rendered_xml = tmp_path / f"{catalog_name}.rendered.xml"
+    rendered_xml.write_text(xmltemplate.render_reference(catalog_name) + "\n", encoding="UTF-8")
+
+    template = xmltemplate.compile_template(str(rendered_xml), template_dir=str(tmp_path / "templates"))
+
+    assert read_xml(template) == read_xml(os.path.join(xmltemplate.TEMPLATE_DIR, f"{catalog_name}.xml"))
+
+def test_rendered_values_are_escaped():
+    header_defaults = dict(xmltemplate.load_header_defaults(), **{"header.default.Curator": "R&D <team>"})
+    xml = xmltemplate.render_reference("poscatalog", header_defaults=header_defaults)
+    assert "<Curator>R&amp;D &lt;team&gt;</Curator>" in xml
+    assert f"<ProductId>{xmltemplate.REFERENCE_PRODUCT_ID}</ProductId>" in xml